@@ -0,0 +1,7 @@
+from pathlib import Path
+
+
+def install_dir() -> Path:
+    """The agent directory: the one holding this package, or holding the zipapp it runs from (see scripts/pkg.py)."""
+    root = Path(__file__).resolve().parent.parent
+    return root.parent if root.is_file() else root
@@ -1,17 +1,31 @@
 from abc import ABC, abstractmethod
 from pathlib import Path
-from agent.config_schema import AgentConfig
+from agent.config_schema import AgentConfig, ConnectionConfig
 import logging
 
+# Connection states that need no repair: an SA is up, or (on-demand) its trap
+# policy is installed and the SA is negotiated when traffic arrives
+HEALTHY_STATES = frozenset({"CONNECTED", "IDLE"})
+# Status of a connection taken down with 'ipsecctl down': not repaired until brought up again
+ADMIN_DOWN = "ADMIN_DOWN"
+
 class IPsecBackend(ABC):
+    # True if connection_status() reports each connection individually (needed to adopt live SAs)
+    per_connection_status = False
+    # True if changed connections can be brought up next to their old version (stage/commit/rollback)
+    supports_make_before_break = False
+
     def __init__(self, config: AgentConfig, base_dir: Path, logger: logging.Logger):
         self.config = config
         self.base_dir = base_dir
         self.logger = logger
 
     @abstractmethod
-    def apply_policy(self) -> bool:
-        """Applies the IPsec policy. Returns True if successful."""
+    def apply_policy(self, names: list[str] = None) -> bool:
+        """
+        Applies the IPsec policy. Returns True if successful.
+        With 'names', only those connections are brought up; the others are already up.
+        """
         pass
 
     @abstractmethod
@@ -19,6 +33,82 @@ class IPsecBackend(ABC):
         """Returns 'CONNECTED', 'DISCONNECTED', or 'ERROR'."""
         pass
 
+    def connection_status(self) -> dict[str, str]:
+        """
+        Per-connection status: CONNECTED, IDLE (on-demand, trap installed),
+        CONNECTING or DISCONNECTED. Backends without per-connection
+        visibility report the aggregate.
+        """
+        status = self.check_status()
+        return {c.name: status for c in self.config.connections}
+
+    def repair(self, names: list[str]) -> bool:
+        """Brings the named connections back up. Defaults to a full cleanup and re-apply."""
+        self.cleanup()
+        return self.apply_policy()
+
+    def terminate(self, names: list[str]):
+        """Takes down the named connections (e.g. removed from the config). Backends that re-create all rules on apply need nothing."""
+        pass
+
+    def hold(self, names: list[str]):
+        """Takes the named connections down on request (ipsecctl down), trap policies included; repair() brings them back."""
+        self.terminate(names)
+
+    def stage(self, running: dict[str, ConnectionConfig]) -> bool:
+        """
+        Brings up the new version (from self.config) of each connection in
+        'running' while the given running version stays up.
+        """
+        raise NotImplementedError
+
+    def staged_status(self) -> dict[str, str]:
+        """Status of the new version of each staged connection."""
+        raise NotImplementedError
+
+    def commit(self, names: list[str]):
+        """Moves the named staged connections to their new version and closes the old one."""
+        raise NotImplementedError
+
+    def rollback(self, names: list[str]):
+        """Closes the new version of the named staged connections; self.config already holds the old one."""
+        raise NotImplementedError
+
+    def share_host(self, prefix: str):
+        """
+        Makes this backend one of several agent processes (shards) on the host:
+        its files are named with 'prefix', and cleanup leaves other processes' state alone.
+        """
+        raise NotImplementedError
+
+    def take_over(self, names: list[str]):
+        """Adopts the named connections (already in self.config) from another agent process (shard), leaving their SAs up."""
+        raise NotImplementedError
+
+    def release(self, names: list[str]):
+        """Forgets the named connections (already removed from self.config) that another agent process took over."""
+        raise NotImplementedError
+
+    def remove_foreign_config(self):
+        """Removes config the unsharded agent wrote, once shards have taken its connections over."""
+        pass
+
+    def flush_cache(self):
+        """Drops cached rendered config, so the next apply renders every connection afresh."""
+        pass
+
+    def probe(self, specs: list) -> dict:
+        """Runs in-tunnel probes (agent.probes.ProbeSpec); returns {name: ProbeResult}."""
+        from agent.probes import run_probes
+        return run_probes(specs)
+
+    def sample_stats(self, now: float):
+        """
+        Samples kernel datapath statistics and returns a report (a dict with
+        deltas since the previous sample), or None where there are none.
+        """
+        return None
+
     @abstractmethod
     def cleanup(self):
         """Removes all policies created by the agent."""
@@ -0,0 +1,52 @@
+import heapq
+import itertools
+import time
+from typing import Callable
+
+
+class SystemClock:
+    """Wall-clock time. The default clock of IPsecAgent."""
+
+    def time(self) -> float:
+        return time.time()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+
+
+class VirtualClock:
+    """
+    Deterministic clock for simulations. sleep() does not block: it advances
+    virtual time and runs every callback scheduled up to the new time, in order.
+    """
+
+    def __init__(self, start: float = 0.0):
+        self.now = start
+        self._timers = []
+        self._seq = itertools.count()  # keeps callbacks at the same time in scheduling order
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def call_at(self, when: float, callback: Callable[[], None]):
+        heapq.heappush(self._timers, (when, next(self._seq), callback))
+
+    def call_later(self, delay: float, callback: Callable[[], None]):
+        self.call_at(self.now + delay, callback)
+
+    def advance(self, seconds: float):
+        target = self.now + seconds
+        while self._timers and self._timers[0][0] <= target:
+            when, _, callback = heapq.heappop(self._timers)
+            self.now = max(self.now, when)
+            callback()
+        self.now = target
+
+    def sleep(self, seconds: float):
+        self.advance(seconds)
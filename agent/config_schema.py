@@ -1,16 +1,16 @@
 import json
+import hashlib
+import importlib.util
 import ipaddress
 import os
+import re
 from dataclasses import dataclass, field
 from enum import Enum
 from typing import Optional, Dict, Any
+from agent.traffic_selectors import find_connection_conflicts
 
-# Try to import PyYAML, fallback to JSON-only if missing
-try:
-    import yaml
-    HAS_YAML = True
-except ImportError:
-    HAS_YAML = False
+# PyYAML is optional (JSON-only without it), and only imported to parse a YAML config
+HAS_YAML = importlib.util.find_spec("yaml") is not None
 
 class IPsecMode(Enum):
     TUNNEL = "tunnel"
@@ -45,7 +45,7 @@ class EncryptionConfig:
         weak_algos = ["des", "md5", "3des", "sha1"]
         
         for algo in [self.ike.lower(), self.esp.lower()]:
-             if algo == "default": continue
+             if algo in ("default", "auto"): continue
              for weak in weak_algos:
                  if weak in algo:
                      # Just print/log warning in real app, here we raise specific error for strictness or pass?
@@ -53,6 +53,183 @@ class EncryptionConfig:
                      pass 
         pass
 
+_MARK_RE = re.compile(r"^(0x[0-9a-fA-F]+|\d+|%unique(-dir)?)(/(0x[0-9a-fA-F]+|\d+))?$")
+
+@dataclass
+class DatapathConfig:
+    """Child SA data-path options. None leaves charon's default in place."""
+    replay_window: Optional[int] = None # Packets; 0 disables replay protection
+    esn: bool = False # 64-bit Extended Sequence Numbers
+    hw_offload: Optional[str] = None # no, yes, auto, crypto, packet
+    ipcomp: bool = False
+    copy_dscp: Optional[str] = None # out, in, yes, no
+    mark_in: Optional[str] = None # value[/mask]
+    mark_out: Optional[str] = None
+    if_id_in: Optional[str] = None # XFRM interface ID or %unique
+    if_id_out: Optional[str] = None
+    updown: Optional[str] = None # Absolute path of an updown script
+    multicore: bool = False # Spread the connection's ESP over CPUs (per-CPU SAs or parallel child SAs)
+    parallel_sas: Optional[int] = None # Child SAs without per-CPU SA support; default one per CPU
+    mss_clamp: bool = False # Clamp the TCP MSS of tunneled traffic to the effective MTU (nftables)
+    link_mtu: int = 1500 # MTU of the path the ESP packets take
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'DatapathConfig':
+        unknown = set(data) - set(cls.__dataclass_fields__)
+        if unknown:
+            raise ValueError(f"Unknown datapath option(s): {', '.join(sorted(unknown))}")
+        values = dict(data)
+        for key in ("mark_in", "mark_out", "if_id_in", "if_id_out", "hw_offload", "copy_dscp"):
+            if values.get(key) is not None:
+                values[key] = str(values[key]).lower() if key in ("hw_offload", "copy_dscp") else str(values[key])
+        return cls(**values)
+
+    def validate(self, name: str):
+        if self.replay_window is not None and (not isinstance(self.replay_window, int) or not 0 <= self.replay_window < 2**32):
+            raise ValueError(f"Invalid replay_window for {name}: {self.replay_window}")
+        if self.hw_offload is not None and self.hw_offload not in ("no", "yes", "auto", "crypto", "packet"):
+            raise ValueError(f"Invalid hw_offload for {name}: {self.hw_offload}")
+        if self.copy_dscp is not None and self.copy_dscp not in ("out", "in", "yes", "no"):
+            raise ValueError(f"Invalid copy_dscp for {name}: {self.copy_dscp}")
+        for key in ("mark_in", "mark_out"):
+            value = getattr(self, key)
+            if value is not None and not _MARK_RE.match(value):
+                raise ValueError(f"Invalid {key} for {name}: {value}")
+        for key in ("if_id_in", "if_id_out"):
+            value = getattr(self, key)
+            if value is not None and not re.match(r"^(0x[0-9a-fA-F]+|\d+|%unique(-dir)?)$", value):
+                raise ValueError(f"Invalid {key} for {name}: {value}")
+        if self.updown is not None and not os.path.isabs(self.updown):
+            raise ValueError(f"updown for {name} must be an absolute path: {self.updown}")
+        if self.parallel_sas is not None and (not isinstance(self.parallel_sas, int) or not 1 <= self.parallel_sas <= 16):
+            raise ValueError(f"Invalid parallel_sas for {name}: {self.parallel_sas} (1-16)")
+        if not isinstance(self.link_mtu, int) or not 576 <= self.link_mtu <= 65535:
+            raise ValueError(f"Invalid link_mtu for {name}: {self.link_mtu}")
+        if self.multicore and self.mark_out is not None:
+            raise ValueError(f"multicore for {name} marks its parallel child SAs itself; remove mark_out")
+
+    def options(self) -> dict[str, str]:
+        """
+        The options that are set, as swanctl child settings. esn is part of the
+        ESP proposals and multicore changes the children themselves.
+        """
+        opts = {}
+        if self.replay_window is not None: opts["replay_window"] = str(self.replay_window)
+        if self.hw_offload is not None: opts["hw_offload"] = self.hw_offload
+        if self.ipcomp: opts["ipcomp"] = "yes"
+        for key in ("copy_dscp", "mark_in", "mark_out", "if_id_in", "if_id_out", "updown"):
+            if getattr(self, key) is not None:
+                opts[key] = getattr(self, key)
+        return opts
+
+# Derived XFRM interface IDs fall in 1..ROUTE_IF_ID_RANGE
+ROUTE_IF_ID_RANGE = 2**30
+
+@dataclass
+class RoutingConfig:
+    """Policy-based (selectors in the child SA) or route-based (XFRM interface plus routes)."""
+    mode: str = "policy" # policy, route
+    if_id: Optional[int] = None # XFRM interface ID; derived from the connection name if not set
+    interface: Optional[str] = None # Default xfrm<if_id>
+    group: Optional[str] = None # ECMP group: connections routing the same prefix must share one
+    weight: int = 1 # ECMP next hop weight
+
+    @property
+    def route_based(self) -> bool:
+        return self.mode == "route"
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'RoutingConfig':
+        unknown = set(data) - set(cls.__dataclass_fields__)
+        if unknown:
+            raise ValueError(f"Unknown routing option(s): {', '.join(sorted(unknown))}")
+        return cls(**data)
+
+    def resolved_if_id(self, name: str) -> int:
+        if self.if_id is not None:
+            return self.if_id
+        return int(hashlib.sha256(name.encode()).hexdigest()[:8], 16) % ROUTE_IF_ID_RANGE + 1
+
+    def resolved_interface(self, name: str) -> str:
+        return self.interface or f"xfrm{self.resolved_if_id(name)}"
+
+    def validate(self, name: str):
+        if self.mode not in ("policy", "route"):
+            raise ValueError(f"Invalid routing mode for {name}: {self.mode}")
+        if self.if_id is not None and (not isinstance(self.if_id, int) or not 0 < self.if_id < 2**32):
+            raise ValueError(f"Invalid if_id for {name}: {self.if_id}")
+        if self.interface is not None and not re.match(r"^[A-Za-z0-9_.-]{1,15}$", self.interface):
+            raise ValueError(f"Invalid interface name for {name}: {self.interface}")
+        if not isinstance(self.weight, int) or not 1 <= self.weight <= 256:
+            raise ValueError(f"Invalid ECMP weight for {name}: {self.weight} (1-256)")
+
+def _in_subnets(address: str, subnets: list[str]) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+        return any(ip in ipaddress.ip_network(s, strict=False) for s in subnets)
+    except ValueError:
+        return False
+
+@dataclass
+class ProbeConfig:
+    """In-tunnel reachability probe of a connection (see agent.probes)."""
+    target: str = "" # Address inside the remote subnets
+    protocol: str = "udp" # udp: echo requests, tcp: connection attempts
+    port: int = 7
+    count: int = 5 # Probes per round
+    interval: float = 0.2 # Seconds between probes of a round
+    timeout: float = 1.0 # Seconds to wait for each reply
+    source: Optional[str] = None # Local address inside the local subnets, so probes take the tunnel
+    max_loss: float = 1.0 # Loss at which the tunnel counts as down and is re-established
+    max_rtt_ms: Optional[float] = None # p90 RTT above which the tunnel counts as degraded
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'ProbeConfig':
+        unknown = set(data) - set(cls.__dataclass_fields__)
+        if unknown:
+            raise ValueError(f"Unknown probe option(s): {', '.join(sorted(unknown))}")
+        values = dict(data)
+        values["protocol"] = str(values.get("protocol", "udp")).lower()
+        return cls(**values)
+
+    def validate(self, conn: 'ConnectionConfig'):
+        name = conn.name
+        if not _in_subnets(self.target, conn.remote_subnets):
+            raise ValueError(f"Probe target of {name} must be an address inside its remote subnets: '{self.target}'")
+        if self.source is not None and not _in_subnets(self.source, conn.local_subnets):
+            raise ValueError(f"Probe source of {name} must be an address inside its local subnets: '{self.source}'")
+        if self.protocol not in ("udp", "tcp"):
+            raise ValueError(f"Invalid probe protocol for {name}: {self.protocol}")
+        if not isinstance(self.port, int) or not 0 < self.port < 65536:
+            raise ValueError(f"Invalid probe port for {name}: {self.port}")
+        if not isinstance(self.count, int) or self.count < 1:
+            raise ValueError(f"Invalid probe count for {name}: {self.count}")
+        if self.interval < 0 or self.timeout <= 0:
+            raise ValueError(f"Invalid probe interval/timeout for {name}")
+        if not 0 < self.max_loss <= 1:
+            raise ValueError(f"Invalid probe max_loss for {name}: {self.max_loss} (0-1)")
+
+@dataclass
+class GatewayConfig:
+    """A peer gateway of a connection. Lower priority values are preferred."""
+    address: str
+    priority: int = 100
+
+    @classmethod
+    def from_dict(cls, data) -> 'GatewayConfig':
+        if isinstance(data, str):
+            return cls(address=data)
+        unknown = set(data) - set(cls.__dataclass_fields__)
+        if unknown:
+            raise ValueError(f"Unknown gateway option(s): {', '.join(sorted(unknown))}")
+        return cls(address=str(data.get("address", "")), priority=data.get("priority", 100))
+
+    def validate(self, name: str):
+        if not re.match(r"^[A-Za-z0-9_.:%-]+$", self.address):
+            raise ValueError(f"Invalid gateway address for {name}: '{self.address}'")
+        if not isinstance(self.priority, int) or self.priority < 0:
+            raise ValueError(f"Invalid gateway priority for {name}: {self.priority}")
+
 @dataclass
 class ConnectionConfig:
     name: str
@@ -68,19 +245,52 @@ class ConnectionConfig:
     
     ike_version: str = "ikev2"
     lifetime_minutes: int = 60
+    on_demand: bool = False # Trap policies only; the SA is negotiated by the first packet
+    idle_timeout: int = 600 # Seconds without traffic before an on-demand SA is closed
+    gateways: list[GatewayConfig] = field(default_factory=list) # Empty: the first remote subnet's address
+    dpd_delay: int = 30 # Seconds between liveness checks of an idle IKE SA
+    dpd_timeout: int = 120 # Seconds until an unresponsive peer is declared dead
+    failback_holddown: int = 300 # Seconds on a standby gateway before switching back to a preferred one
+    probe: Optional[ProbeConfig] = None
+    # Set by the agent after a failover; None uses the preferred gateway
+    active_gateway: Optional[str] = field(default=None, compare=False)
+    datapath: DatapathConfig = field(default_factory=DatapathConfig)
+    routing: RoutingConfig = field(default_factory=RoutingConfig)
 
     def validate(self):
         if not self.name: raise ValueError("Connection name is required")
+        if "~" in self.name: raise ValueError(f"Invalid connection name '{self.name}': '~' is reserved")
         if self.mode.lower() not in [m.value for m in IPsecMode]:
              raise ValueError(f"Invalid mode: {self.mode}")
         self.auth.validate()
         self.encryption.validate()
+        if self.lifetime_minutes <= 0:
+            raise ValueError(f"Invalid SA lifetime for {self.name}: {self.lifetime_minutes} minutes")
+        if self.idle_timeout <= 0:
+            raise ValueError(f"Invalid idle_timeout for {self.name}: {self.idle_timeout} seconds")
+        for gateway in self.gateways:
+            gateway.validate(self.name)
+        addresses = [g.address for g in self.gateways]
+        if len(set(addresses)) != len(addresses):
+            raise ValueError(f"Duplicate gateway address for {self.name}")
+        if self.dpd_delay <= 0:
+            raise ValueError(f"Invalid dpd_delay for {self.name}: {self.dpd_delay} seconds")
+        if self.dpd_timeout < self.dpd_delay:
+            raise ValueError(f"dpd_timeout for {self.name} must be at least dpd_delay ({self.dpd_delay}s)")
+        if self.failback_holddown < 0:
+            raise ValueError(f"Invalid failback_holddown for {self.name}: {self.failback_holddown} seconds")
+        self.datapath.validate(self.name)
+        self.routing.validate(self.name)
+        if self.routing.route_based and (self.datapath.if_id_in or self.datapath.if_id_out):
+            raise ValueError(f"Route-based connection {self.name} sets its if_id in routing, not datapath")
         if not self.local_subnets or not self.remote_subnets:
             raise ValueError("Local and Remote subnets are required")
         # Validate CIDRs
         for s in self.local_subnets + self.remote_subnets:
              try: ipaddress.ip_network(s, strict=False)
              except ValueError: raise ValueError(f"Invalid subnet: {s}")
+        if self.probe:
+            self.probe.validate(self)
         
         # Basic Protocol validation
         valid_protos = ["tcp", "udp", "icmp", "any", "gre"]
@@ -88,12 +298,42 @@ class ConnectionConfig:
              # allow numeric protocols too
              pass 
 
+    def gateway_addresses(self) -> list[str]:
+        """Gateway addresses, most preferred first; equal priorities keep their configured order."""
+        return [g.address for g in sorted(self.gateways, key=lambda g: g.priority)]
+
+    def current_gateway(self) -> Optional[str]:
+        """The gateway the connection uses now; None without configured gateways."""
+        return self.active_gateway or next(iter(self.gateway_addresses()), None)
+
+    def digest(self) -> str:
+        """Stable hash of this connection's settings, used for render caching and change detection."""
+        payload = json.dumps(vars(self), sort_keys=True, default=vars)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
 @dataclass
 class AgentConfig:
     connections: list[ConnectionConfig]
     logging_level: str
     logging_type: str = "file" # file, syslog, stdout
     api_port: int = None # Port for Health API, None = disabled
+    check_interval: float = 30 # Seconds between control loop iterations
+    strict_selectors: bool = False # Reject configs with overlapping traffic selectors
+    aggregate_selectors: bool = False # Collapse adjacent/nested subnets before rendering
+    swanctl_layout: str = "single" # single: one agent.conf, per_connection: one file per connection
+    shutdown_policy: str = "teardown" # teardown: remove policies on stop, detach: leave tunnels up
+    cutover_timeout: float = 120 # Seconds a changed connection may take to come up before it is rolled back
+    rekey_spread: float = 0.0 # Share of the SA lifetime over which child rekeys are spread (0 = charon's jitter only)
+    proposal_benchmark: bool = False # Run a short openssl benchmark to order 'auto' proposals
+    stats_interval: float = 60 # Seconds between kernel datapath statistics samples (0 = off)
+    shards: int = 1 # Agent worker processes the connections are split across (see agent.shards)
+    config_poll_interval: float = 300 # Seconds between polls of a config URL (see agent.config_source)
+    config_poll_jitter: float = 0.2 # Share of config_poll_interval each poll is randomly moved by
+    control_socket: str = "agent.sock" # Unix socket for ipsecctl, relative to the agent directory (None = disabled)
+    # Filled by validate(): overlapping/shadowed selectors across connections
+    selector_conflicts: list = field(default_factory=list, repr=False, compare=False)
+    # Filled by the agent on this host: ProposalChoice used for 'auto' encryption
+    auto_proposals: Any = field(default=None, repr=False, compare=False)
 
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'AgentConfig':
@@ -135,7 +375,16 @@ class AgentConfig:
                     protocol=str(c_data.get("protocol", "any")),
                     local_port=str(c_data.get("local_port", "any")),
                     remote_port=str(c_data.get("remote_port", "any")),
-                    lifetime_minutes=sa_minutes
+                    lifetime_minutes=sa_minutes,
+                    on_demand=bool(c_data.get("on_demand", False)),
+                    idle_timeout=int(c_data.get("idle_timeout", 600)),
+                    gateways=[GatewayConfig.from_dict(g) for g in c_data.get("gateways", [])],
+                    dpd_delay=int(c_data.get("dpd_delay", 30)),
+                    dpd_timeout=int(c_data.get("dpd_timeout", 120)),
+                    failback_holddown=int(c_data.get("failback_holddown", 300)),
+                    probe=ProbeConfig.from_dict(c_data["probe"]) if c_data.get("probe") else None,
+                    datapath=DatapathConfig.from_dict(c_data.get("datapath", {})),
+                    routing=RoutingConfig.from_dict(c_data.get("routing", {}))
                 )
                 connections.append(conn)
 
@@ -143,7 +392,20 @@ class AgentConfig:
                 connections=connections,
                 logging_level=data.get("logging", "info"),
                 logging_type=data.get("logging_type", "file"),
-                api_port=data.get("api_port")
+                api_port=data.get("api_port"),
+                check_interval=float(data.get("check_interval", 30)),
+                strict_selectors=bool(data.get("strict_selectors", False)),
+                aggregate_selectors=bool(data.get("aggregate_selectors", False)),
+                swanctl_layout=data.get("swanctl_layout", "single"),
+                shutdown_policy=data.get("shutdown_policy", "teardown"),
+                cutover_timeout=float(data.get("cutover_timeout", 120)),
+                rekey_spread=float(data.get("rekey_spread", 0.0)),
+                proposal_benchmark=bool(data.get("proposal_benchmark", False)),
+                stats_interval=float(data.get("stats_interval", 60)),
+                shards=int(data.get("shards", 1)),
+                config_poll_interval=float(data.get("config_poll_interval", 300)),
+                config_poll_jitter=float(data.get("config_poll_jitter", 0.2)),
+                control_socket=data.get("control_socket", "agent.sock")
             )
         except Exception as e:
             raise ValueError(f"Config parsing error: {e}")
@@ -151,9 +413,57 @@ class AgentConfig:
     def validate(self):
         if not self.connections:
             raise ValueError("No connections defined in configuration.")
+        if self.check_interval <= 0:
+            raise ValueError("check_interval must be positive")
+        if self.swanctl_layout not in ("single", "per_connection"):
+            raise ValueError(f"Invalid swanctl_layout: {self.swanctl_layout}")
+        if self.shutdown_policy not in ("teardown", "detach"):
+            raise ValueError(f"Invalid shutdown_policy: {self.shutdown_policy}")
+        if self.cutover_timeout <= 0:
+            raise ValueError("cutover_timeout must be positive")
+        if self.stats_interval < 0:
+            raise ValueError("stats_interval must not be negative")
+        if self.shards < 1:
+            raise ValueError(f"shards must be at least 1, got {self.shards}")
+        if self.config_poll_interval <= 0:
+            raise ValueError("config_poll_interval must be positive")
+        if not 0 <= self.config_poll_jitter < 1:
+            raise ValueError(f"config_poll_jitter must be between 0 and 1, got {self.config_poll_jitter}")
+        if self.control_socket is not None and (not isinstance(self.control_socket, str) or not self.control_socket):
+            raise ValueError(f"control_socket must be a path or null, got {self.control_socket!r}")
+        if not 0 <= self.rekey_spread <= 0.5:
+            raise ValueError(f"rekey_spread must be between 0 and 0.5, got {self.rekey_spread}")
         for c in self.connections:
             c.validate()
+        self._validate_routes()
 
+        # Cross-connection check: overlapping selectors make kernel policy selection ambiguous.
+        # Route-based connections install catch-all policies per interface, routing decides.
+        self.selector_conflicts = find_connection_conflicts([c for c in self.connections if not c.routing.route_based])
+        if self.strict_selectors and self.selector_conflicts:
+            details = "; ".join(c.describe() for c in self.selector_conflicts[:5])
+            more = len(self.selector_conflicts) - 5
+            if more > 0: details += f" (and {more} more)"
+            raise ValueError(f"Overlapping traffic selectors: {details}")
+
+
+    def _validate_routes(self):
+        """Route-based connections need distinct interfaces; a prefix may only have several next hops within one ECMP group."""
+        if_ids, interfaces, prefixes = {}, {}, {}
+        for c in self.connections:
+            if not c.routing.route_based:
+                continue
+            if_id, interface = c.routing.resolved_if_id(c.name), c.routing.resolved_interface(c.name)
+            if if_id in if_ids:
+                raise ValueError(f"Connections {if_ids[if_id]} and {c.name} share if_id {if_id}; set routing.if_id explicitly")
+            if interface in interfaces:
+                raise ValueError(f"Connections {interfaces[interface]} and {c.name} share interface {interface}")
+            if_ids[if_id] = interfaces[interface] = c.name
+            for prefix in c.remote_subnets:
+                key = str(ipaddress.ip_network(prefix, strict=False))
+                other = prefixes.setdefault(key, c)
+                if other is not c and (c.routing.group is None or other.routing.group != c.routing.group):
+                    raise ValueError(f"{key} is routed by {other.name} and {c.name}; put them in one routing.group for ECMP")
 
 
 def load_config(file_path: str) -> AgentConfig:
@@ -162,12 +472,17 @@ def load_config(file_path: str) -> AgentConfig:
 
     with open(file_path, 'r') as f:
         content = f.read()
-    
+    return parse_config(content, file_path)
+
+
+def parse_config(content: str, name: str = "") -> AgentConfig:
+    """Parses and validates a config document; 'name' (a path or URL) selects JSON or YAML by its suffix."""
     data = {}
-    if file_path.endswith('.json'):
+    if name.endswith('.json'):
         data = json.loads(content)
-    elif file_path.endswith('.yaml') or file_path.endswith('.yml'):
+    elif name.endswith('.yaml') or name.endswith('.yml'):
         if HAS_YAML:
+            import yaml
             data = yaml.safe_load(content)
         else:
             raise ImportError("PyYAML not installed. Cannot parse YAML config.")
@@ -177,6 +492,7 @@ def load_config(file_path: str) -> AgentConfig:
             data = json.loads(content)
         except json.JSONDecodeError:
             if HAS_YAML:
+                import yaml
                 try:
                     data = yaml.safe_load(content)
                 except yaml.YAMLError:
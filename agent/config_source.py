@@ -0,0 +1,201 @@
+"""
+Configuration pulled from a config server.
+
+'config_path' may be an http:// or https:// URL. The agent fetches the
+document at startup and then polls it every config_poll_interval seconds.
+Each poll is moved randomly by up to config_poll_jitter of the interval, so
+a fleet booted together does not poll in lockstep. Polls are conditional
+(If-None-Match with the last ETag, If-Modified-Since with the last
+Last-Modified), so an unchanged document costs a 304. A changed document is
+validated first and then handed to the agent's reload(), which applies only
+the difference. Only once the reload went through does it become the last
+good document: its validators are sent from then on and it is cached. A
+document the agent could not apply is fetched and tried again next poll.
+
+The last good document is cached on disk (config_cache.json, mode 0600 since
+it holds the PSKs). The agent can boot from it while the server is
+unreachable. A failed poll keeps the running config and is retried after a
+growing, randomized delay of at most the poll interval.
+"""
+import hashlib
+import http.client
+import json
+import os
+import random
+import urllib.error
+import urllib.parse
+import urllib.request
+from pathlib import Path
+from typing import Callable, Optional
+from agent.config_schema import AgentConfig, parse_config
+
+CACHE_FILE = "config_cache.json"
+# Seconds to wait for the config server
+FETCH_TIMEOUT = 30
+# First retry after a failed poll; doubles with every failure, up to the poll interval
+RETRY_DELAY = 15
+USER_AGENT = "unified-ipsec-agent"
+
+# What a failed fetch raises: network and HTTP errors, or a document that does not parse or validate
+FETCH_ERRORS = (OSError, ValueError, http.client.HTTPException)
+
+
+class RemoteConfigSource:
+    def __init__(self, url: str, cache_path: Path, logger, rng: random.Random = None, timeout: float = FETCH_TIMEOUT):
+        self.url = url
+        self.cache_path = Path(cache_path)
+        self.logger = logger
+        self.rng = rng or random.Random()
+        self.timeout = timeout
+        # Last good document, its validators and the poll settings it carries
+        self.content: Optional[str] = None
+        self.name = urllib.parse.urlparse(url).path
+        self.digest: Optional[str] = None
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self.fetched_at: Optional[float] = None
+        self.interval = AgentConfig.config_poll_interval
+        self.jitter = AgentConfig.config_poll_jitter
+        self.next_poll: Optional[float] = None
+        self.failures = 0
+
+    # --- disk cache ---
+
+    def _load_cache(self):
+        try:
+            data = json.loads(self.cache_path.read_text())
+        except (OSError, ValueError):
+            return
+        if not isinstance(data, dict) or data.get("url") != self.url:
+            return
+        try:
+            name = data.get("name", self.name)
+            self._accept(self._parse(data["content"], name), data["content"], name, data.get("etag"), data.get("last_modified"))
+        except (KeyError, *FETCH_ERRORS) as e:
+            self.logger.warning(f"Ignoring the cached config: {e}")
+            return
+        self.fetched_at = data.get("fetched_at")
+
+    def _write_cache(self):
+        data = {
+            "url": self.url,
+            "name": self.name,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "fetched_at": self.fetched_at,
+            "content": self.content,
+        }
+        tmp = self.cache_path.with_name(self.cache_path.name + ".tmp")
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.cache_path)
+
+    # --- fetching ---
+
+    def _get(self) -> Optional[tuple[str, str, Optional[str], Optional[str]]]:
+        """Conditional GET: (content, content type, ETag, Last-Modified), or None if not modified."""
+        headers = {"User-Agent": USER_AGENT, "Accept": "application/json, application/yaml;q=0.9, */*;q=0.1"}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        request = urllib.request.Request(self.url, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                charset = response.headers.get_content_charset() or "utf-8"
+                return (response.read().decode(charset), response.headers.get_content_type(),
+                        response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return None
+            raise
+
+    def _parse(self, content: str, name: str) -> AgentConfig:
+        """Parses and validates a document; YAML without PyYAML installed is a bad document like any other."""
+        try:
+            return parse_config(content, name)
+        except ImportError as e:
+            raise ValueError(str(e))
+
+    def _accept(self, config: AgentConfig, content: str, name: str, etag: Optional[str], last_modified: Optional[str]):
+        """Makes a parsed document the last good one."""
+        self.content, self.name = content, name
+        self.digest = hashlib.sha256(content.encode()).hexdigest()
+        self.etag, self.last_modified = etag, last_modified
+        self.interval, self.jitter = config.config_poll_interval, config.config_poll_jitter
+
+    def fetch(self, now: float) -> Optional[tuple[AgentConfig, Callable[[], None]]]:
+        """
+        One conditional GET. Returns None if the document did not change, else
+        the new config and a commit function, to call once the agent applied
+        it: it makes the document the last good one and caches it. Raises one
+        of FETCH_ERRORS; the last good document is kept.
+        """
+        response = self._get()
+        if response is None:
+            return None
+        content, content_type, etag, last_modified = response
+        if hashlib.sha256(content.encode()).hexdigest() == self.digest:
+            # Same document from a server that does not send validators (or changed them)
+            self.etag, self.last_modified = etag, last_modified
+            return None
+        name = "config.yaml" if "yaml" in content_type else urllib.parse.urlparse(self.url).path
+        config = self._parse(content, name)
+
+        def commit():
+            self._accept(config, content, name, etag, last_modified)
+            self.fetched_at = now
+            # At the interval the new document sets
+            self.next_poll = now + self.poll_delay()
+            try:
+                self._write_cache()
+            except OSError as e:
+                self.logger.warning(f"Could not cache the config in {self.cache_path}: {e}")
+        return config, commit
+
+    def load(self, now: float) -> AgentConfig:
+        """
+        The current config: fetched (conditionally, once there is a cached
+        copy), or the cached copy if the server cannot be reached. A fetched
+        document is committed at once. Raises ValueError without either.
+        """
+        if self.content is None:
+            self._load_cache()
+        try:
+            fetched = self.fetch(now)
+            if fetched:
+                fetched[1]()
+            self.failures = 0
+        except FETCH_ERRORS as e:
+            if self.content is None:
+                raise ValueError(f"Could not fetch the config from {self.url}, and there is no cached copy: {e}")
+            self.logger.warning(f"Could not fetch the config from {self.url} ({e}); using the copy fetched at {self.fetched_at}.")
+        self.next_poll = now + self.poll_delay()
+        return parse_config(self.content, self.name)
+
+    def poll(self, now: float, force: bool = False) -> Optional[tuple[AgentConfig, Callable[[], None]]]:
+        """
+        Polls once the next poll is due, or now with force. Returns what
+        fetch() does: the new config and its commit function, or None.
+        """
+        if not force and self.next_poll is not None and now < self.next_poll:
+            return None
+        try:
+            fetched = self.fetch(now)
+        except FETCH_ERRORS as e:
+            self.failures += 1
+            delay = self.retry_delay()
+            self.next_poll = now + delay
+            self.logger.warning(f"Polling {self.url} failed ({e}); keeping the running config, retrying in {delay:.0f}s.")
+            return None
+        self.failures = 0
+        self.next_poll = now + self.poll_delay()
+        return fetched
+
+    def poll_delay(self) -> float:
+        return self.interval * self.rng.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def retry_delay(self) -> float:
+        # Randomized over the upper half, so agents that lost the server together do not return together
+        return self.rng.uniform(0.5, 1.0) * min(RETRY_DELAY * 2 ** (self.failures - 1), self.interval)
@@ -0,0 +1,232 @@
+"""
+Local control socket, and ipsecctl, its command-line client.
+
+The agent listens on a Unix domain socket (control_socket: agent.sock in
+the agent directory by default). The socket is created with mode 0600, so only
+the agent's user can connect. No TCP port is opened.
+
+The protocol is newline-delimited JSON: one request per line, answered by one
+response per line. A client may send any number of requests over one
+connection.
+
+  -> {"command": "down", "name": "conn1"}
+  <- {"ok": true, "result": ...}
+  <- {"ok": false, "error": "Unknown connection: conn1"}
+
+Commands:
+  status       agent state and each connection's status as of the last check
+  up NAME      bring a connection up (and end a 'down')
+  down NAME    take a connection down; the agent leaves it down until 'up',
+               a reload that changes it, or a restart
+  reload       re-read the config and apply the difference, as SIGHUP does
+  flush-cache  drop the swanctl render cache: the next apply renders afresh
+  stats        the latest kernel datapath statistics (Linux)
+
+'status' and 'stats' answer from memory. The other commands wait for a
+control loop step in progress to finish.
+
+Usage: ipsecctl [--socket PATH] [--json] status|up NAME|down NAME|reload|flush-cache|stats
+       (or python -m agent.control ...)
+"""
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Optional
+from agent import install_dir
+
+CONTROL_SOCKET = "agent.sock"
+COMMANDS = ("status", "up", "down", "reload", "flush-cache", "stats")
+# Where ipsecctl looks without --socket (or IPSECCTL_SOCKET): the default of an agent installed with this package
+DEFAULT_SOCKET = install_dir() / CONTROL_SOCKET
+# Seconds ipsecctl waits for an answer; reload and up can take as long as an apply
+CLIENT_TIMEOUT = 300
+MAX_REQUEST = 64 * 1024
+
+
+class ControlError(Exception):
+    """The agent answered the request with an error."""
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline(MAX_REQUEST)
+            if not line:
+                return
+            self.wfile.write(self.server.control.dispatch(line))
+
+
+class ControlServer:
+    """Serves the control protocol for 'target', an IPsecAgent or shards.Supervisor (anything with control())."""
+
+    def __init__(self, path: Path, target, logger):
+        self.path = Path(path)
+        self.target = target
+        self.logger = logger
+        self.server = None
+
+    def dispatch(self, line: bytes) -> bytes:
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict) or not isinstance(request.get("command"), str):
+                raise ValueError("A request is a JSON object with a 'command'")
+            args = {k: v for k, v in request.items() if k != "command"}
+            response = {"ok": True, "result": self.target.control(request["command"], args)}
+        except ValueError as e:
+            response = {"ok": False, "error": str(e)}
+        except Exception as e:
+            self.logger.error(f"Control command failed: {e}")
+            response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        return json.dumps(response, default=str).encode() + b"\n"
+
+    def start(self) -> bool:
+        server_class = getattr(socketserver, "ThreadingUnixStreamServer", None)
+        if server_class is None:
+            self.logger.info("No Unix domain sockets on this platform; the control socket is disabled.")
+            return False
+        if self.path.exists() or self.path.is_symlink():
+            if _listening(self.path):
+                self.logger.error(f"Another process is listening on {self.path}; the control socket is disabled.")
+                return False
+            self.path.unlink() # Left by an agent that did not stop cleanly
+        # Created 0600: only the agent's user may connect
+        umask = os.umask(0o177)
+        try:
+            self.server = server_class(str(self.path), _Handler)
+        except OSError as e:
+            self.logger.error(f"Could not create the control socket {self.path}: {e}")
+            return False
+        finally:
+            os.umask(umask)
+        self.server.daemon_threads = True
+        self.server.control = self
+        threading.Thread(target=self.server.serve_forever, name="control-socket", daemon=True).start()
+        self.logger.info(f"Control socket listening on {self.path}")
+        return True
+
+    def stop(self):
+        if not self.server:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
+        self.path.unlink(missing_ok=True)
+
+
+def _listening(path: Path) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(str(path))
+            return True
+        except OSError:
+            return False
+
+
+def serve_control(path: Path, target, logger) -> Optional[ControlServer]:
+    """Starts a control socket in a daemon thread; None where it could not be created."""
+    server = ControlServer(path, target, logger)
+    return server if server.start() else None
+
+
+class ControlClient:
+    """One connection to an agent's control socket."""
+
+    def __init__(self, path=DEFAULT_SOCKET, timeout: float = CLIENT_TIMEOUT):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.sock.settimeout(timeout)
+            self.sock.connect(str(path))
+        except OSError:
+            self.sock.close()
+            raise
+        self.file = self.sock.makefile("rb")
+
+    def request(self, command: str, **args) -> Any:
+        self.sock.sendall(json.dumps({"command": command, **args}).encode() + b"\n")
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("the agent closed the connection")
+        response = json.loads(line)
+        if not response.get("ok"):
+            raise ControlError(response.get("error"))
+        return response.get("result")
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def format_status(report: dict) -> str:
+    last = report.get("last_check_seconds")
+    lines = [f"State: {report.get('agent_state')}" + (f" (last check {last:.1f}s ago)" if last is not None else "")]
+    counts = report.get("connections") or {}
+    if counts:
+        lines.append("Connections: " + ", ".join(f"{n} {s}" for s, n in sorted(counts.items())))
+    for shard in report.get("shards", []):
+        lines.append(f"Shard {shard['shard']}: pid {shard['pid']}, {shard['state']}, "
+                     f"{shard['connections']} connections, {shard['restarts']} restarts")
+    states = report.get("connection_states") or {}
+    failover, probes = report.get("failover", {}), report.get("probes", {})
+    width = max(map(len, states), default=0)
+    for name, status in sorted(states.items()):
+        line = f"  {name:<{width}}  {status}"
+        if name in failover:
+            f = failover[name]
+            line += f"  gateway {f['gateway']}" + ("" if f.get("preferred") else " (standby)")
+        if name in probes:
+            p = probes[name]
+            line += f"  probe {p['verdict']} {p['loss']:.0%} loss"
+            if p.get("rtt_p99_ms") is not None:
+                line += f" p99 {p['rtt_p99_ms']:.1f} ms"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main(argv: list[str] = None) -> int:
+    import argparse # Only needed by the command line
+    parser = argparse.ArgumentParser(prog="ipsecctl", description="Control a running IPsec agent over its control socket.")
+    parser.add_argument("--socket", default=os.environ.get("IPSECCTL_SOCKET", str(DEFAULT_SOCKET)),
+                        help=f"Control socket (default: $IPSECCTL_SOCKET or {DEFAULT_SOCKET})")
+    parser.add_argument("--json", action="store_true", help="Print the raw result")
+    parser.add_argument("--timeout", type=float, default=CLIENT_TIMEOUT)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="Agent and connection status")
+    commands.add_parser("up", help="Bring a connection up").add_argument("name")
+    commands.add_parser("down", help="Take a connection down and keep it down").add_argument("name")
+    commands.add_parser("reload", help="Re-read the config and apply the difference")
+    commands.add_parser("flush-cache", help="Drop the swanctl render cache")
+    commands.add_parser("stats", help="Kernel datapath statistics")
+    args = parser.parse_args(argv)
+
+    if not hasattr(socket, "AF_UNIX"):
+        print("ipsecctl: no Unix domain sockets on this platform", file=sys.stderr)
+        return 2
+    request = {"name": args.name} if args.command in ("up", "down") else {}
+    try:
+        with ControlClient(args.socket, args.timeout) as client:
+            result = client.request(args.command, **request)
+    except ControlError as e:
+        print(f"ipsecctl: {e}", file=sys.stderr)
+        return 1
+    except OSError as e:
+        print(f"ipsecctl: cannot reach the agent at {args.socket}: {e}", file=sys.stderr)
+        return 2
+    if args.command == "status" and not args.json:
+        print(format_status(result))
+    elif result is not None:
+        print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
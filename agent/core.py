@@ -1,43 +1,150 @@
-import time
-import subprocess
 import logging
 import os
 import json
 import sys
 import platform
-import logging
-import os
-import json
-import sys
-from logging.handlers import RotatingFileHandler
+import signal
+import threading
+from collections import Counter
 from enum import Enum
+from dataclasses import replace
 from pathlib import Path
-from agent.config_schema import AgentConfig, load_config
+from agent import install_dir
+from agent.config_schema import AgentConfig, ConnectionConfig, load_config
+from agent.clock import SystemClock
+from agent.journal import Journal, render_options
+from agent.base import HEALTHY_STATES, ADMIN_DOWN
+from agent.failover import FailoverTracker, check_interval
 
 # Constants
 CHECK_INTERVAL = 30  # Seconds
 MAX_LOG_SIZE = 5 * 1024 * 1024  # 5 MB
 LOG_BACKUP_COUNT = 3
+JOURNAL_FILE = "agent_state.json"
+CUTOVER_POLL = 2  # Seconds between checks while changed connections are being replaced
+STOP_POLL = 1  # Longest a sleep between checks goes without noticing a stop request (SIGTERM)
+
+def select_auto_proposals(config: AgentConfig, logger: logging.Logger, previous: AgentConfig = None):
+    """
+    Orders the proposals of 'auto' connections for this host and logs why. The
+    choice of 'previous' (the running config) is kept if it was made the same way:
+    the host has not changed, and the openssl benchmark is not run again.
+    """
+    if config.auto_proposals or not any("auto" in (c.encryption.ike, c.encryption.esp) for c in config.connections):
+        return
+    if previous and previous.auto_proposals and previous.proposal_benchmark == config.proposal_benchmark:
+        config.auto_proposals = previous.auto_proposals
+        return
+    from agent.proposals import select_proposals, benchmark_crypto
+    from agent.sysinfo import cpu_features
+    bench = None
+    if config.proposal_benchmark:
+        logger.info("Benchmarking local crypto for 'auto' proposals...")
+        bench = benchmark_crypto()
+        if not bench:
+            logger.warning("openssl not found; ordering 'auto' proposals by CPU features only.")
+    choice = select_proposals(cpu_features(), bench)
+    for reason in choice.reasons:
+        logger.info(f"Auto proposals: {reason}")
+    logger.info(f"Auto proposals: IKE {choice.ike_proposals}")
+    logger.info(f"Auto proposals: ESP {choice.esp_proposals}")
+    config.auto_proposals = choice
 
 class AgentState(Enum):
     INIT = "INIT"
     APPLYING = "APPLYING"
     CONNECTED = "CONNECTED"
     DISCONNECTED = "DISCONNECTED"
+    DEGRADED = "DEGRADED"
     ERROR = "ERROR"
 
+def serve_health_api(port: int, source):
+    """
+    Serves the health API in a daemon thread: /status from
+    source.status_report(), /stats from source.stats (404 while None).
+    """
+    import http.server
+    import threading
+
+    class HealthHandler(http.server.BaseHTTPRequestHandler):
+        # Keep-alive, so scrapers (see agent.fleet) can reuse their connection
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if self.path == "/status":
+                body = source.status_report()
+            elif self.path == "/stats" and source.stats is not None:
+                body = source.stats
+            else:
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            return # Silence console spam
+
+    def run_server():
+        server_address = ('', port)
+        try:
+            # One thread per connection: a scraper holding its connection open must not block the others
+            httpd = http.server.ThreadingHTTPServer(server_address, HealthHandler)
+            httpd.daemon_threads = True
+            print(f"Health API running on port {port}")
+            httpd.serve_forever()
+        except Exception as e:
+            print(f"Failed to start API server: {e}")
+
+    t = threading.Thread(target=run_server, daemon=True)
+    t.start()
+
 class IPsecAgent:
 
-    def __init__(self, config_path: str):
+    def __init__(self, config_path: str, clock=None, logger: logging.Logger = None):
         self.config_path = config_path
+        self.clock = clock or SystemClock()
+        self.running = False
         self.config: AgentConfig = None
         self.state = AgentState.INIT
-        self.base_dir = Path(__file__).parent.parent.resolve()
+        self.base_dir = install_dir()
         self.backend = None
-        self.logger = None
+        self.logger = logger
+        # Applied-state journal used to adopt live SAs on restart (None disables it)
+        self.journal = Journal(self.base_dir / JOURNAL_FILE, self.clock)
+        # Changed connections being replaced make-before-break: {name: old ConnectionConfig}
+        self.cutover: dict[str, ConnectionConfig] = {}
+        self.cutover_deadline = None
+        # Cutovers that move a connection back to its preferred gateway
+        self.failbacks: set[str] = set()
+        # Latest kernel datapath statistics (see IPsecBackend.sample_stats)
+        self.stats = None
+        # Latest in-tunnel probe results: {name: ProbeResult}
+        self.probe_results = {}
+        # Per-connection status as of the latest control loop step
+        self.connection_states: dict[str, str] = {}
+        self._last_check = None
+        # Connections taken down with 'ipsecctl down' (see agent.control); not repaired until brought up
+        self.held_down: set[str] = set()
+        # Held by each control loop step and by control commands that change state
+        self.lock = threading.RLock()
+        self.control_server = None
+        # agent.systemd.Notifier, set by run(): readiness, status and watchdog pings for systemd
+        self.notifier = None
+        self._next_stats = 0
+        self._reload_requested = False
+        # Polls config_path when it is a URL (see agent.config_source)
+        self.config_source = None
         
-        # Initialize basic logging immediately
-        self.setup_logging()
+        # Initialize basic logging immediately (embedders such as simulations pass their own logger)
+        if not self.logger:
+            self.setup_logging()
+        self.failover = FailoverTracker(self.clock, self.logger)
 
     def setup_logging(self):
         log_level = logging.INFO
@@ -65,6 +172,7 @@ class IPsecAgent:
                  log_type = "file"
 
         if log_type == "file":
+            from logging.handlers import RotatingFileHandler
             log_file = self.base_dir / "agent.log"
             fh = RotatingFileHandler(log_file, maxBytes=MAX_LOG_SIZE, backupCount=LOG_BACKUP_COUNT)
             fh.setFormatter(formatter)
@@ -88,46 +196,76 @@ class IPsecAgent:
     def start_health_api(self):
         if not self.config or not self.config.api_port:
             return
+        serve_health_api(self.config.api_port, self)
 
-        import http.server
-        import threading
-        
-        agent_ref = self
-
-        class HealthHandler(http.server.BaseHTTPRequestHandler):
-            def do_GET(self):
-                if self.path == "/status":
-                    self.send_response(200)
-                    self.send_header('Content-type', 'application/json')
-                    self.end_headers()
-                    
-                    status = agent_ref.check_status()
-                    current_state = agent_ref.state.value
-                    
-                    resp = {
-                        "status": status,
-                        "agent_state": current_state,
-                        "uptime": "TODO" # Could add uptime
-                    }
-                    self.wfile.write(json.dumps(resp).encode())
-                else:
-                    self.send_response(404)
-                    self.end_headers()
-            
-            def log_message(self, format, *args):
-                return # Silence console spam
+    def start_control_socket(self):
+        if not self.config or not self.config.control_socket:
+            return
+        from agent.control import serve_control
+        self.control_server = serve_control(self.base_dir / self.config.control_socket, self, self.logger)
 
-        def run_server():
-            server_address = ('', self.config.api_port)
-            try:
-                httpd = http.server.HTTPServer(server_address, HealthHandler)
-                print(f"Health API running on port {self.config.api_port}")
-                httpd.serve_forever()
-            except Exception as e:
-                print(f"Failed to start API server: {e}")
+    def control(self, command: str, args: dict) -> object:
+        """Runs a control socket command (see agent.control); raises ValueError for a bad request."""
+        if command == "status":
+            return {**self.status_report(live=False), "connection_states": dict(self.connection_states)}
+        if command == "stats":
+            return self.stats
+        with self.lock:
+            self.logger.info(f"Control command: {command} {args.get('name', '')}".rstrip())
+            if command == "reload":
+                return self.reload()
+            if command == "flush-cache":
+                self.backend.flush_cache()
+                return None
+            if command in ("up", "down"):
+                return self.set_connection(args.get("name"), command == "up")
+        from agent.control import COMMANDS
+        raise ValueError(f"Unknown command '{command}', expected one of: {', '.join(COMMANDS)}")
 
-        t = threading.Thread(target=run_server, daemon=True)
-        t.start()
+    def set_connection(self, name: str, up: bool) -> str:
+        """Brings one connection up, or takes it down and keeps it down; returns its status."""
+        if not any(c.name == name for c in self.config.connections):
+            raise ValueError(f"Unknown connection: {name}")
+        if not self.backend.per_connection_status:
+            raise ValueError(f"{type(self.backend).__name__} cannot bring single connections up or down")
+        if up:
+            self.held_down.discard(name)
+            if not self.backend.repair([name]):
+                raise RuntimeError(f"Could not bring {name} up")
+            status = self.backend.connection_status().get(name, "DISCONNECTED")
+        else:
+            self.held_down.add(name)
+            self.backend.hold([name])
+            status = ADMIN_DOWN
+        self.connection_states[name] = status
+        return status
+
+    def status_report(self, live: bool = True) -> dict:
+        """
+        The health API's /status document. Without 'live', "status" is taken
+        from the last control loop step instead of queried from the backend.
+        """
+        if live:
+            status = self.check_status()
+        else:
+            status = "CONNECTED" if HEALTHY_STATES & set(self.connection_states.values()) else "DISCONNECTED"
+        resp = {
+            "status": status,
+            "agent_state": self.state.value,
+            "uptime": "TODO", # Could add uptime
+            # Seconds since the control loop last checked the connections; a growing value means a stuck agent
+            "last_check_seconds": round(self.clock.monotonic() - self._last_check, 1) if self._last_check is not None else None,
+        }
+        if self.connection_states:
+            resp["connections"] = dict(Counter(self.connection_states.values()))
+            resp["down"] = sorted(name for name, status in self.connection_states.items()
+                                  if status not in HEALTHY_STATES and status != ADMIN_DOWN)
+        failover = self.failover.metrics(self.config)
+        if failover:
+            resp["failover"] = failover
+        if self.probe_results:
+            resp["probes"] = {name: r.to_dict() for name, r in self.probe_results.items()}
+        return resp
 
     def load_configuration(self):
         try:
@@ -135,20 +273,72 @@ class IPsecAgent:
             if not self.logger: self.setup_logging() 
             
             self.logger.info(f"Loading configuration from {self.config_path}")
-            self.config = load_config(self.config_path)
+            self.config = self._read_config()
             
             # Re-setup logging with config
             self.setup_logging()
             self.logger.info("Configuration loaded successfully.")
-            
+            self._prepare_config(self.config)
+
             self._init_backend()
-            self.start_health_api()
+            if self.config.shutdown_policy == "detach" and not self.backend.per_connection_status:
+                self.logger.warning("shutdown_policy 'detach' leaves policies up, but this platform cannot adopt them: "
+                                    "the next start re-applies every connection.")
+            if self.config.shards > 1 and not self.sharded:
+                self.logger.warning(f"shards = {self.config.shards} needs per-connection status; running as one process.")
+            if not self.sharded:
+                # Sharded, the supervisor serves both
+                self.start_health_api()
+                self.start_control_socket()
         except Exception as e:
             if self.logger: self.logger.error(f"Failed to load configuration: {e}")
             else: print(f"Failed to load configuration: {e}")
             self.state = AgentState.ERROR
             raise
 
+    @property
+    def sharded(self) -> bool:
+        """Whether run() hands the connections to worker processes (see agent.shards)."""
+        return self.config.shards > 1 and self.backend is not None and self.backend.per_connection_status
+
+    def _read_config(self) -> AgentConfig:
+        """Reads config_path: a file, or an http(s) URL fetched with its last good copy cached on disk."""
+        if self.config_source is None and str(self.config_path).startswith(("http://", "https://")):
+            from agent.config_source import RemoteConfigSource, CACHE_FILE
+            self.config_source = RemoteConfigSource(self.config_path, self.base_dir / CACHE_FILE, self.logger)
+        if self.config_source:
+            return self.config_source.load(self.clock.time())
+        return load_config(self.config_path)
+
+    def _prepare_config(self, config: AgentConfig):
+        """The host-specific steps after reading a config, at startup and before a reload is compared."""
+        self._report_selector_conflicts(config)
+        self._select_auto_proposals(config)
+        self._report_datapath_warnings(config)
+
+    def _report_selector_conflicts(self, config: AgentConfig, limit: int = 20):
+        conflicts = config.selector_conflicts
+        if not conflicts:
+            return
+        self.logger.warning(f"{len(conflicts)} overlapping traffic selector(s) across connections.")
+        for c in conflicts[:limit]:
+            self.logger.warning(c.describe())
+        if len(conflicts) > limit:
+            self.logger.warning(f"... {len(conflicts) - limit} more conflicts not shown.")
+
+    def _select_auto_proposals(self, config: AgentConfig = None):
+        select_auto_proposals(config or self.config, self.logger, previous=self.config)
+
+    def _report_datapath_warnings(self, config: AgentConfig):
+        from agent.datapath import datapath_warnings
+        from agent.sysinfo import network_interfaces
+        for warning in datapath_warnings(config, platform.system(), network_interfaces()):
+            self.logger.warning(f"Datapath: {warning}")
+        if platform.system() == "Linux" and any(c.datapath.multicore for c in config.connections):
+            from agent.multicore import tuning_report
+            for tuning in tuning_report():
+                self.logger.info(f"Multicore tuning: {tuning.describe()}")
+
     def _init_backend(self):
         system = platform.system()
         self.logger.info(f"Detected OS: {system}")
@@ -169,10 +359,13 @@ class IPsecAgent:
         if not self.backend: return AgentState.ERROR.value
         return self.backend.check_status()
 
-    def apply_policy(self):
+    def apply_policy(self, names: list[str] = None):
         if not self.backend: return
         self.state = AgentState.APPLYING
-        if self.backend.apply_policy():
+        ok = self.backend.apply_policy() if names is None else self.backend.apply_policy(names)
+        if ok:
+            if self.journal:
+                self.journal.record(self.config, type(self.backend).__name__, names)
              # Verify immediately
             status = self.check_status()
             if status == "CONNECTED":
@@ -187,6 +380,256 @@ class IPsecAgent:
     def cleanup(self):
         if self.backend:
             self.backend.cleanup()
+        if self.journal:
+            self.journal.clear()
+
+    def adopt(self) -> set[str]:
+        """
+        Returns the connections that are up (or, on demand, trapped) with the same config the journal says
+        was applied last time. Costs one status query; nothing is changed.
+        """
+        if not self.journal or not self.backend or not self.backend.per_connection_status:
+            return set()
+        candidates = self.journal.matching(self.config, type(self.backend).__name__)
+        if not candidates:
+            return set()
+        try:
+            statuses = self.backend.connection_status()
+        except Exception as e:
+            self.logger.warning(f"Could not query live SAs, applying everything: {e}")
+            return set()
+        return {name for name in candidates if statuses.get(name) in HEALTHY_STATES}
+
+    def _removed_since_journal(self) -> list[str]:
+        """Connections the journal says were applied last time that are no longer in the config."""
+        if not self.journal or not self.backend:
+            return []
+        configured = {c.name for c in self.config.connections}
+        return sorted(self.journal.connections(type(self.backend).__name__) - configured)
+
+    def start(self):
+        """
+        Initial bring-up: takes down connections removed from the config since
+        the last run, adopts unchanged live connections and applies the rest.
+        """
+        if not self.backend: return
+        adopted = self.adopt()
+        removed = self._removed_since_journal()
+        if removed:
+            self.logger.info(f"Taking down {len(removed)} connections removed from the config since the last run: {', '.join(removed[:10])}")
+            self.backend.terminate(removed)
+        pending = [c.name for c in self.config.connections if c.name not in adopted]
+        if adopted:
+            self.logger.info(f"Adopted {len(adopted)} of {len(self.config.connections)} connections already up from the previous run.")
+        if not pending and removed:
+            # Re-rendered and loaded without them, which also prunes them from the journal
+            self.apply_policy([])
+        elif not pending:
+            self.state = AgentState.CONNECTED
+            self.logger.info("Link is UP (Adopted).")
+        elif adopted:
+            self.logger.info(f"Applying {len(pending)} new or changed connections: {', '.join(pending[:10])}")
+            self.apply_policy(pending)
+        else:
+            self.apply_policy()
+
+    def reload(self, config: AgentConfig = None):
+        """
+        Applies a new configuration (re-read from config_path if not given),
+        touching only what changed: added connections are brought up, removed
+        ones taken down, and changed ones replaced make-before-break where the
+        backend supports it. Unchanged connections are left alone. Returns
+        the names added, removed and changed.
+        """
+        new = config or self._read_config()
+        # Resolved before comparing: 'auto' proposals render as this host's choice, not as the static default
+        self._prepare_config(new)
+        old_conns = {c.name: c for c in self.config.connections}
+        new_conns = {c.name: c for c in new.connections}
+        # Connections stay on the gateway they failed over to, if it is still configured
+        for name, conn in new_conns.items():
+            if name in old_conns and old_conns[name].active_gateway in conn.gateway_addresses():
+                conn.active_gateway = old_conns[name].active_gateway
+        added = [name for name in new_conns if name not in old_conns]
+        removed = [name for name in old_conns if name not in new_conns]
+        edited = [name for name in new_conns if name in old_conns and old_conns[name].digest() != new_conns[name].digest()]
+        changed = list(edited)
+        if render_options(new) != render_options(self.config):
+            # An agent-wide option every connection is rendered with changed: all are replaced (but not brought up)
+            changed += [name for name in new_conns if name in old_conns and name not in edited and name not in self.held_down]
+        # A connection changed again mid-cutover is replaced from the version still running
+        for name in changed:
+            if name in self.cutover:
+                old_conns[name] = self.cutover.pop(name)
+        result = {"added": added, "removed": removed, "changed": changed}
+        # A connection held down stays down unless it was changed
+        self.held_down &= new_conns.keys() - set(edited)
+        # Agent-wide settings (check_interval, shutdown_policy, probe defaults...) take effect either way
+        self.config = new
+        self.backend.config = new
+        if not (added or removed or changed):
+            self.logger.info("No connection changed.")
+            return result
+
+        self.logger.info(f"Reloading configuration: {len(added)} added, {len(removed)} removed, {len(changed)} changed.")
+        abandoned = [name for name in removed if name in self.cutover]
+        if abandoned:
+            self.backend.rollback(abandoned)
+            for name in abandoned:
+                del self.cutover[name]
+
+        pending = list(added)
+        if changed and self.backend.supports_make_before_break:
+            self.logger.info(f"Bringing up new versions of {', '.join(changed[:10])} next to the running ones...")
+            running = {name: old_conns[name] for name in changed}
+            staged = self.backend.stage(running)
+            self.cutover.update(running)
+            # If the new config could not even be loaded, the next step rolls it back
+            self.cutover_deadline = self.clock.time() + (new.cutover_timeout if staged else 0)
+        else:
+            pending += changed
+        if pending or removed:
+            self.apply_policy(pending)
+        if removed:
+            self.backend.terminate(removed)
+        return result
+
+    def _advance_cutover(self):
+        """Commits staged connections whose new SA (or trap) is installed; rolls back the rest after cutover_timeout."""
+        if not self.cutover: return
+        statuses = self.backend.staged_status()
+        ready = [name for name in self.cutover if statuses.get(name) in HEALTHY_STATES]
+        if ready:
+            self.logger.info(f"New SAs installed, closing old versions of: {', '.join(ready[:10])}")
+            self.backend.commit(ready)
+            self.failover.failback_done([name for name in ready if name in self.failbacks])
+            for name in ready:
+                del self.cutover[name]
+                self.failbacks.discard(name)
+            if self.journal:
+                self.journal.record(self.config, type(self.backend).__name__, ready)
+
+        if self.cutover and self.clock.time() >= self.cutover_deadline:
+            expired = list(self.cutover)
+            self.logger.warning(f"New versions of {', '.join(expired[:10])} did not come up in time. Rolling back.")
+            # Back to the running versions, in place so the backend sees the same config object
+            self.config.connections[:] = [self.cutover.get(c.name, c) for c in self.config.connections]
+            self.backend.rollback(expired)
+            self.cutover.clear()
+            self.failbacks.clear()
+
+    def step(self):
+        """One iteration of the control loop: check every connection and repair what is down."""
+        if not self.backend: return
+        # A requested reload fetches the document now
+        polled = self.config_source.poll(self.clock.time(), force=self._reload_requested) if self.config_source else None
+        if polled:
+            self.logger.info(f"New configuration from {self.config_path}.")
+        if polled or self._reload_requested:
+            self._reload_requested = False
+            config, commit = polled or (None, None)
+            try:
+                self.reload(config)
+            except Exception as e:
+                self.logger.error(f"Reload failed, keeping the running configuration: {e}")
+            else:
+                if commit:
+                    commit()
+        self._advance_cutover()
+        self._start_failbacks()
+        statuses = self.backend.connection_status()
+        held = [name for name in statuses if name in self.held_down]
+        for name in held:
+            del statuses[name]
+        blackholed = self._probe(statuses)
+        if blackholed:
+            self.logger.warning(f"{len(blackholed)} connections are up but pass no probe traffic. Re-establishing: {', '.join(blackholed[:10])}")
+            self.backend.terminate(blackholed)
+            statuses.update(dict.fromkeys(blackholed, "DISCONNECTED"))
+        self.connection_states = {**statuses, **dict.fromkeys(held, ADMIN_DOWN)}
+        self._last_check = self.clock.monotonic()
+        switched = []
+        if self.backend.per_connection_status:
+            switched = self.failover.update(self.config, {n: s for n, s in statuses.items() if n not in self.cutover})
+        down = [name for name, status in statuses.items() if status == "DISCONNECTED"]
+        self._sample_stats()
+
+        if statuses and all(status in HEALTHY_STATES for status in statuses.values()):
+            if self.state != AgentState.CONNECTED:
+                self.logger.info("State transition: -> CONNECTED")
+                self.state = AgentState.CONNECTED
+
+        elif down and len(down) == len(statuses):
+            if self.state == AgentState.CONNECTED:
+                self.logger.warning("Lost connection! State transition: -> DISCONNECTED")
+
+            self.logger.info("Link is DOWN. Re-applying policy...")
+            self.state = AgentState.DISCONNECTED
+            self.cleanup() # Clean before re-apply to be safe
+            self.apply_policy()
+            if self.held_down:
+                self.backend.hold(sorted(self.held_down))
+
+        elif down or switched:
+            # Only some connections are down: re-initiate those, leave the rest alone.
+            # Those switched to another gateway are re-rendered and loaded first.
+            if switched:
+                self.apply_policy(switched)
+            down = [name for name in down if name not in switched]
+            if down:
+                self.logger.warning(f"{len(down)} of {len(statuses)} connections down. Re-initiating: {', '.join(down[:10])}")
+                self.backend.repair(down)
+            self.state = AgentState.DEGRADED
+        # Otherwise connections are still negotiating; check again next cycle
+
+    def _probe(self, statuses: dict[str, str]) -> list[str]:
+        """Probes connected connections that have a probe; returns those whose verdict is down."""
+        from agent.probes import probe_specs
+        specs = [spec for spec in probe_specs(self.config) if statuses.get(spec.name) == "CONNECTED"]
+        if not specs:
+            self.probe_results = {}
+            return []
+        try:
+            self.probe_results = self.backend.probe(specs)
+        except Exception as e:
+            self.logger.warning(f"Probing failed: {e}")
+            return []
+        for result in self.probe_results.values():
+            if result.verdict != "healthy":
+                self.logger.info(f"Probe {result.describe()}")
+        return [name for name, result in self.probe_results.items() if result.verdict == "down"]
+
+    def _sample_stats(self):
+        interval = self.config.stats_interval
+        now = self.clock.time()
+        if not interval or now < self._next_stats:
+            return
+        self._next_stats = now + interval
+        try:
+            self.stats = self.backend.sample_stats(now)
+        except Exception as e:
+            self.logger.warning(f"Could not sample datapath statistics: {e}")
+
+    def _start_failbacks(self):
+        """Moves connections that ran on a standby gateway for their hold-down back to the preferred one."""
+        due = [name for name in self.failover.failbacks_due(self.config) if name not in self.cutover]
+        if not due:
+            return
+        running = {}
+        for i, conn in enumerate(self.config.connections):
+            if conn.name in due:
+                running[conn.name] = conn
+                # In place, so the backend sees the same config object
+                self.config.connections[i] = replace(conn, active_gateway=None)
+        self.logger.info(f"Hold-down over, failing back to the preferred gateway: {', '.join(due[:10])}")
+        self.failover.failback_started(due)
+        if self.backend.supports_make_before_break:
+            staged = self.backend.stage(running)
+            self.cutover.update(running)
+            self.failbacks.update(running)
+            self.cutover_deadline = self.clock.time() + (self.config.cutover_timeout if staged else 0)
+        else:
+            self.apply_policy(due)
 
     def run(self):
         self.logger.info("Agent starting...")
@@ -195,48 +638,123 @@ class IPsecAgent:
         except:
             return # Exit if config fails
 
-        # Initial cleanup to ensure clean slate?
-        # Maybe safer to just try Applying. 
-        # But if we want deterministic prototype: Apply on start.
-        self.apply_policy()
+        from agent.systemd import Notifier
+        self.notifier = Notifier()
+        if self.sharded:
+            from agent.shards import Supervisor
+            Supervisor(self.config, self.base_dir, self.logger, config_path=self.config_path,
+                       config_source=self.config_source, notifier=self.notifier).run()
+            return
+        # Connections left up by a previous run with an unchanged config are kept
+        self.start()
+        self._notify()
+        self._install_signal_handlers()
+        self.run_loop()
+        self.shutdown()
+
+    def _install_signal_handlers(self):
+        try:
+            signal.signal(signal.SIGTERM, self._on_sigterm)
+            signal.signal(signal.SIGHUP, self._on_sighup)
+        except (AttributeError, ValueError):
+            pass # No SIGTERM/SIGHUP on this platform, or not running in the main thread
+
+    def _on_sigterm(self, signum, frame):
+        # Ends the loop after the step in progress (raising here could leave a cutover or reload half done);
+        # the sleep between steps notices within STOP_POLL
+        self.running = False
 
-        while True:
+    def _on_sighup(self, signum, frame):
+        # Picked up by the next step()
+        self._reload_requested = True
+
+    def run_loop(self, until: float = None):
+        """
+        Runs the control loop until stop() is called, or until the clock reaches
+        'until' (used by simulations on a VirtualClock).
+        """
+        self.running = True
+        while self.running and (until is None or self.clock.time() < until):
+            # Standby gateways shorten the interval to their dpd_delay (see agent.failover)
+            interval = check_interval(self.config) if self.config else CHECK_INTERVAL
             try:
-                current_status = self.check_status()
-                
-                if current_status == "CONNECTED":
-                    if self.state != AgentState.CONNECTED:
-                        self.logger.info("State transition: -> CONNECTED")
-                        self.state = AgentState.CONNECTED
-                    # Heartbeat log every once in a while?
-                    # self.logger.debug("Heartbeat: Connected")
-
-                elif current_status == "DISCONNECTED":
-                    if self.state == AgentState.CONNECTED:
-                        self.logger.warning("Lost connection! State transition: -> DISCONNECTED")
-                    
-                    self.logger.info("Link is DOWN. Re-applying policy...")
-                    self.state = AgentState.DISCONNECTED
-                    self.cleanup() # Clean before re-apply to be safe
-                    self.apply_policy()
-
-                # Sleep
-                time.sleep(CHECK_INTERVAL)
+                with self.lock:
+                    self.step()
+                self._notify()
+
+                # Sleep (shorter while a cutover waits for new SAs)
+                self._sleep(CUTOVER_POLL if self.cutover else interval)
 
             except KeyboardInterrupt:
-                self.logger.info("Agent stopping (User Interrupt)...")
-                self.cleanup()
+                self.logger.info("Agent stopping (Interrupt)...")
                 break
             except Exception as e:
                 self.logger.error(f"Unexpected error in main loop: {e}")
                 self.state = AgentState.ERROR
-                time.sleep(CHECK_INTERVAL) # Wait before retry
+                self._sleep(interval) # Wait before retry
+        self.running = False
+
+    def _notify(self):
+        """Tells systemd (see agent.systemd) the agent is ready, once an apply succeeded, and how the connections are."""
+        if not self.notifier or not self.notifier.enabled:
+            return
+        from agent.systemd import status_line
+        status = status_line(self.state.value, len(self.config.connections), self.connection_states)
+        if not self.notifier.is_ready and self.state not in (AgentState.INIT, AgentState.APPLYING, AgentState.ERROR):
+            self.notifier.ready(status)
+        else:
+            self.notifier.status(status)
+        self.notifier.watchdog()
+
+    def _sleep(self, seconds: float):
+        """
+        Sleeps between steps, in slices of at most STOP_POLL so a stop request ends it early,
+        pinging the systemd watchdog at least every half WatchdogSec meanwhile.
+        """
+        period = STOP_POLL
+        if self.notifier and self.notifier.watchdog_interval:
+            period = min(period, self.notifier.watchdog_interval / 2)
+        end = self.clock.monotonic() + seconds
+        while self.running:
+            left = end - self.clock.monotonic()
+            if left <= 0:
+                return
+            self.clock.sleep(min(left, period))
+            if self.notifier:
+                self.notifier.watchdog()
+
+    def stop(self):
+        self.running = False
+
+    def shutdown(self):
+        """
+        Stops the agent according to config.shutdown_policy: 'teardown' removes
+        every policy, 'detach' leaves policies and SAs up for the next agent
+        process to adopt (see start()).
+        """
+        self.running = False
+        if self.notifier:
+            self.notifier.stopping()
+        if self.control_server:
+            self.control_server.stop()
+            self.control_server = None
+        policy = self.config.shutdown_policy if self.config else "teardown"
+        if policy == "detach":
+            self.logger.info("Detaching: policies and SAs are left up for the next agent process.")
+            if self.journal:
+                self.journal.mark_detached()
+        else:
+            self.logger.info("Tearing down policies...")
+            self.cleanup()
+
+def main(argv: list[str] = None) -> int:
+    """Entry point of 'python -m agent.core' and of the zipapp built by scripts/pkg.py."""
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) < 1:
+        print("Usage: python -m agent.core <config_path>")
+        return 1
+    IPsecAgent(argv[0]).run()
+    return 0
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python core.py <config_path>")
-        sys.exit(1)
-    
-    config_path = sys.argv[1]
-    agent = IPsecAgent(config_path)
-    agent.run()
+    sys.exit(main())
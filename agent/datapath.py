@@ -0,0 +1,101 @@
+"""
+Checks of the per-connection datapath options against the host.
+
+Nothing here changes the configuration; the agent logs the warnings at
+startup so a setting that caps throughput (or is silently ignored by the
+platform) is visible before traffic is.
+"""
+from agent.config_schema import AgentConfig, ConnectionConfig
+from agent.sysinfo import NicInfo, fastest_nic
+from agent.mtu import esp_proposals
+from agent.swanctl import PFKEY_DATAPATH_OPTIONS
+
+# charon's replay window when none is configured (charon.replay_window)
+DEFAULT_REPLAY_WINDOW = 32
+# Smallest window that survives reordering across receive queues at 10G and up
+FAST_REPLAY_WINDOW = 1024
+FAST_LINK = 10000  # Mbit/s
+# IPComp runs in software for every packet; above this it is the bottleneck
+IPCOMP_MAX_LINK = 1000  # Mbit/s
+# Full-size packet for the sequence number estimate
+PACKET_BYTES = 1400
+# Names listed per warning before the rest is summarized
+MAX_NAMES = 5
+
+# Options each platform applies; None for all
+PLATFORM_OPTIONS = {
+    "Linux": None,
+    "Darwin": PFKEY_DATAPATH_OPTIONS | {"on_demand", "failover"},
+    "Windows": frozenset(),
+}
+
+
+def configured_options(conn: ConnectionConfig) -> list[str]:
+    """Names of the datapath options the connection sets."""
+    names = list(conn.datapath.options())
+    if conn.datapath.esn:
+        names.insert(0, "esn")
+    if conn.datapath.multicore:
+        names.append("multicore")
+    if conn.datapath.mss_clamp:
+        names.append("mss_clamp")
+    if conn.routing.route_based:
+        names.append("route_based")
+    if conn.on_demand:
+        names.append("on_demand")
+    if len(conn.gateways) > 1:
+        names.append("failover")
+    return names
+
+
+def _connection_warnings(conn: ConnectionConfig, config: AgentConfig, system: str, nic: NicInfo) -> list[str]:
+    dp = conn.datapath
+    warnings = []
+    supported = PLATFORM_OPTIONS.get(system, frozenset())
+    ignored = [o for o in configured_options(conn) if supported is not None and o not in supported]
+    if ignored:
+        warnings.append(f"{system} does not support datapath option(s) {', '.join(ignored)}; ignored")
+    xfrm = supported is None # Linux
+
+    if nic and nic.speed >= FAST_LINK and nic.rx_queues > 1:
+        window = DEFAULT_REPLAY_WINDOW if dp.replay_window is None else dp.replay_window
+        if 0 < window < FAST_REPLAY_WINDOW and (supported is None or "replay_window" in supported):
+            source = "charon default" if dp.replay_window is None else "configured"
+            warnings.append(f"Replay window {window} ({source}) on a {nic.speed} Mbit/s link with "
+                            f"{nic.rx_queues} receive queues ({nic.name}); packets reordered across queues "
+                            f"are dropped as replays. Use replay_window >= {FAST_REPLAY_WINDOW}")
+    if dp.ipcomp and nic and nic.speed > IPCOMP_MAX_LINK:
+        warnings.append(f"IPComp compresses every packet in software and limits throughput well "
+                        f"below the {nic.speed} Mbit/s of {nic.name}")
+    if xfrm and dp.hw_offload in ("yes", "crypto", "packet"):
+        first = esp_proposals(conn, config)[0]
+        if "gcm" not in first:
+            warnings.append(f"hw_offload = {dp.hw_offload} with ESP proposal {first}: NICs offload "
+                            f"AES-GCM only, so the SA cannot be installed offloaded")
+        if dp.ipcomp:
+            warnings.append(f"hw_offload = {dp.hw_offload} with IPComp: compressed SAs are not offloaded")
+    if nic and not dp.esn and (xfrm or "esn" in supported):
+        exhausted = 2**32 / (nic.speed * 1e6 / 8 / PACKET_BYTES) # Seconds at line rate
+        if exhausted < conn.lifetime_minutes * 60:
+            warnings.append(f"32-bit sequence numbers run out after {exhausted / 60:.0f} of the "
+                            f"{conn.lifetime_minutes} SA minutes at {nic.speed} Mbit/s line rate; enable esn")
+    return warnings
+
+
+def datapath_warnings(config: AgentConfig, system: str, nics: list[NicInfo]) -> list[str]:
+    """
+    Returns one line per distinct warning, naming the connections it applies
+    to. 'system' is a platform.system() value, 'nics' the host's physical NICs.
+    """
+    nic = fastest_nic(nics)
+    grouped: dict[str, list[str]] = {}
+    for conn in config.connections:
+        for warning in _connection_warnings(conn, config, system, nic):
+            grouped.setdefault(warning, []).append(conn.name)
+    lines = []
+    for warning, names in grouped.items():
+        shown = ", ".join(names[:MAX_NAMES])
+        if len(names) > MAX_NAMES:
+            shown += f" and {len(names) - MAX_NAMES} more"
+        lines.append(f"{shown}: {warning}")
+    return lines
@@ -0,0 +1,129 @@
+"""
+Active/standby gateway failover.
+
+A connection with several gateways talks to one at a time: the preferred one
+(lowest priority value) unless it failed. Its child SA renders
+dpd_action = clear, so when DPD declares the active gateway dead charon
+drops the SA instead of retrying it, and the next control loop step moves
+the connection to the next gateway in priority order. A gateway that does
+not come up within dpd_timeout is given up the same way.
+
+Once the connection has run on a standby gateway for failback_holddown
+seconds, the agent tries the preferred gateway again, make-before-break
+where the backend supports it, so a failed attempt costs nothing.
+
+Failover time is measured from the first step that saw the gateway down to
+the first step that saw the connection healthy on another one, so its
+resolution is the check interval (see check_interval()).
+"""
+import logging
+from dataclasses import dataclass
+from typing import Optional
+from agent.base import HEALTHY_STATES
+from agent.config_schema import AgentConfig, ConnectionConfig
+
+
+def failover_connections(config: AgentConfig) -> list[ConnectionConfig]:
+    return [c for c in config.connections if len(c.gateways) > 1]
+
+
+def check_interval(config: AgentConfig) -> float:
+    """Connections with standby gateways are checked at least once per DPD interval."""
+    delays = [c.dpd_delay for c in failover_connections(config)]
+    return min([config.check_interval] + delays)
+
+
+@dataclass
+class GatewayState:
+    down_since: Optional[float] = None      # First step that saw the active gateway down
+    outage_started: Optional[float] = None  # Start of the failover in progress
+    standby_since: Optional[float] = None   # Healthy on a non-preferred gateway since
+    failovers: int = 0
+    failbacks: int = 0
+    last_failover_seconds: Optional[float] = None
+
+
+class FailoverTracker:
+    """Gateway state of every failover connection, updated from each step's statuses."""
+    def __init__(self, clock, logger: logging.Logger):
+        self.clock = clock
+        self.logger = logger
+        self.states: dict[str, GatewayState] = {}
+
+    def _switch(self, conn: ConnectionConfig, state: GatewayState, now: float):
+        addresses = conn.gateway_addresses()
+        current = conn.current_gateway()
+        following = addresses[(addresses.index(current) + 1) % len(addresses)] if current in addresses else addresses[0]
+        self.logger.warning(f"Gateway {current} of {conn.name} is down; failing over to {following}.")
+        conn.active_gateway = following
+        if state.outage_started is None:
+            state.outage_started = state.down_since
+        # The new gateway gets dpd_timeout of its own to come up
+        state.down_since = now
+        state.standby_since = None
+
+    def update(self, config: AgentConfig, statuses: dict[str, str]) -> list[str]:
+        """
+        Returns the connections switched to another gateway; the caller
+        re-applies them. Connections missing from statuses are left alone.
+        """
+        now = self.clock.time()
+        switched = []
+        conns = failover_connections(config)
+        for name in set(self.states) - {c.name for c in conns}:
+            del self.states[name]
+        for conn in conns:
+            state = self.states.setdefault(conn.name, GatewayState())
+            status = statuses.get(conn.name)
+            if status is None:
+                continue # Not reported, e.g. while being replaced
+            if status in HEALTHY_STATES:
+                state.down_since = None
+                if state.outage_started is not None:
+                    state.failovers += 1
+                    state.last_failover_seconds = now - state.outage_started
+                    state.outage_started = None
+                    self.logger.info(f"{conn.name} failed over to {conn.current_gateway()} "
+                                     f"in {state.last_failover_seconds:.0f}s.")
+                if conn.current_gateway() == conn.gateway_addresses()[0]:
+                    state.standby_since = None
+                elif state.standby_since is None:
+                    state.standby_since = now
+                continue
+            if state.down_since is None:
+                state.down_since = now
+            if status == "DISCONNECTED" or now - state.down_since >= conn.dpd_timeout:
+                self._switch(conn, state, now)
+                switched.append(conn.name)
+        return switched
+
+    def failbacks_due(self, config: AgentConfig) -> list[str]:
+        """Connections that have been healthy on a standby gateway for their hold-down."""
+        now = self.clock.time()
+        return [c.name for c in failover_connections(config)
+                if c.name in self.states and self.states[c.name].standby_since is not None
+                and now - self.states[c.name].standby_since >= c.failback_holddown]
+
+    def failback_started(self, names: list[str]):
+        """The hold-down restarts if the connection is still on its standby afterwards (rolled back)."""
+        for name in names:
+            self.states[name].standby_since = None
+
+    def failback_done(self, names: list[str]):
+        for name in names:
+            if name in self.states:
+                self.states[name].failbacks += 1
+
+    def metrics(self, config: AgentConfig) -> dict[str, dict]:
+        """Per-connection gateway and failover counters, as exported by the health API."""
+        result = {}
+        for conn in failover_connections(config):
+            state = self.states.get(conn.name, GatewayState())
+            result[conn.name] = {
+                "gateway": conn.current_gateway(),
+                "preferred": conn.current_gateway() == conn.gateway_addresses()[0],
+                "failovers": state.failovers,
+                "failbacks": state.failbacks,
+                "last_failover_seconds": state.last_failover_seconds,
+            }
+        return result
@@ -0,0 +1,347 @@
+"""
+Fleet view over many agents' health APIs.
+
+Scrapes /status from every agent concurrently on one asyncio event loop and
+summarizes the fleet:
+
+  agent_states     agents by agent_state
+  connections      connections by status, summed over the fleet
+  worst_tunnels    down tunnels first, then probe loss and RTT, then failovers
+  stale            agents that answer but whose control loop has not checked
+                   its connections for stale_after seconds
+  unreachable      agents that refused, failed or timed out
+
+Every target gets at most 'timeout' seconds, and at most 'concurrency'
+targets are scraped at once, so a round takes at most
+ceil(targets / concurrency) * timeout however many agents hang. Connections
+are HTTP/1.1 keep-alive and reused across rounds (--interval), so a steady
+round costs one request per agent and no handshakes.
+
+Usage: python -m agent.fleet [--targets FILE] [--format json|prometheus]
+       [--output PATH] [--interval SECONDS] [name=]host:port|URL ...
+
+Prometheus output written with --output suits node_exporter's textfile
+collector: the file is replaced atomically.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import urllib.parse
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+# Seconds one agent may take to answer, connecting included
+SCRAPE_TIMEOUT = 2.0
+# Agents scraped at the same time
+MAX_CONCURRENCY = 256
+# An agent whose last check is older than this is reported stale
+STALE_AFTER = 120.0
+WORST_TUNNELS = 20
+MAX_RESPONSE = 64 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class Target:
+    name: str
+    host: str
+    port: int
+    path: str = "/status"
+
+
+@dataclass
+class ScrapeResult:
+    agent: str
+    report: Optional[dict]
+    error: Optional[str] = None
+    seconds: float = 0.0
+
+
+def parse_target(text: str) -> Target:
+    """'[name=]host:port' or '[name=]http://host:port/path'; the name defaults to host:port."""
+    name, sep, address = text.strip().partition("=")
+    if not sep:
+        name, address = "", name
+    url = urllib.parse.urlsplit(address if "://" in address else f"http://{address}")
+    if url.scheme != "http":
+        raise ValueError(f"Target '{text}': only http:// is supported")
+    try:
+        port = url.port
+    except ValueError:
+        port = None
+    if not url.hostname or not port:
+        raise ValueError(f"Target '{text}' needs a host and a port")
+    return Target(name or f"{url.hostname}:{port}", url.hostname, port, url.path or "/status")
+
+
+def read_targets(path: Path) -> list[Target]:
+    """One target per line; blank lines and '#' comments are skipped."""
+    lines = (line.split("#", 1)[0].strip() for line in Path(path).read_text().splitlines())
+    return [parse_target(line) for line in lines if line]
+
+
+async def _read_response(reader: asyncio.StreamReader) -> tuple[int, bytes, bool]:
+    """(status code, body, whether the connection can be reused)"""
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("connection closed by the agent")
+    parts = line.split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith(b"HTTP/") or not parts[1].isdigit():
+        raise ValueError(f"not an HTTP response: {line[:60]!r}")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        key, _, value = line.decode("latin-1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise ValueError("chunked responses are not supported")
+    if "content-length" in headers:
+        length = int(headers["content-length"])
+        if length > MAX_RESPONSE:
+            raise ValueError(f"response of {length} bytes is too large")
+        body = await reader.readexactly(length)
+        keep_alive = parts[0] == b"HTTP/1.1" and headers.get("connection", "").lower() != "close"
+    else:
+        body = await reader.read(MAX_RESPONSE)
+        keep_alive = False
+    return int(parts[1]), body, keep_alive
+
+
+class FleetScraper:
+    """Scrapes the targets' /status, keeping one idle connection per target for the next round."""
+
+    def __init__(self, targets: list[Target], timeout: float = SCRAPE_TIMEOUT, concurrency: int = MAX_CONCURRENCY):
+        names = [t.name for t in targets]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Duplicate target names: {sorted(n for n, c in Counter(names).items() if c > 1)}")
+        self.targets = targets
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self._idle: dict[str, tuple[asyncio.StreamReader, asyncio.StreamWriter]] = {}
+        # Connections opened so far; stays at len(targets) while agents keep theirs open
+        self.connections_opened = 0
+        self.last_duration: Optional[float] = None
+
+    async def _get(self, target: Target) -> dict:
+        connection = self._idle.pop(target.name, None)
+        reused = connection is not None
+        if connection is None:
+            connection = await asyncio.open_connection(target.host, target.port)
+            self.connections_opened += 1
+        reader, writer = connection
+        try:
+            writer.write(f"GET {target.path} HTTP/1.1\r\nHost: {target.host}:{target.port}\r\n"
+                         f"Accept: application/json\r\n\r\n".encode())
+            await writer.drain()
+            status, body, keep_alive = await _read_response(reader)
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            writer.close()
+            if reused:
+                # The agent dropped the idle connection (restart, idle timeout): once more on a new one
+                return await self._get(target)
+            raise
+        except BaseException:
+            # Timed out mid-response: the connection is out of step
+            writer.close()
+            raise
+        if keep_alive:
+            self._idle[target.name] = connection
+        else:
+            writer.close()
+        if status != 200:
+            raise ValueError(f"HTTP {status}")
+        report = json.loads(body)
+        if not isinstance(report, dict):
+            raise ValueError("status is not a JSON object")
+        return report
+
+    async def _scrape_one(self, target: Target, slots: asyncio.Semaphore) -> ScrapeResult:
+        async with slots:
+            t0 = time.perf_counter()
+            try:
+                report = await asyncio.wait_for(self._get(target), self.timeout)
+                return ScrapeResult(target.name, report, seconds=time.perf_counter() - t0)
+            except asyncio.TimeoutError:
+                error = f"timed out after {self.timeout}s"
+            except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+                error = str(e) or type(e).__name__
+            return ScrapeResult(target.name, None, error, time.perf_counter() - t0)
+
+    async def scrape(self) -> list[ScrapeResult]:
+        """One round over every target, in target order."""
+        slots = asyncio.Semaphore(self.concurrency)
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*(self._scrape_one(t, slots) for t in self.targets))
+        self.last_duration = time.perf_counter() - t0
+        return list(results)
+
+    async def close(self):
+        for _, writer in self._idle.values():
+            writer.close()
+        self._idle.clear()
+
+
+def _tunnels(agent: str, report: dict) -> list[dict]:
+    """The agent's connections with something wrong (or that failed over), with a severity to rank them."""
+    tunnels: dict[str, dict] = {}
+    for name in report.get("down", []):
+        tunnels.setdefault(name, {"status": "DOWN"})
+    for name, probe in report.get("probes", {}).items():
+        tunnels.setdefault(name, {}).update(verdict=probe.get("verdict"), loss=probe.get("loss"),
+                                            rtt_p99_ms=probe.get("rtt_p99_ms"))
+    for name, failover in report.get("failover", {}).items():
+        if failover.get("failovers") or not failover.get("preferred", True):
+            tunnels.setdefault(name, {}).update(gateway=failover.get("gateway"), preferred=failover.get("preferred"),
+                                                failovers=failover.get("failovers"))
+    result = []
+    for name, tunnel in tunnels.items():
+        if tunnel.get("status") == "DOWN" or tunnel.get("verdict") == "down":
+            severity = 3
+        elif tunnel.get("verdict") == "degraded":
+            severity = 2
+        elif tunnel.get("preferred") is False:
+            severity = 1
+        else:
+            severity = 0
+        if severity or tunnel.get("failovers"):
+            result.append({"agent": agent, "connection": name, "severity": severity, **tunnel})
+    return result
+
+
+def summarize(results: list[ScrapeResult], stale_after: float = STALE_AFTER, worst: int = WORST_TUNNELS,
+              scrape_seconds: float = None) -> dict:
+    agent_states, connections = Counter(), Counter()
+    stale, unreachable, tunnels = [], [], []
+    for result in results:
+        if result.report is None:
+            unreachable.append({"agent": result.agent, "error": result.error})
+            continue
+        report = result.report
+        agent_states[report.get("agent_state", "UNKNOWN")] += 1
+        connections.update(report.get("connections", {}))
+        age = report.get("last_check_seconds")
+        if age is not None and age > stale_after:
+            stale.append({"agent": result.agent, "last_check_seconds": age})
+        tunnels.extend(_tunnels(result.agent, report))
+    tunnels.sort(key=lambda t: (-t["severity"], -(t.get("loss") or 0), -(t.get("rtt_p99_ms") or 0),
+                                -(t.get("failovers") or 0), t["agent"], t["connection"]))
+    return {
+        "scraped_at": time.time(),
+        "scrape_seconds": round(scrape_seconds, 3) if scrape_seconds is not None else None,
+        "agents": len(results),
+        "reachable": len(results) - len(unreachable),
+        "agent_states": dict(agent_states),
+        "connections": dict(connections),
+        "worst_tunnels": tunnels[:worst],
+        "stale": sorted(stale, key=lambda s: -s["last_check_seconds"]),
+        "unreachable": unreachable,
+    }
+
+
+def _labels(**labels) -> str:
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+def prometheus_text(results: list[ScrapeResult], summary: dict) -> str:
+    """The fleet in the Prometheus text exposition format."""
+    metrics: dict[str, tuple[str, str, list[str]]] = {}
+
+    def add(name: str, kind: str, help: str, value, **labels):
+        if value is None:
+            return
+        metrics.setdefault(name, (kind, help, []))[2].append(f"{name}{_labels(**labels) if labels else ''} {value}")
+
+    stale = {s["agent"] for s in summary["stale"]}
+    add("ipsec_fleet_agents", "gauge", "Agents by scrape result.", summary["reachable"] - len(stale), result="ok")
+    add("ipsec_fleet_agents", "gauge", "Agents by scrape result.", len(stale), result="stale")
+    add("ipsec_fleet_agents", "gauge", "Agents by scrape result.", len(summary["unreachable"]), result="unreachable")
+    add("ipsec_fleet_scrape_duration_seconds", "gauge", "Duration of the last scrape round.", summary["scrape_seconds"])
+    for result in results:
+        agent = result.agent
+        add("ipsec_fleet_agent_up", "gauge", "Whether the agent's health API answered.", int(result.report is not None), agent=agent)
+        if result.report is None:
+            continue
+        report = result.report
+        add("ipsec_fleet_agent_state", "gauge", "The agent's state (1 for the current one).", 1,
+            agent=agent, state=report.get("agent_state", "UNKNOWN"))
+        add("ipsec_fleet_agent_last_check_seconds", "gauge", "Seconds since the agent last checked its connections.",
+            report.get("last_check_seconds"), agent=agent)
+        for status, count in sorted(report.get("connections", {}).items()):
+            add("ipsec_fleet_connections", "gauge", "Connections by status.", count, agent=agent, status=status)
+        for name, probe in sorted(report.get("probes", {}).items()):
+            add("ipsec_fleet_probe_loss_ratio", "gauge", "In-tunnel probe loss.", probe.get("loss"), agent=agent, connection=name)
+            p99 = probe.get("rtt_p99_ms")
+            add("ipsec_fleet_probe_rtt_p99_seconds", "gauge", "In-tunnel probe RTT, 99th percentile.",
+                p99 / 1000 if p99 is not None else None, agent=agent, connection=name)
+        for name, failover in sorted(report.get("failover", {}).items()):
+            add("ipsec_fleet_failovers_total", "counter", "Failovers to a standby gateway.", failover.get("failovers"),
+                agent=agent, connection=name)
+    lines = []
+    for name, (kind, help, samples) in metrics.items():
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}", *samples]
+    return "\n".join(lines) + "\n"
+
+
+def write_output(text: str, path: Optional[str]):
+    if not path:
+        sys.stdout.write(text)
+        return
+    # Atomic, so a textfile collector never reads half a file
+    tmp = Path(f"{path}.tmp")
+    tmp.write_text(text)
+    os.replace(tmp, path)
+
+
+async def _run(scraper: FleetScraper, args) -> int:
+    try:
+        while True:
+            results = await scraper.scrape()
+            summary = summarize(results, args.stale_after, args.worst, scraper.last_duration)
+            if args.format == "prometheus":
+                write_output(prometheus_text(results, summary), args.output)
+            else:
+                write_output(json.dumps(summary, indent=2) + "\n", args.output)
+            if not args.interval:
+                return 0 if not summary["unreachable"] and not summary["stale"] else 1
+            await asyncio.sleep(max(args.interval - scraper.last_duration, 0))
+    finally:
+        await scraper.close()
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m agent.fleet", description="Scrape many agents' /status and summarize the fleet.")
+    parser.add_argument("targets", nargs="*", help="[name=]host:port or [name=]http://host:port/path")
+    parser.add_argument("--targets", dest="targets_file", help="File with one target per line")
+    parser.add_argument("--format", choices=["json", "prometheus"], default="json")
+    parser.add_argument("--output", help="Write here instead of stdout (replaced atomically)")
+    parser.add_argument("--timeout", type=float, default=SCRAPE_TIMEOUT, help="Seconds per agent")
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENCY)
+    parser.add_argument("--stale-after", type=float, default=STALE_AFTER)
+    parser.add_argument("--worst", type=int, default=WORST_TUNNELS)
+    parser.add_argument("--interval", type=float, default=0, help="Scrape every INTERVAL seconds, reusing connections")
+    args = parser.parse_args(argv)
+    try:
+        targets = [parse_target(t) for t in args.targets]
+        if args.targets_file:
+            targets += read_targets(args.targets_file)
+        if not targets:
+            parser.error("no targets")
+        scraper = FleetScraper(targets, args.timeout, args.concurrency)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 2
+    try:
+        return asyncio.run(_run(scraper, args))
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""
+Applied-state journal.
+
+After every successful apply the agent records which backend applied which
+version (ConnectionConfig.digest()) of each connection. On the next start the
+journal is compared with the live SA state: connections that are up and whose
+config did not change are adopted as they are instead of being re-applied.
+
+The file is small JSON, written atomically:
+
+    {"version": 1, "backend": "LinuxAgent", "applied_at": 1718000000.0,
+     "options": {...}, "connections": {"SiteA": "<sha256>", ...}}
+"""
+import json
+import os
+from pathlib import Path
+from agent.config_schema import AgentConfig
+
+JOURNAL_VERSION = 1
+
+
+def render_options(config: AgentConfig) -> dict:
+    """
+    Agent-wide settings that change the applied config of every connection: the
+    inputs of SwanctlRenderer's options key, including the proposals this host
+    chose for 'auto' connections.
+    """
+    auto = config.auto_proposals
+    return {
+        "aggregate_selectors": config.aggregate_selectors,
+        "rekey_spread": config.rekey_spread,
+        "swanctl_layout": config.swanctl_layout,
+        "auto_proposals": [auto.ike_proposals, auto.esp_proposals] if auto else None,
+    }
+
+
+class Journal:
+    def __init__(self, path: Path, clock):
+        self.path = Path(path)
+        self.clock = clock
+
+    def load(self) -> dict:
+        """Returns the journal, or None if it is missing, unreadable or from another version."""
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return None
+        if not isinstance(data, dict) or data.get("version") != JOURNAL_VERSION:
+            return None
+        return data
+
+    def connections(self, backend: str) -> set[str]:
+        """Names of the connections the journal says were applied last; empty for another backend."""
+        data = self.load()
+        if not data or data.get("backend") != backend:
+            return set()
+        return set(data.get("connections", {}))
+
+    def record(self, config: AgentConfig, backend: str, names: list[str] = None):
+        """
+        Records the applied connections. With 'names', only those are updated and
+        the entries of other current connections are kept.
+        """
+        digests = {c.name: c.digest() for c in config.connections}
+        if names is not None:
+            previous = (self.load() or {}).get("connections", {})
+            kept = {n: previous[n] for n in digests if n not in names and n in previous}
+            digests = {**kept, **{n: digests[n] for n in names if n in digests}}
+        data = {
+            "version": JOURNAL_VERSION,
+            "backend": backend,
+            "applied_at": self.clock.time(),
+            "options": render_options(config),
+            "connections": digests,
+        }
+        self._write(data)
+
+    def mark_detached(self):
+        """Notes that the agent stopped without tearing the applied connections down."""
+        data = self.load()
+        if not data:
+            return
+        data["detached_at"] = self.clock.time()
+        self._write(data)
+
+    def _write(self, data: dict):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(data, indent=2, sort_keys=True))
+        os.replace(tmp, self.path)
+
+    def copy_to(self, path: Path, names: set[str]) -> bool:
+        """Writes the entries of the named connections to another journal (a shard's); False without a journal."""
+        data = self.load()
+        if not data:
+            return False
+        data["connections"] = {n: d for n, d in data.get("connections", {}).items() if n in names}
+        Journal(path, self.clock)._write(data)
+        return True
+
+    def clear(self):
+        self.path.unlink(missing_ok=True)
+
+    def matching(self, config: AgentConfig, backend: str) -> set[str]:
+        """Names of connections whose journaled version equals the current config."""
+        data = self.load()
+        if not data or data.get("backend") != backend or data.get("options") != render_options(config):
+            return set()
+        applied = data.get("connections", {})
+        return {c.name for c in config.connections if applied.get(c.name) == c.digest()}
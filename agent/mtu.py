@@ -0,0 +1,203 @@
+"""
+ESP overhead, effective tunnel MTU and nftables TCP MSS clamping.
+
+The overhead of an ESP packet is the ESP header (SPI, sequence number), the
+IV, the trailer (padding to the cipher's block size, pad length, next
+header), the ICV and, in tunnel mode, the outer IP header. With NAT-T
+another UDP header comes on top; it is always counted, since whether a NAT
+is in the path is only known once the SA is up.
+
+MSS clamping rewrites the MSS option of TCP SYNs crossing the tunnel's
+selectors, so TCP never sends segments that would have to be fragmented
+after encryption. Each connection gets its own nftables table, named after
+it, so its rules are replaced and removed together with the connection. The
+same table holds the marks that spread a multicore connection's traffic
+over its parallel child SAs.
+"""
+import hashlib
+import ipaddress
+import re
+from dataclasses import dataclass
+from typing import Optional
+from agent.config_schema import AgentConfig, ConnectionConfig
+from agent.swanctl import resolve_proposal, spread_rules, DEFAULT_ESP_PROPOSAL
+
+ESP_HEADER = 8       # SPI + sequence number
+ESP_TRAILER = 2      # pad length + next header
+UDP_ENCAP = 8        # NAT-T
+IP_HEADER = {4: 20, 6: 40}
+TCP_HEADER = 20
+
+# nftables table names: <prefix><connection>
+NFT_TABLE_PREFIX = "ipsec_agent_"
+
+# (IV, block alignment) per cipher family; ESP aligns to at least 4 bytes
+_CIPHERS = [
+    (re.compile(r"^aes\d*gcm(8|12|16)?$"), 8, 4),
+    (re.compile(r"^aes\d*ccm(8|12|16)?$"), 8, 4),
+    (re.compile(r"^chacha20poly1305$"), 8, 4),
+    (re.compile(r"^aes\d*ctr$"), 8, 4),
+    (re.compile(r"^(aes|camellia)\d*(cbc)?$"), 16, 16),
+    (re.compile(r"^3des$"), 8, 8),
+    (re.compile(r"^null$"), 0, 4),
+]
+# ICV length per integrity algorithm (truncated HMACs as used by ESP)
+_INTEGRITY = {"md5": 12, "sha1": 12, "aesxcbc": 12, "sha256": 16, "sha384": 24, "sha512": 32}
+# Unknown algorithms are assumed to be as large as anything above
+_WORST = (16, 16, 32)
+
+
+@dataclass
+class EspOverhead:
+    iv: int
+    block: int
+    icv: int
+    known: bool = True
+
+
+def esp_overhead(proposal: str) -> EspOverhead:
+    """IV, block alignment and ICV of one ESP proposal, e.g. 'aes256gcm16' or 'aes256-sha256-modp2048'."""
+    tokens = proposal.lower().split("-")
+    for pattern, iv, block in _CIPHERS:
+        m = pattern.match(tokens[0])
+        if not m:
+            continue
+        if "gcm" in tokens[0] or "ccm" in tokens[0]:
+            return EspOverhead(iv, block, int(m.group(1) or 16))
+        if tokens[0] == "chacha20poly1305":
+            return EspOverhead(iv, block, 16)
+        icv = next((_INTEGRITY[t] for t in tokens[1:] if t in _INTEGRITY), None)
+        if icv is None:
+            return EspOverhead(iv, block, _WORST[2], known=False)
+        return EspOverhead(iv, block, icv)
+    return EspOverhead(_WORST[0], _WORST[1], _WORST[2], known=False)
+
+
+def inner_mtu(overhead: EspOverhead, mode: str, outer: int = 4, link_mtu: int = 1500, nat_t: bool = True) -> int:
+    """
+    Largest inner IP packet that fits into one outer packet of link_mtu bytes.
+    In transport mode the IP header is not encrypted, only the payload behind
+    it, which must be padded.
+    """
+    fixed = ESP_HEADER + overhead.iv + overhead.icv + (UDP_ENCAP if nat_t else 0) + IP_HEADER[outer]
+    payload = (link_mtu - fixed) // overhead.block * overhead.block - ESP_TRAILER
+    return payload if mode == "tunnel" else payload + IP_HEADER[outer]
+
+
+def _family(subnet: str) -> int:
+    return ipaddress.ip_network(subnet, strict=False).version
+
+
+def esp_proposals(conn: ConnectionConfig, config: AgentConfig) -> list[str]:
+    """The connection's ESP proposals as rendered ('default' and 'auto' resolved)."""
+    auto = config.auto_proposals
+    return resolve_proposal(conn.encryption.esp, DEFAULT_ESP_PROPOSAL, auto and auto.esp_proposals).split(",")
+
+
+def connection_mtu(conn: ConnectionConfig, config: AgentConfig) -> int:
+    """Effective MTU of the connection: the smallest over all of its ESP proposals."""
+    outer = _family(conn.local_subnets[0])
+    return min(inner_mtu(esp_overhead(p), conn.mode, outer, conn.datapath.link_mtu)
+               for p in esp_proposals(conn, config))
+
+
+def clamp_mss(mtu: int, family: int) -> int:
+    return mtu - IP_HEADER[family] - TCP_HEADER
+
+
+def nft_table(name: str) -> str:
+    """nftables table of a connection; names nft cannot take get a hash suffix to stay unique."""
+    safe = re.sub(r"[^A-Za-z0-9_]", "_", name)
+    if safe != name:
+        safe += "_" + hashlib.sha256(name.encode()).hexdigest()[:8]
+    return NFT_TABLE_PREFIX + safe
+
+
+def _port(keyword: str, port: str) -> str:
+    return "" if port == "any" else f" tcp {keyword} {port}"
+
+
+def clamp_rules(conn: ConnectionConfig, mtu: int) -> list[str]:
+    """TCP SYN rules for both directions of each address family the selectors cover."""
+    if conn.protocol not in ("any", "tcp"):
+        return []
+    rules = []
+    for family, keyword in ((4, "ip"), (6, "ip6")):
+        local = [s for s in conn.local_subnets if _family(s) == family]
+        remote = [s for s in conn.remote_subnets if _family(s) == family]
+        if not (local and remote):
+            continue
+        mss = clamp_mss(mtu, family)
+        match = "tcp flags & (syn | rst) == syn"
+        clamp = f"tcp option maxseg size > {mss} tcp option maxseg size set {mss}"
+        out_ports = _port("sport", conn.local_port) + _port("dport", conn.remote_port)
+        in_ports = _port("sport", conn.remote_port) + _port("dport", conn.local_port)
+        rules.append(f"{keyword} saddr {{ {', '.join(local)} }} {keyword} daddr {{ {', '.join(remote)} }}{out_ports} {match} {clamp}")
+        rules.append(f"{keyword} saddr {{ {', '.join(remote)} }} {keyword} daddr {{ {', '.join(local)} }}{in_ports} {match} {clamp}")
+    return rules
+
+
+def render_connection_table(conn: ConnectionConfig, mtu: Optional[int] = None, spread: int = 1) -> str:
+    """
+    An nft script that atomically (re)creates the connection's table. With
+    an MTU, TCP MSS clamping rules run for forwarded traffic (gateway) and
+    traffic of the host itself. With 'spread' parallel children, outbound
+    traffic is marked before routing, where the XFRM policy lookup sees it:
+    in prerouting for forwarded traffic, and in a route chain for the host's
+    own, which reroutes it after the mark changed.
+    """
+    table = nft_table(conn.name)
+    chains = []
+    if mtu is not None:
+        rules = "".join(f"\n        {rule}" for rule in clamp_rules(conn, mtu))
+        chains.append(f"""    # {conn.name}: MTU {mtu} ({conn.mode}, ESP {conn.encryption.esp}, link MTU {conn.datapath.link_mtu})
+    chain clamp {{{rules}
+    }}
+    chain forward {{
+        type filter hook forward priority mangle; policy accept;
+        jump clamp
+    }}
+    chain output {{
+        type filter hook output priority mangle; policy accept;
+        jump clamp
+    }}
+""")
+    if spread > 1:
+        rules = "".join(f"\n        {rule}" for rule in spread_rules(conn, spread))
+        chains.append(f"""    # {conn.name}: {spread} parallel child SAs
+    chain spread {{{rules}
+    }}
+    chain prerouting {{
+        type filter hook prerouting priority mangle; policy accept;
+        jump spread
+    }}
+    chain route_output {{
+        type route hook output priority mangle; policy accept;
+        jump spread
+    }}
+""")
+    return f"""table inet {table}
+delete table inet {table}
+table inet {table} {{
+{"".join(chains)}}}
+"""
+
+
+def render_clamp_table(conn: ConnectionConfig, mtu: int) -> str:
+    """The connection's table with only MSS clamping."""
+    return render_connection_table(conn, mtu)
+
+
+def connection_tables(config: AgentConfig, spread: dict[str, int] = None) -> dict[str, str]:
+    """
+    {connection name: nft script} for every connection with mss_clamp or
+    parallel child SAs; 'spread' is {connection name: number of children}.
+    """
+    spread = spread or {}
+    tables = {}
+    for conn in config.connections:
+        mtu = connection_mtu(conn, config) if conn.datapath.mss_clamp else None
+        children = spread.get(conn.name, 1)
+        if mtu is not None or children > 1:
+            tables[conn.name] = render_connection_table(conn, mtu, children)
+    return tables
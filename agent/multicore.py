@@ -0,0 +1,142 @@
+"""
+Multi-core ESP: per-CPU SA support detection and a host tuning report.
+
+A child SA is processed on one CPU per packet flow, so a single tunnel is
+capped at one core's ESP throughput. Multicore connections get per-CPU SAs
+(strongSwan 6.0+ on Linux 6.13+) or parallel child SAs (see
+agent.swanctl.multicore_children). The kernel side is spread with RPS/XPS and
+pcrypt; this module only recommends those settings and never writes them.
+
+Run 'python -m agent.multicore [--root DIR]' to print the report.
+"""
+import os
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Optional
+from agent.sysinfo import cpu_features, network_interfaces
+
+# First versions with per-CPU SAs (RFC 9611)
+PER_CPU_SWANCTL = (6, 0)
+PER_CPU_KERNEL = (6, 13)
+
+# Global RFS flow table size recommended with RPS
+RPS_SOCK_FLOW_ENTRIES = 32768
+
+
+def parse_version(text: str) -> Optional[tuple[int, int]]:
+    """(major, minor) of the first version number in text, e.g. 'strongSwan swanctl 6.0.1' or '6.13.0-1-amd64'."""
+    m = re.search(r"(\d+)\.(\d+)", text or "")
+    return (int(m.group(1)), int(m.group(2))) if m else None
+
+
+def kernel_version(root: Path = Path("/")) -> Optional[tuple[int, int]]:
+    try:
+        return parse_version((Path(root) / "proc" / "sys" / "kernel" / "osrelease").read_text())
+    except OSError:
+        return None
+
+
+def per_cpu_sas_supported(swanctl_version: Optional[tuple[int, int]], kernel: Optional[tuple[int, int]]) -> bool:
+    return bool(swanctl_version and kernel and swanctl_version >= PER_CPU_SWANCTL and kernel >= PER_CPU_KERNEL)
+
+
+def cpu_mask(cpus: Iterable[int]) -> str:
+    """sysfs CPU mask ('f', 'ffffffff,ffffffff') for the given CPU numbers."""
+    digits = f"{sum(1 << c for c in cpus):x}"
+    groups = []
+    while len(digits) > 8:
+        groups.insert(0, digits[-8:])
+        digits = digits[:-8]
+    return ",".join([digits] + groups)
+
+
+def _mask_value(text: str) -> int:
+    try:
+        return int(text.strip().replace(",", ""), 16)
+    except ValueError:
+        return 0
+
+
+@dataclass
+class Tuning:
+    setting: str      # sysfs/procfs path, or a module name
+    current: str
+    recommended: str
+    reason: str
+
+    def command(self) -> str:
+        if self.setting.startswith("/"):
+            return f"echo {self.recommended} > {self.setting}"
+        return self.recommended
+
+    def describe(self) -> str:
+        return f"{self.setting}: {self.current} -> {self.recommended} ({self.reason})"
+
+
+def _read(root: Path, path: str) -> str:
+    try:
+        return (Path(root) / path.lstrip("/")).read_text().strip()
+    except OSError:
+        return ""
+
+
+def tuning_report(root: Path = Path("/")) -> list[Tuning]:
+    """RPS/XPS/pcrypt settings that spread ESP processing across the CPUs of the host at root."""
+    cpus = cpu_features(root).cpus or os.cpu_count() or 1
+    if cpus < 2:
+        return []
+    tunings = []
+    all_cpus = cpu_mask(range(cpus))
+    rps_used = False
+    for nic in network_interfaces(root):
+        if nic.rx_queues < cpus:
+            # Fewer receive queues than CPUs: RPS hands packets of each queue to all CPUs
+            for q in range(nic.rx_queues):
+                path = f"/sys/class/net/{nic.name}/queues/rx-{q}/rps_cpus"
+                current = _read(root, path)
+                rps_used = True
+                if _mask_value(current) != _mask_value(all_cpus):
+                    tunings.append(Tuning(path, current or "unset", all_cpus,
+                                          f"{nic.rx_queues} receive queue(s) for {cpus} CPUs"))
+        if nic.tx_queues > 1:
+            # XPS: each transmit queue is served by its own share of the CPUs
+            for q in range(nic.tx_queues):
+                path = f"/sys/class/net/{nic.name}/queues/tx-{q}/xps_cpus"
+                current = _read(root, path)
+                wanted = cpu_mask(c for c in range(cpus) if c % nic.tx_queues == q)
+                if wanted != "0" and _mask_value(current) != _mask_value(wanted):
+                    tunings.append(Tuning(path, current or "unset", wanted,
+                                          f"pins transmit queue {q} of {nic.tx_queues} to its CPUs"))
+    if rps_used:
+        path = "/proc/sys/net/core/rps_sock_flow_entries"
+        current = _read(root, path)
+        if (int(current) if current.isdigit() else 0) < RPS_SOCK_FLOW_ENTRIES:
+            tunings.append(Tuning(path, current or "unset", str(RPS_SOCK_FLOW_ENTRIES),
+                                  "RFS keeps decrypted flows on the CPU of their consumer"))
+    if not (Path(root) / "sys" / "module" / "pcrypt").exists():
+        tunings.append(Tuning("pcrypt", "not loaded",
+                              "modprobe pcrypt && crconf add driver 'pcrypt(rfc4106(gcm(aes)))' type 3",
+                              "runs AES-GCM of a single SA in parallel on all CPUs"))
+    return tunings
+
+
+def main(argv: list[str] = None):
+    import argparse # Only needed by the command line
+    parser = argparse.ArgumentParser(description="Recommends RPS/XPS/pcrypt settings for multi-core ESP.")
+    parser.add_argument("--root", default="/", help="filesystem root holding proc/ and sys/ (default: /)")
+    args = parser.parse_args(argv)
+    root = Path(args.root)
+    kernel = kernel_version(root)
+    print(f"Kernel {'.'.join(map(str, kernel)) if kernel else 'unknown'}; per-CPU SAs need Linux "
+          f"{'.'.join(map(str, PER_CPU_KERNEL))}+ and strongSwan {'.'.join(map(str, PER_CPU_SWANCTL))}+")
+    tunings = tuning_report(root)
+    if not tunings:
+        print("Nothing to tune.")
+    for t in tunings:
+        print(f"# {t.describe()}")
+        print(t.command())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,22 @@
-import subprocess
-import os
 import shutil
+import subprocess
 from pathlib import Path
-from agent.base import IPsecBackend
+from typing import Optional
 from agent.config_schema import AgentConfig
+from agent.platforms.swanctl_backend import SwanctlBackend
+from agent.swanctl import remove_config
+from agent.mtu import connection_tables, nft_table, NFT_TABLE_PREFIX
+from agent.routing import RoutePlan, route_plan, plan_commands, removal_commands
+from agent.multicore import parse_version, kernel_version, per_cpu_sas_supported
+from agent.swanctl import parse_list_sas
+from agent.xfrm import XfrmCollector
+
+# Seconds an nft or ip call may take; the control loop must not hang on one
+HOST_COMMAND_TIMEOUT = 30
 
-class LinuxAgent(IPsecBackend):
+class LinuxAgent(SwanctlBackend):
     def __init__(self, config: AgentConfig, base_dir: Path, logger):
-        super().__init__(config, base_dir, logger)
+        super().__init__(config, base_dir, logger, "# Generated by Unified IPsec Agent")
         self.conf_dir = Path("/etc/swanctl/conf.d")
         
         # Default to local output directory if /etc/swanctl doesn't exist (e.g. dev environment)
@@ -15,153 +24,207 @@ class LinuxAgent(IPsecBackend):
             self.conf_dir = self.base_dir / "output" / "swanctl"
             self.conf_dir.mkdir(parents=True, exist_ok=True)
 
-    def _generate_swanctl_conf(self) -> str:
-        """Generates swanctl.conf content based on config."""
-        
-        conf_lines = ["# Generated by Unified IPsec Agent"]
-        conf_lines.append("connections {")
-        
-        for conn in self.config.connections:
-            # Defaults
-            ike_prop = conn.encryption.ike if conn.encryption.ike != "default" else "aes256-sha256-modp2048"
-            esp_prop = conn.encryption.esp if conn.encryption.esp != "default" else "aes256-sha256"
-            
-            # Traffic Selectors
-            # Format: subnet[proto/port]
-            # e.g. 10.0.0.0/24[tcp/80]
-            
-            proto = conn.protocol.lower()
-            if proto == "any": proto_str = ""
-            else: proto_str = f"{proto}"
-            
-            # Ports
-            # Swanctl expects: [udp/500], [tcp], [6] (protocol number)
-            # If port provided, we need protocol.
-            
-            def format_ts(subnets, port):
-                ts_list = []
-                for s in subnets:
-                    if port != "any":
-                        # If port is set, assuming protocol is set or default to tcp/udp logic?
-                        # Config schema defaults protocol to "any".
-                        # StrongSwan requires protocol for port.
-                        p_str = proto if proto != "any" else "tcp" # Defaulting to tcp if port set but proto any? Or explicit validation needed.
-                        ts_list.append(f"{s}[{p_str}/{port}]")
-                    elif proto != "any":
-                         ts_list.append(f"{s}[{proto}]")
-                    else:
-                        ts_list.append(s)
-                return ",".join(ts_list)
-
-            local_ts = format_ts(conn.local_subnets, conn.local_port)
-            remote_ts = format_ts(conn.remote_subnets, conn.remote_port)
-            
-            # IDs usually based on first IP or explicit ID if we added that field
-            local_id = conn.local_subnets[0].split('/')[0]
-            remote_id = conn.remote_subnets[0].split('/')[0]
+        if any(c.datapath.multicore for c in config.connections):
+            self.renderer.per_cpu_sas = self._per_cpu_sas()
+        # Applied nftables scripts (MSS clamping, multicore marks) per connection
+        self.clamps: dict[str, str] = {}
+        # XFRM interfaces and routes as last applied
+        self.routes = RoutePlan()
+        # Kernel XFRM counters of the previous sample
+        self.xfrm = XfrmCollector()
+        self.proc_root = Path("/")
 
-            conf_lines.append(f"""
+    def _per_cpu_sas(self) -> bool:
+        """Whether charon and the kernel support per-CPU SAs; multicore falls back to parallel child SAs."""
+        swanctl = parse_version(self._swanctl("--version", timeout=10).stdout) if self._swanctl_bin() else None
+        supported = per_cpu_sas_supported(swanctl, kernel_version())
+        self.logger.info(f"Multicore connections use {'per-CPU SAs' if supported else f'{self.renderer.cpus} parallel child SAs'}.")
+        return supported
 
-    {conn.name} {{
-        local_addrs = {local_id} 
-        remote_addrs = {remote_id} 
-        
-        local {{
-            auth = {conn.auth.type}
-            id = {local_id}
-        }}
-        remote {{
-            auth = {conn.auth.type}
-            id = {remote_id}
-        }}
-        
-        children {{
-            {conn.name}-child {{
-                local_ts = {local_ts}
-                remote_ts = {remote_ts}
-                mode = {conn.mode}
-                esp_proposals = {esp_prop}
-                start_action = start
-                dpd_action = restart
-                dpd_delay = 30s
-            }}
-        }}
-        version = {2 if conn.ike_version == "ikev2" else 1}
-        proposals = {ike_prop}
-        dpd_delay = 30s
-        dpd_timeout = 120s
-    }}""")
-        
-        conf_lines.append("}\n") # End connections
-
-        conf_lines.append("secrets {")
-        for conn in self.config.connections:
-            local_id = conn.local_subnets[0].split('/')[0]
-            remote_id = conn.remote_subnets[0].split('/')[0]
-            conf_lines.append(f"""
-    ike-{conn.name} {{
-        secret = "{conn.auth.value}" 
-        id-a = {local_id}
-        id-b = {remote_id}
-    }}""")
-        conf_lines.append("}\n")
-
-        return "\n".join(conf_lines)
-
-    def apply_policy(self) -> bool:
+    def apply_policy(self, names: list[str] = None) -> bool:
         self.logger.info("Generating StrongSwan configuration (swanctl)...")
         
         try:
-            conf_content = self._generate_swanctl_conf()
-            conf_file = self.conf_dir / "agent.conf"
-            
-            self.logger.info(f"Writing config to {conf_file}")
-            with open(conf_file, "w") as f:
-                f.write(conf_content)
+            self.write_config()
                 
             # If we are on actual Linux and have swanctl implementation
-            if shutil.which("swanctl"):
+            if self._swanctl_bin():
                 self.logger.info("Reloading swanctl...")
                 # swanctl --load-all
                 subprocess.run(["swanctl", "--load-all"], check=True)
                 
                 self.logger.info("Initiating connections...")
                 for conn in self.config.connections:
-                    child_name = f"{conn.name}-child"
-                    self.logger.info(f"Initiating {child_name}...")
-                    subprocess.run(["swanctl", "--initiate", "--child", child_name], check=False)
+                    if names is not None and conn.name not in names:
+                        continue
+                    if conn.on_demand:
+                        continue # Loading installed its trap policy
+                    for child in self._children(conn.name):
+                        self.logger.info(f"Initiating {child}...")
+                        subprocess.run(["swanctl", "--initiate", "--child", child], check=False)
             else:
                 self.logger.warning("swanctl command not found. Config generated but not loaded (Expected if running on Windows).")
-            
+
+            self._sync_host()
             return True
             
         except Exception as e:
             self.logger.error(f"Failed to apply Linux policy: {e}")
             return False
 
-    def check_status(self) -> str:
-        # Check swanctl --list-sas
-        if shutil.which("swanctl"):
-            try:
-                res = subprocess.run(["swanctl", "--list-sas", "--output", "json"], capture_output=True, text=True)
-                # Parse JSON if possible, or just look for ANY active child SA
-                # Simple loose verification: if output contains "child-sa", likely something is up.
-                # Or check if any of our configured connection names are present as established.
-                if "home" in res.stdout or "child-" in res.stdout: 
-                     # Better: parse json? 
-                     # For prototype, string matching "INSTALLED" or "ESTABLISHED" is safer.
-                     # swanctl output usually says "state": "ESTABLISHED"
-                     if "ESTABLISHED" in res.stdout or "INSTALLED" in res.stdout:
-                         return "CONNECTED"
-            except:
-                pass
-        return "DISCONNECTED"
+    def _sync_host(self):
+        """Host state that follows the connections: nftables tables, XFRM interfaces and routes."""
+        self._sync_clamps()
+        self._sync_routes()
+
+    def _run_host(self, cmd: list[str], input: str = None) -> subprocess.CompletedProcess:
+        """Runs a host networking command; one that times out comes back as failed (exit code -1)."""
+        try:
+            return subprocess.run(cmd, input=input, capture_output=True, text=True, timeout=HOST_COMMAND_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            return subprocess.CompletedProcess(cmd, -1, "", f"timed out after {HOST_COMMAND_TIMEOUT}s")
+
+    # --- kernel statistics ---
+
+    def _run_xfrm_states(self) -> str:
+        """Returns the raw 'ip -s xfrm state' output, or '' without ip (or root)."""
+        if not shutil.which("ip"):
+            return ""
+        res = self._run_host(["ip", "-s", "xfrm", "state"])
+        return res.stdout if res.returncode == 0 else ""
+
+    def sample_stats(self, now: float) -> Optional[dict]:
+        """XFRM drop counters and per-connection SA counters, with deltas since the last sample."""
+        try:
+            xfrm_stat = (self.proc_root / "proc" / "net" / "xfrm_stat").read_text()
+        except OSError:
+            xfrm_stat = "" # Kernel built without CONFIG_XFRM_STATISTICS
+        xfrm_states = self._run_xfrm_states()
+        if not (xfrm_stat or xfrm_states):
+            return None
+        report = self.xfrm.sample(now, xfrm_stat, xfrm_states, parse_list_sas(self._run_list_sas()))
+        if report.interval is not None:
+            for line in report.describe_drops():
+                self.logger.warning(f"XFRM drops in the last {report.interval:.0f}s: {line}")
+        return report.to_dict()
+
+    # --- route-based connections ---
+
+    def _run_ip(self, cmd: list[str]) -> bool:
+        res = self._run_host(cmd)
+        if res.returncode != 0 and not (cmd[1:3] == ["link", "add"] and "File exists" in res.stderr):
+            self.logger.warning(f"{' '.join(cmd)} failed: {res.stderr.strip()[-200:]}")
+            return False
+        return True
+
+    def _sync_routes(self):
+        """Creates, updates and removes XFRM interfaces and routes to match the config."""
+        plan = route_plan(self.config)
+        commands = plan_commands(plan, self.routes)
+        if not commands:
+            return
+        if not shutil.which("ip"):
+            self.logger.warning("ip (iproute2) not found; route-based connections have no interfaces or routes.")
+            return
+        self.logger.info(f"Updating XFRM interfaces and routes ({len(commands)} changes)...")
+        failed = [cmd for cmd in commands if not self._run_ip(cmd)]
+        # After a failure the next sync redoes everything; 'add' of an existing interface is tolerated
+        self.routes = plan if not failed else RoutePlan()
+
+    def _remove_routes(self):
+        plan = route_plan(self.config)
+        plan.interfaces.update(self.routes.interfaces)
+        self.routes = RoutePlan()
+        if plan.interfaces and shutil.which("ip"):
+            for cmd in removal_commands(plan):
+                self._run_host(cmd)
+
+    # --- nftables: TCP MSS clamping and multicore marks ---
+
+    def _nft_bin(self):
+        return shutil.which("nft")
+
+    def _sync_clamps(self):
+        """
+        Brings the per-connection nftables tables (MSS clamping, marks for
+        parallel child SAs) in line with the config: tables of removed
+        connections are deleted, changed ones replaced.
+        """
+        spread = {conn.name: len(self.renderer.children(conn)) for conn in self.config.connections}
+        wanted = connection_tables(self.config, spread)
+        if not (wanted or self.clamps):
+            return
+        nft = self._nft_bin()
+        if not nft:
+            self.logger.warning("nft not found; TCP MSS clamping and multicore marks are not applied.")
+            return
+        for name in [n for n in self.clamps if n not in wanted]:
+            self._run_host([nft, "delete", "table", "inet", nft_table(name)])
+            del self.clamps[name]
+        for name, script in wanted.items():
+            if self.clamps.get(name) == script:
+                continue
+            res = self._run_host([nft, "-f", "-"], input=script)
+            if res.returncode != 0:
+                self.logger.warning(f"nftables table for {name} failed: {res.stderr.strip()[-200:]}")
+                continue
+            self.logger.info(f"Applied nftables table {nft_table(name)} for {name}.")
+            self.clamps[name] = script
+
+    def _remove_all_clamps(self):
+        """
+        Deletes every agent nftables table, including ones of an earlier run. On a
+        shared host only the tables of this process's connections are deleted.
+        """
+        own = {nft_table(name) for name in [*self.clamps, *(c.name for c in self.config.connections)]}
+        self.clamps.clear()
+        nft = self._nft_bin()
+        if not nft:
+            return
+        res = self._run_host([nft, "list", "tables"])
+        for line in res.stdout.splitlines():
+            parts = line.split()
+            if len(parts) == 3 and parts[1] == "inet" and parts[2].startswith(NFT_TABLE_PREFIX):
+                if self.shared_host and parts[2] not in own:
+                    continue
+                self._run_host([nft, "delete", "table", "inet", parts[2]])
+
+    def terminate(self, names: list[str], generation: dict[str, int] = None):
+        super().terminate(names, generation)
+        self._sync_host()
+
+    def take_over(self, names: list[str]):
+        # Recreating clamp tables, interfaces and routes that exist already is harmless
+        super().take_over(names)
+        self._sync_host()
+
+    def release(self, names: list[str]):
+        super().release(names)
+        # The new owner keeps the host state; forget it without deleting anything
+        for name in names:
+            self.clamps.pop(name, None)
+        interfaces = {n for n, i in self.routes.interfaces.items() if i.connection in names}
+        for name in interfaces:
+            del self.routes.interfaces[name]
+        self.routes.routes = {prefix: route for prefix, route in self.routes.routes.items()
+                              if not all(hop in interfaces for hop, _ in route.nexthops)}
+
+    def commit(self, names: list[str]):
+        super().commit(names)
+        self._sync_host()
+
+    def rollback(self, names: list[str]):
+        super().rollback(names)
+        self._sync_host()
 
     def cleanup(self):
         self.logger.info("Cleaning up swanctl config...")
-        conf_file = self.conf_dir / "agent.conf"
-        if conf_file.exists():
-            os.remove(conf_file)
+        self._remove_all_clamps()
+        self._remove_routes()
+        remove_config(self.conf_dir, self.renderer.prefix)
+        self.renderer.flush_cache()
+        self.generations.clear()
+        self.staged.clear()
         # Reload to clear
-        if shutil.which("swanctl"):
+        if self._swanctl_bin():
              subprocess.run(["swanctl", "--load-all"], check=False)
@@ -0,0 +1,248 @@
+import io
+import os
+import shutil
+import subprocess
+from pathlib import Path
+from agent.base import IPsecBackend, HEALTHY_STATES
+from agent.config_schema import AgentConfig, ConnectionConfig
+from agent.swanctl import (SwanctlRenderer, RenderStats, swanctl_name, generation_config,
+                           parse_list_sas, parse_list_pols, sa_states, trap_states, connection_states,
+                           live_generations, remove_config, CONF_PREFIX)
+
+class SwanctlBackend(IPsecBackend):
+    """
+    strongSwan plumbing shared by the Linux and MacOS backends: rendering,
+    status, repair and make-before-break replacement of changed connections.
+
+    A changed connection is loaded as a new generation ("SiteA~1") next to the
+    running one. Once its child SA is installed the old generation is
+    terminated (commit); if it never comes up the new one is (rollback).
+    """
+    per_connection_status = True
+    supports_make_before_break = True
+    # Datapath settings the kernel interface supports; None for all
+    datapath_options = None
+
+    def __init__(self, config: AgentConfig, base_dir: Path, logger, header: str = "# Generated by Unified IPsec Agent"):
+        super().__init__(config, base_dir, logger)
+        self.conf_dir: Path = None # Set by the platform
+        self.renderer = SwanctlRenderer(header, self.datapath_options)
+        self.renderer.cpus = os.cpu_count() or 1
+        # Loaded generation per connection; 0 (the plain name) if missing
+        self.generations: dict[str, int] = {}
+        # Connections being replaced: {name: (old_conn, old_gen, new_gen)}
+        self.staged: dict[str, tuple[ConnectionConfig, int, int]] = {}
+        # True while other agent processes (shards) manage connections on this host:
+        # cleanup then only removes what belongs to this process's connections
+        self.shared_host = False
+
+    def _swanctl_bin(self):
+        return shutil.which("swanctl")
+
+    def _swanctl(self, *args, timeout: float = 60) -> subprocess.CompletedProcess:
+        """Runs swanctl; a call that times out comes back as failed (exit code -1), so loops over children go on."""
+        cmd = [self._swanctl_bin(), *args]
+        try:
+            return subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            message = f"swanctl {' '.join(args)} timed out after {timeout}s"
+            return subprocess.CompletedProcess(cmd, -1, message, message)
+
+    def _query(self, *args) -> str:
+        """Output of a swanctl listing; raises if it timed out, so no connection is taken for down."""
+        res = self._swanctl(*args, timeout=30)
+        if res.returncode == -1:
+            raise RuntimeError(res.stderr)
+        return res.stdout
+
+    def _child(self, name: str, generation: int = None) -> str:
+        if generation is None:
+            generation = self.generations.get(name, 0)
+        return f"{swanctl_name(name, generation)}-child"
+
+    def _connection(self, name: str) -> ConnectionConfig:
+        return next((c for c in self.config.connections if c.name == name), None)
+
+    def _children(self, name: str, generation: int = None) -> list[str]:
+        """All child SAs of a connection: one, or several for a multicore connection."""
+        child = self._child(name, generation)
+        conn = self._connection(name)
+        if conn is None:
+            return [child]
+        return [child] + [f"{child}-{i}" for i in range(1, len(self.renderer.children(conn)))]
+
+    def loaded_config(self) -> AgentConfig:
+        """The config as loaded into swanctl, with generation names and staged pairs."""
+        return generation_config(self.config, self.generations, self.staged)
+
+    def _generate_swanctl_conf(self) -> str:
+        """Generates swanctl.conf content based on config."""
+        buf = io.StringIO()
+        self.renderer.write(buf, self.loaded_config())
+        return buf.getvalue()
+
+    def write_config(self) -> RenderStats:
+        self.logger.info(f"Writing config to {self.conf_dir} ({self.config.swanctl_layout} layout)")
+        stats = self.renderer.write_config(self.conf_dir, self.loaded_config())
+        self.logger.info(f"Rendered {stats.rendered} of {stats.connections} connections ({stats.reused} cached).")
+        if self.config.aggregate_selectors:
+            self.logger.info(f"Selector aggregation saved {stats.policies_before - stats.policies_after} of {stats.policies_before} kernel policies.")
+        return stats
+
+    def _load(self) -> bool:
+        """Writes the config and loads it. Connections that are not touched keep their SAs."""
+        self.write_config()
+        if not self._swanctl_bin():
+            return False
+        res = self._swanctl("--load-all")
+        if res.returncode != 0:
+            self.logger.error(f"swanctl --load-all failed: {res.stdout.strip()[-200:]}")
+            return False
+        return True
+
+    def _initiate(self, names: list[str], generation: dict[str, int] = None) -> bool:
+        ok = True
+        for name in names:
+            conn = self._connection(name)
+            # On-demand connections only need their trap policy; traffic negotiates the SA
+            command, action = ("--install", "Installing trap for") if conn and conn.on_demand else ("--initiate", "Initiating")
+            for child in self._children(name, (generation or {}).get(name)):
+                self.logger.info(f"{action} {child}...")
+                res = self._swanctl(command, "--child", child)
+                if res.returncode != 0:
+                    self.logger.warning(f"{action} {child} failed: {res.stdout.strip()[-200:]}")
+                    ok = False
+        return ok
+
+    def _run_list_sas(self) -> str:
+        """Returns the raw 'swanctl --list-sas' output, or '' without swanctl."""
+        if not self._swanctl_bin():
+            return ""
+        return self._query("--list-sas")
+
+    def _run_list_pols(self) -> str:
+        """Returns the raw 'swanctl --list-pols --trap' output; only queried with on-demand connections."""
+        if not self._swanctl_bin() or not any(c.on_demand for c in self.config.connections):
+            return ""
+        return self._query("--list-pols", "--trap")
+
+    def connection_status(self) -> dict[str, str]:
+        sas = parse_list_sas(self._run_list_sas())
+        # SAs adopted from a previous run may belong to a later generation
+        for name, generation in live_generations(sas).items():
+            if name not in self.staged and generation > self.generations.get(name, 0):
+                self.generations[name] = generation
+        return connection_states(sas, self.config.connections, parse_list_pols(self._run_list_pols()))
+
+    def repair(self, names: list[str]) -> bool:
+        """Re-initiates the child SAs of the named connections; the loaded config is left as is."""
+        if not self._swanctl_bin():
+            return False
+        return self._initiate(names)
+
+    def check_status(self) -> str:
+        try:
+            states = self.connection_status()
+        except Exception as e:
+            self.logger.warning(f"Status check failed: {e}")
+            return "DISCONNECTED"
+        if HEALTHY_STATES & set(states.values()):
+            return "CONNECTED"
+        return "DISCONNECTED"
+
+    def terminate(self, names: list[str], generation: dict[str, int] = None):
+        """Closes the IKE SAs (and children) of the named connections."""
+        if not self._swanctl_bin():
+            return
+        for name in names:
+            ike = swanctl_name(name, (generation or {}).get(name, self.generations.get(name, 0)))
+            self.logger.info(f"Terminating {ike}...")
+            res = self._swanctl("--terminate", "--ike", ike)
+            if res.returncode == -1:
+                self.logger.warning(res.stderr)
+
+    def hold(self, names: list[str]):
+        """Also removes the trap policies of on-demand connections, so traffic does not bring them back up."""
+        if not self._swanctl_bin():
+            return
+        for name in names:
+            conn = self._connection(name)
+            if conn and conn.on_demand:
+                for child in self._children(name):
+                    self._swanctl("--uninstall", "--child", child)
+        self.terminate(names)
+
+    def flush_cache(self):
+        self.renderer.flush_cache()
+
+    # --- hand-over between agent processes (shards) ---
+
+    def share_host(self, prefix: str):
+        self.renderer.prefix = prefix
+        self.shared_host = True
+
+    def take_over(self, names: list[str]):
+        """
+        Adopts connections (already in self.config) that another agent process
+        ran, without touching their SAs: the live generation is taken from
+        swanctl and the config is written but not loaded. The other process's
+        file still holds the identical definition until it releases them.
+        """
+        live = live_generations(parse_list_sas(self._run_list_sas()))
+        for name in names:
+            self.generations[name] = live.get(name, 0)
+        self.write_config()
+
+    def release(self, names: list[str]):
+        """
+        Forgets connections (already removed from self.config) that another
+        agent process took over. Their SAs and loaded config stay as they are.
+        """
+        for name in names:
+            self.generations.pop(name, None)
+        self.write_config()
+
+    def remove_foreign_config(self, prefix: str = CONF_PREFIX):
+        """Deletes the conf.d files written under another prefix (by default: the unsharded agent's), without reloading."""
+        remove_config(self.conf_dir, prefix)
+
+    # --- make-before-break ---
+
+    def stage(self, running: dict[str, ConnectionConfig]) -> bool:
+        """Loads the new version of each connection next to the running one and initiates it."""
+        for name, conn in running.items():
+            if name in self.staged:
+                # Changed again before the cutover finished: replace the previous new version
+                self.terminate([name], {name: self.staged[name][2]})
+            generation = self.generations.get(name, 0)
+            self.staged[name] = (conn, generation, generation + 1)
+        if not self._load():
+            return False
+        # A failed initiation is not final: charon retries, and the cutover times out otherwise
+        self._initiate(list(running), {name: self.staged[name][2] for name in running})
+        return True
+
+    def staged_status(self) -> dict[str, str]:
+        """Status of the new generation of each staged connection; an installed trap is IDLE."""
+        states = sa_states(parse_list_sas(self._run_list_sas()))
+        for wire in trap_states(parse_list_pols(self._run_list_pols())):
+            states.setdefault(wire, "IDLE")
+        return {name: states.get(swanctl_name(name, new_gen), "DISCONNECTED")
+                for name, (_, _, new_gen) in self.staged.items()}
+
+    def commit(self, names: list[str]):
+        """Switches the named connections to their new generation and closes the old one."""
+        old_gens = {name: self.staged[name][1] for name in names}
+        for name in names:
+            self.generations[name] = self.staged.pop(name)[2]
+        self.terminate(names, old_gens)
+        self._load()
+
+    def rollback(self, names: list[str]):
+        """
+        Gives up on the new generation of the named connections. The caller
+        restores the old connection configs in self.config first.
+        """
+        new_gens = {name: self.staged.pop(name)[2] for name in names}
+        self.terminate(names, new_gens)
+        self._load()
@@ -4,6 +4,7 @@ import logging
 from pathlib import Path
 from agent.base import IPsecBackend
 from agent.config_schema import AgentConfig
+from agent.proposals import windows_crypto
 
 class WindowsAgent(IPsecBackend):
     def __init__(self, config: AgentConfig, base_dir: Path, logger: logging.Logger):
@@ -61,7 +62,9 @@ class WindowsAgent(IPsecBackend):
             self.logger.error(f"Subprocess execution failed: {e}")
             return {"status": "ERROR", "error": str(e)}
 
-    def apply_policy(self) -> bool:
+    def apply_policy(self, names: list[str] = None) -> bool:
+        # Rules are removed and re-created as a whole; 'names' is not used
+        # (without per-connection status nothing is ever adopted).
         self.logger.info("Applying IPsec policies (Windows Native)...")
         
         # Ensure clean state by removing previous rules associated with this agent
@@ -82,6 +85,9 @@ class WindowsAgent(IPsecBackend):
             # If parsing fails, defaults are handled by the PowerShell script parameters.
             
             ike_str = conn.encryption.ike.lower()
+            auto = None
+            if "auto" in (ike_str, conn.encryption.esp.lower()) and self.config.auto_proposals:
+                auto = windows_crypto(self.config.auto_proposals)
             enc_map = {"aes256": "AES256", "aes128": "AES128", "3des": "DES3"}
             hash_map = {"sha256": "SHA256", "sha1": "SHA1", "sha384": "SHA384"}
             dh_map = {"dh14": "DH14", "dh2": "DH2", "modp2048": "DH14"} # map modp names to windows DH
@@ -110,6 +116,11 @@ class WindowsAgent(IPsecBackend):
                 "Hash": w_hash,
                 "DHGroup": w_dh
             }
+            if auto:
+                if ike_str == "auto":
+                    args.update({k: auto[k] for k in ("Encryption", "Hash", "DHGroup")})
+                if conn.encryption.esp.lower() == "auto" and "QMEncryption" in auto:
+                    args.update(QMEncryption=auto["QMEncryption"], QMHash=auto["QMHash"])
 
             res = self.run_powershell("apply.ps1", args)
             
@@ -0,0 +1,243 @@
+"""
+In-tunnel reachability probes.
+
+An installed SA does not prove that traffic flows: a stale SA on the peer,
+a missing route or a firewall can black-hole a tunnel that swanctl lists as
+INSTALLED. A connection with a 'probe' section gets a target inside its
+remote subnets, probed every control loop step:
+
+  udp  datagrams to an echo service (port 7 by default); each reply is
+       matched to its request, so reordering and late replies count right
+  tcp  connection attempts; a refusal (RST) also proves the path works
+
+Neither needs raw sockets. All targets are probed concurrently on one
+asyncio event loop. UDP targets share unconnected sockets (up to
+TARGETS_PER_SOCKET each), so thousands of them need a few dozen file
+descriptors and a round takes about (count + 1) * interval + timeout: their
+first datagrams are spread over one interval, not sent in one burst. TCP
+attempts hold one of MAX_CONCURRENCY slots only while connecting, so
+targets that time out delay others by at most timeout per attempt.
+
+'python -m agent.probes config.json' probes once and prints the results.
+"""
+import asyncio
+import ipaddress
+import os
+import socket
+import sys
+from dataclasses import dataclass, field, asdict
+from typing import Optional
+from agent.config_schema import AgentConfig, load_config
+
+# TCP connection attempts at the same time, across all targets
+MAX_CONCURRENCY = 256
+# UDP targets sharing one socket
+TARGETS_PER_SOCKET = 64
+PAYLOAD_PREFIX = b"ipsec-agent-probe "
+
+
+@dataclass(frozen=True)
+class ProbeSpec:
+    name: str
+    target: str
+    protocol: str = "udp"
+    port: int = 7
+    count: int = 5
+    interval: float = 0.2
+    timeout: float = 1.0
+    source: Optional[str] = None
+    max_loss: float = 1.0
+    max_rtt_ms: Optional[float] = None
+
+
+def probe_specs(config: AgentConfig) -> list[ProbeSpec]:
+    return [ProbeSpec(c.name, **vars(c.probe)) for c in config.connections if c.probe]
+
+
+def percentile(values: list[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile; None without values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+@dataclass
+class ProbeResult:
+    name: str
+    target: str
+    protocol: str
+    sent: int
+    rtts_ms: list[float] = field(default_factory=list)
+    verdict: str = "healthy" # healthy, degraded, down
+    error: Optional[str] = None
+
+    @property
+    def received(self) -> int:
+        return len(self.rtts_ms)
+
+    @property
+    def loss(self) -> float:
+        return 1 - self.received / self.sent if self.sent else 1.0
+
+    def to_dict(self) -> dict:
+        result = asdict(self)
+        del result["rtts_ms"]
+        result.update(received=self.received, loss=round(self.loss, 3),
+                      rtt_p50_ms=percentile(self.rtts_ms, 50), rtt_p90_ms=percentile(self.rtts_ms, 90),
+                      rtt_p99_ms=percentile(self.rtts_ms, 99))
+        return result
+
+    def describe(self) -> str:
+        text = f"{self.name}: {self.protocol} {self.target} {self.received}/{self.sent} replies ({self.loss:.0%} loss)"
+        if self.rtts_ms:
+            text += f", RTT p50 {percentile(self.rtts_ms, 50):.1f} ms, p90 {percentile(self.rtts_ms, 90):.1f} ms"
+        return f"{text}: {self.verdict}"
+
+
+def verdict(spec: ProbeSpec, result: ProbeResult) -> str:
+    """down: loss reached max_loss (by default: nothing came back); degraded: some loss, or p90 RTT above max_rtt_ms."""
+    if not result.rtts_ms or result.loss >= spec.max_loss:
+        return "down"
+    p90 = percentile(result.rtts_ms, 90)
+    if result.loss > 0 or (spec.max_rtt_ms is not None and p90 > spec.max_rtt_ms):
+        return "degraded"
+    return "healthy"
+
+
+class _EchoProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.waiting: dict[bytes, asyncio.Future] = {}
+
+    def datagram_received(self, data, addr):
+        future = self.waiting.pop(data, None)
+        if future and not future.done():
+            future.set_result(asyncio.get_running_loop().time())
+
+    def error_received(self, exc):
+        pass # ICMP errors (e.g. port unreachable): the probe times out as lost
+
+
+class _EchoSockets:
+    """Unconnected UDP sockets shared by the targets of a round, per source address and family."""
+    def __init__(self):
+        self.pools: dict[tuple, list] = {}
+        self.lock = asyncio.Lock()
+
+    async def get(self, spec: ProbeSpec) -> tuple[asyncio.DatagramTransport, _EchoProtocol]:
+        """A socket for the spec's source and family with room for another target."""
+        family = socket.AF_INET6 if ipaddress.ip_address(spec.target).version == 6 else socket.AF_INET
+        key = (spec.source, family)
+        async with self.lock:
+            pool = self.pools.setdefault(key, [])
+            if not pool or pool[-1][2] >= TARGETS_PER_SOCKET:
+                local = (spec.source or ("::" if family == socket.AF_INET6 else "0.0.0.0"), 0)
+                transport, protocol = await asyncio.get_running_loop().create_datagram_endpoint(
+                    _EchoProtocol, local_addr=local, family=family)
+                pool.append([transport, protocol, 0])
+            pool[-1][2] += 1
+            return pool[-1][0], pool[-1][1]
+
+    def close(self):
+        for pool in self.pools.values():
+            for transport, _, _ in pool:
+                transport.close()
+
+
+async def _probe_udp(spec: ProbeSpec, result: ProbeResult, sockets: _EchoSockets):
+    loop = asyncio.get_running_loop()
+    transport, protocol = await sockets.get(spec)
+    nonce = os.urandom(8).hex().encode()
+    pending = []
+    try:
+        for seq in range(spec.count):
+            payload = PAYLOAD_PREFIX + nonce + b" %d" % seq
+            future = loop.create_future()
+            protocol.waiting[payload] = future
+            sent_at = loop.time()
+            transport.sendto(payload, (spec.target, spec.port))
+            result.sent += 1
+            pending.append((sent_at, future))
+            if seq < spec.count - 1:
+                await asyncio.sleep(spec.interval)
+        # Every reply may take up to timeout from its own request
+        for sent_at, future in pending:
+            try:
+                received_at = await asyncio.wait_for(future, max(0, sent_at + spec.timeout - loop.time()))
+                result.rtts_ms.append((received_at - sent_at) * 1000)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        for seq in range(spec.count):
+            protocol.waiting.pop(PAYLOAD_PREFIX + nonce + b" %d" % seq, None)
+
+
+async def _probe_tcp(spec: ProbeSpec, result: ProbeResult, limit: asyncio.Semaphore):
+    loop = asyncio.get_running_loop()
+    local = (spec.source, 0) if spec.source else None
+    for seq in range(spec.count):
+        async with limit:
+            started = loop.time()
+            result.sent += 1
+            try:
+                _, writer = await asyncio.wait_for(
+                    asyncio.open_connection(spec.target, spec.port, local_addr=local), spec.timeout)
+                result.rtts_ms.append((loop.time() - started) * 1000)
+                writer.close()
+            except ConnectionRefusedError:
+                # The RST came back through the tunnel
+                result.rtts_ms.append((loop.time() - started) * 1000)
+            except (asyncio.TimeoutError, OSError):
+                pass
+        if seq < spec.count - 1:
+            await asyncio.sleep(spec.interval)
+
+
+async def _probe(spec: ProbeSpec, delay: float, limit: asyncio.Semaphore, sockets: _EchoSockets) -> ProbeResult:
+    result = ProbeResult(spec.name, spec.target, spec.protocol, 0)
+    await asyncio.sleep(delay)
+    try:
+        if spec.protocol == "tcp":
+            await _probe_tcp(spec, result, limit)
+        else:
+            await _probe_udp(spec, result, sockets)
+    except OSError as e:
+        # E.g. the source address is not configured on this host
+        result.error = str(e)
+    result.verdict = verdict(spec, result)
+    return result
+
+
+async def probe_all(specs: list[ProbeSpec], concurrency: int = MAX_CONCURRENCY) -> dict[str, ProbeResult]:
+    limit = asyncio.Semaphore(concurrency)
+    sockets = _EchoSockets()
+    try:
+        # Starts spread over the first interval
+        results = await asyncio.gather(*(_probe(spec, spec.interval * i / len(specs), limit, sockets)
+                                         for i, spec in enumerate(specs)))
+    finally:
+        sockets.close()
+    return {result.name: result for result in results}
+
+
+def run_probes(specs: list[ProbeSpec], concurrency: int = MAX_CONCURRENCY) -> dict[str, ProbeResult]:
+    """Probes every spec concurrently; returns {connection name: ProbeResult}."""
+    if not specs:
+        return {}
+    return asyncio.run(probe_all(specs, concurrency))
+
+
+def main(argv: list[str] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        print("usage: python -m agent.probes <config.json|config.yaml>", file=sys.stderr)
+        return 2
+    results = run_probes(probe_specs(load_config(argv[0])))
+    for result in results.values():
+        print(result.describe())
+    return 0 if all(r.verdict != "down" for r in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
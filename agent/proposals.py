@@ -0,0 +1,162 @@
+"""
+'auto' crypto proposals.
+
+Orders a fixed set of secure suites by how fast this host runs them, using
+CPU features from agent.sysinfo and, optionally, a short 'openssl speed'
+micro-benchmark. Only the order changes with the host; every list still
+contains the previous defaults (aes256-sha256, modp2048) for peers that
+support nothing newer.
+"""
+import re
+import shutil
+import subprocess
+from dataclasses import dataclass, field
+from agent.sysinfo import CpuFeatures
+
+# ESP suite families, most preferred first when equally fast
+ESP_SUITES = {
+    "gcm": ["aes256gcm16", "aes128gcm16"],
+    "chacha": ["chacha20poly1305"],
+    "cbc": ["aes256-sha256"],
+}
+# IKE encryption/integrity per family; key exchange methods are appended
+IKE_SUITES = {
+    "gcm": "aes256gcm16-prfsha256",
+    "chacha": "chacha20poly1305-prfsha256",
+    "cbc": "aes256-sha256",
+}
+KEY_EXCHANGES = ["x25519", "ecp256", "modp2048"]
+
+# 'openssl speed' algorithm names behind each family / key exchange
+_CIPHER_BENCH = {"gcm": "aes-256-gcm", "chacha": "chacha20-poly1305", "cbc": "aes-256-cbc", "hmac": "sha256"}
+_KE_BENCH = {"x25519": "ecdhx25519", "ecp256": "ecdhp256", "modp2048": "ffdh2048"}
+
+# Only reorder on a benchmark difference larger than this, so run-to-run noise
+# does not flip the order between restarts
+BENCH_MARGIN = 1.2
+
+
+@dataclass
+class ProposalChoice:
+    ike: list[str]
+    esp: list[str]
+    reasons: list[str] = field(default_factory=list)
+
+    @property
+    def ike_proposals(self) -> str:
+        return ",".join(self.ike)
+
+    @property
+    def esp_proposals(self) -> str:
+        return ",".join(self.esp)
+
+
+def _flag(value) -> bool:
+    # Unknown features are assumed present: nearly every current server CPU has them
+    return value is None or value
+
+
+def _estimate(features: CpuFeatures) -> dict[str, float]:
+    """Relative throughput per ESP family from CPU features alone."""
+    aes, clmul, sha, simd = (_flag(features.aes), _flag(features.clmul), _flag(features.sha), _flag(features.simd))
+    return {
+        "gcm": 10.0 if aes and clmul else (3.0 if aes else 1.0),
+        "chacha": 6.0 if simd else 2.0,
+        "cbc": (4.0 if sha else 2.5) if aes else 1.0,
+    }
+
+
+def _openssl_speed(args: list[str], seconds: int) -> str:
+    res = subprocess.run(["openssl", "speed", "-mr", "-seconds", str(seconds), *args],
+                         capture_output=True, text=True, timeout=60)
+    return res.stdout
+
+
+def benchmark_crypto(seconds: int = 1, speed=_openssl_speed) -> dict[str, float]:
+    """
+    Measures ESP family throughput (bytes/s on 16 KiB buffers) and key exchange
+    rates (op/s) with 'openssl speed'. Returns {} without openssl.
+    CBC+HMAC is combined from its two passes.
+    """
+    if speed is _openssl_speed and not shutil.which("openssl"):
+        return {}
+    results = {}
+    for name, algo in _CIPHER_BENCH.items():
+        m = re.search(r"^\+F:\d+:[^:]+:([\d.]+)", speed(["-bytes", "16384", "-evp", algo], seconds), re.M)
+        if m:
+            results[name] = float(m.group(1))
+    if "cbc" in results and "hmac" in results:
+        results["cbc"] = 1 / (1 / results["cbc"] + 1 / results.pop("hmac"))
+    results.pop("hmac", None)
+    for name, algo in _KE_BENCH.items():
+        m = re.search(r"^\+F\d+:\d+:\d+:([\d.]+)", speed([algo], seconds), re.M)
+        if m:
+            results[name] = float(m.group(1))
+    return results
+
+
+def _order(defaults: list[str], scores: dict[str, float]) -> list[str]:
+    """Sorts by score, but keeps the default order unless a score is clearly higher."""
+    ordered = list(defaults)
+    for i in range(1, len(ordered)):
+        j = i
+        while j > 0 and scores.get(ordered[j], 0) > BENCH_MARGIN * scores.get(ordered[j - 1], 0):
+            ordered[j - 1], ordered[j] = ordered[j], ordered[j - 1]
+            j -= 1
+    return ordered
+
+
+def select_proposals(features: CpuFeatures, bench: dict[str, float] = None) -> ProposalChoice:
+    """Returns ordered IKE and ESP proposal lists with the reasons behind the order."""
+    reasons = [features.describe()]
+    if not features.detected:
+        reasons.append("Assuming AES and carry-less multiply acceleration")
+
+    if bench and all(f in bench for f in ESP_SUITES):
+        scores = {f: bench[f] for f in ESP_SUITES}
+        source = "openssl speed"
+        reasons.append("Measured ESP throughput: " + ", ".join(f"{f} {scores[f] / 1e6:.0f} MB/s" for f in ESP_SUITES))
+    else:
+        scores = _estimate(features)
+        source = "CPU features"
+    families = _order(list(ESP_SUITES), scores)
+    if families[0] == "gcm":
+        reasons.append(f"AES-GCM first ({source}): hardware AES and GHASH make AEAD the cheapest suite")
+    elif families[0] == "chacha":
+        reasons.append(f"ChaCha20-Poly1305 first ({source}): faster than AES without full AES/CLMUL acceleration")
+    else:
+        reasons.append(f"AES-CBC/HMAC-SHA256 first ({source})")
+
+    key_exchanges = list(KEY_EXCHANGES)
+    if bench and all(k in bench for k in KEY_EXCHANGES):
+        key_exchanges = _order(key_exchanges, bench)
+        reasons.append("Measured key exchange: " + ", ".join(f"{k} {bench[k]:.0f} op/s" for k in key_exchanges))
+    else:
+        reasons.append("Key exchange: curve25519 and ECP-256 are far cheaper than MODP-2048")
+    reasons.append("aes256-sha256 and modp2048 are kept in the lists for peers without newer algorithms")
+
+    esp = [suite for family in families for suite in ESP_SUITES[family]]
+    ke = "-".join(key_exchanges)
+    ike = [f"{IKE_SUITES[family]}-{ke}" for family in families]
+    return ProposalChoice(ike=ike, esp=esp, reasons=reasons)
+
+
+def windows_crypto(choice: ProposalChoice) -> dict[str, str]:
+    """
+    Maps an auto choice to Windows crypto set parameters: the first ESP suite
+    and key exchange Windows supports. Main mode cannot use AEAD.
+    """
+    params = {"Encryption": "AES256", "Hash": "SHA256", "DHGroup": "DH14"}
+    ke = {"ecp256": "DH19", "modp2048": "DH14"}
+    for proposal in choice.ike:
+        group = next((ke[k] for k in proposal.split("-") if k in ke), None)
+        if group:
+            params["DHGroup"] = group
+            break
+    esp = {"aes256gcm16": ("AESGCM256", "AESGMAC256"), "aes128gcm16": ("AESGCM128", "AESGMAC128"),
+           "aes256-sha256": ("AES256", "SHA256")}
+    for suite in choice.esp:
+        if suite in esp:
+            params["QMEncryption"], params["QMHash"] = esp[suite]
+            break
+    return params
@@ -0,0 +1,129 @@
+"""
+Route-based connections: XFRM interfaces and the routes through them.
+
+A route-based connection's child SA carries catch-all selectors and an
+if_id, so its policies only match traffic routed into its XFRM interface.
+The remote subnets become routes over that interface. Connections in one
+routing.group that route the same prefix form an ECMP route with a next hop
+per tunnel, so traffic to a site is spread across all of its links.
+
+Everything here is plain data and iproute2 argument lists. The Linux backend
+runs the commands; 'python -m agent.routing <config>' prints them as a script
+for review or for applying by hand.
+"""
+import ipaddress
+import shlex
+import sys
+from dataclasses import dataclass, field
+from typing import Optional
+from agent.config_schema import AgentConfig, load_config
+from agent.mtu import connection_mtu
+
+
+@dataclass(frozen=True)
+class XfrmInterface:
+    name: str
+    if_id: int
+    mtu: int
+    connection: str
+
+
+@dataclass(frozen=True)
+class Route:
+    prefix: str
+    nexthops: tuple[tuple[str, int], ...]  # (interface, weight)
+    group: Optional[str] = None
+
+    @property
+    def family(self) -> int:
+        return ipaddress.ip_network(self.prefix).version
+
+
+@dataclass
+class RoutePlan:
+    interfaces: dict[str, XfrmInterface] = field(default_factory=dict)  # by name
+    routes: dict[str, Route] = field(default_factory=dict)              # by prefix
+
+
+def route_plan(config: AgentConfig) -> RoutePlan:
+    """Interfaces and routes for the route-based connections of the config."""
+    plan = RoutePlan()
+    nexthops: dict[str, list[tuple[str, int]]] = {}
+    groups: dict[str, Optional[str]] = {}
+    for conn in config.connections:
+        routing = conn.routing
+        if not routing.route_based:
+            continue
+        interface = XfrmInterface(routing.resolved_interface(conn.name), routing.resolved_if_id(conn.name),
+                                  connection_mtu(conn, config), conn.name)
+        plan.interfaces[interface.name] = interface
+        for subnet in conn.remote_subnets:
+            prefix = str(ipaddress.ip_network(subnet, strict=False))
+            nexthops.setdefault(prefix, []).append((interface.name, routing.weight))
+            groups[prefix] = routing.group
+    for prefix, hops in nexthops.items():
+        plan.routes[prefix] = Route(prefix, tuple(sorted(hops)), groups[prefix])
+    return plan
+
+
+def _ip(family: int) -> list[str]:
+    return ["ip", "-6"] if family == 6 else ["ip"]
+
+
+def route_command(route: Route) -> list[str]:
+    cmd = _ip(route.family) + ["route", "replace", route.prefix]
+    if len(route.nexthops) == 1:
+        return cmd + ["dev", route.nexthops[0][0]]
+    for interface, weight in route.nexthops:
+        cmd += ["nexthop", "dev", interface, "weight", str(weight)]
+    return cmd
+
+
+def plan_commands(new: RoutePlan, old: Optional[RoutePlan] = None) -> list[list[str]]:
+    """
+    iproute2 commands that turn the old plan into the new one; with no old
+    plan, everything in the new one is created. Stale routes go first, then
+    stale interfaces; new interfaces come up before the routes that use them.
+    """
+    old = old or RoutePlan()
+    commands = []
+    for prefix, route in old.routes.items():
+        if prefix not in new.routes:
+            commands.append(_ip(route.family) + ["route", "del", prefix])
+    for name, interface in old.interfaces.items():
+        if name not in new.interfaces or new.interfaces[name].if_id != interface.if_id:
+            commands.append(["ip", "link", "del", name])
+    for name, interface in new.interfaces.items():
+        previous = old.interfaces.get(name)
+        if previous is None or previous.if_id != interface.if_id:
+            commands.append(["ip", "link", "add", name, "type", "xfrm", "if_id", str(interface.if_id)])
+        if previous is None or previous.if_id != interface.if_id or previous.mtu != interface.mtu:
+            commands.append(["ip", "link", "set", name, "mtu", str(interface.mtu), "up"])
+    for prefix, route in new.routes.items():
+        if old.routes.get(prefix) != route:
+            commands.append(route_command(route))
+    return commands
+
+
+def removal_commands(plan: RoutePlan) -> list[list[str]]:
+    """Deleting the interfaces also removes every route through them."""
+    return [["ip", "link", "del", name] for name in plan.interfaces]
+
+
+def render_script(commands: list[list[str]]) -> str:
+    lines = ["#!/bin/sh", "# Generated by Unified IPsec Agent: XFRM interfaces and routes", "set -e"]
+    lines += [shlex.join(cmd) for cmd in commands]
+    return "\n".join(lines) + "\n"
+
+
+def main(argv: list[str] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        print("usage: python -m agent.routing <config.json|config.yaml>", file=sys.stderr)
+        return 2
+    sys.stdout.write(render_script(plan_commands(route_plan(load_config(argv[0])))))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
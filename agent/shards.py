@@ -0,0 +1,615 @@
+"""
+Sharded agent: connections split across worker processes.
+
+One agent process renders, parses and repairs every connection on one core.
+With 'shards' above 1 the agent runs as a supervisor. Each connection is
+assigned to one of N worker processes by consistent hashing of its name, and
+each worker runs the usual control loop (apply, status, repair, cutover) for
+its shard only. Route-based connections of one ECMP group hash by the group,
+so a shared route is managed by one process.
+
+Workers share charon. Each writes its own conf.d files (agent@shard<k>) and
+keeps its own journal (agent_state.shard<k>.json), so a restarted worker
+adopts its live SAs the way a restarted agent does.
+
+After a config change only connections whose shard changed move: with the
+same shard count none do, and going from N to N+1 shards moves about 1/(N+1)
+of them. A moved connection is handed over with its SA left up. The new owner
+writes it into its files first (the definitions are identical, and charon
+merges them), then the old owner drops it from its own.
+
+The supervisor restarts workers that die, serves the health API for all
+shards, and forwards the workers' logging to its own handlers.
+"""
+import bisect
+import hashlib
+import logging
+import logging.handlers
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Any, Callable, Optional
+from agent.base import HEALTHY_STATES, ADMIN_DOWN
+from agent.config_schema import AgentConfig, ConnectionConfig, load_config
+from agent.core import IPsecAgent, AgentState, serve_health_api, select_auto_proposals, CUTOVER_POLL, JOURNAL_FILE, STOP_POLL
+from agent.failover import check_interval
+from agent.journal import Journal
+from agent.swanctl import CONF_PREFIX
+
+# Points per shard on the hash ring; more points spread connections more evenly
+RING_REPLICAS = 128
+# Seconds a worker may take to answer a command (it may be in the middle of a step)
+COMMAND_TIMEOUT = 120
+# A worker that dies sooner than this after starting is restarted with a doubling delay, up to the maximum
+STABLE_RUN = 60
+MAX_RESTART_DELAY = 60
+
+
+def _hash(key: str) -> int:
+    # Stable across processes and restarts, unlike hash()
+    return int.from_bytes(hashlib.sha1(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hashing: each shard owns the arcs of the ring that end at one of its points."""
+    def __init__(self, shards: int, replicas: int = RING_REPLICAS):
+        self.shards = shards
+        points = sorted((_hash(f"shard{shard}#{i}"), shard) for shard in range(shards) for i in range(replicas))
+        self._points = [point for point, _ in points]
+        self._owners = [shard for _, shard in points]
+
+    def shard(self, key: str) -> int:
+        return self._owners[bisect.bisect(self._points, _hash(key)) % len(self._points)]
+
+
+def shard_key(conn: ConnectionConfig) -> str:
+    routing = conn.routing
+    if routing.route_based and routing.group:
+        return f"group:{routing.group}"
+    return conn.name
+
+
+def assign(config: AgentConfig, ring: HashRing) -> dict[str, int]:
+    """{connection name: shard}"""
+    return {c.name: ring.shard(shard_key(c)) for c in config.connections}
+
+
+def shard_prefix(shard: int) -> str:
+    # '@' never occurs in per-connection file names, so shard files and the unsharded agent's cannot collide
+    return f"{CONF_PREFIX}@shard{shard}"
+
+
+def journal_path(base_dir: Path, shard: int) -> Path:
+    return Path(base_dir) / f"agent_state.shard{shard}.json"
+
+
+def shard_config(config: AgentConfig, assignment: dict[str, int], shard: int) -> AgentConfig:
+    """
+    The part of the config one worker runs. The supervisor serves the health
+    API, and only shard 0 samples the (host-wide) datapath statistics.
+    """
+    return replace(config, connections=[c for c in config.connections if assignment.get(c.name) == shard],
+                   api_port=None, stats_interval=config.stats_interval if shard == 0 else 0,
+                   selector_conflicts=[])
+
+
+class ShardAgent(IPsecAgent):
+    """The control loop of one shard, run in a worker process and driven by the supervisor over a pipe."""
+    def __init__(self, shard: int, config: AgentConfig, base_dir: Path, logger: logging.Logger,
+                 backend_factory: Optional[Callable] = None, assigned: frozenset = None):
+        super().__init__(None, logger=logger)
+        self.shard = shard
+        self.config = config
+        # Every connection assigned to some shard; None if unknown (nothing is taken down at start)
+        self.assigned = assigned
+        self.base_dir = Path(base_dir)
+        self.journal = Journal(journal_path(self.base_dir, shard), self.clock)
+        if backend_factory:
+            self.backend = backend_factory(config, self.base_dir, logger)
+        else:
+            self._init_backend()
+        self.backend.share_host(shard_prefix(shard))
+
+    def _removed_since_journal(self) -> list[str]:
+        # A journal written with another shard count lists connections another shard now runs
+        if self.assigned is None:
+            return []
+        return [name for name in super()._removed_since_journal() if name not in self.assigned]
+
+    def adopt(self) -> set[str]:
+        adopted = super().adopt()
+        if adopted:
+            # After running as one process, the adopted definitions are only in the unsharded agent's files
+            self.backend.take_over(sorted(adopted))
+        return adopted
+
+    def report(self) -> dict:
+        return {
+            "shard": self.shard,
+            "pid": os.getpid(),
+            "state": self.state.value,
+            "connections": dict(self.connection_states),
+            "failover": self.failover.metrics(self.config),
+            "probes": {name: r.to_dict() for name, r in self.probe_results.items()},
+            "stats": self.stats,
+        }
+
+    def hand_off(self, names: list[str]) -> list[ConnectionConfig]:
+        """The running versions of connections about to move to another shard; cutovers in progress are rolled back."""
+        rolling = [name for name in names if name in self.cutover]
+        if rolling:
+            self.config.connections[:] = [self.cutover.get(c.name, c) if c.name in rolling else c
+                                          for c in self.config.connections]
+            self.backend.rollback(rolling)
+            for name in rolling:
+                del self.cutover[name]
+                self.failbacks.discard(name)
+        return [c for c in self.config.connections if c.name in names]
+
+    def take_over(self, conns: list[ConnectionConfig]):
+        names = [c.name for c in conns]
+        self.config.connections.extend(conns)
+        self.backend.take_over(names)
+        self.journal.record(self.config, type(self.backend).__name__, names)
+        self.logger.info(f"Took over {len(names)} connections: {', '.join(names[:10])}")
+
+    def release(self, names: list[str]):
+        self.config.connections[:] = [c for c in self.config.connections if c.name not in names]
+        self.backend.release(names)
+        self.journal.record(self.config, type(self.backend).__name__, [])
+        for name in names:
+            self.connection_states.pop(name, None)
+            self.probe_results.pop(name, None)
+            self.held_down.discard(name)
+        self.logger.info(f"Released {len(names)} connections to another shard.")
+
+    def handle(self, command: str, arg: Any = None) -> Any:
+        if command == "reload":
+            return self.reload(arg)
+        elif command in ("up", "down", "flush-cache"):
+            return self.control(command, {"name": arg})
+        elif command == "hand_off":
+            return self.hand_off(arg)
+        elif command == "take_over":
+            self.take_over(arg)
+        elif command == "release":
+            self.release(arg)
+        elif command == "remove_foreign_config":
+            self.backend.remove_foreign_config()
+        elif command == "stop":
+            # serve() shuts down once the acknowledgement is sent
+            self.running = False
+        else:
+            raise ValueError(f"Unknown command: {command}")
+
+    def serve(self, pipe):
+        """
+        Runs the control loop, sending a report after every step and answering
+        the supervisor's commands in between, until told to stop.
+        """
+        self.running = True
+        try:
+            self.start()
+            while self.running:
+                try:
+                    self.step()
+                except Exception as e:
+                    self.logger.error(f"Unexpected error in main loop: {e}")
+                    self.state = AgentState.ERROR
+                pipe.send(("status", self.report()))
+                deadline = time.monotonic() + (CUTOVER_POLL if self.cutover else check_interval(self.config))
+                while self.running:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    # In slices, so a SIGTERM (which only clears self.running) is noticed within STOP_POLL
+                    if not pipe.poll(min(timeout, STOP_POLL)):
+                        continue
+                    command, arg = pipe.recv()
+                    try:
+                        pipe.send(("ack", True, self.handle(command, arg)))
+                    except Exception as e:
+                        self.logger.error(f"Shard command {command} failed: {e}")
+                        pipe.send(("ack", False, str(e)))
+        except (EOFError, BrokenPipeError):
+            # The supervisor is gone: leave everything up for the next one to adopt
+            self.logger.warning("Supervisor gone; exiting without teardown.")
+            return
+        # Told to stop by the supervisor, or by a SIGTERM to the worker
+        self.logger.info("Shard stopping...")
+        self.shutdown()
+
+
+def _worker_main(shard: int, config: AgentConfig, pipe, log_queue, logger_name: str, log_level: int,
+                 base_dir: str, backend_factory: Optional[Callable], assigned: frozenset = None):
+    # Ctrl+C and SIGHUP reach the whole process group; the supervisor handles them
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    logger = logging.getLogger(f"{logger_name}.shard{shard}")
+    logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    logger.propagate = False
+    logger.setLevel(log_level)
+    agent = ShardAgent(shard, config, Path(base_dir), logger, backend_factory, assigned)
+    # A SIGTERM to the worker alone (or to the service's whole cgroup) stops its shard per shutdown_policy
+    signal.signal(signal.SIGTERM, agent._on_sigterm)
+    agent.serve(pipe)
+
+
+@dataclass
+class Worker:
+    """The supervisor's handle on one worker process."""
+    shard: int
+    process: Any = None
+    pipe: Any = None
+    started_at: float = 0.0
+    restarts: int = 0
+    restart_delay: float = 0.0
+    restart_at: Optional[float] = None   # Set once the worker is found dead
+    report: Optional[dict] = None        # Latest report, None until the first step
+    reported_at: Optional[float] = None
+
+
+class Supervisor:
+    """Runs the connections of 'config' in config.shards worker processes."""
+    def __init__(self, config: AgentConfig, base_dir: Path, logger: logging.Logger,
+                 config_path: str = None, backend_factory: Optional[Callable] = None, config_source=None,
+                 notifier=None):
+        self.config = config
+        self.base_dir = Path(base_dir)
+        self.logger = logger
+        self.config_path = config_path
+        # The agent's agent.config_source.RemoteConfigSource when config_path is a URL
+        self.config_source = config_source
+        # agent.systemd.Notifier: ready once every shard reported; its watchdog also bounds how long a worker may hang
+        self.notifier = notifier
+        # Builds a worker's backend from (config, base_dir, logger); by default the platform's
+        self.backend_factory = backend_factory
+        # Workers are started fresh rather than forked from a process with threads
+        self.context = multiprocessing.get_context("spawn")
+        self.ring = HashRing(config.shards)
+        self.assignment = assign(config, self.ring)
+        self.workers: dict[int, Worker] = {}
+        self.log_queue = None
+        self.running = False
+        self._reload_requested = False
+        self._foreign_config_pending = True
+        # Held while talking to workers, which the main loop and control socket commands both do
+        self.lock = threading.RLock()
+        self.control_server = None
+
+    # --- workers ---
+
+    def _spawn(self, shard: int, config: AgentConfig = None):
+        worker = self.workers.setdefault(shard, Worker(shard))
+        if worker.pipe:
+            worker.pipe.close()
+        parent, child = self.context.Pipe()
+        config = config or shard_config(self.config, self.assignment, shard)
+        worker.process = self.context.Process(
+            target=_worker_main, name=f"ipsec-agent-shard{shard}", daemon=True,
+            args=(shard, config, child, self.log_queue, self.logger.name, self.logger.getEffectiveLevel(),
+                  str(self.base_dir), self.backend_factory, frozenset(self.assignment)))
+        worker.process.start()
+        child.close()
+        worker.pipe = parent
+        worker.started_at = time.monotonic()
+        worker.restart_at = None
+        worker.report = worker.reported_at = None
+        self.logger.info(f"Shard {shard}: worker pid {worker.process.pid}, {len(config.connections)} connections.")
+
+    def _receive(self, worker: Worker):
+        try:
+            while worker.pipe.poll():
+                message = worker.pipe.recv()
+                if message[0] == "status":
+                    worker.report, worker.reported_at = message[1], time.monotonic()
+        except (EOFError, OSError):
+            # Dead worker; _check_workers() restarts it
+            worker.pipe.close()
+            worker.pipe = None
+
+    def _request(self, worker: Worker, command: str, arg: Any = None) -> Any:
+        """Sends a command and waits for its answer, keeping reports that arrive meanwhile."""
+        try:
+            worker.pipe.send((command, arg))
+            deadline = time.monotonic() + COMMAND_TIMEOUT
+            while True:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0 or not worker.pipe.poll(timeout):
+                    raise RuntimeError(f"shard {worker.shard} did not answer '{command}'")
+                message = worker.pipe.recv()
+                if message[0] == "status":
+                    worker.report, worker.reported_at = message[1], time.monotonic()
+                    continue
+                _, ok, result = message
+                if not ok:
+                    raise RuntimeError(f"shard {worker.shard}: '{command}' failed: {result}")
+                return result
+        except (EOFError, OSError, AttributeError) as e:
+            raise RuntimeError(f"shard {worker.shard} is not running: {e}")
+
+    def _check_workers(self):
+        """Restarts dead or hung workers; one that keeps dying early waits longer each time."""
+        now = time.monotonic()
+        hung_after = self.notifier.watchdog_interval if self.notifier else None
+        for worker in self.workers.values():
+            if worker.process.is_alive() and hung_after and worker.reported_at \
+                    and now - worker.reported_at > self.config.check_interval + hung_after:
+                self.logger.error(f"Shard {worker.shard} worker (pid {worker.process.pid}) has not reported for "
+                                  f"{now - worker.reported_at:.0f}s. Killing it.")
+                worker.process.kill()
+                worker.process.join(COMMAND_TIMEOUT)
+            if worker.process.is_alive():
+                continue
+            if worker.restart_at is None:
+                ran = now - worker.started_at
+                worker.restart_delay = 0 if ran >= STABLE_RUN else min(max(1, worker.restart_delay * 2), MAX_RESTART_DELAY)
+                worker.restart_at = now + worker.restart_delay
+                self.logger.error(f"Shard {worker.shard} worker (pid {worker.process.pid}) exited with code "
+                                  f"{worker.process.exitcode} after {ran:.0f}s. Restarting in {worker.restart_delay:.0f}s.")
+            if now >= worker.restart_at:
+                worker.restarts += 1
+                self._spawn(worker.shard)
+
+    def _forward_logs(self):
+        while True:
+            record = self.log_queue.get()
+            if record is None:
+                return
+            logging.getLogger(record.name).handle(record)
+
+    def _seed_journals(self):
+        """
+        On the first sharded start after running as one process, splits its
+        journal so workers adopt the SAs it left up. Connections removed from
+        the config since go to shard 0, which takes them down at its start.
+        """
+        legacy = Journal(self.base_dir / JOURNAL_FILE, None)
+        data = legacy.load()
+        if data is None:
+            return
+        removed = set(data.get("connections", {})) - self.assignment.keys()
+        for shard in range(self.config.shards):
+            path = journal_path(self.base_dir, shard)
+            if not path.exists():
+                names = {name for name, s in self.assignment.items() if s == shard}
+                legacy.copy_to(path, names | removed if shard == 0 else names)
+        legacy.clear()
+        self.logger.info(f"Split the single-process journal across {self.config.shards} shards.")
+
+    def _remove_foreign_config(self):
+        """Once every worker has written its files, the unsharded agent's files are only duplicates."""
+        if not self._foreign_config_pending or not all(w.report for w in self.workers.values()):
+            return
+        self._foreign_config_pending = False
+        try:
+            self._request(self.workers[0], "remove_foreign_config")
+        except RuntimeError as e:
+            self.logger.warning(f"Could not remove the single-process config files: {e}")
+
+    # --- lifecycle ---
+
+    def start(self):
+        self.log_queue = self.context.Queue()
+        threading.Thread(target=self._forward_logs, daemon=True).start()
+        self._seed_journals()
+        sizes = Counter(self.assignment.values())
+        self.logger.info(f"Starting {self.config.shards} shard workers for {len(self.assignment)} connections "
+                         f"({min(sizes.values(), default=0)}-{max(sizes.values(), default=0)} each).")
+        for shard in range(self.config.shards):
+            self._spawn(shard)
+        if self.config.api_port:
+            serve_health_api(self.config.api_port, self)
+        if self.config.control_socket:
+            from agent.control import serve_control
+            self.control_server = serve_control(self.base_dir / self.config.control_socket, self, self.logger)
+
+    def poll(self, timeout: float):
+        """Takes in worker reports for up to 'timeout' seconds (less once one arrives) and restarts dead workers."""
+        pipes = {w.pipe: w for w in self.workers.values() if w.pipe}
+        sentinels = [w.process.sentinel for w in self.workers.values() if w.restart_at is None]
+        ready = multiprocessing.connection.wait([*pipes, *sentinels], timeout)
+        with self.lock:
+            for r in ready:
+                if r in pipes and pipes[r].pipe:
+                    self._receive(pipes[r])
+            self._check_workers()
+            self._remove_foreign_config()
+
+    def reload(self, config: AgentConfig = None):
+        """
+        Applies a new configuration (re-read from config_path if not given).
+        Connections whose shard changed are handed over with their SAs up;
+        then every worker reloads its part of the new config. Returns the
+        names added, removed and changed, and how many connections moved.
+        """
+        new = config or (self.config_source.load(time.time()) if self.config_source else load_config(self.config_path))
+        # Resolved once here, so workers (and workers restarted later) render 'auto' connections alike
+        select_auto_proposals(new, self.logger, previous=self.config)
+        ring = self.ring if new.shards == self.ring.shards else HashRing(new.shards)
+        assignment = assign(new, ring)
+        moves: dict[tuple[int, int], list[str]] = {}
+        for name, shard in assignment.items():
+            old = self.assignment.get(name)
+            if old is not None and old != shard:
+                moves.setdefault((old, shard), []).append(name)
+        moved = sum(len(names) for names in moves.values())
+        self.logger.info(f"Reloading configuration on {new.shards} shards: {moved} of {len(assignment)} connections move.")
+
+        for shard in range(self.ring.shards, new.shards):
+            # New shards start empty and are given their connections below
+            self._spawn(shard, replace(shard_config(new, assignment, shard), connections=[]))
+        for (source, target), names in sorted(moves.items()):
+            try:
+                conns = self._request(self.workers[source], "hand_off", names)
+                self._request(self.workers[target], "take_over", conns)
+                self._request(self.workers[source], "release", names)
+            except RuntimeError as e:
+                # The reloads below still converge, by re-initiating instead of handing over
+                self.logger.error(f"Handing {len(names)} connections from shard {source} to {target} over failed: {e}")
+
+        self.config, self.ring, self.assignment = new, ring, assignment
+        result = {"added": [], "removed": [], "changed": [], "moved": moved}
+        for shard, worker in sorted(self.workers.items()):
+            # Shards beyond the new count only have removed connections left to take down
+            try:
+                changes = self._request(worker, "reload", shard_config(new, assignment, shard))
+                for key in ("added", "removed", "changed"):
+                    result[key] += changes[key]
+            except RuntimeError as e:
+                self.logger.error(f"Shard {shard} could not reload: {e}")
+        for shard in [s for s in self.workers if s >= new.shards]:
+            self._stop_workers([self.workers.pop(shard)])
+            journal_path(self.base_dir, shard).unlink(missing_ok=True)
+        return result
+
+    def _stop_workers(self, workers: list[Worker]):
+        for worker in workers:
+            worker.restart_at = float("inf") # Not to be restarted
+            try:
+                worker.pipe.send(("stop", None))
+            except (OSError, AttributeError):
+                pass
+        for worker in workers:
+            worker.process.join(COMMAND_TIMEOUT)
+            if worker.process.is_alive():
+                self.logger.warning(f"Shard {worker.shard} worker did not stop; terminating it.")
+                worker.process.terminate()
+                worker.process.join()
+
+    def stop(self):
+        """Stops every worker; each applies shutdown_policy to its own shard."""
+        if self.notifier:
+            self.notifier.stopping()
+        if self.control_server:
+            self.control_server.stop()
+            self.control_server = None
+        self._stop_workers(list(self.workers.values()))
+        if self.log_queue:
+            self.log_queue.put(None)
+
+    def run(self):
+        self.start()
+        try:
+            signal.signal(signal.SIGTERM, self._on_sigterm)
+            signal.signal(signal.SIGHUP, self._on_sighup)
+        except (AttributeError, ValueError):
+            pass
+        self.running = True
+        try:
+            while self.running:
+                self.poll(1.0)
+                self._notify()
+                polled = self.config_source.poll(time.time(), force=self._reload_requested) if self.config_source else None
+                if polled or self._reload_requested:
+                    self._reload_requested = False
+                    config, commit = polled or (None, None)
+                    try:
+                        with self.lock:
+                            self.reload(config)
+                    except Exception as e:
+                        self.logger.error(f"Reload failed, keeping the running configuration: {e}")
+                    else:
+                        if commit:
+                            commit()
+        except KeyboardInterrupt:
+            self.logger.info("Supervisor stopping (Interrupt)...")
+        finally:
+            self.stop()
+
+    def _on_sigterm(self, signum, frame):
+        # The loop ends within a poll; a reload or hand-off in progress completes first
+        self.running = False
+
+    def _on_sighup(self, signum, frame):
+        self._reload_requested = True
+
+    def _notify(self):
+        if not self.notifier or not self.notifier.enabled:
+            return
+        from agent.systemd import status_line
+        report = self.status_report()
+        statuses = {name: status for w in self.workers.values() if w.report for name, status in w.report["connections"].items()}
+        status = status_line(report["agent_state"], len(self.assignment), statuses) + f" on {len(self.workers)} shards"
+        if not self.notifier.is_ready and all(w.report for w in self.workers.values()):
+            self.notifier.ready(status)
+        else:
+            self.notifier.status(status)
+        self.notifier.watchdog()
+
+    # --- health API and control socket ---
+
+    def control(self, command: str, args: dict) -> Any:
+        """Runs a control socket command (see agent.control), on the shard that owns the connection where it names one."""
+        if command == "status":
+            states = {name: status for w in self.workers.values() if w.report for name, status in w.report["connections"].items()}
+            return {**self.status_report(), "connection_states": states}
+        if command == "stats":
+            return self.stats
+        with self.lock:
+            self.logger.info(f"Control command: {command} {args.get('name', '')}".rstrip())
+            if command == "reload":
+                return self.reload()
+            if command == "flush-cache":
+                for _, worker in sorted(self.workers.items()):
+                    self._request(worker, "flush-cache")
+                return None
+            if command in ("up", "down"):
+                shard = self.assignment.get(args.get("name"))
+                if shard is None:
+                    raise ValueError(f"Unknown connection: {args.get('name')}")
+                return self._request(self.workers[shard], command, args["name"])
+        from agent.control import COMMANDS
+        raise ValueError(f"Unknown command '{command}', expected one of: {', '.join(COMMANDS)}")
+
+    @property
+    def stats(self) -> Optional[dict]:
+        # Shard 0 samples for the whole host
+        worker = self.workers.get(0)
+        return worker.report.get("stats") if worker and worker.report else None
+
+    def status_report(self) -> dict:
+        reports = [w.report for w in self.workers.values() if w.report]
+        statuses = {name: status for r in reports for name, status in r["connections"].items()}
+        states = {r["state"] for r in reports}
+        complete = len(reports) == len(self.workers) and all(w.process.is_alive() for w in self.workers.values())
+        if not reports:
+            agent_state = AgentState.INIT
+        elif complete and states == {AgentState.CONNECTED.value}:
+            agent_state = AgentState.CONNECTED
+        elif complete and states == {AgentState.DISCONNECTED.value}:
+            agent_state = AgentState.DISCONNECTED
+        else:
+            agent_state = AgentState.DEGRADED
+        now = time.monotonic()
+        ages = [now - w.reported_at for w in self.workers.values() if w.reported_at]
+        resp = {
+            "status": "CONNECTED" if HEALTHY_STATES & set(statuses.values()) else "DISCONNECTED",
+            "agent_state": agent_state.value,
+            # Of the shard that reported least recently
+            "last_check_seconds": round(max(ages), 1) if ages else None,
+            "connections": dict(Counter(statuses.values())),
+            "down": sorted(name for name, status in statuses.items() if status not in HEALTHY_STATES and status != ADMIN_DOWN),
+            "shards": [{
+                "shard": w.shard,
+                "pid": w.process.pid,
+                "alive": w.process.is_alive(),
+                "state": w.report["state"] if w.report else None,
+                "connections": len(w.report["connections"]) if w.report else None,
+                "restarts": w.restarts,
+                "last_report_seconds": round(now - w.reported_at, 1) if w.reported_at else None,
+            } for _, w in sorted(self.workers.items())],
+        }
+        failover = {name: m for r in reports for name, m in r["failover"].items()}
+        if failover:
+            resp["failover"] = failover
+        probes = {name: p for r in reports for name, p in r["probes"].items()}
+        if probes:
+            resp["probes"] = probes
+        return resp
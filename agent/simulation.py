@@ -0,0 +1,272 @@
+"""
+Deterministic simulation of the control loop.
+
+A Scenario is a script of backend events (SA drops, peer outages, failed
+applies) on a VirtualClock. ScriptedBackend answers the agent from that
+script, so hours of flaps and retries replay in milliseconds:
+
+    clock = VirtualClock()
+    scenario = Scenario().drop(at=3600, names=["SiteA"]).outage(7200, 7500)
+    agent = simulate(config, scenario, clock)
+    agent.run_loop(until=86400)
+"""
+import logging
+from dataclasses import dataclass, field
+from typing import Optional
+from agent.base import IPsecBackend, HEALTHY_STATES
+from agent.clock import VirtualClock
+from agent.config_schema import AgentConfig
+
+
+@dataclass
+class Scenario:
+    """Scripted backend behaviour. Event times are virtual seconds."""
+    # (time, names or None for all)
+    drops: list = field(default_factory=list)
+    # (start, end, names or None): initiations towards these peers fail
+    outages: list = field(default_factory=list)
+    # (start, end, gateway addresses): gateways are down; DPD drops their SAs
+    gateway_outages: list = field(default_factory=list)
+    # (start, end): apply_policy itself fails (e.g. charon not running)
+    apply_failures: list = field(default_factory=list)
+    # Virtual seconds each backend command takes
+    latency: dict = field(default_factory=dict)
+    # (time, names or None): traffic hits the trap policies of on-demand connections
+    packets: list = field(default_factory=list)
+    # (time, names or None): established SAs stop passing traffic until they are replaced
+    blackholes: list = field(default_factory=list)
+
+    def drop(self, at: float, names: Optional[list[str]] = None) -> 'Scenario':
+        self.drops.append((at, names))
+        return self
+
+    def flap_every(self, period: float, names: Optional[list[str]] = None, start: float = None, end: float = 86400) -> 'Scenario':
+        t = period if start is None else start
+        while t < end:
+            self.drops.append((t, names))
+            t += period
+        return self
+
+    def outage(self, start: float, end: float, names: Optional[list[str]] = None) -> 'Scenario':
+        self.outages.append((start, end, names))
+        return self
+
+    def gateway_outage(self, start: float, end: float, addresses: list[str]) -> 'Scenario':
+        self.gateway_outages.append((start, end, addresses))
+        return self
+
+    def apply_failure(self, start: float, end: float) -> 'Scenario':
+        self.apply_failures.append((start, end))
+        return self
+
+    def blackhole(self, at: float, names: Optional[list[str]] = None) -> 'Scenario':
+        self.blackholes.append((at, names))
+        return self
+
+    def traffic(self, at: float, names: Optional[list[str]] = None) -> 'Scenario':
+        self.packets.append((at, names))
+        return self
+
+
+class ScriptedBackend(IPsecBackend):
+    """Backend driven by a Scenario on a VirtualClock. Records every call in history."""
+    per_connection_status = True
+    supports_make_before_break = True
+
+    def __init__(self, config: AgentConfig, clock: VirtualClock, scenario: Scenario, logger: logging.Logger):
+        super().__init__(config, None, logger)
+        self.clock = clock
+        self.scenario = scenario
+        self.up: set[str] = set()
+        # On-demand connections with their trap policies installed
+        self.trapped: set[str] = set()
+        self.last_traffic: dict[str, float] = {}
+        # Up, but dropping everything (probes fail)
+        self.blackholed: set[str] = set()
+        # Connections with a new version staged next to the running one: {name: running ConnectionConfig}
+        self.staged: dict[str, object] = {}
+        self.history: list[tuple[float, str, object]] = []
+        self.calls: dict[str, int] = {}
+        for at, names in scenario.drops:
+            clock.call_at(at, lambda names=names: self._drop(names))
+        for at, names in scenario.packets:
+            clock.call_at(at, lambda names=names: self._traffic(names))
+        for at, names in scenario.blackholes:
+            clock.call_at(at, lambda names=names: self.blackholed.update(self.up & set(self._names(names))))
+        for start, end, addresses in scenario.gateway_outages:
+            clock.call_at(start, lambda addresses=addresses: self._gateways_down(addresses))
+
+    def _names(self, names) -> list[str]:
+        return [c.name for c in self.config.connections] if names is None else names
+
+    def _drop(self, names):
+        dropped = self.up & set(self._names(names))
+        self.up -= dropped
+        self.blackholed -= dropped
+        if dropped:
+            self.history.append((self.clock.time(), "drop", sorted(dropped)))
+
+    def _on_demand(self, name: str) -> bool:
+        conn = self._connection(name)
+        return conn is not None and conn.on_demand
+
+    def _idle_timeout(self, name: str) -> float:
+        return next(c.idle_timeout for c in self.config.connections if c.name == name)
+
+    def _traffic(self, names):
+        # A packet matching a trap brings the SA up; it closes again after idle_timeout without traffic
+        now = self.clock.time()
+        for name in self._names(names):
+            if name not in self.trapped:
+                continue
+            self.last_traffic[name] = now
+            if name not in self.up and self._reachable(name):
+                self.up.add(name)
+                self.history.append((now, "acquire", [name]))
+            self.clock.call_at(now + self._idle_timeout(name), lambda name=name: self._idle(name))
+
+    def _idle(self, name: str):
+        now = self.clock.time()
+        if name in self.up and name in self.trapped and now - self.last_traffic.get(name, now) >= self._idle_timeout(name):
+            self.up.discard(name)
+            self.history.append((now, "idle", [name]))
+
+    def _gateways_down(self, addresses):
+        # DPD declares a dead gateway's SAs dead after dpd_delay + dpd_timeout
+        for conn in self.config.connections:
+            gateway = conn.current_gateway()
+            if gateway in addresses and conn.name in self.up:
+                def expire(name=conn.name, gateway=gateway):
+                    conn = self._connection(name)
+                    if conn and conn.current_gateway() == gateway and not self._gateway_reachable(gateway):
+                        self._drop([name])
+                self.clock.call_at(self.clock.time() + conn.dpd_delay + conn.dpd_timeout, expire)
+
+    def _gateway_reachable(self, gateway: str) -> bool:
+        now = self.clock.time()
+        return not any(start <= now < end and gateway in addresses
+                       for start, end, addresses in self.scenario.gateway_outages)
+
+    def _connection(self, name: str):
+        return next((c for c in self.config.connections if c.name == name), None)
+
+    def _call(self, command: str):
+        self.calls[command] = self.calls.get(command, 0) + 1
+        if self.scenario.latency.get(command):
+            self.clock.advance(self.scenario.latency[command])
+
+    def _reachable(self, name: str) -> bool:
+        now = self.clock.time()
+        for start, end, names in self.scenario.outages:
+            if start <= now < end and (names is None or name in names):
+                return False
+        conn = self._connection(name)
+        return conn is None or self._gateway_reachable(conn.current_gateway())
+
+    def _initiate(self, names) -> bool:
+        ok = True
+        for name in names:
+            if self._on_demand(name):
+                self._call("install")
+                self.trapped.add(name)
+                continue
+            self._call("initiate")
+            if self._reachable(name):
+                self.up.add(name)
+                self.blackholed.discard(name)
+            else:
+                ok = False
+        self.history.append((self.clock.time(), "initiate", sorted(names)))
+        return ok
+
+    def apply_policy(self, names: list[str] = None) -> bool:
+        self._call("apply")
+        now = self.clock.time()
+        if any(start <= now < end for start, end in self.scenario.apply_failures):
+            self.history.append((now, "apply_failed", None))
+            return False
+        self._initiate(self._names(names))
+        return True
+
+    def repair(self, names: list[str]) -> bool:
+        return self._initiate(names)
+
+    def connection_status(self) -> dict[str, str]:
+        self._call("status")
+        return {c.name: "CONNECTED" if c.name in self.up else "IDLE" if c.name in self.trapped else "DISCONNECTED"
+                for c in self.config.connections}
+
+    def check_status(self) -> str:
+        healthy = HEALTHY_STATES.intersection(self.connection_status().values())
+        return "CONNECTED" if healthy else "DISCONNECTED"
+
+    def probe(self, specs: list) -> dict:
+        from agent.probes import ProbeResult, verdict
+        self._call("probe")
+        results = {}
+        for spec in specs:
+            result = ProbeResult(spec.name, spec.target, spec.protocol, spec.count)
+            if spec.name in self.up and spec.name not in self.blackholed:
+                result.rtts_ms = [10.0] * spec.count
+            result.verdict = verdict(spec, result)
+            results[spec.name] = result
+        return results
+
+    def terminate(self, names: list[str]):
+        self._call("terminate")
+        self.up -= set(names)
+        self.trapped -= set(names)
+        self.blackholed -= set(names)
+        self.history.append((self.clock.time(), "terminate", sorted(names)))
+
+    def stage(self, running: dict) -> bool:
+        self._call("stage")
+        self.staged.update(running)
+        self.history.append((self.clock.time(), "stage", sorted(running)))
+        return True
+
+    def staged_status(self) -> dict[str, str]:
+        # A new version comes up as soon as its peer is reachable
+        self._call("status")
+        return {name: "IDLE" if self._on_demand(name) else "CONNECTED" if self._reachable(name) else "CONNECTING"
+                for name in self.staged}
+
+    def commit(self, names: list[str]):
+        for name in names:
+            del self.staged[name]
+        self.trapped |= {name for name in names if self._on_demand(name)}
+        self.up |= {name for name in names if name not in self.trapped}
+        self.blackholed -= set(names)
+        self.history.append((self.clock.time(), "commit", sorted(names)))
+
+    def rollback(self, names: list[str]):
+        for name in names:
+            del self.staged[name]
+        self.history.append((self.clock.time(), "rollback", sorted(names)))
+
+    def cleanup(self):
+        self._call("cleanup")
+        self.up.clear()
+        self.trapped.clear()
+        self.blackholed.clear()
+        self.staged.clear()
+        self.history.append((self.clock.time(), "cleanup", None))
+
+
+def simulate(config: AgentConfig, scenario: Scenario, clock: VirtualClock = None, logger: logging.Logger = None,
+             journal=None, up: set[str] = ()):
+    """
+    Returns an IPsecAgent wired to a ScriptedBackend, started as after a boot.
+    'up' are connections already established before the agent starts; the
+    journal is only used when one is passed.
+    """
+    from agent.core import IPsecAgent
+    clock = clock or VirtualClock()
+    logger = logger or logging.getLogger("Simulation")
+    agent = IPsecAgent(None, clock=clock, logger=logger)
+    agent.config = config
+    agent.journal = journal
+    agent.backend = ScriptedBackend(config, clock, scenario, logger)
+    agent.backend.up.update(up)
+    agent.start()
+    return agent
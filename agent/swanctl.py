@@ -0,0 +1,600 @@
+import hashlib
+import ipaddress
+import os
+import re
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Optional, TextIO
+from agent.config_schema import AgentConfig, ConnectionConfig
+from agent.traffic_selectors import AggregationResult, aggregate_connection
+
+# Proposals used when a connection asks for "default"
+DEFAULT_IKE_PROPOSAL = "aes256-sha256-modp2048"
+DEFAULT_ESP_PROPOSAL = "aes256-sha256"
+
+# File name prefix for everything the agent writes into conf.d
+CONF_PREFIX = "agent"
+
+# Child SAs rekey at 90% of their lifetime, minus up to 10% of charon's own jitter (rand_time)
+REKEY_MARGIN = 0.1
+
+# Child SA datapath settings charon's kernel-pfkey interface (MacOS) can install;
+# hardware offload, marks, XFRM interface IDs and DSCP copying are Linux XFRM only
+PFKEY_DATAPATH_OPTIONS = frozenset({"replay_window", "ipcomp", "updown"})
+
+# Parallel child SAs of a multicore connection (without per-CPU SAs) select
+# outbound traffic by these mark bits; child 0 stays unmarked and takes the rest
+MULTICORE_MARK_MASK = 0x00ff0000
+MULTICORE_MARK_SHIFT = 16
+MAX_PARALLEL_SAS = 16
+
+# A changed connection is loaded as a new generation, "<name>~<n>", next to the old one
+GENERATION_SEP = "~"
+
+
+@dataclass
+class RenderStats:
+    connections: int = 0
+    rendered: int = 0      # blocks rendered from scratch (cache misses)
+    reused: int = 0        # blocks served from the cache
+    files_written: int = 0
+    files_removed: int = 0
+    policies_before: int = 0
+    policies_after: int = 0
+
+
+@dataclass
+class _CachedBlock:
+    key: str
+    connection: str
+    secret: str
+    aggregation: Optional[AggregationResult]
+
+
+def child_name(conn: ConnectionConfig) -> str:
+    return f"{conn.name}-child"
+
+
+def swanctl_name(name: str, generation: int = 0) -> str:
+    """Name of a connection generation as loaded into swanctl; generation 0 keeps the plain name."""
+    return f"{name}{GENERATION_SEP}{generation}" if generation else name
+
+
+def split_generation(name: str) -> tuple[str, int]:
+    """Inverse of swanctl_name: 'SiteA~2' -> ('SiteA', 2)."""
+    base, sep, generation = name.rpartition(GENERATION_SEP)
+    if sep and generation.isdigit():
+        return base, int(generation)
+    return name, 0
+
+
+def generation_config(config: AgentConfig, generations: dict[str, int], staged: dict = None) -> AgentConfig:
+    """
+    The config as loaded into swanctl: every connection under the name of its
+    current generation, and for staged connections ({name: (old_conn, old_gen, new_gen)})
+    the old version next to the new one.
+    """
+    staged = staged or {}
+    if not generations and not staged:
+        return config
+    conns = []
+    for conn in config.connections:
+        if conn.name in staged:
+            old, old_gen, new_gen = staged[conn.name]
+            # Both generations share one set of IDs, so they must share the secret too;
+            # the old IKE SA is already authenticated and keeps running.
+            conns.append(replace(old, name=swanctl_name(conn.name, old_gen), auth=conn.auth))
+            conns.append(replace(conn, name=swanctl_name(conn.name, new_gen)))
+        elif generations.get(conn.name):
+            conns.append(replace(conn, name=swanctl_name(conn.name, generations[conn.name])))
+        else:
+            conns.append(conn)
+    return replace(config, connections=conns)
+
+
+def resolve_proposal(value: str, default: str, auto: Optional[str]) -> str:
+    """'default' -> the agent default; 'auto' -> the host's auto choice (the default until one is made)."""
+    if value == "default":
+        return default
+    if value == "auto":
+        return auto or default
+    return value
+
+
+def rekey_offset(name: str) -> float:
+    """Deterministic position of a connection in the rekey window, in [0, 1)."""
+    return int(hashlib.sha256(name.encode()).hexdigest()[:8], 16) / 2**32
+
+
+def child_lifetimes(conn: ConnectionConfig, spread: float = 0.0) -> tuple[int, int, int]:
+    """
+    Returns (rekey_time, life_time, rand_time) in seconds for a child SA.
+
+    life_time is the configured lifetime. Without spread every child rekeys
+    between 80% and 90% of it. With spread, each connection moves its rekey
+    earlier by its own fixed share of 'spread' x lifetime. Tunnels that start
+    together (e.g. at boot) then rekey across the whole window instead of at
+    the same moment. Offsets depend only on the connection name, so they are
+    stable across renders and generations.
+    """
+    life = conn.lifetime_minutes * 60
+    rand = int(life * REKEY_MARGIN)
+    offset = rekey_offset(split_generation(conn.name)[0]) * spread * life
+    rekey = int(life * (1 - REKEY_MARGIN) - offset)
+    return rekey, life, rand
+
+
+def with_esn(proposals: str) -> str:
+    """Adds Extended Sequence Numbers to each ESP proposal that does not choose already."""
+    return ",".join(p if p.endswith(("-esn", "-noesn")) else f"{p}-esn" for p in proposals.split(","))
+
+
+def datapath_lines(conn: ConnectionConfig, supported: Optional[frozenset] = None) -> str:
+    """Child SA settings for the connection's datapath options, limited to the supported ones."""
+    return "".join(f"\n                {key} = {value}" for key, value in conn.datapath.options().items()
+                   if supported is None or key in supported)
+
+
+def multicore_children(conn: ConnectionConfig, per_cpu_sas: bool = False, cpus: int = 1) -> list[tuple[str, str]]:
+    """
+    (child name, extra settings) for each child SA of the connection.
+
+    A multicore connection gets one child with per_cpu_sas where charon and
+    the kernel support it (the kernel then installs an SA per CPU). Otherwise
+    it gets parallel children with the same selectors, one per CPU unless
+    parallel_sas says otherwise, told apart by their outbound mark. The extra
+    children are named '<child>-<n>' and do not count for status. The marks
+    are set by the connection's nftables rules (see spread_rules).
+    """
+    child = child_name(conn)
+    if not conn.datapath.multicore:
+        return [(child, "")]
+    if per_cpu_sas:
+        return [(child, "\n                per_cpu_sas = yes")]
+    count = min(conn.datapath.parallel_sas or cpus, MAX_PARALLEL_SAS)
+    children = [(child, "")]
+    for i in range(1, count):
+        mark = i << MULTICORE_MARK_SHIFT
+        children.append((f"{child}-{i}", f"\n                mark_out = {mark:#x}/{MULTICORE_MARK_MASK:#x}"))
+    return children
+
+
+def spread_rules(conn: ConnectionConfig, count: int) -> list[str]:
+    """
+    nft rules that mark the connection's outbound traffic for one of 'count'
+    parallel children: a hash of the source and destination address picks
+    the child, so each flow stays on one SA. Only the multicore mark bits
+    are changed; bucket 0 leaves them clear, for the unmarked child.
+    """
+    if count < 2:
+        return []
+    keep = ~MULTICORE_MARK_MASK & 0xffffffff
+    rules = []
+    for family, keyword in ((4, "ip"), (6, "ip6")):
+        local = [s for s in conn.local_subnets if ipaddress.ip_network(s, strict=False).version == family]
+        remote = [s for s in conn.remote_subnets if ipaddress.ip_network(s, strict=False).version == family]
+        if not (local and remote):
+            continue
+        match = f"{keyword} saddr {{ {', '.join(local)} }} {keyword} daddr {{ {', '.join(remote)} }}"
+        # An explicit seed: every rule must compute the same hash
+        bucket = f"jhash {keyword} saddr . {keyword} daddr mod {count} seed 0x0"
+        rules.append(f"{match} meta mark set meta mark & {keep:#010x}")
+        for i in range(1, count):
+            rules.append(f"{match} {bucket} == {i} meta mark set meta mark | {i << MULTICORE_MARK_SHIFT:#010x}")
+    return rules
+
+
+def catch_all(subnets: list[str]) -> list[str]:
+    """0.0.0.0/0 and/or ::/0 for the address families of the subnets."""
+    families = {ipaddress.ip_network(s, strict=False).version for s in subnets}
+    return [net for version, net in ((4, "0.0.0.0/0"), (6, "::/0")) if version in families]
+
+
+def conf_filename(name: str, prefix: str = CONF_PREFIX) -> str:
+    """Per-connection file name, restricted to characters safe in conf.d."""
+    return f"{prefix}-{re.sub(r'[^A-Za-z0-9_.-]', '_', name)}.conf"
+
+
+def format_ts(subnets: list[str], protocol: str, port: str) -> str:
+    """
+    Formats traffic selectors as swanctl expects: subnet[proto/port].
+    strongSwan requires a protocol for a port, so a port with protocol 'any' is rendered as tcp.
+    """
+    proto = protocol.lower()
+    ts_list = []
+    for s in subnets:
+        if port != "any":
+            p_str = proto if proto != "any" else "tcp"
+            ts_list.append(f"{s}[{p_str}/{port}]")
+        elif proto != "any":
+            ts_list.append(f"{s}[{proto}]")
+        else:
+            ts_list.append(s)
+    return ",".join(ts_list)
+
+
+class SwanctlRenderer:
+    """
+    Streams swanctl configuration for a set of connections.
+
+    Rendered blocks are cached per connection, keyed by the connection's digest
+    plus the agent-level options that affect rendering, so re-rendering after a
+    change only redoes the connections that changed. The document is written
+    block by block and never assembled in memory.
+    """
+
+    def __init__(self, header: str = "# Generated by Unified IPsec Agent", datapath_options: Optional[frozenset] = None):
+        self.header = header
+        # Datapath settings the platform's kernel interface supports; None for all
+        self.datapath_options = datapath_options
+        # Host facts for multicore connections, set by the backend
+        self.per_cpu_sas = False
+        self.cpus = 1
+        # File name prefix in conf.d; agent processes sharing a host (shards) each use their own
+        self.prefix = CONF_PREFIX
+        self._cache: dict[str, _CachedBlock] = {}
+        # Per-connection layout only needs to remember what is on disk
+        self._file_keys: dict[str, str] = {}
+
+    def _options_key(self, config: AgentConfig) -> str:
+        key = f"agg={int(config.aggregate_selectors)};spread={config.rekey_spread};pcpu={int(self.per_cpu_sas)}/{self.cpus}"
+        if config.auto_proposals:
+            key += f";auto={config.auto_proposals.ike_proposals}/{config.auto_proposals.esp_proposals}"
+        return key
+
+    def supports(self, option: str) -> bool:
+        return self.datapath_options is None or option in self.datapath_options
+
+    def children(self, conn: ConnectionConfig) -> list[tuple[str, str]]:
+        """(child name, extra settings) for each child SA of the connection on this platform."""
+        if not self.supports("multicore"):
+            return [(child_name(conn), "")]
+        return multicore_children(conn, self.per_cpu_sas, self.cpus)
+
+    def _render(self, conn: ConnectionConfig, config: AgentConfig) -> _CachedBlock:
+        route_based = conn.routing.route_based and self.supports("route_based")
+        aggregation = aggregate_connection(conn) if config.aggregate_selectors and not route_based else None
+        local_subnets, remote_subnets = conn.local_subnets, conn.remote_subnets
+        if aggregation:
+            local_subnets, remote_subnets = aggregation.local_subnets, aggregation.remote_subnets
+        routed = ""
+        if route_based:
+            # Policies match everything on the connection's XFRM interface; routes pick the interface
+            local_subnets, remote_subnets = catch_all(local_subnets), catch_all(remote_subnets)
+            if_id = conn.routing.resolved_if_id(split_generation(conn.name)[0])
+            routed = f"\n                if_id_in = {if_id}\n                if_id_out = {if_id}"
+
+        auto = config.auto_proposals
+        ike_prop = resolve_proposal(conn.encryption.ike, DEFAULT_IKE_PROPOSAL, auto and auto.ike_proposals)
+        esp_prop = resolve_proposal(conn.encryption.esp, DEFAULT_ESP_PROPOSAL, auto and auto.esp_proposals)
+        if conn.datapath.esn and self.supports("esn"):
+            esp_prop = with_esn(esp_prop)
+        local_ts = format_ts(local_subnets, conn.protocol, conn.local_port)
+        remote_ts = format_ts(remote_subnets, conn.protocol, conn.remote_port)
+
+        rekey_time, life_time, rand_time = child_lifetimes(conn, config.rekey_spread)
+
+        # IDs are based on the first configured subnet address
+        local_id = conn.local_subnets[0].split('/')[0]
+        remote_id = conn.remote_subnets[0].split('/')[0]
+
+        if conn.on_demand:
+            # Trap policies negotiate the SA on the first packet; idle SAs close and leave the trap
+            actions = f"""
+                start_action = trap
+                dpd_action = trap
+                close_action = trap
+                inactivity = {conn.idle_timeout}s"""
+        elif len(conn.gateways) > 1:
+            # The agent fails over to the next gateway instead of charon retrying a dead one
+            actions = """
+                start_action = start
+                dpd_action = clear"""
+        else:
+            actions = """
+                start_action = start
+                dpd_action = restart"""
+
+        children = "".join(f"""
+            {name} {{
+                local_ts = {local_ts}
+                remote_ts = {remote_ts}
+                mode = {conn.mode}
+                esp_proposals = {esp_prop}
+                rekey_time = {rekey_time}s
+                life_time = {life_time}s
+                rand_time = {rand_time}s{datapath_lines(conn, self.datapath_options)}{routed}{extra}{actions}
+            }}""" for name, extra in self.children(conn))
+
+        comment = ""
+        if aggregation:
+            comment = f"    # {conn.name}: {aggregation.policies_before} -> {aggregation.policies_after} kernel policies\n"
+
+        connection = f"""{comment}
+    {conn.name} {{
+        local_addrs = {local_id}
+        remote_addrs = {conn.current_gateway() or remote_id}
+
+        local {{
+            auth = {conn.auth.type}
+            id = {local_id}
+        }}
+        remote {{
+            auth = {conn.auth.type}
+            id = {remote_id}
+        }}
+
+        children {{{children}
+        }}
+        version = {2 if conn.ike_version == "ikev2" else 1}
+        proposals = {ike_prop}
+        dpd_delay = {conn.dpd_delay}s
+        dpd_timeout = {conn.dpd_timeout}s
+    }}
+"""
+        secret = f"""
+    ike-{conn.name} {{
+        secret = "{conn.auth.value}"
+        id-a = {local_id}
+        id-b = {remote_id}
+    }}
+"""
+        return _CachedBlock("", connection, secret, aggregation)
+
+    def _block(self, conn: ConnectionConfig, config: AgentConfig, stats: RenderStats, cache: bool = True) -> _CachedBlock:
+        key = f"{conn.digest()}:{self._options_key(config)}"
+        cached = self._cache.get(conn.name)
+        if cached and cached.key == key:
+            stats.reused += 1
+            return cached
+        block = self._render(conn, config)
+        block.key = key
+        if cache:
+            self._cache[conn.name] = block
+        stats.rendered += 1
+        return block
+
+    def write(self, fp: TextIO, config: AgentConfig) -> RenderStats:
+        """Writes one document with all connections and secrets to fp."""
+        stats = RenderStats(connections=len(config.connections))
+        names = set()
+        blocks = []
+        for conn in config.connections:
+            block = self._block(conn, config, stats)
+            blocks.append(block)
+            names.add(conn.name)
+            if block.aggregation:
+                stats.policies_before += block.aggregation.policies_before
+                stats.policies_after += block.aggregation.policies_after
+        # Forget connections that were removed from the config
+        for stale in set(self._cache) - names:
+            del self._cache[stale]
+
+        fp.write(self.header + "\n")
+        if config.aggregate_selectors:
+            saved = stats.policies_before - stats.policies_after
+            fp.write(f"# Selector aggregation: {stats.policies_before} -> {stats.policies_after} kernel policies ({saved} saved)\n")
+        fp.write("connections {\n")
+        for block in blocks:
+            fp.write(block.connection)
+        fp.write("}\n\nsecrets {\n")
+        for block in blocks:
+            fp.write(block.secret)
+        fp.write("}\n")
+        return stats
+
+    def write_file(self, path: Path, config: AgentConfig) -> RenderStats:
+        """Streams the document to path via a temp file, so charon never sees a partial config."""
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "w") as f:
+            stats = self.write(f, config)
+        os.replace(tmp, path)
+        stats.files_written = 1
+        return stats
+
+    def write_dir(self, conf_dir: Path, config: AgentConfig) -> RenderStats:
+        """
+        Writes one file per connection. Only files whose connection changed are
+        rewritten, and files of removed connections are deleted. Blocks are not
+        kept in memory in this layout; only their keys are.
+        """
+        stats = RenderStats(connections=len(config.connections))
+        wanted = set()
+        for conn in config.connections:
+            filename = conf_filename(conn.name, self.prefix)
+            wanted.add(filename)
+            key = f"{conn.digest()}:{self._options_key(config)}"
+            if self._file_keys.get(filename) == key and (conf_dir / filename).exists():
+                stats.reused += 1
+                continue
+
+            block = self._block(conn, config, stats, cache=False)
+            if block.aggregation:
+                stats.policies_before += block.aggregation.policies_before
+                stats.policies_after += block.aggregation.policies_after
+            tmp = conf_dir / (filename + ".tmp")
+            with open(tmp, "w") as f:
+                f.write(self.header + "\n")
+                f.write("connections {\n")
+                f.write(block.connection)
+                f.write("}\n\nsecrets {\n")
+                f.write(block.secret)
+                f.write("}\n")
+            os.replace(tmp, conf_dir / filename)
+            self._file_keys[filename] = key
+            stats.files_written += 1
+
+        for path in conf_dir.glob(f"{self.prefix}-*.conf"):
+            if path.name not in wanted:
+                path.unlink()
+                self._file_keys.pop(path.name, None)
+                stats.files_removed += 1
+        return stats
+
+    def write_config(self, conf_dir: Path, config: AgentConfig) -> RenderStats:
+        """Writes config in the layout selected by config.swanctl_layout."""
+        if config.swanctl_layout == "per_connection":
+            single = conf_dir / f"{self.prefix}.conf"
+            if single.exists():
+                single.unlink()
+            return self.write_dir(conf_dir, config)
+        for path in conf_dir.glob(f"{self.prefix}-*.conf"):
+            path.unlink()
+        self._file_keys.clear()
+        return self.write_file(conf_dir / f"{self.prefix}.conf", config)
+
+    def flush_cache(self):
+        self._cache.clear()
+        self._file_keys.clear()
+
+
+def remove_config(conf_dir: Path, prefix: str = CONF_PREFIX):
+    """Removes every file the renderer may have written to conf_dir."""
+    for path in [conf_dir / f"{prefix}.conf", *conf_dir.glob(f"{prefix}-*.conf")]:
+        if path.exists():
+            os.remove(path)
+
+
+# --- swanctl --list-sas parsing ---
+
+_IKE_RE = re.compile(r"^(\S+): #(\d+), (\w+), (IKEv\d)")
+_CHILD_RE = re.compile(r"^  (\S+): #(\d+), reqid (\d+), (\w+), ([\w-]+)(?:, (\S+))?")
+_REMOTE_RE = re.compile(r"^  remote '[^']*' @ ([^\[\s]+)")
+_TRAFFIC_RE = re.compile(r"^    (in|out)\s+([0-9a-f]+)(?: \([^)]*\))?,\s+(\d+) bytes,\s+(\d+) packets")
+_TS_RE = re.compile(r"^    (local|remote)\s+(.+)$")
+
+
+@dataclass
+class ChildSA:
+    name: str
+    uniqueid: int
+    reqid: int
+    state: str
+    mode: str
+    proposal: str = ""
+    spi_in: str = ""
+    spi_out: str = ""
+    bytes_in: int = 0
+    bytes_out: int = 0
+    packets_in: int = 0
+    packets_out: int = 0
+    local_ts: list[str] = field(default_factory=list)
+    remote_ts: list[str] = field(default_factory=list)
+
+
+@dataclass
+class IkeSA:
+    name: str
+    uniqueid: int
+    state: str
+    version: str
+    remote_host: str = ""
+    children: list[ChildSA] = field(default_factory=list)
+
+
+def parse_list_sas(output: str) -> list[IkeSA]:
+    """Parses the text output of 'swanctl --list-sas'."""
+    sas = []
+    ike = None
+    child = None
+    for line in output.splitlines():
+        m = _IKE_RE.match(line)
+        if m:
+            ike = IkeSA(m.group(1), int(m.group(2)), m.group(3), m.group(4))
+            sas.append(ike)
+            child = None
+            continue
+        if ike is None:
+            continue
+        m = _CHILD_RE.match(line)
+        if m:
+            child = ChildSA(m.group(1), int(m.group(2)), int(m.group(3)), m.group(4), m.group(5), m.group(6) or "")
+            ike.children.append(child)
+            continue
+        m = _REMOTE_RE.match(line)
+        if m and child is None:
+            ike.remote_host = m.group(1)
+            continue
+        if child is None:
+            continue
+        m = _TRAFFIC_RE.match(line)
+        if m:
+            direction, spi, nbytes, npackets = m.group(1), m.group(2), int(m.group(3)), int(m.group(4))
+            if direction == "in":
+                child.spi_in, child.bytes_in, child.packets_in = spi, nbytes, npackets
+            else:
+                child.spi_out, child.bytes_out, child.packets_out = spi, nbytes, npackets
+            continue
+        m = _TS_RE.match(line)
+        if m:
+            target = child.local_ts if m.group(1) == "local" else child.remote_ts
+            target.extend(m.group(2).split())
+    return sas
+
+
+def sa_states(sas: list[IkeSA]) -> dict[str, str]:
+    """
+    State per swanctl connection name (generation suffix included): CONNECTED
+    (child SA installed) or CONNECTING (IKE SA without installed child).
+    """
+    states = {}
+    for ike in sas:
+        for child in ike.children:
+            if child.state == "INSTALLED" and child.name.endswith("-child"):
+                states[child.name[:-len("-child")]] = "CONNECTED"
+        if ike.state in ("ESTABLISHED", "CONNECTING"):
+            states.setdefault(ike.name, "CONNECTING")
+    return states
+
+
+def connection_states(sas: list[IkeSA], connections, trapped: set[str] = frozenset()) -> dict[str, str]:
+    """
+    Maps each configured connection to CONNECTED, CONNECTING, IDLE or
+    DISCONNECTED. A connection is CONNECTED if any of its generations is. An
+    on-demand connection without SA is IDLE while its trap policy ('trapped',
+    as from parse_list_pols) is installed.
+    """
+    states = {conn.name: "DISCONNECTED" for conn in connections}
+    for wire, state in sa_states(sas).items():
+        name, _ = split_generation(wire)
+        if name in states and (state == "CONNECTED" or states[name] == "DISCONNECTED"):
+            states[name] = state
+    if trapped:
+        idle = {split_generation(wire)[0] for wire in trap_states(trapped)}
+        for conn in connections:
+            if conn.on_demand and states[conn.name] == "DISCONNECTED" and conn.name in idle:
+                states[conn.name] = "IDLE"
+    return states
+
+
+# --- swanctl --list-pols parsing ---
+
+_POLICY_RE = re.compile(r"^(\S+), (\w+)")
+
+
+def parse_list_pols(output: str) -> set[str]:
+    """
+    Child names with a trap policy in the text output of 'swanctl --list-pols'.
+    Entries are '<child>, <mode>' or '<connection>/<child>, <mode>'; PASS and
+    DROP entries are shunts, not traps.
+    """
+    trapped = set()
+    for line in output.splitlines():
+        m = _POLICY_RE.match(line)
+        if m and m.group(2) in ("TUNNEL", "TRANSPORT", "BEET"):
+            trapped.add(m.group(1).rsplit("/", 1)[-1])
+    return trapped
+
+
+def trap_states(trapped: set[str]) -> set[str]:
+    """swanctl connection names (generation suffix included) whose primary child is trapped."""
+    return {child[:-len("-child")] for child in trapped if child.endswith("-child")}
+
+
+def live_generations(sas: list[IkeSA]) -> dict[str, int]:
+    """Newest generation of each connection with an SA, e.g. after adopting SAs of a previous run."""
+    generations = {}
+    for wire in sa_states(sas):
+        name, generation = split_generation(wire)
+        generations[name] = max(generation, generations.get(name, 0))
+    return generations
@@ -0,0 +1,113 @@
+"""
+Host capability probes. Everything reads from a filesystem root so tests can
+point it at a fixture tree instead of the live /proc and /sys.
+"""
+import platform
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+# /proc/cpuinfo flag -> feature, for x86 ("flags") and ARM ("Features")
+_CPU_FLAGS = {
+    "aes": "aes",
+    "pclmulqdq": "clmul", "pmull": "clmul",
+    "sha_ni": "sha", "sha2": "sha",
+    "avx2": "simd", "asimd": "simd",
+}
+
+
+@dataclass
+class CpuFeatures:
+    """
+    Crypto-relevant CPU features. A value of None means unknown (no cpuinfo on
+    this platform), as opposed to False (known to be missing).
+    """
+    aes: Optional[bool] = None    # AES-NI / ARMv8 AES instructions
+    clmul: Optional[bool] = None  # Carry-less multiply (PCLMULQDQ / PMULL), speeds up GCM's GHASH
+    sha: Optional[bool] = None    # SHA-256 instructions (SHA-NI / ARMv8 SHA2)
+    simd: Optional[bool] = None   # Wide vector units (AVX2 / NEON), speed up ChaCha20-Poly1305
+    cpus: int = 0
+    source: str = "unknown"
+    flags: set[str] = field(default_factory=set, repr=False)
+
+    @property
+    def detected(self) -> bool:
+        return self.source != "unknown"
+
+    def describe(self) -> str:
+        if not self.detected:
+            return "CPU features unknown"
+        names = {"aes": "AES", "clmul": "CLMUL", "sha": "SHA", "simd": "SIMD"}
+        have = [label for attr, label in names.items() if getattr(self, attr)]
+        missing = [label for attr, label in names.items() if not getattr(self, attr)]
+        text = f"{self.cpus} CPU(s) with {', '.join(have) or 'no crypto extensions'}"
+        if missing:
+            text += f"; without {', '.join(missing)}"
+        return f"{text} (from {self.source})"
+
+
+def cpu_features(root: Path = Path("/")) -> CpuFeatures:
+    """Reads CPU features from <root>/proc/cpuinfo; Apple Silicon is known without it."""
+    path = Path(root) / "proc" / "cpuinfo"
+    try:
+        text = path.read_text()
+    except OSError:
+        if platform.system() == "Darwin" and platform.machine() == "arm64":
+            # ARMv8 crypto extensions are present on every Apple Silicon CPU
+            return CpuFeatures(aes=True, clmul=True, sha=True, simd=True, source="Apple Silicon")
+        return CpuFeatures()
+
+    flags = set()
+    cpus = 0
+    for line in text.splitlines():
+        key, _, value = line.partition(":")
+        key = key.strip()
+        if key == "processor":
+            cpus += 1
+        elif key in ("flags", "Features") and not flags:
+            flags = set(value.split())
+    features = CpuFeatures(aes=False, clmul=False, sha=False, simd=False, cpus=cpus, source=str(path), flags=flags)
+    for flag, attr in _CPU_FLAGS.items():
+        if flag in flags:
+            setattr(features, attr, True)
+    return features
+
+
+@dataclass
+class NicInfo:
+    name: str
+    speed: Optional[int]  # Mbit/s; None if unknown (link down, or not reported)
+    rx_queues: int = 1
+    tx_queues: int = 1
+
+
+def _read_int(path: Path) -> Optional[int]:
+    try:
+        value = int(path.read_text().strip())
+    except (OSError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+def network_interfaces(root: Path = Path("/")) -> list[NicInfo]:
+    """Physical NICs (those backed by a device) from <root>/sys/class/net, by name."""
+    base = Path(root) / "sys" / "class" / "net"
+    try:
+        entries = sorted(base.iterdir())
+    except OSError:
+        return []
+    nics = []
+    for entry in entries:
+        if not (entry / "device").exists():
+            continue # lo, bridges, tunnels, veth
+        queues = entry / "queues"
+        rx = len(list(queues.glob("rx-*"))) if queues.is_dir() else 0
+        tx = len(list(queues.glob("tx-*"))) if queues.is_dir() else 0
+        nics.append(NicInfo(entry.name, _read_int(entry / "speed"), rx or 1, tx or 1))
+    return nics
+
+
+def fastest_nic(nics: list[NicInfo]) -> Optional[NicInfo]:
+    """The NIC with the highest known link speed, or None if no speed is known."""
+    known = [n for n in nics if n.speed]
+    return max(known, key=lambda n: (n.speed, n.rx_queues)) if known else None
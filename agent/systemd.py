@@ -0,0 +1,87 @@
+"""
+systemd service notifications (the sd_notify protocol), without libsystemd.
+
+Run as a Type=notify unit, the agent tells systemd over $NOTIFY_SOCKET (a
+Unix datagram socket; '@' starts an abstract address):
+
+  READY=1       once the first apply succeeded: the unit is then 'active'
+  STATUS=...    the agent state and connection counts, shown by 'systemctl status'
+  WATCHDOG=1    from the control loop, at least every half WatchdogSec; if the
+                loop hangs, the pings stop and systemd restarts the agent
+  STOPPING=1    when shutting down
+
+Outside systemd (no $NOTIFY_SOCKET) every call is a no-op.
+"""
+import os
+import socket
+from collections import Counter
+from typing import Optional
+
+
+class Notifier:
+    def __init__(self, env: dict = None):
+        env = os.environ if env is None else env
+        address = env.get("NOTIFY_SOCKET") or None
+        if address and address.startswith("@"):
+            address = "\0" + address[1:]
+        self.address = address if hasattr(socket, "AF_UNIX") else None
+        self.sock = None
+        # Seconds after which systemd considers the agent hung (WatchdogSec), if set for this process
+        self.watchdog_interval: Optional[float] = None
+        usec, pid = env.get("WATCHDOG_USEC"), env.get("WATCHDOG_PID")
+        if self.address and usec and (not pid or pid == str(os.getpid())):
+            try:
+                self.watchdog_interval = int(usec) / 1e6 or None
+            except ValueError:
+                pass
+        self.is_ready = False
+        self._status = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.address is not None
+
+    def notify(self, *fields: str) -> bool:
+        """Sends 'KEY=value' fields in one datagram; False if there is no socket or sending failed."""
+        if not self.address:
+            return False
+        try:
+            if self.sock is None:
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                # A full queue drops the message rather than stalling the control loop
+                self.sock.setblocking(False)
+            self.sock.sendto("\n".join(fields).encode(), self.address)
+            return True
+        except OSError:
+            # systemd gone or socket full: nothing to report to
+            return False
+
+    def ready(self, status: str = None) -> bool:
+        self.is_ready = True
+        self._status = status
+        return self.notify("READY=1", *([f"STATUS={status}"] if status else []))
+
+    def status(self, status: str) -> bool:
+        """Sends STATUS only when it changed."""
+        if status == self._status:
+            return False
+        self._status = status
+        return self.notify(f"STATUS={status}")
+
+    def watchdog(self) -> bool:
+        return self.watchdog_interval is not None and self.notify("WATCHDOG=1")
+
+    def stopping(self) -> bool:
+        return self.notify("STOPPING=1", "STATUS=Stopping")
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+
+def status_line(state: str, total: int, statuses: dict[str, str]) -> str:
+    """'DEGRADED: 10 connections, 9 CONNECTED, 1 DISCONNECTED'"""
+    counts = Counter(statuses.values())
+    details = ", ".join(f"{n} {status}" for status, n in sorted(counts.items()))
+    return f"{state}: {total} connections" + (f", {details}" if details else "")
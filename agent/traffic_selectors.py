@@ -0,0 +1,321 @@
+import ipaddress
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from typing import Iterable, Optional, Union
+
+IPNetwork = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+# IP protocol numbers for the names accepted in ConnectionConfig.protocol
+PROTOCOL_NUMBERS = {
+    "icmp": 1,
+    "tcp": 6,
+    "udp": 17,
+    "gre": 47,
+    "esp": 50,
+    "ah": 51,
+    "icmpv6": 58,
+    "sctp": 132,
+}
+
+ANY_PORT = (0, 65535)
+
+
+def parse_protocol(protocol: str) -> Optional[int]:
+    """Returns the IP protocol number, or None for 'any'."""
+    proto = protocol.lower()
+    if proto == "any":
+        return None
+    if proto.isdigit():
+        return int(proto)
+    return PROTOCOL_NUMBERS.get(proto)
+
+
+def parse_port_range(port: str) -> tuple[int, int]:
+    """Parses 'any', '443', '1000-2000' or a service name into an inclusive range."""
+    port = str(port).lower()
+    if port == "any":
+        return ANY_PORT
+    if "-" in port:
+        lo, hi = port.split("-", 1)
+        return (int(lo), int(hi))
+    if port.isdigit():
+        return (int(port), int(port))
+    import socket
+    try:
+        p = socket.getservbyname(port)
+        return (p, p)
+    except OSError:
+        # Unknown service name: assume it can match anything
+        return ANY_PORT
+
+
+@dataclass(frozen=True)
+class TrafficSelector:
+    """One local/remote selector pair as the kernel sees it."""
+    connection: str
+    local: IPNetwork
+    remote: IPNetwork
+    protocol: Optional[int] = None  # None = any
+    local_ports: tuple[int, int] = ANY_PORT
+    remote_ports: tuple[int, int] = ANY_PORT
+
+    def __str__(self):
+        proto = "any" if self.protocol is None else str(self.protocol)
+        return (f"{self.connection}: {self.local}[{proto}/{_fmt_ports(self.local_ports)}]"
+                f" <=> {self.remote}[{proto}/{_fmt_ports(self.remote_ports)}]")
+
+
+@dataclass(frozen=True)
+class SelectorConflict:
+    """
+    Two selectors of different connections that can match the same packet.
+
+    kind is one of:
+      duplicate - both selectors are identical
+      shadowed  - 'second' is fully covered by 'first'
+      overlap   - the selectors partially intersect
+    """
+    kind: str
+    first: TrafficSelector
+    second: TrafficSelector
+
+    def describe(self) -> str:
+        if self.kind == "duplicate":
+            return f"Duplicate selector in '{self.first.connection}' and '{self.second.connection}': {self.first}"
+        if self.kind == "shadowed":
+            return f"Selector {self.second} is shadowed by {self.first}"
+        return f"Selector {self.first} overlaps {self.second}"
+
+
+def _fmt_ports(ports: tuple[int, int]) -> str:
+    if ports == ANY_PORT:
+        return "any"
+    if ports[0] == ports[1]:
+        return str(ports[0])
+    return f"{ports[0]}-{ports[1]}"
+
+
+def selectors_for_connection(conn) -> list[TrafficSelector]:
+    """
+    Expands a ConnectionConfig into its selector pairs (local x remote).
+    Mirrors the generators: a port without a protocol is rendered as tcp.
+    """
+    proto = parse_protocol(conn.protocol)
+    local_ports = parse_port_range(conn.local_port)
+    remote_ports = parse_port_range(conn.remote_port)
+    if proto is None and (local_ports != ANY_PORT or remote_ports != ANY_PORT):
+        proto = PROTOCOL_NUMBERS["tcp"]
+
+    locals_ = [ipaddress.ip_network(s, strict=False) for s in conn.local_subnets]
+    remotes = [ipaddress.ip_network(s, strict=False) for s in conn.remote_subnets]
+
+    result = []
+    for l in locals_:
+        for r in remotes:
+            # Mixed-family pairs never become a kernel policy
+            if l.version != r.version:
+                continue
+            result.append(TrafficSelector(conn.name, l, r, proto, local_ports, remote_ports))
+    return result
+
+
+class _RemoteIndex:
+    """
+    Index over the remote prefixes of all selectors sharing one local prefix.
+
+    CIDR prefixes either nest or are disjoint, so the prefixes overlapping R are
+    exactly its supernets (one hash lookup per distinct prefix length) and its
+    subnets (a contiguous run of start addresses inside R, found by bisection).
+    """
+
+    def __init__(self, selectors: list[TrafficSelector]):
+        self.selectors = sorted(selectors, key=lambda s: (int(s.remote.network_address), s.remote.prefixlen))
+        self.starts = [int(s.remote.network_address) for s in self.selectors]
+        self.by_prefix: dict[tuple[int, int], list[int]] = {}
+        for pos, s in enumerate(self.selectors):
+            self.by_prefix.setdefault((self.starts[pos], s.remote.prefixlen), []).append(pos)
+        self.prefixlens = sorted({s.remote.prefixlen for s in self.selectors})
+
+    def overlapping(self, remote: IPNetwork) -> Iterable[int]:
+        """Yields positions of selectors whose remote prefix overlaps 'remote'."""
+        start = int(remote.network_address)
+        end = int(remote.broadcast_address)
+        width = remote.max_prefixlen
+        # Supernets of remote (including remote itself)
+        for plen in self.prefixlens:
+            if plen > remote.prefixlen:
+                break
+            mask = ((1 << width) - 1) ^ ((1 << (width - plen)) - 1)
+            yield from self.by_prefix.get((start & mask, plen), ())
+        # Strict subnets of remote
+        lo = bisect_left(self.starts, start)
+        hi = bisect_right(self.starts, end)
+        for pos in range(lo, hi):
+            if self.selectors[pos].remote.prefixlen > remote.prefixlen:
+                yield pos
+
+
+def _range_relation(a: tuple[int, int], b: tuple[int, int]) -> Optional[str]:
+    """Relation of two inclusive ranges: 'eq', 'sup' (a covers b), 'sub', 'partial' or None."""
+    if a[1] < b[0] or b[1] < a[0]:
+        return None
+    if a == b:
+        return "eq"
+    if a[0] <= b[0] and b[1] <= a[1]:
+        return "sup"
+    if b[0] <= a[0] and a[1] <= b[1]:
+        return "sub"
+    return "partial"
+
+
+def _net_relation(a: IPNetwork, b: IPNetwork) -> Optional[str]:
+    return _range_relation((int(a.network_address), int(a.broadcast_address)),
+                           (int(b.network_address), int(b.broadcast_address)))
+
+
+def _proto_relation(a: Optional[int], b: Optional[int]) -> Optional[str]:
+    if a == b:
+        return "eq"
+    if a is None:
+        return "sup"
+    if b is None:
+        return "sub"
+    return None
+
+
+def classify(a: TrafficSelector, b: TrafficSelector) -> Optional[SelectorConflict]:
+    """Compares two selectors. Returns None if no packet can match both."""
+    relations = [_proto_relation(a.protocol, b.protocol)]
+    if relations[0] is None:
+        return None
+    relations.append(_net_relation(a.local, b.local))
+    relations.append(_net_relation(a.remote, b.remote))
+    # Ports only narrow the selector for port-carrying protocols
+    relations.append(_range_relation(a.local_ports, b.local_ports))
+    relations.append(_range_relation(a.remote_ports, b.remote_ports))
+    if None in relations:
+        return None
+
+    kinds = set(relations)
+    if kinds == {"eq"}:
+        return SelectorConflict("duplicate", a, b)
+    if kinds <= {"eq", "sup"}:
+        return SelectorConflict("shadowed", a, b)
+    if kinds <= {"eq", "sub"}:
+        return SelectorConflict("shadowed", b, a)
+    return SelectorConflict("overlap", a, b)
+
+
+def find_conflicts(selectors: Iterable[TrafficSelector]) -> list[SelectorConflict]:
+    """
+    Reports every pair of selectors from different connections that overlap.
+
+    Selectors are grouped by local prefix and the groups are swept in address
+    order, keeping a stack of the enclosing (ancestor) local prefixes. Each
+    selector is only checked against the remote index of its own group and its
+    ancestors; the stack depth is bounded by the address width, so the pass is
+    O(n log n) plus the number of conflicts reported.
+    """
+    groups: dict[tuple[int, int, int], list[TrafficSelector]] = {}
+    for s in selectors:
+        key = (s.local.version, int(s.local.network_address), s.local.prefixlen)
+        groups.setdefault(key, []).append(s)
+
+    conflicts = []
+    stack: list[tuple[IPNetwork, _RemoteIndex]] = []
+    for key in sorted(groups):
+        group = groups[key]
+        local = group[0].local
+        while stack and (stack[-1][0].version != local.version or not local.subnet_of(stack[-1][0])):
+            stack.pop()
+
+        index = _RemoteIndex(group)
+        for ancestor_local, ancestor in stack:
+            for s in group:
+                for pos in ancestor.overlapping(s.remote):
+                    other = ancestor.selectors[pos]
+                    if other.connection == s.connection:
+                        continue
+                    c = classify(other, s)
+                    if c: conflicts.append(c)
+
+        # Pairs within the same local prefix, each reported once
+        for pos_s, s in enumerate(index.selectors):
+            for pos in index.overlapping(s.remote):
+                if pos >= pos_s:
+                    continue
+                other = index.selectors[pos]
+                if other.connection == s.connection:
+                    continue
+                c = classify(other, s)
+                if c: conflicts.append(c)
+
+        stack.append((local, index))
+    return conflicts
+
+
+def find_connection_conflicts(connections) -> list[SelectorConflict]:
+    """Expands all ConnectionConfigs and runs find_conflicts over their selectors."""
+    selectors = []
+    for conn in connections:
+        selectors.extend(selectors_for_connection(conn))
+    return find_conflicts(selectors)
+
+
+@dataclass(frozen=True)
+class AggregationResult:
+    """Outcome of collapsing one connection's subnet lists."""
+    connection: str
+    local_subnets: list[str]
+    remote_subnets: list[str]
+    policies_before: int
+    policies_after: int
+
+    @property
+    def saved(self) -> int:
+        return self.policies_before - self.policies_after
+
+
+def aggregate_subnets(subnets: list[str]) -> list[str]:
+    """
+    Merges adjacent and nested prefixes with ipaddress.collapse_addresses.
+    collapse_addresses cannot mix families, so each family is collapsed on its own
+    (IPv4 first, then IPv6).
+    """
+    by_family: dict[int, list] = {4: [], 6: []}
+    for s in subnets:
+        net = ipaddress.ip_network(s, strict=False)
+        by_family[net.version].append(net)
+    result = []
+    for version in (4, 6):
+        result.extend(str(n) for n in ipaddress.collapse_addresses(by_family[version]))
+    return result
+
+
+def count_policies(local_subnets: list[str], remote_subnets: list[str], mode: str = "tunnel") -> int:
+    """
+    Number of XFRM policies charon installs for the subnet lists: one per
+    same-family local/remote pair and direction (in/out, plus fwd in tunnel mode).
+    """
+    families = [ipaddress.ip_network(s, strict=False).version for s in local_subnets]
+    remote_families = [ipaddress.ip_network(s, strict=False).version for s in remote_subnets]
+    pairs = sum(families.count(v) * remote_families.count(v) for v in (4, 6))
+    directions = 3 if mode.lower() == "tunnel" else 2
+    return pairs * directions
+
+
+def aggregate_connection(conn) -> AggregationResult:
+    """
+    Collapses a connection's local and remote subnets. A connection carries a
+    single protocol/port pair, so grouping per connection keeps selectors with
+    different protocols or ports apart.
+    """
+    local = aggregate_subnets(conn.local_subnets)
+    remote = aggregate_subnets(conn.remote_subnets)
+    return AggregationResult(
+        connection=conn.name,
+        local_subnets=local,
+        remote_subnets=remote,
+        policies_before=count_policies(conn.local_subnets, conn.remote_subnets, conn.mode),
+        policies_after=count_policies(local, remote, conn.mode),
+    )
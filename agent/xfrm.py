@@ -0,0 +1,188 @@
+"""
+Kernel XFRM statistics: where the Linux datapath drops packets.
+
+/proc/net/xfrm_stat holds host-wide error counters (no state for an inbound
+SPI, sequence numbers outside the replay window, failed integrity checks,
+traffic without a policy). 'ip -s xfrm state' adds per-SA traffic and drop
+counters. Both are cumulative; XfrmCollector keeps the previous sample and
+reports what changed in between, with per-SA counters added up per
+connection by matching their SPIs against 'swanctl --list-sas'.
+
+Parsers and the collector only work on text, so they are tested against
+captured output; the Linux backend does the reading and runs 'ip'.
+"""
+import re
+from dataclasses import dataclass, asdict
+from typing import Optional
+from agent.swanctl import IkeSA, split_generation
+
+# Counters of /proc/net/xfrm_stat that mean dropped packets, with what they usually indicate
+DROP_COUNTERS = {
+    "XfrmInNoStates": "no SA for the inbound SPI (peer uses an SA we deleted)",
+    "XfrmInStateProtoError": "integrity or decryption failures",
+    "XfrmInStateSeqError": "sequence numbers outside the replay window",
+    "XfrmInStateMismatch": "inbound SA does not match its policy",
+    "XfrmInTmplMismatch": "inbound traffic does not match the policy template",
+    "XfrmInNoPols": "inbound traffic without a matching policy",
+    "XfrmInBufferError": "receive buffers exhausted",
+    "XfrmOutNoStates": "outbound policy without an SA",
+    "XfrmOutStateSeqError": "outbound sequence number overflow",
+    "XfrmAcquireError": "SA acquisition failed",
+}
+
+_STATE_HEAD_RE = re.compile(r"^src (\S+) dst (\S+)$")
+_STATE_ID_RE = re.compile(r"^\s+proto (\w+) spi 0x([0-9a-fA-F]+)\(\d+\) reqid (\d+)\(0x[0-9a-fA-F]+\) mode (\S+)")
+_LIFETIME_RE = re.compile(r"^\s+(\d+)\(bytes\), (\d+)\(packets\)")
+_STATS_RE = re.compile(r"^\s+replay-window (\d+) replay (\d+) failed (\d+)")
+
+# Per-SA counters, as summed up per connection
+STATE_COUNTERS = ("bytes", "packets", "replay_window", "replay", "integrity_failed")
+
+
+def parse_xfrm_stat(text: str) -> dict[str, int]:
+    """Parses /proc/net/xfrm_stat ('<name> <value>' per line)."""
+    counters = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[1].isdigit():
+            counters[parts[0]] = int(parts[1])
+    return counters
+
+
+@dataclass
+class XfrmState:
+    src: str
+    dst: str
+    proto: str
+    spi: int
+    reqid: int
+    mode: str
+    bytes: int = 0
+    packets: int = 0
+    replay_window: int = 0     # Dropped: outside the replay window
+    replay: int = 0            # Dropped: replayed sequence number
+    integrity_failed: int = 0  # Dropped: ICV check failed
+
+
+def parse_xfrm_states(text: str) -> list[XfrmState]:
+    """Parses the text output of 'ip -s xfrm state'."""
+    states = []
+    state = None
+    src_dst = None
+    section = None
+    for line in text.splitlines():
+        m = _STATE_HEAD_RE.match(line)
+        if m:
+            src_dst, state, section = m.groups(), None, None
+            continue
+        m = _STATE_ID_RE.match(line)
+        if m and src_dst:
+            state = XfrmState(src_dst[0], src_dst[1], m.group(1), int(m.group(2), 16), int(m.group(3)), m.group(4))
+            states.append(state)
+            continue
+        if state is None:
+            continue
+        stripped = line.strip()
+        if stripped.endswith(":") and not stripped.startswith("limit"):
+            section = stripped[:-1]
+            continue
+        if section == "lifetime current":
+            m = _LIFETIME_RE.match(line)
+            if m:
+                state.bytes, state.packets = int(m.group(1)), int(m.group(2))
+        elif section == "stats":
+            m = _STATS_RE.match(line)
+            if m:
+                state.replay_window, state.replay, state.integrity_failed = (int(g) for g in m.groups())
+    return states
+
+
+def spi_connections(sas: list[IkeSA]) -> dict[int, tuple[str, str]]:
+    """{SPI: (connection name, 'in' or 'out')} for every child SA swanctl lists, generations folded in."""
+    spis = {}
+    for ike in sas:
+        name = split_generation(ike.name)[0]
+        for child in ike.children:
+            for direction, spi in (("in", child.spi_in), ("out", child.spi_out)):
+                if spi:
+                    spis[int(spi, 16)] = (name, direction)
+    return spis
+
+
+def _delta(current: int, previous: Optional[int]) -> int:
+    # A counter that went backwards was reset (SA replaced, module reloaded)
+    if previous is None or current < previous:
+        return current
+    return current - previous
+
+
+@dataclass
+class XfrmReport:
+    time: float
+    interval: Optional[float]                    # Seconds since the previous sample
+    counters: dict[str, dict[str, int]]          # xfrm_stat counter -> {"total", "delta"}
+    connections: dict[str, dict[str, dict]]      # name -> in/out -> {"total": {...}, "delta": {...}}
+    unmapped_states: int = 0                     # SAs whose SPI swanctl does not list
+
+    def drops(self) -> dict[str, int]:
+        """Drop counters of xfrm_stat that grew since the previous sample."""
+        return {name: self.counters[name]["delta"] for name in DROP_COUNTERS
+                if self.counters.get(name, {}).get("delta")}
+
+    def describe_drops(self) -> list[str]:
+        lines = [f"{name} +{delta} ({DROP_COUNTERS[name]})" for name, delta in self.drops().items()]
+        for name, directions in sorted(self.connections.items()):
+            inbound = directions.get("in", {}).get("delta", {})
+            parts = [f"{inbound[key]} {label}" for key, label in
+                     (("replay_window", "outside the replay window"), ("replay", "replayed"),
+                      ("integrity_failed", "failed integrity"))
+                     if inbound.get(key)]
+            if parts:
+                lines.append(f"{name}: {', '.join(parts)}")
+        return lines
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class XfrmCollector:
+    """Turns successive samples into deltas; the first sample has totals as deltas and no interval."""
+    def __init__(self):
+        self.previous_time: Optional[float] = None
+        self.previous_counters: dict[str, int] = {}
+        self.previous_states: dict[tuple[str, int], XfrmState] = {}
+        self.report: Optional[XfrmReport] = None
+
+    def sample(self, now: float, xfrm_stat: str, xfrm_states: str, sas: list[IkeSA]) -> XfrmReport:
+        counters = parse_xfrm_stat(xfrm_stat)
+        states = {(s.dst, s.spi): s for s in parse_xfrm_states(xfrm_states)}
+        spis = spi_connections(sas)
+
+        first = self.previous_time is None
+        connections: dict[str, dict[str, dict]] = {}
+        unmapped = 0
+        for key, state in states.items():
+            owner = spis.get(state.spi)
+            if owner is None:
+                unmapped += 1
+                continue
+            name, direction = owner
+            entry = connections.setdefault(name, {}).setdefault(
+                direction, {"total": dict.fromkeys(STATE_COUNTERS, 0), "delta": dict.fromkeys(STATE_COUNTERS, 0)})
+            previous = self.previous_states.get(key)
+            for counter in STATE_COUNTERS:
+                value = getattr(state, counter)
+                entry["total"][counter] += value
+                # An SA that is new since the last sample counted all of its traffic in between
+                entry["delta"][counter] += _delta(value, getattr(previous, counter) if previous else (None if first else 0))
+
+        self.report = XfrmReport(
+            time=now,
+            interval=None if first else now - self.previous_time,
+            counters={name: {"total": value, "delta": _delta(value, self.previous_counters.get(name))}
+                      for name, value in counters.items()},
+            connections=connections,
+            unmapped_states=unmapped,
+        )
+        self.previous_time, self.previous_counters, self.previous_states = now, counters, states
+        return self.report
@@ -0,0 +1,107 @@
+"""
+End-to-end convergence benchmark for IPsecAgent against the swanctl simulator.
+
+For each scale it measures, on one box and without real peers:
+  time_to_all_connected - from the first apply until every child SA is installed
+  repair_time           - from dropping a share of the SAs until all are back
+  subprocess counts     - swanctl invocations per command for each phase
+
+The control loop is driven by IPsecAgent.step() with a short poll interval
+instead of the production CHECK_INTERVAL.
+
+Usage: python -m benchmarks.bench_convergence [--scales 1,10,100,1000] [--fail-ratio 0.1]
+       [--drop-ratio 0.1] [--latency 0.0] [--poll 0.05] [--output results.json]
+"""
+import argparse
+import json
+import logging
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from agent.core import IPsecAgent, AgentState
+from agent.platforms.linux import LinuxAgent
+from benchmarks.swanctl_sim import SwanctlSimulator
+from benchmarks.synthetic import synthetic_config
+
+
+def converge(agent: IPsecAgent, sim: SwanctlSimulator, expected: int, poll: float, timeout: float) -> dict:
+    """Runs control-loop iterations until the simulator reports every child installed."""
+    t0 = time.perf_counter()
+    iterations = 0
+    while len(sim.installed()) < expected:
+        if time.perf_counter() - t0 > timeout:
+            return {"seconds": None, "iterations": iterations, "converged": False}
+        agent.step()
+        iterations += 1
+        time.sleep(poll)
+    # One more pass so the agent observes the converged state
+    agent.step()
+    return {"seconds": time.perf_counter() - t0, "iterations": iterations, "converged": agent.state == AgentState.CONNECTED}
+
+
+def run_scale(connections: int, args, work_dir: Path) -> dict:
+    logger = logging.getLogger("benchmark")
+    config = synthetic_config(connections)
+
+    agent = IPsecAgent(str(work_dir / "config.json"))
+    agent.config = config
+    agent.logger = logger
+    agent.backend = LinuxAgent(config, work_dir, logger)
+    agent.backend.conf_dir = work_dir / "conf.d"
+    agent.backend.conf_dir.mkdir(exist_ok=True)
+
+    latency = {"initiate": args.latency, "load-all": args.latency, "list-sas": args.latency}
+    with SwanctlSimulator(work_dir / "sim", agent.backend.conf_dir, latency=latency,
+                          fail_ratio=args.fail_ratio, seed=connections) as sim:
+        t0 = time.perf_counter()
+        agent.apply_policy()
+        bring_up = converge(agent, sim, connections, args.poll, args.timeout)
+        if bring_up["seconds"] is not None:
+            bring_up["seconds"] = time.perf_counter() - t0
+        bring_up["calls"] = sim.call_counts()
+
+        sim.reset_counts()
+        dropped = sim.drop(ratio=args.drop_ratio, seed=connections)
+        repair = converge(agent, sim, connections, args.poll, args.timeout)
+        repair["dropped"] = len(dropped)
+        repair["calls"] = sim.call_counts()
+
+    result = {"connections": connections, "fail_ratio": args.fail_ratio,
+              "time_to_all_connected": bring_up, "repair": repair}
+    print(f"n={connections:<6} up={bring_up['seconds']}s repair={repair['seconds']}s "
+          f"dropped={len(dropped)} calls={bring_up['calls']} / {repair['calls']}", file=sys.stderr)
+    return result
+
+
+def main(argv=None) -> dict:
+    parser = argparse.ArgumentParser(description="Control-loop convergence benchmark against a simulated swanctl.")
+    parser.add_argument("--scales", default="1,10,100,1000")
+    parser.add_argument("--fail-ratio", type=float, default=0.1, help="Share of initiations that fail")
+    parser.add_argument("--drop-ratio", type=float, default=0.1, help="Share of SAs dropped before the repair phase")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to each swanctl call")
+    parser.add_argument("--poll", type=float, default=0.05, help="Seconds between control-loop iterations")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--output")
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.WARNING)
+    report = {"suite": "convergence", "results": []}
+    try:
+        for scale in [int(s) for s in args.scales.split(",")]:
+            with tempfile.TemporaryDirectory() as tmp:
+                report["results"].append(run_scale(scale, args, Path(tmp)))
+    finally:
+        logging.disable(logging.NOTSET)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
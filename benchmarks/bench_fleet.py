@@ -0,0 +1,164 @@
+"""
+Fleet scrape benchmark for agent.fleet against local stub agents.
+
+Starts N stub health APIs on localhost (HTTP/1.1 keep-alive, each answering
+/status with a generated report) and measures, at each scale:
+  cold_seconds  - first round: connect and scrape every agent
+  warm_seconds  - second round over the reused connections
+  hung_seconds  - a round in which hung_ratio of the agents accept but never answer;
+                  bounded by ceil(N / concurrency) * timeout
+and how many connections the scraper opened (N when every one is reused).
+
+Usage: python -m benchmarks.bench_fleet [--scales 10,100,1000] [--connections 50]
+       [--hung-ratio 0.1] [--latency 0.0] [--timeout 1.0] [--concurrency 256] [--output results.json]
+"""
+import argparse
+import asyncio
+import json
+import math
+import threading
+from pathlib import Path
+
+from agent.fleet import FleetScraper, Target, summarize
+
+
+def stub_status(index: int, connections: int) -> dict:
+    """A /status report; every 7th agent has a down tunnel, every 5th a lossy probe."""
+    names = [f"conn{i}" for i in range(connections)]
+    down = names[:1] if index % 7 == 0 else []
+    report = {
+        "status": "CONNECTED",
+        "agent_state": "DEGRADED" if down else "CONNECTED",
+        "last_check_seconds": 3.0,
+        "connections": {"CONNECTED": connections - len(down), **({"DISCONNECTED": len(down)} if down else {})},
+        "down": down,
+        "probes": {name: {"verdict": "healthy", "loss": 0.0, "rtt_p99_ms": 2.0 + i % 5} for i, name in enumerate(names[:5])},
+    }
+    if index % 5 == 0:
+        report["probes"]["conn1"].update(verdict="degraded", loss=0.2 + index % 3 / 10)
+    return report
+
+
+class StubAgents:
+    """N stub health APIs served from one background event loop."""
+
+    def __init__(self, count: int, connections: int = 50, hung: int = 0, latency: float = 0.0):
+        self.count = count
+        self.connections = connections
+        self.hung = set(range(count - hung, count))
+        self.latency = latency
+        self.accepted = 0
+        self.requests = 0
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.servers = []
+        self.ports: list[int] = []
+
+    def __enter__(self):
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result(60)
+        return self
+
+    def targets(self) -> list[Target]:
+        return [Target(f"agent{i}", "127.0.0.1", port) for i, port in enumerate(self.ports)]
+
+    async def _start(self):
+        for index in range(self.count):
+            body = json.dumps(stub_status(index, self.connections)).encode()
+            server = await asyncio.start_server(lambda r, w, i=index, b=body: self._serve(i, b, r, w), "127.0.0.1", 0)
+            self.servers.append(server)
+            self.ports.append(server.sockets[0].getsockname()[1])
+
+    async def _serve(self, index: int, body: bytes, reader, writer):
+        self.accepted += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                while line not in (b"\r\n", b"\n", b""):
+                    line = await reader.readline()
+                self.requests += 1
+                if index in self.hung:
+                    await reader.read()  # until the scraper gives up and closes
+                    return
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             b"Content-Length: %d\r\n\r\n" % len(body) + body)
+                await writer.drain()
+        except ConnectionError:
+            return
+        finally:
+            writer.close()
+
+    def __exit__(self, *exc):
+        async def stop():
+            for server in self.servers:
+                server.close()
+        asyncio.run_coroutine_threadsafe(stop(), self.loop).result(60)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(10)
+
+
+def run_scale(scale: int, args) -> dict:
+    hung = int(scale * args.hung_ratio)
+
+    async def rounds(agents: StubAgents) -> dict:
+        targets = agents.targets()
+        scraper = FleetScraper(targets, args.timeout, args.concurrency)
+        try:
+            cold = await scraper.scrape()
+            cold_seconds = scraper.last_duration
+            warm = await scraper.scrape()
+            warm_seconds = scraper.last_duration
+            opened = scraper.connections_opened
+        finally:
+            await scraper.close()
+        summary = summarize(warm, scrape_seconds=warm_seconds)
+
+        agents.hung = set(range(scale - hung, scale))
+        scraper = FleetScraper(targets, args.timeout, args.concurrency)
+        try:
+            await scraper.scrape()
+            hung_seconds = scraper.last_duration
+        finally:
+            await scraper.close()
+        return {
+            "agents": scale,
+            "cold_seconds": round(cold_seconds, 4),
+            "warm_seconds": round(warm_seconds, 4),
+            "connections_opened": opened,
+            "reachable": sum(r.report is not None for r in cold),
+            "worst_tunnel": summary["worst_tunnels"][0] if summary["worst_tunnels"] else None,
+            "hung_agents": hung,
+            "hung_seconds": round(hung_seconds, 4),
+            "hung_bound_seconds": math.ceil(scale / args.concurrency) * args.timeout,
+        }
+
+    with StubAgents(scale, args.connections, latency=args.latency) as agents:
+        return asyncio.run(rounds(agents))
+
+
+def main(argv=None) -> dict:
+    parser = argparse.ArgumentParser(description="Fleet scrape benchmark against local stub agents.")
+    parser.add_argument("--scales", default="10,100,1000")
+    parser.add_argument("--connections", type=int, default=50, help="Connections per stub agent")
+    parser.add_argument("--hung-ratio", type=float, default=0.1, help="Share of agents that never answer in the hung round")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds each stub takes to answer")
+    parser.add_argument("--timeout", type=float, default=1.0)
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--output")
+    args = parser.parse_args(argv)
+
+    report = {"suite": "fleet", "results": [run_scale(int(s), args) for s in args.scales.split(",")]}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
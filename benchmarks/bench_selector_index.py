@@ -0,0 +1,65 @@
+"""
+Benchmark for the traffic-selector overlap index (agent.traffic_selectors).
+
+Builds N synthetic selectors (default 50k) spread over a realistic mix of
+prefix lengths, with a small share of deliberately overlapping entries, then
+times find_conflicts. The naive pairwise check is timed on a sample and
+extrapolated to N for comparison.
+
+Usage: python -m benchmarks.bench_selector_index [count]
+"""
+import ipaddress
+import random
+import sys
+import time
+
+from agent.traffic_selectors import TrafficSelector, classify, find_conflicts
+
+
+def synthetic_selectors(count: int, overlap_ratio: float = 0.01, seed: int = 1) -> list[TrafficSelector]:
+    rnd = random.Random(seed)
+    selectors = []
+    for i in range(count):
+        # Unique /24 <=> /24 pairs, like per-site inventory data
+        local = ipaddress.IPv4Network((0x0A000000 + (i << 8), 24))
+        remote = ipaddress.IPv4Network((0xAC100000 + (rnd.randrange(1 << 16) << 8), 24))
+        proto = rnd.choice([None, 6, 17])
+        ports = rnd.choice([(0, 65535), (443, 443), (53, 53)]) if proto else (0, 65535)
+        selectors.append(TrafficSelector(f"conn{i}", local, remote, proto, (0, 65535), ports))
+
+    # Sprinkle aggregate connections that cover some of the /24s
+    for j in range(int(count * overlap_ratio)):
+        base = selectors[rnd.randrange(count)]
+        selectors.append(TrafficSelector(f"agg{j}", base.local.supernet(new_prefix=20), base.remote.supernet(new_prefix=16)))
+    return selectors
+
+
+def naive(selectors: list[TrafficSelector]) -> int:
+    found = 0
+    for i, a in enumerate(selectors):
+        for b in selectors[i + 1:]:
+            if a.connection != b.connection and classify(a, b):
+                found += 1
+    return found
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    selectors = synthetic_selectors(count)
+
+    t0 = time.perf_counter()
+    conflicts = find_conflicts(selectors)
+    indexed = time.perf_counter() - t0
+    print(f"indexed: {len(selectors)} selectors, {len(conflicts)} conflicts in {indexed:.3f}s")
+
+    sample = selectors[:1000]
+    t0 = time.perf_counter()
+    naive(sample)
+    sample_time = time.perf_counter() - t0
+    # Pairwise cost scales with n^2
+    projected = sample_time * (len(selectors) / len(sample)) ** 2
+    print(f"naive:   {len(sample)} selectors in {sample_time:.3f}s, projected {projected:.1f}s at {len(selectors)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Startup benchmark for the single-file zipapp built by scripts/pkg.py.
+
+Builds the zipapp into a scratch directory and measures:
+  interpreter_ms   - 'python -c pass', the floor no packaging can go below
+  import_ms        - importing agent.core and the Linux backend, from -X importtime
+                     (best of --runs), with the modules that cost the most themselves
+  first_apply_ms   - from spawning 'python ipsec-agent.pyz config.json' until the agent
+                     reports READY=1 (see agent.systemd) after its first apply, against
+                     the local swanctl simulator
+With --source, import_ms is also measured for the source tree, for comparison.
+Modules that should only be imported when used (YAML, the HTTP server, log
+rotation, other platforms' backends, argparse) are listed if found imported.
+
+Exits non-zero when import_ms or first_apply_ms is over its budget.
+
+Usage: python -m benchmarks.bench_startup [--connections 10] [--runs 5] [--import-budget-ms 250]
+       [--apply-budget-ms 3000] [--source] [--output results.json]
+"""
+import argparse
+import json
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.swanctl_sim import SwanctlSimulator
+from benchmarks.synthetic import synthetic_config_dict
+
+BASE_DIR = Path(__file__).parent.parent.resolve()
+STARTUP_MODULES = ("agent.core", "agent.platforms.linux")
+# Imported only when a config, or the platform, needs them
+LAZY_MODULES = ("yaml", "http.server", "logging.handlers", "argparse",
+                "agent.platforms.windows", "agent.platforms.macos", "agent.control", "agent.shards")
+
+
+def parse_importtime(text: str) -> list[dict]:
+    """Parses '-X importtime' output into [{module, self_us, cumulative_us, depth}] in import order."""
+    entries = []
+    for line in text.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        entries.append({"module": name.strip(), "self_us": int(self_us), "cumulative_us": int(cumulative_us),
+                        "depth": (len(name) - len(name.lstrip()) - 1) // 2})
+    return entries
+
+
+def _python(args: list[str], path_entry: Path, cwd: Path) -> subprocess.CompletedProcess:
+    env = {**os.environ, "PYTHONPATH": str(path_entry)}
+    return subprocess.run([sys.executable, *args], env=env, cwd=cwd, capture_output=True, text=True, timeout=60)
+
+
+def import_profile(path_entry: Path, runs: int, cwd: Path, top: int = 10) -> dict:
+    """Best of 'runs' cold imports of STARTUP_MODULES with path_entry (the zipapp or source tree) on sys.path."""
+    best = None
+    for _ in range(runs):
+        result = _python(["-X", "importtime", "-c", f"import {', '.join(STARTUP_MODULES)}"], path_entry, cwd)
+        if result.returncode != 0:
+            raise RuntimeError(f"import failed: {result.stderr.strip()[-500:]}")
+        entries = parse_importtime(result.stderr)
+        total = sum(e["cumulative_us"] for e in entries if e["depth"] == 0 and e["module"] in STARTUP_MODULES)
+        if best is None or total < best[0]:
+            best = (total, entries)
+    total, entries = best
+    imported = {e["module"] for e in entries}
+    return {
+        "import_ms": round(total / 1000, 2),
+        "modules": len(entries),
+        "top_imports": [{"module": e["module"], "self_ms": round(e["self_us"] / 1000, 2)}
+                        for e in sorted(entries, key=lambda e: -e["self_us"])[:top]],
+        "eager": [m for m in LAZY_MODULES if m in imported],
+    }
+
+
+def interpreter_ms(runs: int, cwd: Path) -> float:
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], cwd=cwd, check=True, timeout=60)
+        times.append(time.perf_counter() - t0)
+    return round(min(times) * 1000, 2)
+
+
+def first_apply_ms(pyz: Path, connections: int, timeout: float = 60) -> float:
+    """Spawns the zipapp from its own directory and times it to READY=1, read from a stand-in NOTIFY_SOCKET."""
+    work_dir = pyz.parent
+    config = work_dir / "config.json"
+    config.write_text(json.dumps(synthetic_config_dict(connections)))
+    notify_path = work_dir / "notify.sock"
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as notify, \
+            SwanctlSimulator(work_dir / "sim", work_dir / "output" / "swanctl"):
+        notify.bind(str(notify_path))
+        notify.settimeout(timeout)
+        env = {**os.environ, "NOTIFY_SOCKET": str(notify_path)}
+        env.pop("PYTHONPATH", None)
+        t0 = time.perf_counter()
+        process = subprocess.Popen([sys.executable, str(pyz), str(config)], cwd=work_dir, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while True:
+                message = notify.recv(4096).decode()
+                if message.startswith("READY=1"):
+                    elapsed = time.perf_counter() - t0
+                    break
+        except socket.timeout:
+            raise RuntimeError(f"no READY=1 within {timeout}s (exit code {process.poll()})")
+        finally:
+            process.send_signal(signal.SIGTERM)
+            try:
+                process.wait(30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+    notify_path.unlink(missing_ok=True)
+    return round(elapsed * 1000, 2)
+
+
+def main(argv=None) -> dict:
+    parser = argparse.ArgumentParser(description="Startup time of the zipapp: import breakdown and time to first apply.")
+    parser.add_argument("--connections", type=int, default=10)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget-ms", type=float, default=250)
+    parser.add_argument("--apply-budget-ms", type=float, default=3000)
+    parser.add_argument("--source", action="store_true", help="Also profile imports from the source tree")
+    parser.add_argument("--output")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, str(BASE_DIR / "scripts"))
+    from pkg import ZIPAPP_NAME, build_zipapp
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        pyz = build_zipapp(tmp / "app" / ZIPAPP_NAME)
+        report = {
+            "suite": "startup",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "parameters": {"connections": args.connections, "runs": args.runs},
+            "budget": {"import_ms": args.import_budget_ms, "first_apply_ms": args.apply_budget_ms},
+            "interpreter_ms": interpreter_ms(args.runs, tmp),
+            "zipapp": {"size_bytes": pyz.stat().st_size, **import_profile(pyz, args.runs, tmp)},
+        }
+        if args.source:
+            report["source"] = import_profile(BASE_DIR, args.runs, tmp)
+        report["zipapp"]["first_apply_ms"] = min(first_apply_ms(pyz, args.connections) for _ in range(max(1, args.runs // 2)))
+
+    over = []
+    if report["zipapp"]["import_ms"] > args.import_budget_ms:
+        over.append(f"import {report['zipapp']['import_ms']} ms > {args.import_budget_ms} ms")
+    if report["zipapp"]["first_apply_ms"] > args.apply_budget_ms:
+        over.append(f"first apply {report['zipapp']['first_apply_ms']} ms > {args.apply_budget_ms} ms")
+    report["over_budget"] = over
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    report = main()
+    for line in report["over_budget"]:
+        print(f"Over budget: {line}", file=sys.stderr)
+    sys.exit(1 if report["over_budget"] else 0)
@@ -0,0 +1,66 @@
+"""
+Benchmark for the streaming swanctl renderer (agent.swanctl).
+
+Renders N synthetic connections (default 20k) to a single file and to
+per-connection files, then changes one connection and renders again.
+Reports wall time, blocks rendered and the peak memory traced during each
+pass. The document is never built in memory, so warm passes stay small; the
+cold single-file pass includes filling the per-connection block cache.
+
+Usage: python -m benchmarks.bench_swanctl_render [count]
+"""
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from agent.swanctl import SwanctlRenderer
+from benchmarks.synthetic import synthetic_config
+
+
+def run_scenarios(out: Path, count: int, step):
+    config = synthetic_config(count, subnets=2)
+    renderer = SwanctlRenderer()
+    step("single file, cold", lambda: renderer.write_file(out / "agent.conf", config))
+    step("single file, warm", lambda: renderer.write_file(out / "agent.conf", config))
+    config.connections[count // 2].auth.value = "rotated"
+    step("single file, one change", lambda: renderer.write_file(out / "agent.conf", config))
+
+    per_conn = out / "conf.d"
+    per_conn.mkdir(exist_ok=True)
+    renderer = SwanctlRenderer()
+    step("per-connection, cold", lambda: renderer.write_dir(per_conn, config))
+    config.connections[0].auth.value = "rotated again"
+    step("per-connection, one change", lambda: renderer.write_dir(per_conn, config))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    # Timing and memory tracing run separately: tracemalloc slows every allocation down
+    results = {}
+
+    def time_step(label, fn):
+        t0 = time.perf_counter()
+        stats = fn()
+        results[label] = [time.perf_counter() - t0, stats, 0]
+
+    def trace_step(label, fn):
+        tracemalloc.start()
+        fn()
+        results[label][2] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    for step in (time_step, trace_step):
+        with tempfile.TemporaryDirectory() as tmp:
+            run_scenarios(Path(tmp), count, step)
+
+    print(f"{count} connections")
+    for label, (elapsed, stats, peak) in results.items():
+        print(f"{label:<28} {elapsed:8.3f}s  rendered={stats.rendered:<6} reused={stats.reused:<6} "
+              f"files={stats.files_written:<6} peak={peak / 1024:,.0f} KiB")
+
+
+if __name__ == "__main__":
+    main()
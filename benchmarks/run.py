@@ -0,0 +1,195 @@
+"""
+Benchmark suite for the agent's hot paths.
+
+Times, at each scale (number of connections):
+  load_config      - parse + validate a config.json from disk
+  validate         - AgentConfig.validate on an already parsed config
+  render_cold      - swanctl rendering with an empty block cache
+  render_warm      - swanctl rendering with every block cached
+  status_parse     - parse recorded 'swanctl --list-sas' output into connection states
+  health_api       - sequential GET /status requests against the health API
+  control_socket   - sequential 'status' requests over one control socket connection (ipsecctl)
+
+Results are written as JSON so runs can be compared across releases.
+
+Usage: python -m benchmarks.run [--scales 10,100,1000] [--subnets 2] [--repeat 3] [--output results.json]
+"""
+import argparse
+import datetime
+import io
+import json
+import logging
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+from agent.config_schema import AgentConfig, load_config
+from agent.core import IPsecAgent, AgentState
+from agent.platforms.linux import LinuxAgent
+from agent.swanctl import SwanctlRenderer, parse_list_sas, connection_states
+from benchmarks.synthetic import synthetic_config_dict, synthetic_list_sas
+
+BASE_DIR = Path(__file__).parent.parent.resolve()
+
+
+class RecordedLinuxAgent(LinuxAgent):
+    """Linux backend that answers status queries from recorded swanctl output."""
+
+    def __init__(self, config, base_dir, logger, list_sas_output: str):
+        super().__init__(config, base_dir, logger)
+        self.list_sas_output = list_sas_output
+
+    def _run_list_sas(self) -> str:
+        return self.list_sas_output
+
+
+def measure(fn, repeat: int) -> dict:
+    """Runs fn repeat times and returns min/median wall time in seconds."""
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return {"seconds": min(times), "median_seconds": statistics.median(times)}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def bench_health_api(config: AgentConfig, list_sas: str, work_dir: Path, requests: int) -> dict:
+    logger = logging.getLogger("benchmark")
+    config.api_port = free_port()
+    agent = IPsecAgent(str(work_dir / "config.json"))
+    agent.config = config
+    agent.logger = logger
+    agent.backend = RecordedLinuxAgent(config, work_dir, logger, list_sas)
+    agent.state = AgentState.CONNECTED
+    agent.start_health_api()
+
+    url = f"http://127.0.0.1:{config.api_port}/status"
+    deadline = time.time() + 5
+    while True:
+        try:
+            urllib.request.urlopen(url).read()
+            break
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+    t0 = time.perf_counter()
+    for _ in range(requests):
+        with urllib.request.urlopen(url) as resp:
+            resp.read()
+    elapsed = time.perf_counter() - t0
+    return {"seconds": elapsed, "requests": requests, "requests_per_sec": requests / elapsed}
+
+
+def bench_control_socket(config: AgentConfig, list_sas: str, work_dir: Path, requests: int) -> dict:
+    from agent.control import ControlClient, serve_control
+    logger = logging.getLogger("benchmark")
+    agent = IPsecAgent(str(work_dir / "config.json"), logger=logger)
+    agent.config = config
+    agent.backend = RecordedLinuxAgent(config, work_dir, logger, list_sas)
+    agent.connection_states = agent.backend.connection_status()
+    agent.state = AgentState.CONNECTED
+    server = serve_control(work_dir / "agent.sock", agent, logger)
+    try:
+        with ControlClient(work_dir / "agent.sock") as client:
+            client.request("status")
+            t0 = time.perf_counter()
+            for _ in range(requests):
+                client.request("status")
+            elapsed = time.perf_counter() - t0
+    finally:
+        server.stop()
+    return {"seconds": elapsed, "requests": requests, "requests_per_sec": requests / elapsed,
+            "round_trip_us": elapsed / requests * 1e6}
+
+
+def run_scale(connections: int, subnets: int, repeat: int, api_requests: int, work_dir: Path) -> list[dict]:
+    data = synthetic_config_dict(connections, subnets)
+    config_path = work_dir / "config.json"
+    config_path.write_text(json.dumps(data))
+
+    config = AgentConfig.from_dict(data)
+    list_sas = synthetic_list_sas(config, connected_ratio=0.9)
+
+    results = []
+
+    def record(name, result):
+        entry = {"name": name, "connections": connections, "subnets": subnets}
+        entry.update(result)
+        entry["per_connection_us"] = entry["seconds"] / connections * 1e6
+        results.append(entry)
+        print(f"{name:<14} n={connections:<7} {entry['seconds'] * 1000:10.2f} ms", file=sys.stderr)
+
+    record("load_config", measure(lambda: load_config(str(config_path)), repeat))
+    record("validate", measure(config.validate, repeat))
+    record("render_cold", measure(lambda: SwanctlRenderer().write(io.StringIO(), config), repeat))
+
+    warm = SwanctlRenderer()
+    warm.write(io.StringIO(), config)
+    record("render_warm", measure(lambda: warm.write(io.StringIO(), config), repeat))
+    record("status_parse", measure(lambda: connection_states(parse_list_sas(list_sas), config.connections), repeat))
+    record("health_api", bench_health_api(config, list_sas, work_dir, api_requests))
+    if hasattr(socket, "AF_UNIX"):
+        record("control_socket", bench_control_socket(config, list_sas, work_dir, api_requests))
+    return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                              capture_output=True, text=True, timeout=5).stdout.strip()
+    except Exception:
+        return ""
+
+
+def main(argv=None) -> dict:
+    parser = argparse.ArgumentParser(description="Benchmark the agent's hot paths with synthetic configs.")
+    parser.add_argument("--scales", default="10,100,1000", help="Comma separated connection counts")
+    parser.add_argument("--subnets", type=int, default=2, help="Subnets per side per connection")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--api-requests", type=int, default=200)
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    # Keep backend chatter out of the timings
+    logging.disable(logging.WARNING)
+
+    report = {
+        "suite": "agent-hot-paths",
+        "revision": git_revision(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {"subnets": args.subnets, "repeat": args.repeat, "api_requests": args.api_requests},
+        "results": [],
+    }
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for scale in [int(s) for s in args.scales.split(",")]:
+                report["results"].extend(run_scale(scale, args.subnets, args.repeat, args.api_requests, Path(tmp)))
+    finally:
+        logging.disable(logging.NOTSET)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+"""
+Local charon/swanctl simulator for convergence tests and benchmarks.
+
+SwanctlSimulator puts a fake 'swanctl' executable first on PATH. The fake
+keeps simulated SA state in a JSON file and understands the subset of the
+CLI the agent uses:
+
+  --load-all                 load connections from the agent's conf.d files
+  --initiate --child NAME    bring a child SA up (may fail, see fail_ratio)
+  --install --child NAME     install a child's trap policy (on-demand)
+  --terminate --child/--ike  take an SA down
+  --list-sas                 print SAs in the real text format
+  --list-pols --trap         print trap policies
+  --version
+
+Per-command latency, the share of failing initiations, an establishment
+delay and scheduled SA drops are configurable. Every invocation is counted.
+Traffic hitting a trap is simulated with SwanctlSimulator.traffic().
+
+The agent only talks to charon through the swanctl CLI, so no VICI socket
+stand-in is needed.
+
+This module is imported by the fake executable on every call and therefore
+only depends on the standard library.
+"""
+import fcntl
+import json
+import os
+import random
+import re
+import stat
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+STATE_FILE = "state.json"
+
+
+def _child_id(name: str) -> int:
+    return sum(name.encode()) % 0xFFFF
+
+
+def parse_conf_children(text: str, traps: Optional[dict] = None) -> dict[str, list[str]]:
+    """
+    Returns {connection: [child, ...]} from swanctl.conf-style text. Children
+    with 'start_action = trap' are added to traps as {child: connection}.
+    """
+    result = {}
+    path = []
+    for raw in text.splitlines():
+        line = raw.split("#", 1)[0].strip()
+        if not line:
+            continue
+        if line.endswith("{"):
+            path.append(line[:-1].strip())
+            if len(path) == 2 and path[0] == "connections":
+                result.setdefault(path[1], [])
+            elif len(path) == 4 and path[0] == "connections" and path[2] == "children":
+                result[path[1]].append(path[3])
+        elif line == "}":
+            if path:
+                path.pop()
+        elif traps is not None and len(path) == 4 and line.replace(" ", "") == "start_action=trap":
+            traps[path[3]] = path[1]
+    return result
+
+
+@contextmanager
+def _locked_state(state_dir: Path):
+    """Loads the simulator state under an exclusive lock and writes it back."""
+    with open(state_dir / "state.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        path = state_dir / STATE_FILE
+        state = json.loads(path.read_text())
+        yield state
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(state))
+        os.replace(tmp, path)
+
+
+def _apply_drops(state: dict, now: float):
+    pending = []
+    for drop in state["drops"]:
+        if drop["at"] > now:
+            pending.append(drop)
+            continue
+        children = drop.get("children") or list(state["sas"])
+        if drop.get("ratio") is not None:
+            rnd = random.Random(drop.get("seed", 0))
+            children = [c for c in sorted(children) if rnd.random() < drop["ratio"]]
+        for child in children:
+            state["sas"].pop(child, None)
+    state["drops"] = pending
+
+
+def _format_sas(state: dict, now: float) -> str:
+    lines = []
+    for n, (child, sa) in enumerate(sorted(state["sas"].items()), start=1):
+        conn = sa["connection"]
+        if sa["installed_at"] > now:
+            lines.append(f"{conn}: #{sa['uid']}, CONNECTING, IKEv2, {sa['uid']:016x}_i* 0000000000000000_r")
+            lines.append("  local  '%any' @ 127.0.0.1[500]")
+            lines.append("  remote '%any' @ 127.0.0.2[500]")
+            continue
+        age = int(now - sa["installed_at"])
+        spi = _child_id(child)
+        lines.append(f"{conn}: #{sa['uid']}, ESTABLISHED, IKEv2, {sa['uid']:016x}_i* {sa['uid'] * 7919:016x}_r")
+        lines.append("  local  '127.0.0.1' @ 127.0.0.1[4500]")
+        lines.append("  remote '127.0.0.2' @ 127.0.0.2[4500]")
+        lines.append("  AES_GCM_16-256/PRF_HMAC_SHA2_256/ECP_256")
+        lines.append(f"  established {age}s ago, rekeying in {max(0, 14400 - age)}s")
+        lines.append(f"  {child}: #{sa['uid']}, reqid {sa['uid']}, INSTALLED, TUNNEL, ESP:AES_GCM_16-256")
+        lines.append(f"    installed {age}s ago, rekeying in {max(0, 3600 - age)}s, expires in {max(0, 3960 - age)}s")
+        lines.append(f"    in  c{sa['uid']:07x},      0 bytes,     0 packets")
+        lines.append(f"    out d{sa['uid']:07x},      0 bytes,     0 packets")
+    return "\n".join(lines) + ("\n" if lines else "")
+
+
+def main(argv: list[str], state_dir: str) -> int:
+    state_dir = Path(state_dir)
+    command = next((a for a in argv if a.startswith("--") and a not in ("--child", "--ike")), "")
+    now = time.time()
+
+    with _locked_state(state_dir) as state:
+        state["calls"][command] = state["calls"].get(command, 0) + 1
+        _apply_drops(state, now)
+        cfg = state["config"]
+        latency = cfg["latency"].get(command.lstrip("-"), 0.0)
+
+        if command == "--load-all":
+            loaded, traps = {}, {}
+            conf_dir = Path(cfg["conf_dir"])
+            for path in sorted(conf_dir.glob("*.conf")):
+                loaded.update(parse_conf_children(path.read_text(), traps))
+            state["loaded"] = loaded
+            state["traps"].update(traps)
+            # SAs and traps of unloaded connections are closed
+            for child, sa in list(state["sas"].items()):
+                if child not in loaded.get(sa["connection"], []):
+                    del state["sas"][child]
+            for child, conn in list(state["traps"].items()):
+                if child not in loaded.get(conn, []):
+                    del state["traps"][child]
+            out, rc = f"loaded {len(loaded)} connections\n", 0
+
+        elif command == "--initiate":
+            child = argv[argv.index("--child") + 1] if "--child" in argv else ""
+            conn = next((c for c, children in state["loaded"].items() if child in children), None)
+            state["next_id"] += 1
+            rnd = random.Random(f"{cfg['seed']}:{state['next_id']}")
+            if conn is None:
+                out, rc = f"initiate failed: CHILD_SA config '{child}' not found\n", 1
+            elif rnd.random() < cfg["fail_ratio"]:
+                out, rc = f"[IKE] giving up after 5 retransmits\ninitiate failed: establishing CHILD_SA '{child}' failed\n", 1
+            else:
+                state["sas"][child] = {"connection": conn, "uid": state["next_id"],
+                                       "installed_at": now + cfg["establish_delay"]}
+                out, rc = "initiate completed successfully\n", 0
+
+        elif command == "--install":
+            child = argv[argv.index("--child") + 1] if "--child" in argv else ""
+            conn = next((c for c, children in state["loaded"].items() if child in children), None)
+            if conn is None:
+                out, rc = f"install failed: CHILD_SA config '{child}' not found\n", 1
+            else:
+                state["traps"][child] = conn
+                out, rc = "install completed successfully\n", 0
+
+        elif command == "--uninstall":
+            child = argv[argv.index("--child") + 1] if "--child" in argv else ""
+            if state["traps"].pop(child, None) is None:
+                out, rc = f"uninstall failed: policy '{child}' not found\n", 1
+            else:
+                out, rc = "uninstall completed successfully\n", 0
+
+        elif command == "--terminate":
+            if "--child" in argv:
+                state["sas"].pop(argv[argv.index("--child") + 1], None)
+            elif "--ike" in argv:
+                ike = argv[argv.index("--ike") + 1]
+                for child in [c for c, sa in state["sas"].items() if sa["connection"] == ike]:
+                    del state["sas"][child]
+            out, rc = "terminate completed successfully\n", 0
+
+        elif command == "--list-sas":
+            out, rc = _format_sas(state, now), 0
+
+        elif command == "--list-pols":
+            out, rc = "".join(f"{conn}/{child}, TUNNEL\n  local:  dynamic\n  remote: dynamic\n"
+                              for child, conn in sorted(state["traps"].items())), 0
+
+        elif command == "--version":
+            out, rc = "strongSwan swanctl 5.9.13 (simulated)\n", 0
+
+        else:
+            out, rc = f"unknown command: {command}\n", 1
+
+    if latency:
+        time.sleep(latency)
+    sys.stdout.write(out)
+    return rc
+
+
+class SwanctlSimulator:
+    """
+    Test harness around the fake swanctl executable.
+
+    Use as a context manager: PATH is prepended with the fake while active.
+    """
+
+    def __init__(self, work_dir: Path, conf_dir: Path, latency: Optional[dict] = None,
+                 fail_ratio: float = 0.0, establish_delay: float = 0.0, seed: int = 0):
+        self.work_dir = Path(work_dir)
+        self.bin_dir = self.work_dir / "bin"
+        self.conf_dir = Path(conf_dir)
+        self.config = {
+            "conf_dir": str(self.conf_dir),
+            "latency": latency or {},
+            "fail_ratio": fail_ratio,
+            "establish_delay": establish_delay,
+            "seed": seed,
+        }
+        self._old_path = None
+
+    def install(self):
+        self.bin_dir.mkdir(parents=True, exist_ok=True)
+        (self.work_dir / STATE_FILE).write_text(json.dumps({
+            "config": self.config, "loaded": {}, "sas": {}, "traps": {}, "drops": [], "next_id": 0, "calls": {}
+        }))
+        repo_root = Path(__file__).parent.parent.resolve()
+        shim = self.bin_dir / "swanctl"
+        # -S skips site initialisation; the fake only needs the standard library
+        shim.write_text(
+            f"#!{sys.executable} -S\n"
+            f"import sys\n"
+            f"sys.path.insert(0, {str(repo_root)!r})\n"
+            f"from benchmarks.swanctl_sim import main\n"
+            f"sys.exit(main(sys.argv[1:], {str(self.work_dir)!r}))\n"
+        )
+        shim.chmod(shim.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+        self._old_path = os.environ.get("PATH", "")
+        os.environ["PATH"] = f"{self.bin_dir}{os.pathsep}{self._old_path}"
+
+    def uninstall(self):
+        if self._old_path is not None:
+            os.environ["PATH"] = self._old_path
+            self._old_path = None
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *exc):
+        self.uninstall()
+
+    def configure(self, **changes):
+        """Changes fail_ratio, establish_delay, latency or seed while installed."""
+        self.config.update(changes)
+        self._update(lambda s: s["config"].update(changes))
+
+    def _update(self, fn):
+        with _locked_state(self.work_dir) as state:
+            return fn(state)
+
+    def state(self) -> dict:
+        return json.loads((self.work_dir / STATE_FILE).read_text())
+
+    def installed(self) -> set[str]:
+        """Child SAs that are currently installed."""
+        now = time.time()
+        state = self.state()
+        _apply_drops(state, now)
+        return {c for c, sa in state["sas"].items() if sa["installed_at"] <= now}
+
+    def loaded_children(self) -> set[str]:
+        return {c for children in self.state()["loaded"].values() for c in children}
+
+    def call_counts(self) -> dict[str, int]:
+        return dict(self.state()["calls"])
+
+    def reset_counts(self):
+        self._update(lambda s: s.update(calls={}))
+
+    def trapped(self) -> set[str]:
+        return set(self.state()["traps"])
+
+    def traffic(self, children: list[str]) -> set[str]:
+        """Packets hit the traps of these children; returns the children whose SA came up."""
+        def acquire(state):
+            started = set()
+            for child in children:
+                if child in state["traps"] and child not in state["sas"]:
+                    state["next_id"] += 1
+                    state["sas"][child] = {"connection": state["traps"][child], "uid": state["next_id"],
+                                           "installed_at": time.time() + state["config"]["establish_delay"]}
+                    started.add(child)
+            return started
+        return self._update(acquire)
+
+    def schedule_drop(self, after: float, children: Optional[list[str]] = None,
+                      ratio: Optional[float] = None, seed: int = 0):
+        """Drops the given children (or a random share of all SAs) 'after' seconds from now."""
+        drop = {"at": time.time() + after, "children": children, "ratio": ratio, "seed": seed}
+        self._update(lambda s: s["drops"].append(drop))
+
+    def drop(self, children: Optional[list[str]] = None, ratio: Optional[float] = None, seed: int = 0) -> set[str]:
+        """Drops SAs immediately and returns the children that went down."""
+        before = self.installed()
+        self.schedule_drop(0, children, ratio, seed)
+        return before - self.installed()
@@ -0,0 +1,87 @@
+"""
+Synthetic configuration and swanctl output generator for benchmarks.
+
+Every connection gets unique, non-overlapping local (/26 out of 10.0.0.0/8)
+and remote (/28 out of 100.64.0.0/10) subnets, so generated configs pass
+validation without selector conflicts. Protocols and ports rotate through a
+fixed mix.
+"""
+import ipaddress
+import random
+
+from agent.config_schema import AgentConfig
+from agent.swanctl import child_name
+
+# (protocol, local_port, remote_port)
+SELECTOR_MIX = [
+    ("any", "any", "any"),
+    ("tcp", "any", "443"),
+    ("udp", "any", "53"),
+    ("tcp", "any", "any"),
+    ("icmp", "any", "any"),
+]
+
+LOCAL_POOL = ipaddress.IPv4Network("10.0.0.0/8")
+REMOTE_POOL = ipaddress.IPv4Network("100.64.0.0/10")
+
+
+def _subnet(pool: ipaddress.IPv4Network, index: int, prefixlen: int) -> str:
+    size = 1 << (32 - prefixlen)
+    if (index + 1) * size > pool.num_addresses:
+        raise ValueError(f"Synthetic address pool {pool} exhausted at index {index}")
+    return f"{pool.network_address + index * size}/{prefixlen}"
+
+
+def synthetic_config_dict(connections: int, subnets: int = 1) -> dict:
+    """Builds a config.json-style dict with N connections and M subnets per side."""
+    conns = []
+    for i in range(connections):
+        proto, lport, rport = SELECTOR_MIX[i % len(SELECTOR_MIX)]
+        conns.append({
+            "name": f"conn{i}",
+            "mode": "tunnel" if i % 2 == 0 else "transport",
+            "ike_version": "ikev2",
+            "auth": {"type": "psk", "value": f"synthetic-key-{i}"},
+            "encryption": {"ike": "default", "esp": "default"},
+            "local_subnets": [_subnet(LOCAL_POOL, i * subnets + j, 26) for j in range(subnets)],
+            "remote_subnets": [_subnet(REMOTE_POOL, i * subnets + j, 28) for j in range(subnets)],
+            "protocol": proto,
+            "local_port": lport,
+            "remote_port": rport,
+            "lifetime": {"sa_minutes": 60},
+        })
+    return {"connections": conns, "logging": "info"}
+
+
+def synthetic_config(connections: int, subnets: int = 1) -> AgentConfig:
+    return AgentConfig.from_dict(synthetic_config_dict(connections, subnets))
+
+
+def synthetic_list_sas(config: AgentConfig, connected_ratio: float = 1.0, seed: int = 0) -> str:
+    """
+    Renders 'swanctl --list-sas' text output for the config, with roughly
+    connected_ratio of the connections established and installed.
+    """
+    rnd = random.Random(seed)
+    lines = []
+    for n, conn in enumerate(config.connections, start=1):
+        local_ip = conn.local_subnets[0].split('/')[0]
+        remote_ip = conn.remote_subnets[0].split('/')[0]
+        if rnd.random() >= connected_ratio:
+            lines.append(f"{conn.name}: #{n}, CONNECTING, IKEv2, {n:016x}_i* 0000000000000000_r")
+            lines.append(f"  local  '{local_ip}' @ {local_ip}[500]")
+            lines.append(f"  remote '%any' @ {remote_ip}[500]")
+            lines.append("  queued:  IKE_SA_INIT")
+            continue
+        lines.append(f"{conn.name}: #{n}, ESTABLISHED, IKEv2, {n:016x}_i* {n * 7919:016x}_r")
+        lines.append(f"  local  '{local_ip}' @ {local_ip}[4500]")
+        lines.append(f"  remote '{remote_ip}' @ {remote_ip}[4500]")
+        lines.append("  AES_CBC-256/HMAC_SHA2_256_128/PRF_HMAC_SHA2_256/MODP_2048")
+        lines.append(f"  established {rnd.randrange(3600)}s ago, rekeying in {rnd.randrange(14400)}s")
+        lines.append(f"  {child_name(conn)}: #{n}, reqid {n}, INSTALLED, {conn.mode.upper()}, ESP:AES_CBC-256/HMAC_SHA2_256_128")
+        lines.append(f"    installed {rnd.randrange(3600)}s ago, rekeying in {rnd.randrange(3600)}s, expires in 3960s")
+        lines.append(f"    in  {0xc0000000 + n:08x}, {rnd.randrange(10 ** 9):>10} bytes, {rnd.randrange(10 ** 6):>7} packets")
+        lines.append(f"    out {0xd0000000 + n:08x}, {rnd.randrange(10 ** 9):>10} bytes, {rnd.randrange(10 ** 6):>7} packets")
+        lines.append(f"    local  {' '.join(conn.local_subnets)}")
+        lines.append(f"    remote {' '.join(conn.remote_subnets)}")
+    return "\n".join(lines) + "\n"
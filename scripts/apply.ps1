@@ -35,7 +35,11 @@ param (
     # Crypto Params (Defaults to Suite B-ish)
     [string]$Encryption = "AES256",
     [string]$Hash = "SHA256",
-    [string]$DHGroup = "DH14"
+    [string]$DHGroup = "DH14",
+
+    # Quick Mode (ESP) crypto; defaults to the Main Mode Encryption/Hash
+    [string]$QMEncryption = "",
+    [string]$QMHash = ""
 )
 
 $ErrorActionPreference = "Stop"
@@ -75,7 +79,7 @@ try {
     Write-Host "Creating Quick Mode Crypto Set..."
     $qmSet = New-NetIPsecQuickModeCryptoSet -DisplayName $QMCryptoSetName `
         -Group $GroupName `
-        -Proposal (New-NetIPsecQuickModeCryptoProposal -Encapsulation ESP -Encryption $Encryption -ESPHash $Hash)
+        -Proposal (New-NetIPsecQuickModeCryptoProposal -Encapsulation ESP -Encryption $(if ($QMEncryption) { $QMEncryption } else { $Encryption }) -ESPHash $(if ($QMHash) { $QMHash } else { $Hash }))
 
     # 4. Create Phase 1 Auth Set (PSK)
     Write-Host "Creating Phase 1 Auth Set..."
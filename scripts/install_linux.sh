@@ -25,29 +25,55 @@ else
 fi
 
 AGENT_DIR="/opt/unified-ipsec-agent"
+# Set CONFIG_URL to pull the config from a config server instead of installing config.json
+CONFIG_URL="${CONFIG_URL:-}"
 SERVICE_FILE="/etc/systemd/system/unified-ipsec-agent.service"
+# Seconds the control loop may go without a watchdog ping before systemd restarts the agent
+WATCHDOG_SEC="${WATCHDOG_SEC:-120}"
+# Seconds the first apply may take before systemd gives up on the start
+START_TIMEOUT_SEC="${START_TIMEOUT_SEC:-300}"
 
 echo "Installing Agent to $AGENT_DIR..."
 mkdir -p "$AGENT_DIR"
 cp -r ../agent "$AGENT_DIR/"
-cp ../config.json "$AGENT_DIR/"
+if [ -n "$CONFIG_URL" ]; then
+    CONFIG_ARG="$CONFIG_URL"
+    NETWORK_TARGET="network-online.target"
+else
+    cp ../config.json "$AGENT_DIR/"
+    CONFIG_ARG="config.json"
+    NETWORK_TARGET="network.target"
+fi
 cp ../*.py "$AGENT_DIR/"
 
 echo "Setting up Python Environment..."
 python3 -m venv "$AGENT_DIR/venv"
 "$AGENT_DIR/venv/bin/pip" install pyyaml
 
+echo "Installing ipsecctl..."
+cat > /usr/local/bin/ipsecctl <<EOF
+#!/bin/sh
+PYTHONPATH="$AGENT_DIR" exec "$AGENT_DIR/venv/bin/python" -m agent.control "\$@"
+EOF
+chmod 755 /usr/local/bin/ipsecctl
+
 echo "Creating Systemd Service..."
 cat > "$SERVICE_FILE" <<EOF
 [Unit]
 Description=Unified Cross-Platform IPsec Agent
-After=network.target strongswan.service
+After=$NETWORK_TARGET strongswan.service
+Wants=$NETWORK_TARGET
 
 [Service]
-Type=simple
+# The agent reports READY=1 after its first apply and pings the watchdog from its control loop
+Type=notify
+NotifyAccess=main
+WatchdogSec=$WATCHDOG_SEC
+TimeoutStartSec=$START_TIMEOUT_SEC
 User=root
 WorkingDirectory=$AGENT_DIR
-ExecStart=$AGENT_DIR/venv/bin/python -m agent.core config.json
+ExecStart=$AGENT_DIR/venv/bin/python -m agent.core $CONFIG_ARG
+ExecReload=/bin/kill -HUP \$MAINPID
 Restart=always
 RestartSec=5
 
@@ -42,6 +42,13 @@ echo "Setting up Python Environment..."
 python3 -m venv "$AGENT_DIR/venv"
 "$AGENT_DIR/venv/bin/pip" install pyyaml
 
+echo "Installing ipsecctl..."
+cat > /usr/local/bin/ipsecctl <<EOF
+#!/bin/sh
+PYTHONPATH="$AGENT_DIR" exec "$AGENT_DIR/venv/bin/python" -m agent.control "\$@"
+EOF
+chmod 755 /usr/local/bin/ipsecctl
+
 echo "Installing LaunchDaemon..."
 cp com.unified.ipsec.agent.plist "$PLIST_DEST"
 chmod 644 "$PLIST_DEST"
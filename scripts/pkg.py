@@ -1,18 +1,45 @@
+"""
+Packages the agent into dist/:
+
+  unified-ipsec-agent-<date>.zip  the source tree, for the installers
+  ipsec-agent.pyz                 a single-file zipapp: python3 ipsec-agent.pyz <config>
+
+The zipapp holds the agent package (and PyYAML's pure-Python code, if
+installed here) with precompiled bytecode next to each source file, so a cold
+start does not compile anything. The .pyc files are UNCHECKED_HASH: they are
+used as they are, without stat()ing or hashing the source, which zip entry
+timestamps could not be trusted for anyway. The shebang pins the Python
+minor version the bytecode was built for; another version falls back to the
+sources. The entry point is agent.core:main, and the agent directory (logs,
+journal, control socket) is the one holding the .pyz.
+
+Usage: python scripts/pkg.py [--zipapp-only] [--output-dir DIR] [--python INTERPRETER]
+"""
+import argparse
+import importlib.util
+import py_compile
 import shutil
-import os
+import sys
+import tempfile
+import zipapp
 from pathlib import Path
 import datetime
 
-def package_agent():
-    base_dir = Path(__file__).parent.parent.resolve()
-    dist_dir = base_dir / "dist"
+BASE_DIR = Path(__file__).parent.parent.resolve()
+ZIPAPP_NAME = "ipsec-agent.pyz"
+# Pinned to the minor version whose bytecode is inside
+DEFAULT_INTERPRETER = f"/usr/bin/env python{sys.version_info.major}.{sys.version_info.minor}"
+ENTRY_POINT = "import sys\nfrom agent.core import main\nsys.exit(main())\n"
+
+def package_agent(dist_dir: Path = BASE_DIR / "dist"):
+    base_dir = BASE_DIR
     version = datetime.datetime.now().strftime("%Y%m%d")
     archive_name = dist_dir / f"unified-ipsec-agent-{version}"
-    
+
     if dist_dir.exists():
         shutil.rmtree(dist_dir)
     dist_dir.mkdir()
-    
+
     # Files to include
     includes = [
         "agent",
@@ -21,11 +48,11 @@ def package_agent():
         "README.md",
         "requirements.txt" # if exists, or create one
     ]
-    
+
     # Create temp dir for zip structure
     temp_dir = dist_dir / "temp"
     temp_dir.mkdir()
-    
+
     for item in includes:
         src = base_dir / item
         dst = temp_dir / item
@@ -33,14 +60,58 @@ def package_agent():
             shutil.copytree(src, dst, ignore=shutil.ignore_patterns("__pycache__", "*.pyc", "output", "dist"))
         elif src.exists():
             shutil.copy2(src, dst)
-            
+
     # Create Zip
     shutil.make_archive(str(archive_name), 'zip', temp_dir)
-    
+
     # Cleanup temp
     shutil.rmtree(temp_dir)
-    
+
     print(f"Package created at: {archive_name}.zip")
 
+def _yaml_package():
+    """PyYAML's package directory when it is installed as files (not itself zipped), else None."""
+    spec = importlib.util.find_spec("yaml")
+    if spec is None or not spec.submodule_search_locations:
+        return None
+    path = Path(list(spec.submodule_search_locations)[0])
+    return path if path.is_dir() else None
+
+def compile_tree(root: Path):
+    """Compiles every .py under root to a .pyc beside it, where zipimport looks for it."""
+    for source in sorted(root.rglob("*.py")):
+        py_compile.compile(str(source), cfile=str(source.with_suffix(".pyc")),
+                           dfile=source.relative_to(root).as_posix(), doraise=True,
+                           invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+
+def build_zipapp(output: Path, interpreter: str = DEFAULT_INTERPRETER, with_yaml: bool = True) -> Path:
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        stage = Path(tmp) / "app"
+        shutil.copytree(BASE_DIR / "agent", stage / "agent", ignore=shutil.ignore_patterns("__pycache__", "*.pyc"))
+        yaml_dir = _yaml_package() if with_yaml else None
+        if yaml_dir:
+            # The libyaml extension cannot be loaded from a zip; PyYAML falls back to its Python parser
+            shutil.copytree(yaml_dir, stage / "yaml", ignore=shutil.ignore_patterns("__pycache__", "*.pyc", "*.so", "*.pyd"))
+        (stage / "__main__.py").write_text(ENTRY_POINT)
+        compile_tree(stage)
+        # Stored, not deflated: nothing to inflate on import
+        zipapp.create_archive(stage, output, interpreter=interpreter)
+    print(f"Zipapp created at: {output}")
+    return output
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Package the agent as a source archive and a single-file zipapp.")
+    parser.add_argument("--output-dir", type=Path, default=BASE_DIR / "dist")
+    parser.add_argument("--zipapp-only", action="store_true", help="Only build the zipapp (keeps the rest of the output dir)")
+    parser.add_argument("--python", default=DEFAULT_INTERPRETER, help=f"Interpreter for the zipapp's shebang (default: {DEFAULT_INTERPRETER})")
+    parser.add_argument("--no-yaml", action="store_true", help="Leave PyYAML out of the zipapp")
+    args = parser.parse_args(argv)
+    if not args.zipapp_only:
+        package_agent(args.output_dir)
+    build_zipapp(args.output_dir / ZIPAPP_NAME, args.python, with_yaml=not args.no_yaml)
+    return 0
+
 if __name__ == "__main__":
-    package_agent()
+    sys.exit(main())
@@ -30,7 +30,7 @@ class IPsecService(win32serviceutil.ServiceFramework):
         win32event.SetEvent(self.stop_event)
         self.running = False
         if self.agent:
-            pass
+            self.agent.stop()
 
     def SvcDoRun(self):
         servicemanager.LogMsg(
@@ -49,7 +49,7 @@ class IPsecService(win32serviceutil.ServiceFramework):
             
             # Run the agent logic.
             self.agent.load_configuration()
-            self.agent.apply_policy()
+            self.agent.start()
             
             while self.running:
                 # check stop event
@@ -83,7 +83,7 @@ class IPsecService(win32serviceutil.ServiceFramework):
                     # Log error to service log
                     servicemanager.LogInfoMsg(f"Agent Loop Error: {e}")
             
-            self.agent.cleanup()
+            self.agent.shutdown()
             
         except Exception as e:
             servicemanager.LogErrorMsg(f"Service Fatal Error: {e}")
@@ -0,0 +1,36 @@
+import json
+import os
+import unittest
+from agent.config_schema import AgentConfig, load_config
+from agent.swanctl import parse_list_sas, connection_states
+from benchmarks.synthetic import synthetic_config_dict, synthetic_list_sas
+from benchmarks import run
+
+class TestSyntheticConfig(unittest.TestCase):
+    def test_generated_config_is_valid(self):
+        data = synthetic_config_dict(50, subnets=3)
+        config = AgentConfig.from_dict(data)
+        config.validate()
+        self.assertEqual(len(config.connections), 50)
+        self.assertEqual(len(config.connections[7].local_subnets), 3)
+        self.assertEqual(config.selector_conflicts, [])
+        self.assertEqual({c.protocol for c in config.connections}, {"any", "tcp", "udp", "icmp"})
+
+    def test_recorded_status_roundtrip(self):
+        config = AgentConfig.from_dict(synthetic_config_dict(40))
+        states = connection_states(parse_list_sas(synthetic_list_sas(config, connected_ratio=1.0)), config.connections)
+        self.assertEqual(set(states.values()), {"CONNECTED"})
+
+class TestBenchmarkSuite(unittest.TestCase):
+    def test_suite_emits_json(self):
+        report = run.main(["--scales", "3", "--repeat", "1", "--api-requests", "2", "--output", "test_bench.json"])
+        try:
+            with open("test_bench.json") as f:
+                self.assertEqual(json.load(f), report)
+        finally:
+            os.remove("test_bench.json")
+        names = {r["name"] for r in report["results"]}
+        self.assertEqual(names, {"load_config", "validate", "render_cold", "render_warm", "status_parse", "health_api", "control_socket"})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,253 @@
+import hashlib
+import http.server
+import json
+import logging
+import random
+import shutil
+import stat
+import threading
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+from agent.config_schema import HAS_YAML
+from agent.config_source import RemoteConfigSource, CACHE_FILE, RETRY_DELAY
+from agent.core import IPsecAgent
+from agent.simulation import Scenario, simulate
+from benchmarks.synthetic import synthetic_config_dict
+
+LAST_MODIFIED = "Mon, 19 Oct 2026 08:00:00 GMT"
+
+class ConfigServer:
+    """Stand-in config server: serves one document with an ETag (or only Last-Modified) and answers 304s."""
+    def __init__(self):
+        self.document = json.dumps(synthetic_config_dict(2))
+        self.content_type = "application/json"
+        self.use_etag = True
+        self.fail = False
+        self.requests: list[dict] = []
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append(dict(self.headers))
+                if server.fail:
+                    self.send_error(503)
+                    return
+                etag = '"%s"' % hashlib.sha256(server.document.encode()).hexdigest()[:16]
+                if (self.headers.get("If-None-Match") == etag if server.use_etag
+                        else self.headers.get("If-Modified-Since") == LAST_MODIFIED):
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                body = server.document.encode()
+                self.send_response(200)
+                self.send_header("Content-Type", server.content_type)
+                self.send_header("Content-Length", str(len(body)))
+                if server.use_etag:
+                    self.send_header("ETag", etag)
+                else:
+                    self.send_header("Last-Modified", LAST_MODIFIED)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                return
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/agents/edge1/config"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def serve(self, data: dict):
+        self.document = json.dumps(data)
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class ConfigServerCase(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = Path("test_output_config_source").resolve()
+        self.work_dir.mkdir(exist_ok=True)
+        self.cache = self.work_dir / CACHE_FILE
+        self.logger = logging.getLogger("TestConfigSource")
+        self.logger.setLevel(logging.CRITICAL)
+        self.server = ConfigServer()
+        self.addCleanup(self.server.close)
+
+    def tearDown(self):
+        if self.work_dir.exists():
+            shutil.rmtree(self.work_dir)
+
+    def source(self, seed: int = 0) -> RemoteConfigSource:
+        return RemoteConfigSource(self.server.url, self.cache, self.logger, rng=random.Random(seed), timeout=5)
+
+class TestRemoteConfigSource(ConfigServerCase):
+    def test_conditional_polling(self):
+        source = self.source()
+        config = source.load(0)
+        self.assertEqual([c.name for c in config.connections], ["conn0", "conn1"])
+        self.assertEqual(stat.S_IMODE(self.cache.stat().st_mode), 0o600)
+        self.assertEqual(json.loads(self.cache.read_text())["content"], self.server.document)
+
+        self.assertIsNone(source.poll(100))
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertIsNone(source.poll(1000))
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertTrue(self.server.requests[-1]["If-None-Match"])
+
+    def test_last_modified_only(self):
+        self.server.use_etag = False
+        source = self.source()
+        source.load(0)
+        self.assertIsNone(source.poll(1000))
+        self.assertEqual(self.server.requests[-1]["If-Modified-Since"], LAST_MODIFIED)
+
+    def test_changed_document(self):
+        source = self.source()
+        source.load(0)
+        data = synthetic_config_dict(3)
+        data["config_poll_interval"] = 60
+        self.server.serve(data)
+        old = self.cache.read_text()
+        config, commit = source.poll(1000)
+        self.assertEqual(len(config.connections), 3)
+        # Not the last good document before the agent applied it
+        self.assertEqual(self.cache.read_text(), old)
+        self.assertEqual(source.interval, 300)
+        commit()
+        self.assertEqual(source.interval, 60)
+        self.assertTrue(1000 + 48 <= source.next_poll <= 1000 + 72)
+        self.assertEqual(json.loads(self.cache.read_text())["content"], self.server.document)
+        self.assertIsNone(source.poll(source.next_poll))
+
+    def test_uncommitted_document_is_fetched_again(self):
+        source = self.source()
+        source.load(0)
+        etag = source.etag
+        self.server.serve(synthetic_config_dict(3))
+        source.poll(1000)
+        # Still polled with the validators of the applied document, so the new one comes again
+        config, commit = source.poll(source.next_poll)
+        self.assertEqual(self.server.requests[-1]["If-None-Match"], etag)
+        self.assertEqual(len(config.connections), 3)
+        commit()
+        self.assertIsNone(source.poll(source.next_poll))
+
+    @patch("agent.config_schema.HAS_YAML", False)
+    def test_yaml_without_pyyaml_is_a_failed_poll(self):
+        source = self.source()
+        source.load(0)
+        self.server.document = "connections: []\n"
+        self.server.content_type = "application/yaml"
+        self.assertIsNone(source.poll(1000))
+        self.assertEqual(source.failures, 1)
+        self.assertEqual(len(source.load(2000).connections), 2)
+
+    def test_invalid_document_keeps_last_good(self):
+        source = self.source()
+        source.load(0)
+        good = self.cache.read_text()
+        self.server.serve({"connections": []})
+        self.assertIsNone(source.poll(1000))
+        self.assertEqual(source.failures, 1)
+        self.assertTrue(1000 + RETRY_DELAY / 2 <= source.next_poll <= 1000 + RETRY_DELAY)
+        self.assertEqual(self.cache.read_text(), good)
+
+        self.server.fail = True
+        self.assertIsNone(source.poll(source.next_poll))
+        self.assertEqual(source.failures, 2)
+        self.server.fail = False
+        self.server.serve(synthetic_config_dict(4))
+        self.assertEqual(len(source.poll(source.next_poll)[0].connections), 4)
+        self.assertEqual(source.failures, 0)
+
+    def test_offline_boot_from_cache(self):
+        self.source().load(0)
+        self.server.fail = True
+        config = self.source().load(10)
+        self.assertEqual(len(config.connections), 2)
+        self.cache.unlink()
+        with self.assertRaisesRegex(ValueError, "no cached copy"):
+            self.source().load(20)
+
+    def test_cache_of_another_url_is_ignored(self):
+        self.source().load(0)
+        other = RemoteConfigSource(self.server.url + "?v=2", self.cache, self.logger)
+        self.server.fail = True
+        with self.assertRaises(ValueError):
+            other.load(10)
+
+    def test_jittered_intervals(self):
+        delays = [self.source(seed).poll_delay() for seed in range(50)]
+        self.assertTrue(all(240 <= d <= 360 for d in delays))
+        self.assertGreater(len(set(delays)), 40)
+        source = self.source()
+        retries = []
+        for failures in range(1, 10):
+            source.failures = failures
+            retries.append(source.retry_delay())
+        self.assertLess(retries[0], retries[3])
+        self.assertTrue(all(d <= source.interval for d in retries))
+
+    @unittest.skipUnless(HAS_YAML, "PyYAML not installed")
+    def test_yaml_by_content_type(self):
+        import yaml
+        self.server.document = yaml.safe_dump(synthetic_config_dict(2))
+        self.server.content_type = "application/yaml"
+        self.assertEqual(len(self.source().load(0).connections), 2)
+
+class TestAgentWithConfigServer(ConfigServerCase):
+    def test_agent_reads_url(self):
+        agent = IPsecAgent(self.server.url, logger=self.logger)
+        agent.base_dir = self.work_dir
+        config = agent._read_config()
+        self.assertEqual(len(config.connections), 2)
+        self.assertTrue(self.cache.exists())
+
+    def test_poll_applies_only_the_difference(self):
+        data = synthetic_config_dict(2)
+        data["config_poll_interval"] = 60
+        self.server.serve(data)
+        source = self.source()
+        agent = simulate(source.load(0), Scenario(), logger=self.logger)
+        agent.config_source = source
+
+        data = synthetic_config_dict(3)
+        data["config_poll_interval"] = 60
+        self.server.serve(data)
+        agent.run_loop(until=200)
+        self.assertEqual([c.name for c in agent.config.connections], ["conn0", "conn1", "conn2"])
+        initiated = [names for t, event, names in agent.backend.history if event == "initiate"]
+        self.assertEqual(initiated, [["conn0", "conn1"], ["conn2"]])
+
+    def test_failed_reload_is_retried(self):
+        data = synthetic_config_dict(2)
+        data["config_poll_interval"] = 60
+        self.server.serve(data)
+        source = self.source()
+        agent = simulate(source.load(0), Scenario(), logger=self.logger)
+        agent.config_source = source
+        good = self.cache.read_text()
+
+        data = synthetic_config_dict(3)
+        data["config_poll_interval"] = 60
+        self.server.serve(data)
+        prepare = agent._prepare_config
+        failures = []
+        def fail_once(config):
+            if not failures:
+                failures.append(config)
+                raise RuntimeError("host not ready")
+            prepare(config)
+        agent._prepare_config = fail_once
+        agent.run_loop(until=100)
+        self.assertEqual(len(failures), 1)
+        self.assertEqual(len(agent.config.connections), 2)
+        self.assertEqual(self.cache.read_text(), good)
+        # The next poll fetches the document again, and this time it is applied and cached
+        agent.run_loop(until=200)
+        self.assertEqual(len(agent.config.connections), 3)
+        self.assertEqual(json.loads(self.cache.read_text())["content"], self.server.document)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,222 @@
+import contextlib
+import io
+import json
+import logging
+import shutil
+import socket
+import stat
+import statistics
+import time
+import unittest
+from pathlib import Path
+from agent.base import ADMIN_DOWN
+from agent.config_schema import AgentConfig
+from agent.control import ControlClient, ControlError, ControlServer, serve_control, main
+from agent.core import AgentState
+from agent.platforms.linux import LinuxAgent
+from agent.shards import Supervisor
+from agent.simulation import Scenario, simulate
+from benchmarks.swanctl_sim import SwanctlSimulator
+from benchmarks.synthetic import synthetic_config_dict
+
+def config(count: int = 3, **changes) -> AgentConfig:
+    data = synthetic_config_dict(count)
+    data.update(changes)
+    config = AgentConfig.from_dict(data)
+    config.validate()
+    return config
+
+class Echo:
+    def control(self, command, args):
+        if command == "fail":
+            raise RuntimeError("broken")
+        if command != "echo":
+            raise ValueError(f"Unknown command '{command}'")
+        return args
+
+class ControlCase(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = Path("test_output_control").resolve()
+        self.work_dir.mkdir(exist_ok=True)
+        self.path = self.work_dir / "agent.sock"
+        self.logger = logging.getLogger("TestControl")
+        self.logger.setLevel(logging.CRITICAL)
+
+    def tearDown(self):
+        if self.work_dir.exists():
+            shutil.rmtree(self.work_dir)
+
+    def serve(self, target) -> ControlServer:
+        server = serve_control(self.path, target, self.logger)
+        self.assertIsNotNone(server)
+        self.addCleanup(server.stop)
+        return server
+
+    def ctl(self, *argv) -> tuple[int, str]:
+        out, err = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            code = main(["--socket", str(self.path), *argv])
+        return code, out.getvalue() + err.getvalue()
+
+class TestProtocol(ControlCase):
+    def test_requests_on_one_connection(self):
+        self.serve(Echo())
+        self.assertEqual(stat.S_IMODE(self.path.stat().st_mode), 0o600)
+        with ControlClient(self.path) as client:
+            self.assertEqual(client.request("echo", name="conn1"), {"name": "conn1"})
+            with self.assertRaisesRegex(ControlError, "Unknown command 'nope'"):
+                client.request("nope")
+            with self.assertRaisesRegex(ControlError, "RuntimeError: broken"):
+                client.request("fail")
+            self.assertEqual(client.request("echo"), {})
+
+    def test_malformed_requests(self):
+        self.serve(Echo())
+        with socket.socket(socket.AF_UNIX) as s:
+            s.connect(str(self.path))
+            reader = s.makefile("rb")
+            for line in (b"not json\n", b"[1, 2]\n", b'{"name": "x"}\n'):
+                s.sendall(line)
+                self.assertFalse(json.loads(reader.readline())["ok"])
+            reader.close()
+
+    def test_stale_and_busy_socket(self):
+        # Left behind by an agent that was killed
+        stale = socket.socket(socket.AF_UNIX)
+        stale.bind(str(self.path))
+        stale.close()
+        server = self.serve(Echo())
+        self.assertIsNone(serve_control(self.path, Echo(), self.logger))
+        server.stop()
+        self.assertFalse(self.path.exists())
+
+    def test_round_trip_latency(self):
+        agent = simulate(config(20), Scenario(), logger=self.logger)
+        agent.step()
+        self.serve(agent)
+        with ControlClient(self.path) as client:
+            client.request("status")
+            times = []
+            for _ in range(500):
+                t0 = time.perf_counter()
+                client.request("status")
+                times.append(time.perf_counter() - t0)
+        # Typically well below a millisecond; the bound leaves room for a loaded test machine
+        self.assertLess(statistics.median(times), 0.005)
+
+class TestAgentCommands(ControlCase):
+    def test_down_is_held_until_up(self):
+        agent = simulate(config(3), Scenario(), logger=self.logger)
+        agent.step()
+        self.serve(agent)
+        with ControlClient(self.path) as client:
+            self.assertEqual(client.request("down", name="conn1"), ADMIN_DOWN)
+            agent.run_loop(until=300)
+            status = client.request("status")
+            self.assertEqual(status["connection_states"],
+                             {"conn0": "CONNECTED", "conn1": ADMIN_DOWN, "conn2": "CONNECTED"})
+            self.assertEqual(status["agent_state"], "CONNECTED")
+            self.assertEqual(status["down"], [])
+            self.assertNotIn("conn1", agent.backend.up)
+            self.assertFalse([h for h in agent.backend.history if h[1] == "initiate" and "conn1" in h[2] and h[0] > 0])
+
+            self.assertEqual(client.request("up", name="conn1"), "CONNECTED")
+            agent.step()
+            self.assertEqual(agent.connection_states["conn1"], "CONNECTED")
+            with self.assertRaisesRegex(ControlError, "Unknown connection: conn9"):
+                client.request("down", name="conn9")
+
+    def test_held_down_survives_full_reapply(self):
+        agent = simulate(config(2), Scenario().drop(100), logger=self.logger)
+        agent.step()
+        agent.control("down", {"name": "conn0"})
+        agent.run_loop(until=200)
+        self.assertEqual(agent.backend.up, {"conn1"})
+        self.assertEqual(agent.state, AgentState.CONNECTED)
+
+    def test_reload_and_flush_cache(self):
+        path = self.work_dir / "config.json"
+        path.write_text(json.dumps(synthetic_config_dict(2)))
+        agent = simulate(config(2), Scenario(), logger=self.logger)
+        agent.config_path = str(path)
+        agent.step()
+        agent.control("down", {"name": "conn1"})
+        self.serve(agent)
+
+        data = synthetic_config_dict(3)
+        data["connections"][1]["remote_subnets"] = ["100.64.99.0/24"]
+        path.write_text(json.dumps(data))
+        code, out = self.ctl("reload")
+        self.assertEqual(code, 0)
+        self.assertEqual(json.loads(out), {"added": ["conn2"], "removed": [], "changed": ["conn1"]})
+        # Changing a connection that was held down brings it back
+        self.assertEqual(agent.held_down, set())
+        self.assertEqual(self.ctl("flush-cache"), (0, ""))
+
+    def test_ipsecctl(self):
+        agent = simulate(config(2), Scenario(), logger=self.logger)
+        agent.step()
+        self.serve(agent)
+        code, out = self.ctl("status")
+        self.assertEqual(code, 0)
+        self.assertIn("State: CONNECTED", out)
+        self.assertIn("Connections: 2 CONNECTED", out)
+        self.assertIn("  conn1  CONNECTED", out.splitlines())
+        self.assertEqual(self.ctl("down", "conn1"), (0, '"ADMIN_DOWN"\n'))
+        code, out = self.ctl("up", "conn7")
+        self.assertEqual(code, 1)
+        self.assertIn("Unknown connection: conn7", out)
+        self.assertEqual(self.ctl("stats"), (0, ""))
+        code, out = self.ctl("--json", "status")
+        self.assertEqual(json.loads(out)["connection_states"]["conn1"], ADMIN_DOWN)
+
+        code, out = self.ctl("--socket", str(self.work_dir / "none.sock"), "status")
+        self.assertEqual(code, 2)
+        self.assertIn("cannot reach the agent", out)
+
+class TestSwanctlControl(ControlCase):
+    def test_down_removes_trap_of_on_demand_connection(self):
+        data = synthetic_config_dict(2)
+        data["connections"][0]["on_demand"] = True
+        backend = LinuxAgent(AgentConfig.from_dict(data), self.work_dir, self.logger)
+        with SwanctlSimulator(self.work_dir / "sim", backend.conf_dir) as sim:
+            backend.apply_policy()
+            self.assertEqual(sim.trapped(), {"conn0-child"})
+            backend.hold(["conn0", "conn1"])
+            self.assertEqual((sim.trapped(), sim.installed()), (set(), set()))
+            backend.repair(["conn0"])
+            self.assertEqual(sim.trapped(), {"conn0-child"})
+
+class TestSupervisorControl(ControlCase):
+    def test_commands_reach_the_owning_shard(self):
+        sim = SwanctlSimulator(self.work_dir / "sim", self.work_dir / "output" / "swanctl")
+        (self.work_dir / "output" / "swanctl").mkdir(parents=True)
+        sim.install()
+        self.addCleanup(sim.uninstall)
+        supervisor = Supervisor(config(8, shards=2, check_interval=0.2), self.work_dir, self.logger,
+                                backend_factory=LinuxAgent)
+        supervisor.start()
+        self.addCleanup(supervisor.stop)
+        self.assertTrue(self.path.exists())
+
+        def wait_until(predicate):
+            deadline = time.monotonic() + 30
+            while not predicate():
+                self.assertLess(time.monotonic(), deadline, supervisor.status_report())
+                supervisor.poll(0.1)
+
+        wait_until(lambda: supervisor.status_report()["connections"] == {"CONNECTED": 8})
+        with ControlClient(self.path) as client:
+            self.assertEqual(client.request("down", name="conn5"), ADMIN_DOWN)
+            self.assertNotIn("conn5-child", sim.installed())
+            wait_until(lambda: client.request("status")["connection_states"].get("conn5") == ADMIN_DOWN)
+            self.assertEqual(sim.call_counts()["--initiate"], 8)
+            self.assertIsNone(client.request("flush-cache"))
+            self.assertEqual(client.request("up", name="conn5"), "CONNECTED")
+            with self.assertRaisesRegex(ControlError, "Unknown connection"):
+                client.request("up", name="conn99")
+        supervisor.stop()
+        self.assertFalse(self.path.exists())
+
+if __name__ == '__main__':
+    unittest.main()
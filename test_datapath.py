@@ -0,0 +1,111 @@
+import io
+import unittest
+from pathlib import Path
+from agent.config_schema import AgentConfig
+from agent.datapath import datapath_warnings
+from agent.swanctl import SwanctlRenderer, PFKEY_DATAPATH_OPTIONS
+from agent.sysinfo import network_interfaces, fastest_nic, NicInfo
+from benchmarks.synthetic import synthetic_config_dict
+
+FIXTURES = Path(__file__).parent / "fixtures" / "sysinfo"
+
+def config_with(count=1, **datapath):
+    data = synthetic_config_dict(count)
+    for conn in data["connections"]:
+        conn["datapath"] = dict(datapath)
+    return AgentConfig.from_dict(data)
+
+class TestDatapathConfig(unittest.TestCase):
+    def test_defaults_render_nothing(self):
+        config = config_with()
+        self.assertEqual(config.connections[0].datapath.options(), {})
+
+    def test_parses_and_normalizes(self):
+        dp = config_with(replay_window=4096, esn=True, hw_offload="Packet", mark_in="0x10/0xff", if_id_out=7).connections[0].datapath
+        self.assertEqual(dp.options(), {"replay_window": "4096", "hw_offload": "packet", "mark_in": "0x10/0xff", "if_id_out": "7"})
+        self.assertTrue(dp.esn)
+
+    def test_invalid_values(self):
+        for bad in ({"replay_window": -1}, {"hw_offload": "maybe"}, {"copy_dscp": "both"},
+                    {"mark_out": "ten"}, {"if_id_in": "1/2"}, {"updown": "updown.sh"}, {"jumbo": True}):
+            with self.assertRaises(ValueError, msg=bad):
+                config_with(**bad).validate()
+
+class TestDatapathRendering(unittest.TestCase):
+    def render(self, config, renderer=None):
+        conf = io.StringIO()
+        (renderer or SwanctlRenderer()).write(conf, config)
+        return conf.getvalue()
+
+    def test_options_in_child_block(self):
+        text = self.render(config_with(replay_window=1024, hw_offload="auto", copy_dscp="out",
+                                       mark_in="42", updown="/usr/local/libexec/agent-updown"))
+        for line in ("replay_window = 1024", "hw_offload = auto", "copy_dscp = out",
+                     "mark_in = 42", "updown = /usr/local/libexec/agent-updown"):
+            self.assertIn(line, text)
+
+    def test_esn_extends_each_esp_proposal(self):
+        data = synthetic_config_dict(1)
+        data["connections"][0]["encryption"]["esp"] = "aes256gcm16,aes128gcm16-noesn"
+        data["connections"][0]["datapath"] = {"esn": True}
+        text = self.render(AgentConfig.from_dict(data))
+        self.assertIn("esp_proposals = aes256gcm16-esn,aes128gcm16-noesn", text)
+
+    def test_pfkey_drops_linux_only_options(self):
+        config = config_with(replay_window=1024, esn=True, hw_offload="yes", if_id_in="%unique", ipcomp=True)
+        text = self.render(config, SwanctlRenderer(datapath_options=PFKEY_DATAPATH_OPTIONS))
+        self.assertIn("replay_window = 1024", text)
+        self.assertIn("ipcomp = yes", text)
+        self.assertNotIn("hw_offload", text)
+        self.assertNotIn("if_id_in", text)
+        self.assertNotIn("-esn", text)
+
+class TestNics(unittest.TestCase):
+    def test_fixture_interfaces(self):
+        nics = network_interfaces(FIXTURES / "x86_server")
+        self.assertEqual([n.name for n in nics], ["eth0", "eth1"]) # lo has no device
+        self.assertEqual((nics[0].speed, nics[0].rx_queues, nics[0].tx_queues), (10000, 8, 8))
+        self.assertIsNone(nics[1].speed) # link down reports -1
+        self.assertEqual(fastest_nic(nics).name, "eth0")
+
+    def test_missing_sysfs(self):
+        self.assertEqual(network_interfaces(FIXTURES / "missing"), [])
+        self.assertIsNone(fastest_nic([]))
+
+class TestDatapathWarnings(unittest.TestCase):
+    def setUp(self):
+        self.fast = network_interfaces(FIXTURES / "x86_server")
+        self.slow = network_interfaces(FIXTURES / "rpi4")
+
+    def test_default_replay_window_on_fast_multiqueue_link(self):
+        warnings = datapath_warnings(config_with(7), "Linux", self.fast)
+        self.assertEqual(len(warnings), 1)
+        self.assertIn("conn0, conn1, conn2, conn3, conn4 and 2 more", warnings[0])
+        self.assertIn("Replay window 32 (charon default)", warnings[0])
+        self.assertEqual(datapath_warnings(config_with(replay_window=2048), "Linux", self.fast), [])
+        self.assertEqual(datapath_warnings(config_with(), "Linux", self.slow), [])
+
+    def test_ipcomp_and_offload(self):
+        warnings = datapath_warnings(config_with(replay_window=4096, ipcomp=True, hw_offload="packet"), "Linux", self.fast)
+        self.assertEqual(len(warnings), 3)
+        self.assertIn("IPComp compresses", warnings[0])
+        self.assertIn("AES-GCM only", warnings[1]) # default ESP proposal is aes256-sha256
+        self.assertIn("compressed SAs are not offloaded", warnings[2])
+
+    def test_esn_at_line_rate(self):
+        config = config_with(replay_window=4096)
+        config.connections[0].lifetime_minutes = 240
+        nics = [NicInfo("eth0", 25000, 16, 16)]
+        self.assertIn("enable esn", datapath_warnings(config, "Linux", nics)[0])
+        config.connections[0].datapath.esn = True
+        self.assertEqual(datapath_warnings(config, "Linux", nics), [])
+
+    def test_unsupported_platform_options(self):
+        config = config_with(replay_window=1024, esn=True, mark_in="1")
+        mac = datapath_warnings(config, "Darwin", self.slow)
+        self.assertEqual(mac, ["conn0: Darwin does not support datapath option(s) esn, mark_in; ignored"])
+        win = datapath_warnings(config, "Windows", self.fast)
+        self.assertIn("esn, replay_window, mark_in; ignored", win[0])
+
+if __name__ == '__main__':
+    unittest.main()
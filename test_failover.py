@@ -0,0 +1,157 @@
+import io
+import logging
+import unittest
+from agent.clock import VirtualClock
+from agent.config_schema import AgentConfig
+from agent.core import AgentState
+from agent.failover import FailoverTracker, check_interval
+from agent.simulation import Scenario, simulate
+from agent.swanctl import SwanctlRenderer
+from benchmarks.synthetic import synthetic_config_dict
+
+PRIMARY, STANDBY = "203.0.113.1", "198.51.100.1"
+
+def failover_config_dict(count=2, **changes):
+    """conn0 has a primary and a standby gateway; the others keep the derived address."""
+    data = synthetic_config_dict(count)
+    data["check_interval"] = 30
+    data["connections"][0].update(gateways=[{"address": STANDBY, "priority": 20}, {"address": PRIMARY, "priority": 10}],
+                                  dpd_delay=5, dpd_timeout=15, failback_holddown=600, **changes)
+    return data
+
+def failover_config(count=2, **changes):
+    config = AgentConfig.from_dict(failover_config_dict(count, **changes))
+    config.validate()
+    return config
+
+class TestGatewayConfig(unittest.TestCase):
+    def test_priority_order(self):
+        conn = failover_config().connections[0]
+        self.assertEqual(conn.gateway_addresses(), [PRIMARY, STANDBY])
+        self.assertEqual(conn.current_gateway(), PRIMARY)
+        conn.active_gateway = STANDBY
+        self.assertEqual(conn.current_gateway(), STANDBY)
+
+    def test_plain_addresses(self):
+        data = synthetic_config_dict(1)
+        data["connections"][0]["gateways"] = ["gw1.example.net", "gw2.example.net"]
+        conn = AgentConfig.from_dict(data).connections[0]
+        self.assertEqual(conn.gateway_addresses(), ["gw1.example.net", "gw2.example.net"])
+
+    def test_invalid(self):
+        for bad in ({"gateways": ["a b"]}, {"gateways": [PRIMARY, PRIMARY]},
+                    {"gateways": [{"address": PRIMARY, "priority": -1}]},
+                    {"dpd_delay": 0}, {"dpd_delay": 30, "dpd_timeout": 10}, {"failback_holddown": -1}):
+            data = synthetic_config_dict(1)
+            data["connections"][0].update(bad)
+            with self.assertRaises(ValueError, msg=bad):
+                AgentConfig.from_dict(data).validate()
+
+    def test_unknown_gateway_option(self):
+        data = synthetic_config_dict(1)
+        data["connections"][0]["gateways"] = [{"address": PRIMARY, "weight": 1}]
+        with self.assertRaisesRegex(ValueError, "weight"):
+            AgentConfig.from_dict(data)
+
+    def test_check_interval(self):
+        self.assertEqual(check_interval(failover_config()), 5)
+        self.assertEqual(check_interval(AgentConfig.from_dict(synthetic_config_dict(1))), 30)
+
+class TestGatewayRendering(unittest.TestCase):
+    def render(self, config):
+        conf = io.StringIO()
+        SwanctlRenderer().write(conf, config)
+        return conf.getvalue().split("conn1 {", 1)
+
+    def test_active_gateway_and_dpd(self):
+        config = failover_config()
+        conn0, conn1 = self.render(config)
+        self.assertIn(f"remote_addrs = {PRIMARY}\n", conn0)
+        self.assertIn("dpd_delay = 5s\n        dpd_timeout = 15s", conn0)
+        self.assertIn("dpd_action = clear", conn0)
+        self.assertIn("remote_addrs = 100.64.0.16\n", conn1)
+        self.assertIn("dpd_delay = 30s\n        dpd_timeout = 120s", conn1)
+        self.assertIn("dpd_action = restart", conn1)
+
+        config.connections[0].active_gateway = STANDBY
+        self.assertIn(f"remote_addrs = {STANDBY}\n", self.render(config)[0])
+
+class TestFailoverTracker(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.logger = logging.getLogger("TestFailover")
+        self.logger.setLevel(logging.CRITICAL)
+        self.tracker = FailoverTracker(self.clock, self.logger)
+        self.config = failover_config()
+        self.conn = self.config.connections[0]
+
+    def test_dpd_failure_switches_and_measures(self):
+        self.assertEqual(self.tracker.update(self.config, {"conn0": "CONNECTED"}), [])
+        self.clock.advance(100)
+        self.assertEqual(self.tracker.update(self.config, {"conn0": "DISCONNECTED"}), ["conn0"])
+        self.assertEqual(self.conn.current_gateway(), STANDBY)
+        self.clock.advance(5)
+        self.assertEqual(self.tracker.update(self.config, {"conn0": "CONNECTING"}), [])
+        self.clock.advance(5)
+        self.tracker.update(self.config, {"conn0": "CONNECTED"})
+        metrics = self.tracker.metrics(self.config)["conn0"]
+        self.assertEqual(metrics, {"gateway": STANDBY, "preferred": False, "failovers": 1, "failbacks": 0,
+                                   "last_failover_seconds": 10})
+
+    def test_gateway_stuck_connecting_is_given_up(self):
+        self.tracker.update(self.config, {"conn0": "CONNECTING"})
+        self.clock.advance(10)
+        self.assertEqual(self.tracker.update(self.config, {"conn0": "CONNECTING"}), [])
+        self.clock.advance(5)
+        self.assertEqual(self.tracker.update(self.config, {"conn0": "CONNECTING"}), ["conn0"])
+
+    def test_failback_after_holddown(self):
+        self.conn.active_gateway = STANDBY
+        self.tracker.update(self.config, {"conn0": "CONNECTED"})
+        self.clock.advance(599)
+        self.assertEqual(self.tracker.failbacks_due(self.config), [])
+        self.clock.advance(1)
+        self.assertEqual(self.tracker.failbacks_due(self.config), ["conn0"])
+
+class TestFailoverSimulation(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger("TestFailover")
+        self.logger.setLevel(logging.CRITICAL)
+
+    def test_failover_and_failback(self):
+        scenario = Scenario().gateway_outage(1000, 2000, [PRIMARY])
+        agent = simulate(failover_config(), scenario, logger=self.logger)
+        conn = agent.config.connections[0]
+
+        # DPD drops the SA 20s into the outage; the next 5s check moves it to the standby
+        agent.run_loop(until=1040)
+        self.assertEqual(conn.current_gateway(), STANDBY)
+        self.assertEqual(agent.state, AgentState.CONNECTED)
+        drop = next(t for t, event, names in agent.backend.history if event == "drop")
+        self.assertEqual(drop, 1020)
+        metrics = agent.failover.metrics(agent.config)["conn0"]
+        self.assertLessEqual(metrics["last_failover_seconds"], 5)
+
+        # The primary is still down when the hold-down ends: the failback is rolled back, the SA kept
+        agent.run_loop(until=1900)
+        self.assertEqual(conn.current_gateway(), STANDBY)
+        self.assertIn("rollback", [event for t, event, names in agent.backend.history])
+        self.assertEqual(agent.backend.history.count((1020, "drop", ["conn0"])), 1)
+
+        # Back on the primary after the next hold-down, without another outage
+        agent.run_loop(until=3600)
+        conn = agent.config.connections[0]
+        self.assertEqual(conn.current_gateway(), PRIMARY)
+        self.assertEqual([names for t, event, names in agent.backend.history if event == "drop"], [["conn0"]])
+        metrics = agent.failover.metrics(agent.config)["conn0"]
+        self.assertEqual((metrics["failovers"], metrics["failbacks"], metrics["preferred"]), (1, 1, True))
+
+    def test_reload_keeps_active_gateway(self):
+        scenario = Scenario().gateway_outage(100, 5000, [PRIMARY])
+        agent = simulate(failover_config(), scenario, logger=self.logger)
+        agent.run_loop(until=200)
+        agent.reload(failover_config())
+        self.assertEqual(agent.config.connections[0].current_gateway(), STANDBY)
+
+if __name__ == '__main__':
+    unittest.main()
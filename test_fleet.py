@@ -0,0 +1,169 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import unittest
+from agent.config_schema import AgentConfig
+from agent.core import IPsecAgent, AgentState, serve_health_api
+from agent.fleet import FleetScraper, ScrapeResult, Target, parse_target, summarize, prometheus_text, main
+from benchmarks import bench_fleet
+from benchmarks.bench_fleet import StubAgents
+from benchmarks.synthetic import synthetic_config_dict
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def scrape_rounds(scraper: FleetScraper, rounds: int) -> list[list[ScrapeResult]]:
+    async def run():
+        try:
+            return [await scraper.scrape() for _ in range(rounds)]
+        finally:
+            await scraper.close()
+    return asyncio.run(run())
+
+class TestTargets(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(parse_target("10.0.0.1:8080"), Target("10.0.0.1:8080", "10.0.0.1", 8080))
+        self.assertEqual(parse_target("edge1=http://gw.example:9000/status"), Target("edge1", "gw.example", 9000))
+        for bad in ("10.0.0.1", "https://gw:443/status", "gw:http"):
+            with self.assertRaises(ValueError, msg=bad):
+                parse_target(bad)
+
+    def test_duplicate_names(self):
+        with self.assertRaises(ValueError):
+            FleetScraper([parse_target("a=h:1"), parse_target("a=h:2")])
+
+class TestSummary(unittest.TestCase):
+    results = [
+        ScrapeResult("edge1", {"agent_state": "CONNECTED", "last_check_seconds": 2.0,
+                               "connections": {"CONNECTED": 3},
+                               "probes": {"c1": {"verdict": "degraded", "loss": 0.4, "rtt_p99_ms": 80.0},
+                                          "c2": {"verdict": "healthy", "loss": 0.0, "rtt_p99_ms": 3.0}}}),
+        ScrapeResult("edge2", {"agent_state": "DEGRADED", "last_check_seconds": 900.0,
+                               "connections": {"CONNECTED": 1, "DISCONNECTED": 1}, "down": ["c9"],
+                               "failover": {"c1": {"gateway": "192.0.2.2", "preferred": False, "failovers": 2},
+                                            "c3": {"gateway": "192.0.2.1", "preferred": True, "failovers": 0}}}),
+        ScrapeResult("edge3", None, "Connection refused"),
+    ]
+
+    def test_summarize(self):
+        summary = summarize(self.results, stale_after=120, scrape_seconds=0.25)
+        self.assertEqual((summary["agents"], summary["reachable"]), (3, 2))
+        self.assertEqual(summary["agent_states"], {"CONNECTED": 1, "DEGRADED": 1})
+        self.assertEqual(summary["connections"], {"CONNECTED": 4, "DISCONNECTED": 1})
+        worst = [(t["agent"], t["connection"]) for t in summary["worst_tunnels"]]
+        self.assertEqual(worst, [("edge2", "c9"), ("edge1", "c1"), ("edge2", "c1")])
+        self.assertEqual(summary["stale"], [{"agent": "edge2", "last_check_seconds": 900.0}])
+        self.assertEqual(summary["unreachable"], [{"agent": "edge3", "error": "Connection refused"}])
+        json.dumps(summary)
+
+    def test_prometheus(self):
+        results = self.results + [ScrapeResult('we"ird', {"agent_state": "INIT"})]
+        text = prometheus_text(results, summarize(results, scrape_seconds=0.25))
+        lines = text.splitlines()
+        self.assertIn('ipsec_fleet_agents{result="ok"} 2', lines)
+        self.assertIn('ipsec_fleet_agents{result="stale"} 1', lines)
+        self.assertIn('ipsec_fleet_agent_up{agent="edge3"} 0', lines)
+        self.assertIn('ipsec_fleet_connections{agent="edge2",status="DISCONNECTED"} 1', lines)
+        self.assertIn('ipsec_fleet_probe_rtt_p99_seconds{agent="edge1",connection="c1"} 0.08', lines)
+        self.assertIn('ipsec_fleet_failovers_total{agent="edge2",connection="c1"} 2', lines)
+        self.assertIn('ipsec_fleet_agent_state{agent="we\\"ird",state="INIT"} 1', lines)
+        # One HELP/TYPE header per metric
+        self.assertEqual(text.count("# TYPE ipsec_fleet_agents "), 1)
+
+class TestScraper(unittest.TestCase):
+    def test_reuses_connections(self):
+        with StubAgents(20, connections=5) as agents:
+            scraper = FleetScraper(agents.targets(), timeout=2)
+            first, second = scrape_rounds(scraper, 2)
+        self.assertTrue(all(r.report for r in first + second))
+        self.assertEqual(scraper.connections_opened, 20)
+        self.assertEqual(agents.accepted, 20)
+        self.assertEqual(agents.requests, 40)
+
+    def test_hung_and_dead_agents_are_bounded(self):
+        with StubAgents(10, connections=5, hung=2) as agents:
+            targets = agents.targets() + [Target("dead", "127.0.0.1", free_port())]
+            scraper = FleetScraper(targets, timeout=0.5, concurrency=4)
+            t0 = time.perf_counter()
+            results, = scrape_rounds(scraper, 1)
+            elapsed = time.perf_counter() - t0
+        errors = {r.agent: r.error for r in results if r.report is None}
+        self.assertEqual(set(errors), {"agent8", "agent9", "dead"})
+        self.assertIn("timed out", errors["agent8"])
+        # ceil(11 / 4) rounds of at most one timeout each
+        self.assertLess(elapsed, 3 * 0.5 + 0.5)
+
+    def test_agent_restart_is_retried(self):
+        with StubAgents(3, connections=5) as agents:
+            scraper = FleetScraper(agents.targets(), timeout=2)
+
+            async def run():
+                try:
+                    await scraper.scrape()
+                    # The agents drop their idle connections
+                    for _, writer in scraper._idle.values():
+                        writer.transport.abort()
+                    return await scraper.scrape()
+                finally:
+                    await scraper.close()
+            results = asyncio.run(run())
+        self.assertTrue(all(r.report for r in results))
+        self.assertEqual(scraper.connections_opened, 6)
+
+    def test_health_api_keep_alive(self):
+        logger = logging.getLogger("TestFleet")
+        logger.setLevel(logging.CRITICAL)
+        agent = IPsecAgent("dummy_path", logger=logger)
+        agent.config = AgentConfig.from_dict(synthetic_config_dict(2))
+        agent.state = AgentState.CONNECTED
+        agent.check_status = lambda: "CONNECTED"
+        agent.connection_states = {"a": "CONNECTED", "b": "DISCONNECTED"}
+        agent._last_check = agent.clock.monotonic()
+        port = free_port()
+        serve_health_api(port, agent)
+        targets = [Target("agent", "127.0.0.1", port)]
+        deadline = time.monotonic() + 5
+        while True:
+            results, = scrape_rounds(FleetScraper(targets, timeout=1), 1)
+            if results[0].report or time.monotonic() > deadline:
+                break
+            time.sleep(0.05)
+
+        scraper = FleetScraper(targets, timeout=2)
+        first, second = scrape_rounds(scraper, 2)
+        self.assertEqual(scraper.connections_opened, 1)
+        report = second[0].report
+        self.assertEqual(report["connections"], {"CONNECTED": 1, "DISCONNECTED": 1})
+        self.assertEqual(report["down"], ["b"])
+        self.assertLess(report["last_check_seconds"], 5)
+
+class TestCommand(unittest.TestCase):
+    def test_json_and_prometheus_files(self):
+        with StubAgents(3, connections=5) as agents:
+            args = [f"{t.name}={t.host}:{t.port}" for t in agents.targets()]
+            self.assertEqual(main(args + ["--output", "test_fleet.json"]), 0)
+            self.assertEqual(main(args + ["--format", "prometheus", "--output", "test_fleet.prom"]), 0)
+        try:
+            with open("test_fleet.json") as f:
+                self.assertEqual(json.load(f)["reachable"], 3)
+            with open("test_fleet.prom") as f:
+                self.assertIn('ipsec_fleet_agent_up{agent="agent0"} 1', f.read().splitlines())
+        finally:
+            os.remove("test_fleet.json")
+            os.remove("test_fleet.prom")
+
+    def test_benchmark(self):
+        report = bench_fleet.main(["--scales", "20", "--connections", "5", "--timeout", "0.3", "--output", "test_bench_fleet.json"])
+        os.remove("test_bench_fleet.json")
+        result, = report["results"]
+        self.assertEqual((result["reachable"], result["connections_opened"]), (20, 20))
+        self.assertEqual(result["worst_tunnel"]["connection"], "conn0")
+        self.assertLess(result["hung_seconds"], result["hung_bound_seconds"] + 0.5)
+
+if __name__ == '__main__':
+    unittest.main()
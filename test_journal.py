@@ -0,0 +1,181 @@
+import unittest
+import copy
+import shutil
+import logging
+import signal
+from pathlib import Path
+from agent.clock import VirtualClock
+from agent.core import AgentState, STOP_POLL
+from agent.journal import Journal
+from agent.proposals import select_proposals
+from agent.sysinfo import CpuFeatures
+from agent.simulation import Scenario, simulate
+from benchmarks.synthetic import synthetic_config
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = Path("test_output_journal").resolve()
+        self.work_dir.mkdir(exist_ok=True)
+        self.clock = VirtualClock(1000)
+        self.journal = Journal(self.work_dir / "agent_state.json", self.clock)
+        self.config = synthetic_config(5)
+        self.logger = logging.getLogger("TestJournal")
+        self.logger.setLevel(logging.CRITICAL)
+
+    def tearDown(self):
+        if self.work_dir.exists():
+            shutil.rmtree(self.work_dir)
+
+    def boot(self, config, up=()):
+        return simulate(config, Scenario(), VirtualClock(), self.logger, journal=self.journal, up=up)
+
+    def test_record_and_match(self):
+        self.assertIsNone(self.journal.load())
+        self.journal.record(self.config, "LinuxAgent")
+        data = self.journal.load()
+        self.assertEqual(data["applied_at"], 1000)
+        self.assertEqual(data["connections"]["conn0"], self.config.connections[0].digest())
+
+        names = {c.name for c in self.config.connections}
+        self.assertEqual(self.journal.matching(self.config, "LinuxAgent"), names)
+        self.assertEqual(self.journal.matching(self.config, "MacOSAgent"), set())
+
+        changed = copy.deepcopy(self.config)
+        changed.connections[1].remote_subnets = ["192.0.2.0/24"]
+        self.assertEqual(self.journal.matching(changed, "LinuxAgent"), names - {"conn1"})
+        changed.aggregate_selectors = True
+        self.assertEqual(self.journal.matching(changed, "LinuxAgent"), set())
+
+    def test_partial_record_keeps_other_entries(self):
+        self.journal.record(self.config, "LinuxAgent")
+        changed = copy.deepcopy(self.config)
+        changed.connections[1].remote_subnets = ["192.0.2.0/24"]
+        changed.connections.pop()
+        self.journal.record(changed, "LinuxAgent", ["conn1"])
+        self.assertEqual(self.journal.matching(changed, "LinuxAgent"), {"conn0", "conn1", "conn2", "conn3"})
+
+    def test_unreadable_journal_is_ignored(self):
+        self.journal.path.write_text("{not json")
+        self.assertIsNone(self.journal.load())
+        self.assertEqual(self.journal.matching(self.config, "ScriptedBackend"), set())
+
+    def test_restart_adopts_with_one_status_query(self):
+        first = self.boot(self.config)
+        self.assertEqual(first.state, AgentState.CONNECTED)
+
+        second = self.boot(self.config, up=first.backend.up)
+        self.assertEqual(second.state, AgentState.CONNECTED)
+        self.assertEqual(second.backend.calls, {"status": 1})
+        self.assertEqual(second.backend.history, [])
+
+    def test_restart_applies_only_changed_and_down(self):
+        first = self.boot(self.config)
+        changed = copy.deepcopy(self.config)
+        changed.connections[1].remote_subnets = ["192.0.2.0/24"]
+        up = first.backend.up - {"conn3"}
+
+        second = self.boot(changed, up=up)
+        self.assertEqual(second.backend.history, [(0, "initiate", ["conn1", "conn3"])])
+        self.assertEqual(second.state, AgentState.CONNECTED)
+        names = {c.name for c in changed.connections}
+        self.assertEqual(self.journal.matching(changed, "ScriptedBackend"), names)
+
+    def test_restart_after_an_agent_wide_render_option_changed(self):
+        first = self.boot(self.config)
+        spread = copy.deepcopy(self.config)
+        spread.rekey_spread = 0.5
+        self.assertEqual(self.journal.matching(spread, "ScriptedBackend"), set())
+        second = self.boot(spread, up=first.backend.up)
+        self.assertEqual(second.backend.calls["apply"], 1)
+        self.assertEqual(len(second.backend.history[0][2]), 5)
+
+        # As does this host choosing other proposals for 'auto' connections
+        auto = copy.deepcopy(spread)
+        auto.auto_proposals = select_proposals(CpuFeatures(aes=False))
+        self.assertEqual(self.journal.matching(auto, "ScriptedBackend"), set())
+
+    def test_restart_takes_down_connections_removed_from_the_config(self):
+        first = self.boot(self.config)
+        # Every remaining connection is adopted
+        fewer = copy.deepcopy(self.config)
+        del fewer.connections[4]
+        second = self.boot(fewer, up=first.backend.up)
+        self.assertEqual(second.backend.history[0], (0, "terminate", ["conn4"]))
+        self.assertEqual(second.backend.calls["apply"], 1)
+        self.assertNotIn("conn4", second.backend.up)
+        self.assertEqual(second.state, AgentState.CONNECTED)
+        self.assertEqual(self.journal.connections("ScriptedBackend"), {c.name for c in fewer.connections})
+
+        # Some connections pending
+        self.journal.record(self.config, "ScriptedBackend")
+        changed = copy.deepcopy(fewer)
+        del changed.connections[3]
+        changed.connections[1].remote_subnets = ["192.0.2.0/24"]
+        third = self.boot(changed, up=first.backend.up)
+        self.assertEqual(third.backend.history[:2], [(0, "terminate", ["conn3", "conn4"]), (0, "initiate", ["conn1"])])
+        self.assertEqual(third.backend.up, {"conn0", "conn1", "conn2"})
+        self.assertEqual(self.journal.connections("ScriptedBackend"), {"conn0", "conn1", "conn2"})
+
+    def test_no_journal_applies_everything(self):
+        agent = self.boot(self.config, up={"conn0"})
+        self.assertEqual(agent.backend.calls["apply"], 1)
+        self.assertEqual(len(agent.backend.history[0][2]), 5)
+
+    def test_cleanup_clears_journal(self):
+        agent = self.boot(self.config)
+        agent.cleanup()
+        self.assertIsNone(self.journal.load())
+
+    def test_detach_leaves_tunnels_for_next_process(self):
+        self.config.shutdown_policy = "detach"
+        first = self.boot(self.config)
+        first.shutdown()
+        self.assertEqual(len(first.backend.up), 5)
+        self.assertNotIn("cleanup", first.backend.calls)
+        self.assertIn("detached_at", self.journal.load())
+
+        second = self.boot(self.config, up=first.backend.up)
+        self.assertEqual(second.backend.calls, {"status": 1})
+
+    def test_teardown_is_default(self):
+        agent = self.boot(self.config)
+        agent.shutdown()
+        self.assertEqual(agent.backend.up, set())
+        self.assertIsNone(self.journal.load())
+
+    def test_sigterm_stops_loop(self):
+        self.config.shutdown_policy = "detach"
+        agent = self.boot(self.config)
+        previous = signal.getsignal(signal.SIGTERM)
+        try:
+            agent._install_signal_handlers()
+            agent.clock.call_at(95, lambda: signal.raise_signal(signal.SIGTERM))
+            agent.run_loop(until=1000)
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+        # The sleep notices the stop request at its next slice
+        self.assertGreaterEqual(agent.clock.time(), 95)
+        self.assertLessEqual(agent.clock.time(), 95 + STOP_POLL)
+        agent.shutdown()
+        self.assertEqual(len(agent.backend.up), 5)
+
+    def test_sigterm_lets_the_step_finish(self):
+        agent = self.boot(self.config)
+        status = agent.backend.connection_status
+        def status_then_sigterm():
+            signal.raise_signal(signal.SIGTERM)
+            return status()
+        agent.backend.connection_status = status_then_sigterm
+        previous = signal.getsignal(signal.SIGTERM)
+        try:
+            agent._install_signal_handlers()
+            agent.run_loop(until=1000)
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+        # Stopped after the first step, which ran to the end
+        self.assertEqual(agent.clock.time(), 0)
+        self.assertEqual(set(agent.connection_states.values()), {"CONNECTED"})
+        self.assertEqual(agent.state, AgentState.CONNECTED)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,11 @@
 import unittest
 import shutil
+import subprocess
 from pathlib import Path
+from unittest.mock import patch
 from agent.config_schema import AgentConfig, AuthConfig, EncryptionConfig
 from agent.platforms.linux import LinuxAgent
+from benchmarks.synthetic import synthetic_config
 import logging
 
 class TestLinuxAgent(unittest.TestCase):
@@ -50,5 +53,36 @@ class TestLinuxAgent(unittest.TestCase):
         # Check traffic selector with port
         self.assertIn("[tcp/80]", conf)
 
+    def test_aggregated_selectors(self):
+        conn = self.config.connections[0]
+        conn.local_subnets = ["10.0.0.0/25", "10.0.0.128/25"]
+        conn.protocol, conn.local_port = "any", "any"
+        self.config.aggregate_selectors = True
+
+        agent = LinuxAgent(self.config, self.base_dir, self.logger)
+        conf = agent._generate_swanctl_conf()
+
+        self.assertIn("local_ts = 10.0.0.0/24\n", conf)
+        self.assertIn("# Selector aggregation: 6 -> 3 kernel policies (3 saved)", conf)
+        # IDs are still taken from the configured subnets
+        self.assertIn("local_addrs = 10.0.0.0", conf)
+
+    @patch("agent.platforms.swanctl_backend.subprocess.run")
+    def test_swanctl_timeout_fails_only_that_call(self, run):
+        def swanctl(cmd, **kwargs):
+            if "conn1-child" in cmd or "--list-sas" in cmd:
+                raise subprocess.TimeoutExpired(cmd, kwargs["timeout"])
+            return subprocess.CompletedProcess(cmd, 0, "", "")
+        run.side_effect = swanctl
+        agent = LinuxAgent(synthetic_config(3), self.base_dir, self.logger)
+        agent._swanctl_bin = lambda: "swanctl"
+        self.assertFalse(agent.repair(["conn0", "conn1", "conn2"]))
+        initiated = [c.args[0][-1] for c in run.call_args_list]
+        self.assertEqual(initiated, ["conn0-child", "conn1-child", "conn2-child"])
+        agent.terminate(["conn1"])
+        # A listing that timed out is an error, not every connection down
+        with self.assertRaisesRegex(RuntimeError, "timed out"):
+            agent.connection_status()
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,165 @@
+import shutil
+import logging
+import subprocess
+import unittest
+from pathlib import Path
+from unittest.mock import patch, MagicMock
+from agent.config_schema import AgentConfig
+from agent.mtu import (esp_overhead, inner_mtu, connection_mtu, clamp_mss, clamp_rules,
+                       render_clamp_table, connection_tables, nft_table, EspOverhead)
+from agent.platforms.linux import LinuxAgent, HOST_COMMAND_TIMEOUT
+from benchmarks.synthetic import synthetic_config_dict
+
+def clamp_config(count=1, esp="aes256gcm16", **conn_changes):
+    data = synthetic_config_dict(count)
+    for conn in data["connections"]:
+        conn["mode"] = "tunnel"
+        conn["protocol"], conn["local_port"], conn["remote_port"] = "any", "any", "any"
+        conn["encryption"]["esp"] = esp
+        conn["datapath"] = {"mss_clamp": True}
+        conn.update(conn_changes)
+    return AgentConfig.from_dict(data)
+
+class TestEspOverhead(unittest.TestCase):
+    def test_algorithms(self):
+        self.assertEqual(esp_overhead("aes256gcm16"), EspOverhead(8, 4, 16))
+        self.assertEqual(esp_overhead("aes128gcm8-esn"), EspOverhead(8, 4, 8))
+        self.assertEqual(esp_overhead("chacha20poly1305"), EspOverhead(8, 4, 16))
+        self.assertEqual(esp_overhead("aes256-sha256"), EspOverhead(16, 16, 16))
+        self.assertEqual(esp_overhead("aes128-sha1-modp2048"), EspOverhead(16, 16, 12))
+        self.assertEqual(esp_overhead("3des-md5"), EspOverhead(8, 8, 12))
+        self.assertFalse(esp_overhead("serpent256-sha256").known)
+
+    def test_tunnel_mtu(self):
+        gcm = esp_overhead("aes256gcm16")
+        # 1500 - 20 (IP) - 8 (UDP) - 8 (ESP) - 8 (IV) - 16 (ICV) = 1440, 4-aligned, minus trailer
+        self.assertEqual(inner_mtu(gcm, "tunnel"), 1438)
+        self.assertEqual(inner_mtu(gcm, "tunnel", nat_t=False), 1446)
+        self.assertEqual(inner_mtu(gcm, "tunnel", outer=6), 1418)
+        # CBC pads to 16 bytes: 1500 - 20 - 8 - 8 - 16 - 16 = 1432 -> 1424
+        self.assertEqual(inner_mtu(esp_overhead("aes256-sha256"), "tunnel"), 1422)
+        self.assertEqual(inner_mtu(gcm, "tunnel", link_mtu=9000), 8938)
+
+    def test_transport_keeps_ip_header(self):
+        gcm = esp_overhead("aes256gcm16")
+        self.assertEqual(inner_mtu(gcm, "transport"), 1458)
+
+    def test_connection_uses_worst_proposal(self):
+        config = clamp_config(esp="aes256gcm16,aes256-sha256")
+        self.assertEqual(connection_mtu(config.connections[0], config), 1422)
+        config = clamp_config(esp="default")
+        self.assertEqual(connection_mtu(config.connections[0], config), 1422)
+
+    def test_mss(self):
+        self.assertEqual(clamp_mss(1438, 4), 1398)
+        self.assertEqual(clamp_mss(1438, 6), 1378)
+
+class TestClampRules(unittest.TestCase):
+    def test_both_directions(self):
+        conn = clamp_config().connections[0]
+        rules = clamp_rules(conn, 1438)
+        self.assertEqual(rules, [
+            "ip saddr { 10.0.0.0/26 } ip daddr { 100.64.0.0/28 } tcp flags & (syn | rst) == syn "
+            "tcp option maxseg size > 1398 tcp option maxseg size set 1398",
+            "ip saddr { 100.64.0.0/28 } ip daddr { 10.0.0.0/26 } tcp flags & (syn | rst) == syn "
+            "tcp option maxseg size > 1398 tcp option maxseg size set 1398",
+        ])
+
+    def test_ports_and_families(self):
+        conn = clamp_config(protocol="tcp", local_port="443",
+                            local_subnets=["10.0.0.0/24", "fd00::/64"],
+                            remote_subnets=["192.0.2.0/24", "fd01::/64"]).connections[0]
+        rules = clamp_rules(conn, 1438)
+        self.assertEqual(len(rules), 4)
+        self.assertIn("ip daddr { 192.0.2.0/24 } tcp sport 443 tcp flags", rules[0])
+        self.assertIn("ip daddr { 10.0.0.0/24 } tcp dport 443 tcp flags", rules[1])
+        self.assertTrue(rules[2].startswith("ip6 saddr { fd00::/64 }"))
+        self.assertIn("set 1378", rules[2])
+
+    def test_non_tcp_selectors_need_no_clamp(self):
+        conn = clamp_config(protocol="udp").connections[0]
+        self.assertEqual(clamp_rules(conn, 1438), [])
+
+    def test_table(self):
+        conn = clamp_config().connections[0]
+        script = render_clamp_table(conn, 1438)
+        self.assertTrue(script.startswith("table inet ipsec_agent_conn0\ndelete table inet ipsec_agent_conn0\n"))
+        self.assertIn("type filter hook forward priority mangle; policy accept;", script)
+        self.assertIn("type filter hook output priority mangle; policy accept;", script)
+        self.assertEqual(script.count("jump clamp"), 2)
+
+    def test_table_names(self):
+        self.assertEqual(nft_table("SiteA_1"), "ipsec_agent_SiteA_1")
+        self.assertNotEqual(nft_table("Site-A"), nft_table("Site_A"))
+        self.assertRegex(nft_table("Site-A"), r"^ipsec_agent_Site_A_[0-9a-f]{8}$")
+
+    def test_only_opted_in_connections(self):
+        config = clamp_config(3)
+        config.connections[1].datapath.mss_clamp = False
+        self.assertEqual(list(connection_tables(config)), ["conn0", "conn2"])
+
+class TestLinuxClamps(unittest.TestCase):
+    def setUp(self):
+        self.base_dir = Path("test_output_mtu").resolve()
+        self.base_dir.mkdir(exist_ok=True)
+        self.logger = logging.getLogger("TestMtu")
+        self.logger.setLevel(logging.CRITICAL)
+        self.config = clamp_config(2)
+        self.agent = LinuxAgent(self.config, self.base_dir, self.logger)
+        self.agent._nft_bin = lambda: "nft"
+        self.agent._swanctl_bin = lambda: None
+
+    def tearDown(self):
+        if self.base_dir.exists():
+            shutil.rmtree(self.base_dir)
+
+    def nft_calls(self, run):
+        return [c.args[0][1:] for c in run.call_args_list]
+
+    @patch("agent.platforms.linux.subprocess.run")
+    def test_applied_and_removed_with_connections(self, run):
+        run.return_value = MagicMock(returncode=0, stdout="", stderr="")
+        self.assertTrue(self.agent.apply_policy())
+        self.assertEqual(self.nft_calls(run), [["-f", "-"], ["-f", "-"]])
+        self.assertIn("ipsec_agent_conn0", run.call_args_list[0].kwargs["input"])
+
+        # Unchanged tables are not rewritten
+        run.reset_mock()
+        self.agent.apply_policy()
+        self.assertEqual(run.call_count, 0)
+
+        # Removing a connection drops its table
+        self.config.connections.pop()
+        self.agent.terminate(["conn1"])
+        self.assertEqual(self.nft_calls(run), [["delete", "table", "inet", "ipsec_agent_conn1"]])
+        self.assertEqual(list(self.agent.clamps), ["conn0"])
+
+        # A changed connection gets its table replaced
+        run.reset_mock()
+        self.config.connections[0].datapath.link_mtu = 9000
+        self.agent.apply_policy(["conn0"])
+        self.assertIn("set 8898", run.call_args.kwargs["input"])
+
+    @patch("agent.platforms.linux.subprocess.run")
+    def test_hung_nft_does_not_block(self, run):
+        run.side_effect = subprocess.TimeoutExpired("nft", HOST_COMMAND_TIMEOUT)
+        self.assertTrue(self.agent.apply_policy())
+        self.assertEqual(run.call_args.kwargs["timeout"], HOST_COMMAND_TIMEOUT)
+        self.assertEqual(self.agent.clamps, {})
+        self.agent.cleanup()
+
+        # Retried on the next apply
+        run.side_effect = None
+        run.return_value = MagicMock(returncode=0, stdout="", stderr="")
+        self.agent.apply_policy()
+        self.assertEqual(list(self.agent.clamps), ["conn0", "conn1"])
+
+    @patch("agent.platforms.linux.subprocess.run")
+    def test_cleanup_removes_all_agent_tables(self, run):
+        run.return_value = MagicMock(returncode=0, stdout="table inet filter\ntable inet ipsec_agent_old\n", stderr="")
+        self.agent.cleanup()
+        self.assertIn(["delete", "table", "inet", "ipsec_agent_old"], self.nft_calls(run))
+        self.assertNotIn(["delete", "table", "inet", "filter"], self.nft_calls(run))
+
+if __name__ == '__main__':
+    unittest.main()
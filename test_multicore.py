@@ -0,0 +1,165 @@
+import io
+import shutil
+import logging
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+from agent.config_schema import AgentConfig
+from agent.multicore import (parse_version, kernel_version, per_cpu_sas_supported, cpu_mask,
+                             tuning_report, Tuning)
+from agent.platforms.linux import LinuxAgent
+from agent.platforms.macos import MacOSAgent
+from agent.mtu import render_connection_table
+from agent.swanctl import SwanctlRenderer, multicore_children, spread_rules, parse_list_sas, connection_states
+from benchmarks.swanctl_sim import SwanctlSimulator, parse_conf_children
+from benchmarks.synthetic import synthetic_config_dict
+
+FIXTURES = Path(__file__).parent / "fixtures" / "sysinfo"
+
+def multicore_config(count=1, **datapath):
+    data = synthetic_config_dict(count)
+    for conn in data["connections"]:
+        conn["datapath"] = {"multicore": True, **datapath}
+    return AgentConfig.from_dict(data)
+
+class TestPerCpuSupport(unittest.TestCase):
+    def test_versions(self):
+        self.assertEqual(parse_version("strongSwan swanctl 6.0.1"), (6, 0))
+        self.assertEqual(kernel_version(FIXTURES / "x86_server"), (6, 14))
+        self.assertEqual(kernel_version(FIXTURES / "rpi4"), (6, 6))
+        self.assertIsNone(kernel_version(FIXTURES / "missing"))
+
+    def test_needs_both(self):
+        self.assertTrue(per_cpu_sas_supported((6, 0), (6, 14)))
+        self.assertFalse(per_cpu_sas_supported((5, 9), (6, 14)))
+        self.assertFalse(per_cpu_sas_supported((6, 0), (6, 6)))
+        self.assertFalse(per_cpu_sas_supported(None, (6, 14)))
+
+class TestMulticoreRendering(unittest.TestCase):
+    def test_per_cpu_sas(self):
+        conn = multicore_config().connections[0]
+        self.assertEqual(multicore_children(conn, per_cpu_sas=True, cpus=8),
+                         [("conn0-child", "\n                per_cpu_sas = yes")])
+
+    def test_parallel_children_with_marks(self):
+        renderer = SwanctlRenderer()
+        renderer.cpus = 4
+        conf = io.StringIO()
+        renderer.write(conf, multicore_config())
+        text = conf.getvalue()
+        self.assertEqual(parse_conf_children(text)["conn0"], ["conn0-child", "conn0-child-1", "conn0-child-2", "conn0-child-3"])
+        self.assertIn("mark_out = 0x30000/0xff0000", text)
+        self.assertEqual(text.count("mark_out"), 3) # child 0 takes unmarked traffic
+
+    def test_parallel_sas_overrides_cpu_count(self):
+        conn = multicore_config(parallel_sas=2).connections[0]
+        self.assertEqual(len(multicore_children(conn, cpus=64)), 2)
+        self.assertEqual(len(multicore_children(multicore_config().connections[0], cpus=64)), 16)
+
+    def test_marks_for_parallel_children(self):
+        conn = multicore_config(parallel_sas=3).connections[0]
+        self.assertEqual(spread_rules(conn, 1), [])
+        rules = spread_rules(conn, 3)
+        self.assertEqual(len(rules), 3)
+        match = f"ip saddr {{ {conn.local_subnets[0]} }} ip daddr {{ {conn.remote_subnets[0]} }}"
+        self.assertEqual(rules[0], f"{match} meta mark set meta mark & 0xff00ffff")
+        self.assertEqual(rules[2], f"{match} jhash ip saddr . ip daddr mod 3 seed 0x0 == 2 meta mark set meta mark | 0x00020000")
+        # Every mark the rules set selects one of the rendered children
+        marks = {int(extra.split("=")[1].split("/")[0], 16) for _, extra in multicore_children(conn) if extra}
+        self.assertEqual(marks, {0x10000, 0x20000})
+
+        script = render_connection_table(conn, spread=3)
+        self.assertIn("type filter hook prerouting priority mangle; policy accept;", script)
+        self.assertIn("type route hook output priority mangle; policy accept;", script)
+        self.assertEqual(script.count("jump spread"), 2)
+        self.assertNotIn("clamp", script)
+
+    def test_validation(self):
+        for bad in ({"parallel_sas": 0}, {"parallel_sas": 17}, {"mark_out": "5"}):
+            with self.assertRaises(ValueError, msg=bad):
+                multicore_config(**bad).validate()
+
+    def test_extra_children_do_not_count_for_status(self):
+        sas = parse_list_sas(
+            "conn0: #1, ESTABLISHED, IKEv2, 1_i* 2_r\n"
+            "  conn0-child-1: #2, reqid 2, INSTALLED, TUNNEL, ESP:AES_GCM_16-256\n")
+        config = multicore_config()
+        self.assertEqual(connection_states(sas, config.connections), {"conn0": "CONNECTING"})
+
+class TestMulticoreBackends(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = Path("test_output_multicore").resolve()
+        self.work_dir.mkdir(exist_ok=True)
+        self.logger = logging.getLogger("TestMulticore")
+        self.logger.setLevel(logging.CRITICAL)
+
+    def tearDown(self):
+        if self.work_dir.exists():
+            shutil.rmtree(self.work_dir)
+
+    def test_linux_initiates_every_child(self):
+        config = multicore_config(2, parallel_sas=3)
+        backend = LinuxAgent(config, self.work_dir, self.logger)
+        with SwanctlSimulator(self.work_dir / "sim", backend.conf_dir) as sim:
+            backend.renderer.per_cpu_sas = backend._per_cpu_sas() # simulated 5.9: parallel children
+            self.assertTrue(backend.apply_policy())
+            self.assertEqual(len(sim.installed()), 6)
+            self.assertEqual(backend.connection_status(), {"conn0": "CONNECTED", "conn1": "CONNECTED"})
+            sim.drop(children=["conn1-child-2"])
+            sim.reset_counts()
+            backend.repair(["conn1"])
+            self.assertEqual(sim.call_counts()["--initiate"], 3)
+            self.assertIn("conn1-child-2", sim.installed())
+
+    @patch("agent.platforms.linux.subprocess.run")
+    def test_linux_marks_parallel_children(self, run):
+        run.return_value = MagicMock(returncode=0, stdout="", stderr="")
+        config = multicore_config(2, parallel_sas=3)
+        config.connections[1].datapath.multicore = False
+        backend = LinuxAgent(config, self.work_dir, self.logger)
+        backend._nft_bin = lambda: "nft"
+        backend._swanctl_bin = lambda: None
+        self.assertTrue(backend.apply_policy())
+        self.assertEqual(list(backend.clamps), ["conn0"])
+        self.assertIn("jump spread", backend.clamps["conn0"])
+
+        # With per-CPU SAs there is a single child and nothing to mark
+        backend.renderer.per_cpu_sas = True
+        run.reset_mock()
+        self.assertTrue(backend.apply_policy())
+        self.assertEqual(backend.clamps, {})
+        self.assertEqual([c.args[0][1:] for c in run.call_args_list], [["delete", "table", "inet", "ipsec_agent_conn0"]])
+
+    def test_macos_ignores_multicore(self):
+        backend = MacOSAgent(multicore_config(), self.work_dir, self.logger)
+        self.assertEqual(backend._children("conn0"), ["conn0-child"])
+        self.assertNotIn("conn0-child-1", backend._generate_swanctl_conf())
+
+class TestTuningReport(unittest.TestCase):
+    def test_cpu_mask(self):
+        self.assertEqual(cpu_mask(range(4)), "f")
+        self.assertEqual(cpu_mask([0, 4]), "11")
+        self.assertEqual(cpu_mask(range(40)), "ff,ffffffff")
+
+    def test_server_fixture(self):
+        report = {t.setting: t for t in tuning_report(FIXTURES / "x86_server")}
+        # eth0 has a receive queue per CPU, so no RPS there; eth1 has one queue
+        self.assertNotIn("/sys/class/net/eth0/queues/rx-0/rps_cpus", report)
+        self.assertEqual(report["/sys/class/net/eth1/queues/rx-0/rps_cpus"].recommended, "f")
+        # 8 transmit queues for 4 CPUs: one CPU per queue, the rest stay unmapped
+        self.assertEqual(report["/sys/class/net/eth0/queues/tx-3/xps_cpus"].recommended, "8")
+        self.assertNotIn("/sys/class/net/eth0/queues/tx-4/xps_cpus", report)
+        self.assertEqual(report["/proc/sys/net/core/rps_sock_flow_entries"].recommended, "32768")
+        self.assertIn("pcrypt", report)
+        self.assertEqual(report["/sys/class/net/eth1/queues/rx-0/rps_cpus"].command(),
+                         "echo f > /sys/class/net/eth1/queues/rx-0/rps_cpus")
+
+    def test_tuned_host_has_nothing_to_report(self):
+        self.assertEqual(tuning_report(FIXTURES / "rpi4"), [])
+
+    def test_describe(self):
+        t = Tuning("/proc/x", "0", "1", "why")
+        self.assertEqual(t.describe(), "/proc/x: 0 -> 1 (why)")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import io
+import shutil
+import logging
+import unittest
+from pathlib import Path
+from agent.config_schema import AgentConfig
+from agent.core import AgentState
+from agent.datapath import datapath_warnings
+from agent.platforms.linux import LinuxAgent
+from agent.simulation import Scenario, simulate
+from agent.swanctl import SwanctlRenderer, parse_list_sas, parse_list_pols, connection_states
+from benchmarks.swanctl_sim import SwanctlSimulator
+from benchmarks.synthetic import synthetic_config_dict
+
+def on_demand_config(count=2, idle_timeout=600):
+    """conn0 is on demand; the others are started as usual."""
+    data = synthetic_config_dict(count)
+    data["connections"][0].update(on_demand=True, idle_timeout=idle_timeout)
+    config = AgentConfig.from_dict(data)
+    config.validate()
+    return config
+
+class TestOnDemandConfig(unittest.TestCase):
+    def test_rendering(self):
+        conf = io.StringIO()
+        SwanctlRenderer().write(conf, on_demand_config(idle_timeout=300))
+        conn0, conn1 = conf.getvalue().split("conn1 {", 1)
+        self.assertIn("start_action = trap", conn0)
+        self.assertIn("close_action = trap", conn0)
+        self.assertIn("inactivity = 300s", conn0)
+        self.assertIn("start_action = start", conn1)
+        self.assertNotIn("inactivity", conn1)
+
+    def test_idle_timeout_must_be_positive(self):
+        data = synthetic_config_dict(1)
+        data["connections"][0].update(on_demand=True, idle_timeout=0)
+        with self.assertRaisesRegex(ValueError, "idle_timeout"):
+            AgentConfig.from_dict(data).validate()
+
+    def test_windows_ignores_on_demand(self):
+        config = on_demand_config()
+        self.assertIn("on_demand", "\n".join(datapath_warnings(config, "Windows", [])))
+        self.assertEqual(datapath_warnings(config, "Darwin", []), [])
+
+class TestOnDemandStatus(unittest.TestCase):
+    POLS = ("conn0/conn0-child, TUNNEL\n"
+            "  local:  10.0.0.0/26\n"
+            "  remote: 100.64.0.0/28\n"
+            "bypass-lan, PASS\n")
+
+    def test_parse_list_pols(self):
+        self.assertEqual(parse_list_pols(self.POLS), {"conn0-child"})
+        self.assertEqual(parse_list_pols("conn0~2-child, TRANSPORT\n"), {"conn0~2-child"})
+
+    def test_trapped_connection_is_idle(self):
+        config = on_demand_config()
+        states = connection_states([], config.connections, parse_list_pols(self.POLS))
+        self.assertEqual(states, {"conn0": "IDLE", "conn1": "DISCONNECTED"})
+
+    def test_established_wins_over_trap(self):
+        sas = parse_list_sas(
+            "conn0: #1, ESTABLISHED, IKEv2, 1_i* 2_r\n"
+            "  conn0-child: #2, reqid 2, INSTALLED, TUNNEL, ESP:AES_GCM_16-256\n")
+        states = connection_states(sas, on_demand_config().connections, {"conn0-child"})
+        self.assertEqual(states["conn0"], "CONNECTED")
+
+    def test_trap_only_counts_for_on_demand_connections(self):
+        states = connection_states([], on_demand_config().connections, {"conn1-child"})
+        self.assertEqual(states["conn1"], "DISCONNECTED")
+
+class TestOnDemandLoop(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger("TestOnDemand")
+        self.logger.setLevel(logging.CRITICAL)
+
+    def test_idle_is_healthy_and_not_repaired(self):
+        agent = simulate(on_demand_config(), Scenario(), logger=self.logger)
+        agent.run_loop(until=3600)
+        self.assertEqual(agent.state, AgentState.CONNECTED)
+        self.assertEqual(agent.backend.connection_status(), {"conn0": "IDLE", "conn1": "CONNECTED"})
+        self.assertEqual([h for h in agent.backend.history if h[1] == "initiate"], [(0, "initiate", ["conn0", "conn1"])])
+        self.assertEqual(agent.backend.calls["install"], 1)
+        self.assertEqual(agent.backend.calls["initiate"], 1)
+
+    def test_traffic_then_idle_teardown(self):
+        scenario = Scenario().traffic(1000, ["conn0"]).traffic(1300, ["conn0"])
+        agent = simulate(on_demand_config(idle_timeout=600), scenario, logger=self.logger)
+        agent.run_loop(until=3600)
+        events = [(t, event) for t, event, names in agent.backend.history if event in ("acquire", "idle")]
+        # The second packet arrives on the established SA and pushes the teardown back
+        self.assertEqual(events, [(1000, "acquire"), (1900, "idle")])
+        self.assertEqual(agent.state, AgentState.CONNECTED)
+        self.assertNotIn("conn0", agent.backend.up)
+
+    def test_dropped_on_demand_sa_falls_back_to_trap(self):
+        scenario = Scenario().traffic(100, ["conn0"]).drop(500, ["conn0"])
+        agent = simulate(on_demand_config(), scenario, logger=self.logger)
+        agent.run_loop(until=1000)
+        self.assertEqual(agent.backend.connection_status()["conn0"], "IDLE")
+        self.assertEqual(agent.backend.calls["install"], 1)
+
+class TestOnDemandSwanctl(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = Path("test_output_on_demand").resolve()
+        self.work_dir.mkdir(exist_ok=True)
+        self.logger = logging.getLogger("TestOnDemand")
+        self.logger.setLevel(logging.CRITICAL)
+
+    def tearDown(self):
+        if self.work_dir.exists():
+            shutil.rmtree(self.work_dir)
+
+    def test_linux_installs_traps_instead_of_initiating(self):
+        backend = LinuxAgent(on_demand_config(), self.work_dir, self.logger)
+        with SwanctlSimulator(self.work_dir / "sim", backend.conf_dir) as sim:
+            self.assertTrue(backend.apply_policy())
+            self.assertEqual(sim.installed(), {"conn1-child"})
+            self.assertEqual(sim.call_counts()["--initiate"], 1)
+            # Loading the config installs the trap; a repair installs it again instead of initiating
+            self.assertEqual(sim.trapped(), {"conn0-child"})
+            backend.repair(["conn0"])
+            self.assertEqual(sim.call_counts()["--install"], 1)
+            self.assertEqual(backend.connection_status(), {"conn0": "IDLE", "conn1": "CONNECTED"})
+            self.assertEqual(backend.check_status(), "CONNECTED")
+
+            self.assertEqual(sim.traffic(["conn0-child"]), {"conn0-child"})
+            self.assertEqual(backend.connection_status()["conn0"], "CONNECTED")
+            self.assertEqual(sim.call_counts()["--initiate"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import importlib.util
+import json
+import os
+import shutil
+import subprocess
+import sys
+import unittest
+import zipfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "scripts"))
+from pkg import ZIPAPP_NAME, build_zipapp
+from benchmarks import bench_startup
+
+class TestZipapp(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = Path("test_output_pkg").resolve()
+        cls.work_dir.mkdir(exist_ok=True)
+        cls.pyz = build_zipapp(cls.work_dir / ZIPAPP_NAME)
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.work_dir.exists():
+            shutil.rmtree(cls.work_dir)
+
+    def python(self, *args, path_entry=None) -> subprocess.CompletedProcess:
+        env = {k: v for k, v in os.environ.items() if k != "PYTHONPATH"}
+        if path_entry:
+            env["PYTHONPATH"] = str(path_entry)
+        return subprocess.run([sys.executable, *args], cwd=self.work_dir, env=env, capture_output=True, text=True, timeout=60)
+
+    def test_precompiled_unchecked_bytecode(self):
+        self.assertTrue(self.pyz.read_bytes().startswith(
+            f"#!/usr/bin/env python{sys.version_info.major}.{sys.version_info.minor}\n".encode()))
+        with zipfile.ZipFile(self.pyz) as z:
+            names = set(z.namelist())
+            self.assertIn("__main__.pyc", names)
+            self.assertFalse([n for n in names if "__pycache__" in n])
+            sources = [n for n in names if n.startswith("agent/") and n.endswith(".py")]
+            self.assertIn("agent/platforms/linux.py", sources)
+            for source in sources:
+                header = z.read(source + "c")[:8]
+                self.assertEqual(header[:4], importlib.util.MAGIC_NUMBER, source)
+                # Hash-based, not checked against the source
+                self.assertEqual(int.from_bytes(header[4:8], "little"), 0b01, source)
+
+    def test_entry_point_and_agent_directory(self):
+        result = self.python(str(self.pyz))
+        self.assertEqual(result.returncode, 1)
+        self.assertIn("Usage:", result.stdout)
+        result = self.python("-c", "import agent, agent.core; print(agent.install_dir()); print(agent.core.__file__)",
+                             path_entry=self.pyz)
+        install_dir, core = result.stdout.split()
+        self.assertEqual(Path(install_dir), self.work_dir)
+        self.assertTrue(core.endswith(".pyc"), core)
+
+    def test_lazy_imports(self):
+        modules = json.dumps(bench_startup.LAZY_MODULES)
+        result = self.python("-c", f"import sys, agent.core; print([m for m in {modules} if m in sys.modules])",
+                             path_entry=self.pyz)
+        self.assertEqual(result.stdout.strip(), "[]", result.stderr)
+
+class TestStartupBenchmark(unittest.TestCase):
+    def test_parse_importtime(self):
+        text = ("import time: self [us] | cumulative | imported package\n"
+                "import time:       120 |        120 |   _ast\n"
+                "import time:      2000 |       2120 | agent.core\n")
+        self.assertEqual(bench_startup.parse_importtime(text), [
+            {"module": "_ast", "self_us": 120, "cumulative_us": 120, "depth": 1},
+            {"module": "agent.core", "self_us": 2000, "cumulative_us": 2120, "depth": 0},
+        ])
+
+    def test_budgets(self):
+        report = bench_startup.main(["--runs", "1", "--connections", "3", "--output", "test_startup.json",
+                                     "--import-budget-ms", "5000", "--apply-budget-ms", "30000"])
+        try:
+            with open("test_startup.json") as f:
+                self.assertEqual(json.load(f), report)
+        finally:
+            os.remove("test_startup.json")
+        self.assertEqual(report["over_budget"], [])
+        self.assertGreater(report["zipapp"]["first_apply_ms"], 0)
+        self.assertEqual(report["zipapp"]["eager"], [])
+
+        report = bench_startup.main(["--runs", "1", "--connections", "3", "--output", "test_startup.json",
+                                     "--import-budget-ms", "0.001"])
+        os.remove("test_startup.json")
+        self.assertEqual(len(report["over_budget"]), 1)
+        self.assertIn("import", report["over_budget"][0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+import asyncio
+import socket
+import logging
+import threading
+import time
+import unittest
+from agent.config_schema import AgentConfig
+from agent.core import AgentState
+from agent.probes import ProbeSpec, ProbeResult, run_probes, percentile, verdict, probe_specs
+from agent.simulation import Scenario, simulate
+from benchmarks.synthetic import synthetic_config_dict
+
+class Responders:
+    """UDP echo (optionally dropping every n-th datagram) and TCP listener on localhost, in a background loop."""
+    def __init__(self, drop_every: int = 0):
+        self.drop_every = drop_every
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result(5)
+        return self
+
+    async def _start(self):
+        responders = self
+
+        class Echo(asyncio.DatagramProtocol):
+            seen = 0
+
+            def connection_made(self, transport):
+                self.transport = transport
+
+            def datagram_received(self, data, addr):
+                Echo.seen += 1
+                if responders.drop_every and Echo.seen % responders.drop_every == 0:
+                    return
+                self.transport.sendto(data, addr)
+
+        self.udp, _ = await self.loop.create_datagram_endpoint(Echo, local_addr=("127.0.0.1", 0))
+        self.udp_port = self.udp.get_extra_info("sockname")[1]
+        self.tcp = await asyncio.start_server(lambda r, w: w.close(), "127.0.0.1", 0)
+        self.tcp_port = self.tcp.sockets[0].getsockname()[1]
+
+    def __exit__(self, *exc):
+        async def stop():
+            self.udp.close()
+            self.tcp.close()
+        asyncio.run_coroutine_threadsafe(stop(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+
+def unused_port(kind=socket.SOCK_DGRAM) -> int:
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def spec(name="conn0", **changes):
+    values = dict(target="127.0.0.1", count=4, interval=0.01, timeout=0.3)
+    values.update(changes)
+    return ProbeSpec(name, **values)
+
+class TestVerdicts(unittest.TestCase):
+    def test_percentile(self):
+        self.assertEqual(percentile([5, 1, 3, 2, 4], 50), 3)
+        self.assertEqual(percentile([5, 1, 3, 2, 4], 90), 5)
+        self.assertEqual(percentile(list(range(1, 101)), 99), 99)
+        self.assertIsNone(percentile([], 50))
+
+    def test_verdict(self):
+        s = spec(max_rtt_ms=50)
+        self.assertEqual(verdict(s, ProbeResult("c", "t", "udp", 4, [1, 2, 3, 4])), "healthy")
+        self.assertEqual(verdict(s, ProbeResult("c", "t", "udp", 4, [1, 2, 3])), "degraded")
+        self.assertEqual(verdict(s, ProbeResult("c", "t", "udp", 4, [1, 2, 3, 80])), "degraded")
+        self.assertEqual(verdict(s, ProbeResult("c", "t", "udp", 4, [])), "down")
+        self.assertEqual(verdict(spec(max_loss=0.5), ProbeResult("c", "t", "udp", 4, [1, 2])), "down")
+
+    def test_result_dict(self):
+        result = ProbeResult("c", "t", "udp", 4, [1.0, 2.0, 3.0])
+        d = result.to_dict()
+        self.assertEqual((d["received"], d["loss"], d["rtt_p50_ms"], d["rtt_p99_ms"]), (3, 0.25, 2.0, 3.0))
+        self.assertNotIn("rtts_ms", d)
+
+class TestLocalhostProbes(unittest.TestCase):
+    def test_udp_echo(self):
+        with Responders() as r:
+            result = run_probes([spec(port=r.udp_port)])["conn0"]
+        self.assertEqual((result.sent, result.received, result.verdict), (4, 4, "healthy"))
+        self.assertLess(percentile(result.rtts_ms, 99), 300)
+
+    def test_udp_loss(self):
+        with Responders(drop_every=2) as r:
+            result = run_probes([spec(port=r.udp_port)])["conn0"]
+        self.assertEqual((result.received, result.loss, result.verdict), (2, 0.5, "degraded"))
+
+    def test_udp_without_responder_is_down(self):
+        result = run_probes([spec(port=unused_port())])["conn0"]
+        self.assertEqual((result.sent, result.received, result.verdict), (4, 0, "down"))
+
+    def test_tcp_connect_and_refused(self):
+        with Responders() as r:
+            results = run_probes([spec("open", protocol="tcp", port=r.tcp_port),
+                                  spec("refused", protocol="tcp", port=unused_port(socket.SOCK_STREAM))])
+        self.assertEqual(results["open"].verdict, "healthy")
+        # A RST proves the path works
+        self.assertEqual(results["refused"].verdict, "healthy")
+
+    def test_bad_source_is_reported(self):
+        result = run_probes([spec(port=7, source="192.0.2.1")])["conn0"]
+        self.assertEqual(result.verdict, "down")
+        self.assertIsNotNone(result.error)
+
+    def test_thousands_of_targets(self):
+        with Responders() as r:
+            specs = [spec(f"conn{i}", port=r.udp_port, count=2, interval=0.05, timeout=2.0) for i in range(2000)]
+            t0 = time.perf_counter()
+            results = run_probes(specs, concurrency=512)
+            elapsed = time.perf_counter() - t0
+        self.assertEqual(len(results), 2000)
+        self.assertGreater(sum(r.verdict != "down" for r in results.values()), 1900)
+        # Concurrent: nowhere near 2000 sequential rounds
+        self.assertLess(elapsed, 30)
+
+    def test_round_time_at_scale(self):
+        # Defaults of a probe section: a round is about (count + 1) * interval + timeout
+        count, interval, timeout = 5, 0.2, 1.0
+        with Responders() as r:
+            specs = [spec(f"conn{i}", port=r.udp_port, count=count, interval=interval, timeout=timeout) for i in range(5000)]
+            t0 = time.perf_counter()
+            results = run_probes(specs)
+            elapsed = time.perf_counter() - t0
+        self.assertGreater(sum(r.verdict != "down" for r in results.values()), 4900)
+        self.assertLess(elapsed, (count + 1) * interval + timeout + 3)
+
+    def test_tcp_slots_are_held_per_attempt(self):
+        port = unused_port(socket.SOCK_STREAM)
+        specs = [spec(f"conn{i}", protocol="tcp", port=port, count=3, interval=0.2) for i in range(20)]
+        t0 = time.perf_counter()
+        results = run_probes(specs, concurrency=1)
+        elapsed = time.perf_counter() - t0
+        self.assertTrue(all(r.verdict == "healthy" for r in results.values()))
+        # Not 20 rounds one after the other
+        self.assertLess(elapsed, 2)
+
+class TestProbeConfig(unittest.TestCase):
+    def config_dict(self, **probe):
+        data = synthetic_config_dict(2)
+        data["connections"][0]["probe"] = {"target": "100.64.0.1", **probe}
+        return data
+
+    def test_specs(self):
+        config = AgentConfig.from_dict(self.config_dict(protocol="TCP", port=22))
+        config.validate()
+        self.assertEqual(probe_specs(config), [ProbeSpec("conn0", "100.64.0.1", "tcp", 22)])
+
+    def test_invalid(self):
+        for bad in ({"target": "192.0.2.1"}, {"source": "192.0.2.1"}, {"protocol": "icmp"},
+                    {"port": 0}, {"count": 0}, {"max_loss": 0}):
+            with self.assertRaises(ValueError, msg=bad):
+                AgentConfig.from_dict(self.config_dict(**bad)).validate()
+        with self.assertRaisesRegex(ValueError, "ttl"):
+            AgentConfig.from_dict(self.config_dict(ttl=3))
+
+class TestProbeRepair(unittest.TestCase):
+    def test_blackholed_tunnel_is_reestablished(self):
+        logger = logging.getLogger("TestProbes")
+        logger.setLevel(logging.CRITICAL)
+        data = synthetic_config_dict(3)
+        data["connections"][1]["probe"] = {"target": "100.64.0.17"}
+        config = AgentConfig.from_dict(data)
+        config.validate()
+
+        agent = simulate(config, Scenario().blackhole(100, ["conn1", "conn2"]), logger=logger)
+        agent.run_loop(until=200)
+        history = agent.backend.history
+        # Only the probed connection is noticed, at the first check after it broke
+        self.assertIn((120, "terminate", ["conn1"]), history)
+        self.assertIn((120, "initiate", ["conn1"]), history)
+        self.assertFalse([names for t, event, names in history if "conn2" in names and t > 0])
+        self.assertEqual(agent.state, AgentState.CONNECTED)
+        self.assertEqual(agent.probe_results["conn1"].verdict, "healthy")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import copy
+import io
+import unittest
+import logging
+from pathlib import Path
+from agent.core import IPsecAgent
+from agent.simulation import Scenario, simulate
+from agent.proposals import select_proposals, benchmark_crypto, windows_crypto
+from agent.swanctl import SwanctlRenderer
+from agent.sysinfo import cpu_features, CpuFeatures
+from benchmarks.synthetic import synthetic_config
+
+FIXTURES = Path(__file__).parent / "fixtures" / "sysinfo"
+
+def fake_speed(rates):
+    """'openssl speed -mr' output with the given rates (bytes/s for ciphers, op/s for key exchange)."""
+    def speed(args, seconds):
+        algo = args[-1]
+        if algo in ("ecdhx25519", "ecdhp256", "ffdh2048"):
+            return f"+R7:18470:253:0.99\n+F5:22:253:{rates[algo]}:0.000054\n"
+        return f"+DT:{algo}:1:16384\n+H:16384\n+F:25:{algo.upper()}:{rates[algo]}\n"
+    return speed
+
+class TestCpuFeatures(unittest.TestCase):
+    def test_x86_server(self):
+        f = cpu_features(FIXTURES / "x86_server")
+        self.assertEqual((f.aes, f.clmul, f.sha, f.simd, f.cpus), (True, True, True, True, 4))
+        self.assertTrue(f.detected)
+
+    def test_arm_without_crypto_extensions(self):
+        f = cpu_features(FIXTURES / "rpi4")
+        self.assertEqual((f.aes, f.clmul, f.simd), (False, False, True))
+        self.assertIn("without AES", f.describe())
+
+    def test_unknown(self):
+        f = cpu_features(FIXTURES / "missing")
+        self.assertIsNone(f.aes)
+        self.assertFalse(f.detected)
+
+class TestProposalSelection(unittest.TestCase):
+    def test_aesni_prefers_gcm_and_ecc(self):
+        choice = select_proposals(cpu_features(FIXTURES / "x86_server"))
+        self.assertEqual(choice.esp, ["aes256gcm16", "aes128gcm16", "chacha20poly1305", "aes256-sha256"])
+        self.assertEqual(choice.ike[0], "aes256gcm16-prfsha256-x25519-ecp256-modp2048")
+        self.assertTrue(any("AES-GCM first" in r for r in choice.reasons))
+
+    def test_no_aes_prefers_chacha(self):
+        choice = select_proposals(cpu_features(FIXTURES / "rpi4"))
+        self.assertEqual(choice.esp[0], "chacha20poly1305")
+        self.assertEqual(choice.esp[-1], "aes256-sha256")
+
+    def test_unknown_cpu_is_explained(self):
+        choice = select_proposals(CpuFeatures())
+        self.assertEqual(choice.esp[0], "aes256gcm16")
+        self.assertIn("Assuming AES and carry-less multiply acceleration", choice.reasons)
+
+    def test_benchmark_orders_with_margin(self):
+        rates = {"aes-256-gcm": 2.0e9, "chacha20-poly1305": 2.2e9, "aes-256-cbc": 8e8, "sha256": 1e9,
+                 "ecdhx25519": 18000, "ecdhp256": 25000, "ffdh2048": 2000}
+        bench = benchmark_crypto(speed=fake_speed(rates))
+        self.assertAlmostEqual(bench["cbc"], 1 / (1 / 8e8 + 1 / 1e9))
+        choice = select_proposals(cpu_features(FIXTURES / "x86_server"), bench)
+        # 10% faster ChaCha is within noise; 39% faster ECP-256 is not
+        self.assertEqual(choice.esp[0], "aes256gcm16")
+        self.assertEqual(choice.ike[0], "aes256gcm16-prfsha256-ecp256-x25519-modp2048")
+
+        rates["chacha20-poly1305"] = 5e9
+        choice = select_proposals(cpu_features(FIXTURES / "x86_server"), benchmark_crypto(speed=fake_speed(rates)))
+        self.assertEqual(choice.esp[0], "chacha20poly1305")
+        self.assertTrue(any("Measured ESP throughput" in r for r in choice.reasons))
+
+    def test_windows_mapping(self):
+        params = windows_crypto(select_proposals(cpu_features(FIXTURES / "rpi4")))
+        # ChaCha20 and curve25519 are not available on Windows
+        self.assertEqual(params, {"Encryption": "AES256", "Hash": "SHA256", "DHGroup": "DH19",
+                                  "QMEncryption": "AESGCM256", "QMHash": "AESGMAC256"})
+
+class TestAutoProposalRendering(unittest.TestCase):
+    def test_rendered_and_cached_by_choice(self):
+        config = synthetic_config(2)
+        config.connections[0].encryption.esp = "auto"
+        renderer = SwanctlRenderer()
+        text = io.StringIO()
+        renderer.write(text, config)
+        self.assertEqual(text.getvalue().count("esp_proposals = aes256-sha256"), 2)
+
+        config.auto_proposals = select_proposals(cpu_features(FIXTURES / "x86_server"))
+        text = io.StringIO()
+        self.assertEqual(renderer.write(text, config).rendered, 2)
+        self.assertIn("esp_proposals = aes256gcm16,aes128gcm16,chacha20poly1305,aes256-sha256", text.getvalue())
+
+    def test_agent_selects_only_when_used(self):
+        agent = IPsecAgent(None, logger=logging.getLogger("TestProposals"))
+        agent.config = synthetic_config(2)
+        agent._select_auto_proposals()
+        self.assertIsNone(agent.config.auto_proposals)
+        agent.config.connections[1].encryption.ike = "auto"
+        agent._select_auto_proposals()
+        self.assertTrue(agent.config.auto_proposals.ike)
+
+    def test_reload_keeps_the_host_choice(self):
+        config = synthetic_config(2)
+        config.connections[0].encryption.esp = "auto"
+        reloaded = copy.deepcopy(config)
+        agent = simulate(config, Scenario(), logger=logging.getLogger("TestProposals"))
+        agent._select_auto_proposals()
+        choice = agent.config.auto_proposals
+        self.assertIsNotNone(choice)
+        # As read from disk, the reloaded config has no choice yet: it takes the running one, not the static default
+        self.assertIsNone(reloaded.auto_proposals)
+        self.assertEqual(agent.reload(reloaded), {"added": [], "removed": [], "changed": []})
+        self.assertIs(agent.config.auto_proposals, choice)
+        self.assertEqual(agent.backend.calls.get("apply"), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+import io
+import copy
+import json
+import shutil
+import subprocess
+import logging
+import unittest
+from pathlib import Path
+from unittest.mock import patch, MagicMock
+from agent.config_schema import AgentConfig
+from agent.platforms.linux import LinuxAgent, HOST_COMMAND_TIMEOUT
+from agent.routing import route_plan, plan_commands, removal_commands, render_script, main
+from agent.swanctl import SwanctlRenderer, PFKEY_DATAPATH_OPTIONS
+from benchmarks.synthetic import synthetic_config_dict
+
+def routed_config_dict(count=3):
+    """conn0 and conn1 are two links to one site (ECMP group 'dc'); conn2 is its own site."""
+    data = synthetic_config_dict(count)
+    for i, conn in enumerate(data["connections"]):
+        conn["mode"] = "tunnel"
+        conn["protocol"], conn["local_port"], conn["remote_port"] = "any", "any", "any"
+        conn["encryption"]["esp"] = "aes256gcm16"
+        conn["routing"] = {"mode": "route", "if_id": 10 + i}
+    for conn in data["connections"][:2]:
+        conn["remote_subnets"] = ["192.168.0.0/24", "fd00:1::/64"]
+        conn["routing"]["group"] = "dc"
+    if count > 1:
+        data["connections"][1]["routing"]["weight"] = 3
+    return data
+
+def routed_config(count=3):
+    config = AgentConfig.from_dict(routed_config_dict(count))
+    config.validate()
+    return config
+
+class TestRoutingConfig(unittest.TestCase):
+    def test_derived_if_id_is_stable(self):
+        data = routed_config_dict(1)
+        data["connections"][0]["routing"] = {"mode": "route"}
+        routing = AgentConfig.from_dict(data).connections[0].routing
+        if_id = routing.resolved_if_id("conn0")
+        self.assertEqual(if_id, routing.resolved_if_id("conn0"))
+        self.assertEqual(routing.resolved_interface("conn0"), f"xfrm{if_id}")
+
+    def test_shared_prefix_needs_group(self):
+        data = routed_config_dict()
+        del data["connections"][1]["routing"]["group"]
+        with self.assertRaisesRegex(ValueError, "routing.group"):
+            AgentConfig.from_dict(data).validate()
+
+    def test_duplicate_if_id(self):
+        data = routed_config_dict()
+        data["connections"][2]["routing"]["if_id"] = 10
+        with self.assertRaisesRegex(ValueError, "share if_id 10"):
+            AgentConfig.from_dict(data).validate()
+
+    def test_invalid(self):
+        for bad in ({"mode": "bgp"}, {"mode": "route", "interface": "a-very-long-interface"},
+                    {"mode": "route", "weight": 0}):
+            data = routed_config_dict(1)
+            data["connections"][0]["routing"] = bad
+            with self.assertRaises(ValueError, msg=bad):
+                AgentConfig.from_dict(data).validate()
+
+    def test_ecmp_members_are_not_selector_conflicts(self):
+        self.assertEqual(routed_config().selector_conflicts, [])
+
+class TestRouteBasedRendering(unittest.TestCase):
+    def render(self, config, renderer=None):
+        conf = io.StringIO()
+        (renderer or SwanctlRenderer()).write(conf, config)
+        return conf.getvalue()
+
+    def test_catch_all_selectors_and_if_id(self):
+        text = self.render(routed_config())
+        self.assertIn("local_ts = 0.0.0.0/0\n", text)
+        self.assertIn("remote_ts = 0.0.0.0/0,::/0\n", text)
+        self.assertIn("if_id_in = 11\n                if_id_out = 11", text)
+        self.assertNotIn("192.168.0.0/24", text)
+
+    def test_generation_keeps_if_id(self):
+        config = routed_config()
+        config.connections[0].name = "conn0~2"
+        self.assertIn("if_id_out = 10", self.render(config))
+
+    def test_pfkey_falls_back_to_policies(self):
+        text = self.render(routed_config(), SwanctlRenderer(datapath_options=PFKEY_DATAPATH_OPTIONS))
+        self.assertNotIn("if_id", text)
+        self.assertIn("remote_ts = 192.168.0.0/24,fd00:1::/64", text)
+
+class TestRoutePlan(unittest.TestCase):
+    def test_plan(self):
+        plan = route_plan(routed_config())
+        self.assertEqual(sorted(plan.interfaces), ["xfrm10", "xfrm11", "xfrm12"])
+        self.assertEqual(plan.interfaces["xfrm10"].mtu, 1438)
+        self.assertEqual(plan.routes["192.168.0.0/24"].nexthops, (("xfrm10", 1), ("xfrm11", 3)))
+        self.assertEqual(plan.routes["100.64.0.32/28"].nexthops, (("xfrm12", 1),))
+
+    def test_commands_from_scratch(self):
+        commands = plan_commands(route_plan(routed_config()))
+        self.assertEqual(commands[:2], [["ip", "link", "add", "xfrm10", "type", "xfrm", "if_id", "10"],
+                                        ["ip", "link", "set", "xfrm10", "mtu", "1438", "up"]])
+        self.assertIn(["ip", "route", "replace", "192.168.0.0/24",
+                       "nexthop", "dev", "xfrm10", "weight", "1", "nexthop", "dev", "xfrm11", "weight", "3"], commands)
+        self.assertIn(["ip", "-6", "route", "replace", "fd00:1::/64",
+                       "nexthop", "dev", "xfrm10", "weight", "1", "nexthop", "dev", "xfrm11", "weight", "3"], commands)
+        self.assertIn(["ip", "route", "replace", "100.64.0.32/28", "dev", "xfrm12"], commands)
+
+    def test_diff(self):
+        old_config = routed_config()
+        old = route_plan(old_config)
+        self.assertEqual(plan_commands(old, old), [])
+
+        new_config = copy.deepcopy(old_config)
+        new_config.connections.pop(1) # one link of the ECMP group goes away
+        new_config.connections[1].remote_subnets = ["198.51.100.0/24"]
+        commands = plan_commands(route_plan(new_config), old)
+        self.assertEqual(commands, [
+            ["ip", "route", "del", "100.64.0.32/28"],
+            ["ip", "link", "del", "xfrm11"],
+            ["ip", "route", "replace", "192.168.0.0/24", "dev", "xfrm10"],
+            ["ip", "-6", "route", "replace", "fd00:1::/64", "dev", "xfrm10"],
+            ["ip", "route", "replace", "198.51.100.0/24", "dev", "xfrm12"],
+        ])
+
+    def test_removal_and_script(self):
+        plan = route_plan(routed_config())
+        self.assertEqual(removal_commands(plan)[0], ["ip", "link", "del", "xfrm10"])
+        script = render_script(plan_commands(plan))
+        self.assertTrue(script.startswith("#!/bin/sh\n"))
+        self.assertIn("ip link add xfrm10 type xfrm if_id 10\n", script)
+
+class TestRouteApply(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = Path("test_output_routing").resolve()
+        self.work_dir.mkdir(exist_ok=True)
+        self.logger = logging.getLogger("TestRouting")
+        self.logger.setLevel(logging.CRITICAL)
+
+    def tearDown(self):
+        if self.work_dir.exists():
+            shutil.rmtree(self.work_dir)
+
+    def test_cli_prints_script(self):
+        path = self.work_dir / "config.json"
+        path.write_text(json.dumps(routed_config_dict()))
+        with patch("sys.stdout", new_callable=io.StringIO) as out:
+            self.assertEqual(main([str(path)]), 0)
+        self.assertIn("ip link set xfrm12 mtu 1438 up", out.getvalue())
+
+    @patch("agent.platforms.linux.shutil.which", return_value="/usr/sbin/ip")
+    @patch("agent.platforms.linux.subprocess.run")
+    def test_linux_applies_changes_only(self, run, which):
+        run.return_value = MagicMock(returncode=0, stdout="", stderr="")
+        config = routed_config()
+        agent = LinuxAgent(config, self.work_dir, self.logger)
+        agent._swanctl_bin = lambda: None
+        agent.apply_policy()
+        ip_calls = [c.args[0] for c in run.call_args_list if c.args[0][0] == "ip"]
+        self.assertEqual(len(ip_calls), 9) # 3 interfaces x (add, up), 3 routes
+        run.reset_mock()
+        agent.apply_policy()
+        self.assertFalse([c for c in run.call_args_list if c.args[0][0] == "ip"])
+
+        run.reset_mock()
+        agent.cleanup()
+        self.assertIn(["ip", "link", "del", "xfrm12"], [c.args[0] for c in run.call_args_list])
+
+    @patch("agent.platforms.linux.shutil.which", return_value="/usr/sbin/ip")
+    @patch("agent.platforms.linux.subprocess.run")
+    def test_hung_ip_does_not_block(self, run, which):
+        run.side_effect = subprocess.TimeoutExpired("ip", HOST_COMMAND_TIMEOUT)
+        agent = LinuxAgent(routed_config(), self.work_dir, self.logger)
+        agent._swanctl_bin = lambda: None
+        self.assertTrue(agent.apply_policy())
+        self.assertTrue(all(c.kwargs["timeout"] == HOST_COMMAND_TIMEOUT for c in run.call_args_list))
+        # Nothing is taken as applied: the next sync redoes it
+        self.assertEqual(agent.routes.interfaces, {})
+        agent.cleanup()
+
+        run.side_effect = None
+        run.return_value = MagicMock(returncode=0, stdout="", stderr="")
+        agent.apply_policy()
+        self.assertEqual(len(agent.routes.interfaces), 3)
+
+if __name__ == '__main__':
+    unittest.main()
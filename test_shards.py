@@ -0,0 +1,190 @@
+import os
+import shutil
+import signal
+import time
+import logging
+import unittest
+from pathlib import Path
+from agent.config_schema import AgentConfig
+from agent.core import IPsecAgent, JOURNAL_FILE
+from agent.journal import Journal
+from agent.platforms.linux import LinuxAgent
+from agent.shards import HashRing, Supervisor, assign, shard_config, journal_path
+from benchmarks.swanctl_sim import SwanctlSimulator, parse_conf_children
+from benchmarks.synthetic import synthetic_config_dict
+
+def sharded_config(count: int, shards: int) -> AgentConfig:
+    data = synthetic_config_dict(count)
+    data.update(shards=shards, check_interval=0.2)
+    config = AgentConfig.from_dict(data)
+    config.validate()
+    return config
+
+class TestHashRing(unittest.TestCase):
+    names = [f"conn{i}" for i in range(10000)]
+
+    def test_balance(self):
+        ring = HashRing(4)
+        counts = [0] * 4
+        for name in self.names:
+            counts[ring.shard(name)] += 1
+        for count in counts:
+            self.assertTrue(2000 < count < 3000, counts)
+
+    def test_adding_a_shard_moves_few(self):
+        four, five = HashRing(4), HashRing(5)
+        moved = [name for name in self.names if four.shard(name) != five.shard(name)]
+        # About a fifth, all of them to the new shard
+        self.assertLess(len(moved), 0.3 * len(self.names))
+        self.assertEqual({five.shard(name) for name in moved}, {4})
+
+    def test_ecmp_group_stays_together(self):
+        data = synthetic_config_dict(20)
+        for conn in data["connections"]:
+            conn["routing"] = {"mode": "route", "group": "site"}
+        assignment = assign(AgentConfig.from_dict(data), HashRing(4))
+        self.assertEqual(len(set(assignment.values())), 1)
+
+    def test_shard_config(self):
+        config = sharded_config(12, 3)
+        config.api_port = 8080
+        assignment = assign(config, HashRing(3))
+        parts = [shard_config(config, assignment, shard) for shard in range(3)]
+        self.assertEqual(sorted(c.name for p in parts for c in p.connections), sorted(assignment))
+        self.assertEqual([p.api_port for p in parts], [None] * 3)
+        self.assertEqual([p.stats_interval for p in parts], [60, 0, 0])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            sharded_config(2, 0)
+
+class TestSupervisor(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = Path("test_output_shards").resolve()
+        self.work_dir.mkdir(exist_ok=True)
+        self.conf_dir = self.work_dir / "output" / "swanctl"
+        self.conf_dir.mkdir(parents=True, exist_ok=True)
+        self.logger = logging.getLogger("TestShards")
+        self.logger.setLevel(logging.CRITICAL)
+        self.sim = SwanctlSimulator(self.work_dir / "sim", self.conf_dir)
+        self.sim.install()
+        self.supervisor = None
+
+    def tearDown(self):
+        if self.supervisor:
+            self.supervisor.stop()
+        self.sim.uninstall()
+        if self.work_dir.exists():
+            shutil.rmtree(self.work_dir)
+
+    def start(self, config: AgentConfig):
+        self.supervisor = Supervisor(config, self.work_dir, self.logger, backend_factory=LinuxAgent)
+        self.supervisor.start()
+        self.wait_connected(len(config.connections))
+
+    def wait_until(self, predicate, timeout: float = 30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self.supervisor.poll(0.1)
+            if predicate():
+                return
+        self.fail(f"Timed out: {self.supervisor.status_report()}")
+
+    def wait_connected(self, count: int):
+        def connected():
+            report = self.supervisor.status_report()
+            return report["agent_state"] == "CONNECTED" and report["connections"] == {"CONNECTED": count}
+        self.wait_until(connected)
+
+    def shard_files(self) -> dict[str, set[str]]:
+        return {path.name: set(parse_conf_children(path.read_text()))
+                for path in sorted(self.conf_dir.glob("agent@shard*.conf"))}
+
+    def sa_ids(self) -> dict[str, int]:
+        return {child: sa["uid"] for child, sa in self.sim.state()["sas"].items()}
+
+    def test_shards_and_worker_restart(self):
+        self.start(sharded_config(24, 3))
+        files = self.shard_files()
+        self.assertEqual(len(files), 3)
+        self.assertEqual(sum(len(names) for names in files.values()), 24)
+        self.assertEqual(set.union(*files.values()), {f"conn{i}" for i in range(24)})
+        self.assertEqual(self.sim.call_counts()["--initiate"], 24)
+        sas = self.sa_ids()
+
+        victim = self.supervisor.workers[1]
+        pid = victim.process.pid
+        os.kill(pid, signal.SIGKILL)
+        self.wait_until(lambda: victim.restarts == 1 and victim.report is not None)
+        self.wait_connected(24)
+        self.assertNotEqual(victim.process.pid, pid)
+        # The new worker adopted its shard's SAs from its journal
+        self.assertEqual(self.sa_ids(), sas)
+        self.assertEqual(self.sim.call_counts()["--initiate"], 24)
+        self.assertEqual(self.supervisor.status_report()["shards"][1]["restarts"], 1)
+
+    def test_resharding_hands_over_live_sas(self):
+        self.start(sharded_config(24, 3))
+        sas = self.sa_ids()
+        before = dict(self.supervisor.assignment)
+
+        # One more shard and one more connection
+        self.supervisor.reload(sharded_config(25, 4))
+        self.wait_connected(25)
+        moved = [name for name, shard in before.items() if self.supervisor.assignment[name] != shard]
+        self.assertTrue(moved)
+        self.assertEqual({self.supervisor.assignment[name] for name in moved}, {3})
+        files = self.shard_files()
+        self.assertEqual(sum(len(names) for names in files.values()), 25)
+        self.assertEqual(files["agent@shard3.conf"], {n for n, s in self.supervisor.assignment.items() if s == 3})
+        # Only the new connection was initiated; moved ones kept their SAs
+        self.assertEqual({child: uid for child, uid in self.sa_ids().items() if child != "conn24-child"}, sas)
+        self.assertEqual(self.sim.call_counts()["--initiate"], 25)
+
+        self.supervisor.reload(sharded_config(25, 3))
+        self.wait_connected(25)
+        self.assertEqual(sorted(self.supervisor.workers), [0, 1, 2])
+        self.assertFalse(journal_path(self.work_dir, 3).exists())
+        self.assertEqual(len(self.shard_files()), 3)
+        self.assertEqual(self.sim.call_counts()["--initiate"], 25)
+
+        self.supervisor.stop()
+        self.supervisor = None
+        self.assertEqual(self.shard_files(), {})
+        self.assertEqual(self.sim.installed(), set())
+
+    def test_adopts_single_process_connections(self):
+        config = sharded_config(12, 1)
+        agent = IPsecAgent("dummy_path", logger=self.logger)
+        agent.config = config
+        agent.journal = Journal(self.work_dir / JOURNAL_FILE, agent.clock)
+        agent.backend = LinuxAgent(config, self.work_dir, self.logger)
+        agent.apply_policy()
+        self.assertTrue((self.conf_dir / "agent.conf").exists())
+        sas = self.sa_ids()
+
+        self.start(sharded_config(12, 3))
+        self.wait_until(lambda: not (self.conf_dir / "agent.conf").exists())
+        self.assertEqual(self.sa_ids(), sas)
+        self.assertEqual(self.sim.call_counts()["--initiate"], 12)
+        self.assertFalse((self.work_dir / JOURNAL_FILE).exists())
+
+    def test_single_process_connection_removed_before_sharding(self):
+        config = sharded_config(12, 1)
+        agent = IPsecAgent("dummy_path", logger=self.logger)
+        agent.config = config
+        agent.journal = Journal(self.work_dir / JOURNAL_FILE, agent.clock)
+        agent.backend = LinuxAgent(config, self.work_dir, self.logger)
+        agent.apply_policy()
+        self.assertIn("conn11-child", self.sa_ids())
+
+        fewer = sharded_config(12, 3)
+        del fewer.connections[11]
+        self.start(fewer)
+        self.wait_until(lambda: not (self.conf_dir / "agent.conf").exists())
+        self.wait_until(lambda: "conn11-child" not in self.sa_ids())
+        self.assertEqual(len(self.sa_ids()), 11)
+        self.assertEqual(self.sim.call_counts()["--initiate"], 12)
+
+if __name__ == '__main__':
+    unittest.main()
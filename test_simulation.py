@@ -0,0 +1,149 @@
+import unittest
+import logging
+import time
+import copy
+from agent.clock import VirtualClock
+from agent.core import AgentState
+from agent.simulation import Scenario, simulate
+from benchmarks.synthetic import synthetic_config
+
+DAY = 86400
+
+class TestVirtualClock(unittest.TestCase):
+    def test_callbacks_run_in_order(self):
+        clock = VirtualClock()
+        seen = []
+        clock.call_at(10, lambda: seen.append(("b", clock.time())))
+        clock.call_at(5, lambda: seen.append(("a", clock.time())))
+        clock.call_at(10, lambda: seen.append(("c", clock.time())))
+        clock.sleep(7)
+        self.assertEqual(seen, [("a", 5)])
+        self.assertEqual(clock.time(), 7)
+        clock.sleep(30)
+        self.assertEqual(seen, [("a", 5), ("b", 10), ("c", 10)])
+        self.assertEqual(clock.time(), 37)
+
+class TestControlLoopSimulation(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger("TestSimulation")
+        self.logger.setLevel(logging.CRITICAL)
+
+    def run_day(self, connections=200):
+        config = synthetic_config(connections)
+        flappy = [f"conn{i}" for i in range(0, connections, 20)]
+        scenario = (Scenario()
+                    .flap_every(3600, names=flappy)
+                    .drop(at=40000)                      # everything drops once
+                    .outage(7200, 7500)                  # peers unreachable for 5 minutes
+                    .outage(50000, 50600, names=["conn1"]))
+        agent = simulate(config, scenario, logger=self.logger)
+        agent.run_loop(until=DAY)
+        return agent, flappy
+
+    def test_day_of_flaps_replays_fast_and_converges(self):
+        t0 = time.perf_counter()
+        agent, flappy = self.run_day()
+        self.assertLess(time.perf_counter() - t0, 10)
+
+        backend = agent.backend
+        self.assertEqual(agent.clock.time(), DAY)
+        self.assertEqual(agent.state, AgentState.CONNECTED)
+        self.assertEqual(len(backend.up), 200)
+        self.assertEqual(backend.calls["status"] // 10, DAY // 30 // 10)
+
+        # Every partial drop is repaired by re-initiating only the dropped connections
+        # at the next check, one interval later at most
+        history = backend.history
+        for i, (t, event, names) in enumerate(history):
+            if event == "drop" and t not in (7200, 40000) and len(names) < 200:
+                repair = next(h for h in history[i + 1:] if h[1] == "initiate")
+                self.assertLessEqual(repair[0] - t, 30)
+                self.assertEqual(repair[2], names)
+
+    def test_outage_retries_every_interval(self):
+        agent, flappy = self.run_day()
+        history = agent.backend.history
+        # The flap at 7200 falls into the outage: dropped connections are retried
+        # every check until the peers come back at 7500, the rest are left alone
+        retries = [h for h in history if h[1] == "initiate" and 7200 <= h[0] <= 7600]
+        self.assertEqual([h[0] for h in retries], [float(t) for t in range(7200, 7501, 30)])
+        self.assertTrue(all(h[2] == sorted(flappy) for h in retries))
+        # A drop of every connection triggers one cleanup + re-apply at the next check
+        self.assertEqual([h[1] for h in history if 40000 <= h[0] < 40030], ["drop", "cleanup", "initiate"])
+
+    def test_repair_during_outage(self):
+        config = synthetic_config(10)
+        scenario = Scenario().drop(at=100, names=["conn3"]).outage(90, 400, names=["conn3"])
+        agent = simulate(config, scenario, logger=self.logger)
+        agent.run_loop(until=1000)
+        attempts = [h[0] for h in agent.backend.history if h[1] == "initiate" and h[2] == ["conn3"]]
+        # Retried every 30s during the outage, first success at the first check after 400
+        self.assertEqual(attempts, [float(t) for t in range(120, 421, 30)])
+        self.assertIn("conn3", agent.backend.up)
+        self.assertEqual(agent.state, AgentState.CONNECTED)
+
+    def test_deterministic(self):
+        first, _ = self.run_day(50)
+        second, _ = self.run_day(50)
+        self.assertEqual(first.backend.history, second.backend.history)
+
+    def test_failed_apply_sets_error_and_recovers(self):
+        config = synthetic_config(5)
+        scenario = Scenario().apply_failure(0, 100)
+        agent = simulate(config, scenario, logger=self.logger)
+        self.assertEqual(agent.state, AgentState.ERROR)
+        agent.run_loop(until=200)
+        self.assertEqual(agent.state, AgentState.CONNECTED)
+        applies = [h[0] for h in agent.backend.history if h[1] in ("apply_failed", "initiate")]
+        self.assertEqual(applies, [0, 0, 30, 60, 90, 120])
+
+class TestReload(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger("TestReload")
+        self.logger.setLevel(logging.CRITICAL)
+        self.config = synthetic_config(5)
+        self.changed = copy.deepcopy(self.config)
+        self.changed.connections[1].encryption.esp = "aes128gcm16-ecp256"
+
+    def test_changed_connection_is_made_before_broken(self):
+        agent = simulate(self.config, Scenario(), logger=self.logger)
+        self.changed.connections.pop()  # conn4 removed
+        added = copy.deepcopy(self.changed.connections[0])
+        added.name = "conn9"
+        self.changed.connections.append(added)
+        start = len(agent.backend.history)
+
+        agent.reload(self.changed)
+        self.assertEqual(agent.backend.history[start:], [
+            (0, "stage", ["conn1"]), (0, "initiate", ["conn9"]), (0, "terminate", ["conn4"])])
+        # The running version stays up until the new one is installed
+        self.assertIn("conn1", agent.backend.up)
+        self.assertEqual(list(agent.cutover), ["conn1"])
+
+        agent.step()
+        self.assertEqual(agent.backend.history[-1], (0, "commit", ["conn1"]))
+        self.assertEqual(agent.cutover, {})
+        self.assertEqual(agent.state, AgentState.CONNECTED)
+        agent.reload(copy.deepcopy(self.changed))
+        self.assertEqual(agent.backend.history[-1], (0, "commit", ["conn1"]))
+
+    def test_rollback_when_new_version_never_comes_up(self):
+        agent = simulate(self.config, Scenario().outage(100, 10000, names=["conn1"]), logger=self.logger)
+        agent.run_loop(until=100)  # last check at 90, sleeps until 120
+        agent.reload(self.changed)
+        agent.run_loop(until=400)
+        events = [h for h in agent.backend.history if h[1] in ("stage", "commit", "rollback")]
+        self.assertEqual(events, [(120, "stage", ["conn1"]), (240, "rollback", ["conn1"])])
+        self.assertEqual(agent.config.connections[1].digest(), self.config.connections[1].digest())
+        self.assertIn("conn1", agent.backend.up)
+        # Polled every CUTOVER_POLL seconds while waiting, then back to check_interval
+        self.assertGreater(agent.backend.calls["status"], 60)
+
+    def test_unchanged_reload_is_a_no_op(self):
+        agent = simulate(self.config, Scenario(), logger=self.logger)
+        calls = dict(agent.backend.calls)
+        agent.reload(copy.deepcopy(self.config))
+        self.assertEqual(agent.backend.calls, calls)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+import io
+import copy
+import unittest
+import shutil
+from pathlib import Path
+from agent.config_schema import AgentConfig, ConnectionConfig, AuthConfig, EncryptionConfig
+from agent.swanctl import (SwanctlRenderer, conf_filename, parse_list_sas, connection_states,
+                           generation_config, split_generation, live_generations, child_lifetimes)
+
+def make_config(count):
+    conns = [
+        ConnectionConfig(
+            name=f"Site{i}", mode="tunnel",
+            auth=AuthConfig("psk", f"secret{i}"),
+            encryption=EncryptionConfig("default", "default"),
+            local_subnets=[f"10.{i}.0.0/24"], remote_subnets=[f"192.168.{i}.0/24"]
+        )
+        for i in range(count)
+    ]
+    return AgentConfig(connections=conns, logging_level="info")
+
+class TestSwanctlRenderer(unittest.TestCase):
+    def setUp(self):
+        self.out_dir = Path("test_output_swanctl").resolve()
+        self.out_dir.mkdir(exist_ok=True)
+
+    def tearDown(self):
+        if self.out_dir.exists():
+            shutil.rmtree(self.out_dir)
+
+    def test_document_layout(self):
+        conf = io.StringIO()
+        SwanctlRenderer("# Header").write(conf, make_config(2))
+        text = conf.getvalue()
+        self.assertTrue(text.startswith("# Header\nconnections {\n"))
+        self.assertLess(text.index("Site1-child"), text.index("secrets {"))
+        self.assertIn('secret = "secret1"', text)
+        self.assertIn("proposals = aes256-sha256-modp2048", text)
+
+    def test_rerender_only_changed_connection(self):
+        config = make_config(10)
+        renderer = SwanctlRenderer()
+        self.assertEqual(renderer.write(io.StringIO(), config).rendered, 10)
+
+        config.connections[3].remote_subnets = ["172.16.0.0/16"]
+        buf = io.StringIO()
+        stats = renderer.write(buf, config)
+        self.assertEqual((stats.rendered, stats.reused), (1, 9))
+        self.assertIn("remote_ts = 172.16.0.0/16", buf.getvalue())
+
+        # Agent-level rendering options invalidate every block
+        config.aggregate_selectors = True
+        self.assertEqual(renderer.write(io.StringIO(), config).rendered, 10)
+
+    def test_per_connection_files(self):
+        config = make_config(3)
+        renderer = SwanctlRenderer()
+        stats = renderer.write_dir(self.out_dir, config)
+        self.assertEqual(stats.files_written, 3)
+        self.assertTrue((self.out_dir / conf_filename("Site0")).exists())
+
+        config.connections[0].auth.value = "rotated"
+        del config.connections[2]
+        stats = renderer.write_dir(self.out_dir, config)
+        self.assertEqual((stats.files_written, stats.reused, stats.files_removed), (1, 1, 1))
+        self.assertIn('"rotated"', (self.out_dir / conf_filename("Site0")).read_text())
+        self.assertFalse((self.out_dir / conf_filename("Site2")).exists())
+
+    def test_layout_switch_removes_other_layout(self):
+        config = make_config(2)
+        renderer = SwanctlRenderer()
+        renderer.write_config(self.out_dir, config)
+        self.assertTrue((self.out_dir / "agent.conf").exists())
+
+        config.swanctl_layout = "per_connection"
+        renderer.write_config(self.out_dir, config)
+        self.assertFalse((self.out_dir / "agent.conf").exists())
+        self.assertEqual(len(list(self.out_dir.glob("agent-*.conf"))), 2)
+
+    def test_staged_generation_rendered_next_to_running(self):
+        config = make_config(2)
+        running = copy.deepcopy(config.connections[1])
+        config.connections[1].encryption.esp = "aes128gcm16"
+        config.connections[1].auth.value = "rotated"
+        loaded = generation_config(config, {"Site0": 2}, {"Site1": (running, 0, 1)})
+        self.assertEqual([c.name for c in loaded.connections], ["Site0~2", "Site1", "Site1~1"])
+        conf = io.StringIO()
+        SwanctlRenderer().write(conf, loaded)
+        text = conf.getvalue()
+        self.assertIn("Site1~1-child {", text)
+        self.assertEqual(text.count("esp_proposals = aes128gcm16"), 1)
+        # Both generations authenticate with the new secret
+        self.assertEqual(text.count('secret = "rotated"'), 2)
+        self.assertIs(generation_config(config, {}), config)
+
+    def test_lifetimes_rendered(self):
+        config = make_config(1)
+        config.connections[0].lifetime_minutes = 480
+        conf = io.StringIO()
+        SwanctlRenderer().write(conf, config)
+        text = conf.getvalue()
+        self.assertIn("rekey_time = 25920s", text)
+        self.assertIn("life_time = 28800s", text)
+        self.assertIn("rand_time = 2880s", text)
+
+    def test_rekey_spread(self):
+        config = make_config(1000)
+        life = 3600
+        plain = {child_lifetimes(c)[0] for c in config.connections}
+        self.assertEqual(plain, {3240})
+
+        rekeys = [child_lifetimes(c, 0.5)[0] for c in config.connections]
+        self.assertTrue(all(0.4 * life <= r <= 0.9 * life for r in rekeys))
+        # Roughly even over the window: every tenth of it gets a share
+        bins = [0] * 10
+        for r in rekeys:
+            bins[min(9, int((0.9 * life - r) / (0.05 * life)))] += 1
+        self.assertTrue(all(60 <= b <= 140 for b in bins), bins)
+
+        # Stable across generations, and a spread change re-renders
+        renamed = copy.deepcopy(config.connections[7])
+        renamed.name = "Site7~3"
+        self.assertEqual(child_lifetimes(renamed, 0.5), child_lifetimes(config.connections[7], 0.5))
+        renderer = SwanctlRenderer()
+        renderer.write(io.StringIO(), config)
+        config.rekey_spread = 0.5
+        self.assertEqual(renderer.write(io.StringIO(), config).rendered, 1000)
+
+class TestListSasParser(unittest.TestCase):
+    def setUp(self):
+        with open(Path(__file__).parent / "fixtures" / "swanctl_list_sas.txt") as f:
+            self.sas = parse_list_sas(f.read())
+
+    def test_parse_fixture(self):
+        self.assertEqual([(s.name, s.state) for s in self.sas],
+                         [("SiteA", "ESTABLISHED"), ("SiteB", "CONNECTING"), ("SiteC", "ESTABLISHED")])
+        child = self.sas[0].children[0]
+        self.assertEqual((child.name, child.state, child.mode), ("SiteA-child", "INSTALLED", "TUNNEL-in-UDP"))
+        self.assertEqual((child.spi_in, child.spi_out), ("c3b0a1f2", "ca5e1234"))
+        self.assertEqual((child.bytes_in, child.packets_out), (48213, 611))
+        self.assertEqual(child.remote_ts, ["192.168.1.0/24"])
+        self.assertEqual(self.sas[1].remote_host, "203.0.113.7")
+        # Rekeyed and new child of the same connection, IPComp CPIs skipped
+        self.assertEqual([c.state for c in self.sas[2].children], ["REKEYED", "INSTALLED"])
+        self.assertEqual(self.sas[2].children[0].spi_in, "00c1a9f4")
+
+    def test_connection_states(self):
+        config = make_config(0)
+        for name in ["SiteA", "SiteB", "SiteC", "SiteD"]:
+            config.connections.append(ConnectionConfig(
+                name=name, mode="tunnel", auth=AuthConfig("psk", "x"),
+                encryption=EncryptionConfig("default", "default"),
+                local_subnets=["10.0.0.0/24"], remote_subnets=["192.168.1.0/24"]))
+        states = connection_states(self.sas, config.connections)
+        self.assertEqual(states, {"SiteA": "CONNECTED", "SiteB": "CONNECTING",
+                                  "SiteC": "CONNECTED", "SiteD": "DISCONNECTED"})
+
+    def test_generations(self):
+        self.assertEqual(split_generation("SiteA~12"), ("SiteA", 12))
+        self.assertEqual(split_generation("Site~A"), ("Site~A", 0))
+        with open(Path(__file__).parent / "fixtures" / "swanctl_list_sas.txt") as f:
+            sas = parse_list_sas(f.read().replace("SiteA", "SiteA~1"))
+        self.assertEqual(live_generations(sas), {"SiteA": 1, "SiteB": 0, "SiteC": 0})
+        states = connection_states(sas, make_config(0).connections + [ConnectionConfig(
+            name="SiteA", mode="tunnel", auth=AuthConfig("psk", "x"), encryption=EncryptionConfig("default", "default"),
+            local_subnets=["10.0.0.0/24"], remote_subnets=["192.168.1.0/24"])])
+        self.assertEqual(states, {"SiteA": "CONNECTED"})
+
+if __name__ == '__main__':
+    unittest.main()
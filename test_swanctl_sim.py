@@ -0,0 +1,136 @@
+import unittest
+import shutil
+import logging
+import subprocess
+import copy
+import time
+from pathlib import Path
+from agent.core import IPsecAgent, AgentState
+from agent.platforms.linux import LinuxAgent
+from agent.swanctl import child_lifetimes
+from benchmarks.swanctl_sim import SwanctlSimulator, parse_conf_children
+from benchmarks.synthetic import synthetic_config
+
+class TestSwanctlSimulator(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = Path("test_output_sim").resolve()
+        self.work_dir.mkdir(exist_ok=True)
+        self.logger = logging.getLogger("TestSim")
+        self.config = synthetic_config(6)
+
+        self.agent = IPsecAgent("dummy_path")
+        self.agent.config = self.config
+        self.agent.logger = self.logger
+        self.agent.backend = LinuxAgent(self.config, self.work_dir, self.logger)
+
+    def tearDown(self):
+        if self.work_dir.exists():
+            shutil.rmtree(self.work_dir)
+
+    def test_parse_conf_children(self):
+        conf = self.agent.backend._generate_swanctl_conf()
+        children = parse_conf_children(conf)
+        self.assertEqual(children["conn0"], ["conn0-child"])
+        self.assertEqual(len(children), 6)
+
+    def test_converges_with_failures_and_repairs_only_dropped(self):
+        with SwanctlSimulator(self.work_dir / "sim", self.agent.backend.conf_dir, fail_ratio=0.5, seed=3) as sim:
+            self.agent.apply_policy()
+            for _ in range(20):
+                if len(sim.installed()) == 6:
+                    break
+                self.agent.step()
+            self.assertEqual(len(sim.installed()), 6)
+            self.agent.step()
+            self.assertEqual(self.agent.state, AgentState.CONNECTED)
+            # Failed initiations were retried individually, config loaded once
+            self.assertEqual(sim.call_counts()["--load-all"], 1)
+            self.assertGreater(sim.call_counts()["--initiate"], 6)
+
+            sim.reset_counts()
+            sim.drop(children=["conn2-child"])
+            self.agent.step()
+            self.assertEqual(self.agent.state, AgentState.DEGRADED)
+            calls = sim.call_counts()
+            self.assertEqual(calls.get("--initiate"), 1)
+            self.assertNotIn("--load-all", calls)
+
+    def test_full_outage_reapplies(self):
+        with SwanctlSimulator(self.work_dir / "sim", self.agent.backend.conf_dir) as sim:
+            self.agent.apply_policy()
+            self.assertEqual(len(sim.installed()), 6)
+            sim.drop()
+            self.agent.step()
+            self.assertEqual(len(sim.installed()), 6)
+            self.assertEqual(sim.call_counts()["--load-all"], 3)  # apply, cleanup, re-apply
+
+    def test_make_before_break_reload(self):
+        with SwanctlSimulator(self.work_dir / "sim", self.agent.backend.conf_dir) as sim:
+            self.agent.apply_policy()
+            sim.configure(establish_delay=0.3)
+            changed = copy.deepcopy(self.config)
+            changed.connections[2].encryption.esp = "aes128gcm16-ecp256"
+            self.agent.reload(changed)
+
+            self.assertIn("conn2~1-child", sim.loaded_children())
+            self.agent.step()
+            # Old SA carries traffic while the new one negotiates
+            self.assertIn("conn2-child", sim.installed())
+            self.assertNotIn("conn2~1-child", sim.installed())
+
+            time.sleep(0.35)
+            self.agent.step()
+            self.assertIn("conn2~1-child", sim.installed())
+            self.assertNotIn("conn2-child", sim.installed())
+            self.assertNotIn("conn2-child", sim.loaded_children())
+            self.assertEqual(self.agent.backend.generations, {"conn2": 1})
+            self.assertEqual(self.agent.state, AgentState.CONNECTED)
+
+    def test_make_before_break_rollback(self):
+        with SwanctlSimulator(self.work_dir / "sim", self.agent.backend.conf_dir) as sim:
+            self.agent.apply_policy()
+            sim.configure(fail_ratio=1.0)
+            changed = copy.deepcopy(self.config)
+            changed.connections[2].encryption.esp = "aes128gcm16-ecp256"
+            changed.cutover_timeout = 0.01
+            self.agent.reload(changed)
+            time.sleep(0.02)
+            self.agent.step()
+            self.assertEqual(self.agent.cutover, {})
+            self.assertNotIn("conn2~1-child", sim.loaded_children())
+            self.assertIn("conn2-child", sim.installed())
+            self.assertEqual(self.agent.config.connections[2].encryption.esp, self.config.connections[2].encryption.esp)
+
+    def test_reload_of_an_agent_wide_option(self):
+        with SwanctlSimulator(self.work_dir / "sim", self.agent.backend.conf_dir) as sim:
+            self.agent.apply_policy()
+            changed = copy.deepcopy(self.config)
+            changed.check_interval = 5
+            self.assertEqual(self.agent.reload(changed), {"added": [], "removed": [], "changed": []})
+            self.assertEqual(self.agent.config.check_interval, 5)
+
+            spread = copy.deepcopy(changed)
+            spread.rekey_spread = 0.5
+            result = self.agent.reload(spread)
+            self.assertEqual(result["changed"], [c.name for c in self.config.connections])
+            self.agent.step()
+            text = "".join(path.read_text() for path in self.agent.backend.conf_dir.glob("*.conf"))
+            for conn in spread.connections:
+                self.assertIn(f"rekey_time = {child_lifetimes(conn, 0.5)[0]}s", text)
+            self.assertEqual(len(sim.installed()), 6)
+
+    def test_scheduled_drop_and_establish_delay(self):
+        with SwanctlSimulator(self.work_dir / "sim", self.agent.backend.conf_dir, establish_delay=60) as sim:
+            self.agent.backend.apply_policy()
+            # Negotiating SAs show up as CONNECTING, not installed
+            self.assertEqual(sim.installed(), set())
+            self.assertEqual(set(self.agent.backend.connection_status().values()), {"CONNECTING"})
+
+        with SwanctlSimulator(self.work_dir / "sim2", self.agent.backend.conf_dir) as sim:
+            self.agent.backend.apply_policy()
+            sim.schedule_drop(0, ratio=1.0)
+            out = subprocess.run(["swanctl", "--list-sas"], capture_output=True, text=True).stdout
+            self.assertEqual(out, "")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import logging
+import os
+import shutil
+import signal
+import socket
+import time
+import unittest
+from pathlib import Path
+from agent.config_schema import AgentConfig
+from agent.core import AgentState
+from agent.platforms.linux import LinuxAgent
+from agent.shards import Supervisor
+from agent.simulation import Scenario, simulate
+from agent.systemd import Notifier, status_line
+from benchmarks.swanctl_sim import SwanctlSimulator
+from benchmarks.synthetic import synthetic_config_dict
+
+def config(count: int = 3, **changes) -> AgentConfig:
+    data = synthetic_config_dict(count)
+    data.update(changes)
+    config = AgentConfig.from_dict(data)
+    config.validate()
+    return config
+
+class NotifyCase(unittest.TestCase):
+    """Stands in for systemd: a datagram socket collecting the notifications."""
+    def setUp(self):
+        self.work_dir = Path("test_output_systemd").resolve()
+        self.work_dir.mkdir(exist_ok=True)
+        self.path = self.work_dir / "notify.sock"
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(str(self.path))
+        self.sock.setblocking(False)
+        self.logger = logging.getLogger("TestSystemd")
+        self.logger.setLevel(logging.CRITICAL)
+
+    def tearDown(self):
+        self.sock.close()
+        if self.work_dir.exists():
+            shutil.rmtree(self.work_dir)
+
+    def notifier(self, watchdog_sec: float = None, **env) -> Notifier:
+        env = {"NOTIFY_SOCKET": str(self.path), **env}
+        if watchdog_sec:
+            env["WATCHDOG_USEC"] = str(int(watchdog_sec * 1e6))
+        notifier = Notifier(env)
+        self.addCleanup(notifier.close)
+        return notifier
+
+    def received(self) -> list[str]:
+        messages = []
+        while True:
+            try:
+                messages.append(self.sock.recv(4096).decode())
+            except BlockingIOError:
+                return messages
+
+class TestNotifier(NotifyCase):
+    def test_messages(self):
+        notifier = self.notifier(watchdog_sec=20)
+        self.assertTrue(notifier.enabled)
+        self.assertEqual(notifier.watchdog_interval, 20)
+        self.assertTrue(notifier.ready("CONNECTED: 1 connections"))
+        self.assertFalse(notifier.status("CONNECTED: 1 connections"))
+        self.assertTrue(notifier.status("DEGRADED: 1 connections"))
+        self.assertTrue(notifier.watchdog())
+        self.assertTrue(notifier.stopping())
+        self.assertEqual(self.received(), ["READY=1\nSTATUS=CONNECTED: 1 connections", "STATUS=DEGRADED: 1 connections",
+                                           "WATCHDOG=1", "STOPPING=1\nSTATUS=Stopping"])
+
+    def test_environment(self):
+        self.assertIsNone(self.notifier(watchdog_sec=20, WATCHDOG_PID="1").watchdog_interval)
+        self.assertEqual(self.notifier(watchdog_sec=20, WATCHDOG_PID=str(os.getpid())).watchdog_interval, 20)
+        self.assertIsNone(self.notifier(WATCHDOG_USEC="soon").watchdog_interval)
+        self.assertEqual(Notifier({"NOTIFY_SOCKET": "@/org/test/notify"}).address, "\0/org/test/notify")
+
+        # Outside systemd every call is a no-op
+        outside = Notifier({"WATCHDOG_USEC": "1000000"})
+        self.assertFalse(outside.enabled)
+        self.assertIsNone(outside.watchdog_interval)
+        self.assertFalse(outside.ready() or outside.watchdog() or outside.stopping())
+        self.assertIsNone(outside.sock)
+
+    def test_full_or_gone_socket(self):
+        notifier = self.notifier(watchdog_sec=20)
+        # Nobody reads: sending must not block once the queue is full
+        sent = [notifier.watchdog() for _ in range(1000)]
+        self.assertTrue(sent[0])
+        self.assertFalse(sent[-1])
+        self.sock.close()
+        self.path.unlink()
+        self.assertFalse(notifier.watchdog())
+
+    def test_status_line(self):
+        self.assertEqual(status_line("DEGRADED", 3, {"a": "CONNECTED", "b": "DISCONNECTED", "c": "CONNECTED"}),
+                         "DEGRADED: 3 connections, 2 CONNECTED, 1 DISCONNECTED")
+        self.assertEqual(status_line("INIT", 0, {}), "INIT: 0 connections")
+
+class TestAgentNotifications(NotifyCase):
+    def test_ready_status_and_watchdog_in_the_loop(self):
+        agent = simulate(config(3, check_interval=60), Scenario().drop(100, ["conn1"]), logger=self.logger)
+        agent.notifier = self.notifier(watchdog_sec=20)
+        # More than the socket queues: recorded as sent, in virtual time
+        messages = []
+        agent.notifier.notify = lambda *fields: messages.append("\n".join(fields)) or True
+        agent.run_loop(until=300)
+        ready = [m for m in messages if m.startswith("READY=1")]
+        self.assertEqual(ready, ["READY=1\nSTATUS=CONNECTED: 3 connections, 3 CONNECTED"])
+        self.assertEqual(messages[0], ready[0])
+        # Pinged at least every 10s while sleeping out the 60s check interval
+        self.assertGreaterEqual(messages.count("WATCHDOG=1"), 30)
+        self.assertTrue(any(m.startswith("STATUS=") and "DISCONNECTED" in m for m in messages))
+        agent.shutdown()
+        self.assertEqual(messages[-1], "STOPPING=1\nSTATUS=Stopping")
+
+    def test_no_ready_before_a_successful_apply(self):
+        agent = simulate(config(2), Scenario(), logger=self.logger)
+        agent.notifier = self.notifier()
+        agent.state = AgentState.ERROR
+        agent._notify()
+        self.assertEqual(self.received(), ["STATUS=ERROR: 2 connections"])
+        self.assertFalse(agent.notifier.is_ready)
+        agent.step()
+        agent._notify()
+        self.assertEqual(self.received(), ["READY=1\nSTATUS=CONNECTED: 2 connections, 2 CONNECTED"])
+
+class TestSupervisorWatchdog(NotifyCase):
+    def test_hung_worker_is_killed_and_restarted(self):
+        conf_dir = self.work_dir / "output" / "swanctl"
+        conf_dir.mkdir(parents=True)
+        sim = SwanctlSimulator(self.work_dir / "sim", conf_dir)
+        sim.install()
+        self.addCleanup(sim.uninstall)
+        supervisor = Supervisor(config(6, shards=2, check_interval=0.2), self.work_dir, self.logger,
+                                backend_factory=LinuxAgent, notifier=self.notifier(watchdog_sec=1))
+        supervisor.start()
+        self.addCleanup(supervisor.stop)
+
+        messages = []
+        def wait_until(predicate):
+            deadline = time.monotonic() + 30
+            while not predicate():
+                self.assertLess(time.monotonic(), deadline, supervisor.status_report())
+                supervisor.poll(0.1)
+                supervisor._notify()
+                messages.extend(self.received())
+
+        wait_until(lambda: supervisor.notifier.is_ready)
+        self.assertEqual([m for m in messages if m.startswith("READY=1")],
+                         ["READY=1\nSTATUS=CONNECTED: 6 connections, 6 CONNECTED on 2 shards"])
+
+        victim = supervisor.workers[0]
+        pid = victim.process.pid
+        os.kill(pid, signal.SIGSTOP)
+        self.addCleanup(lambda: os.kill(pid, signal.SIGCONT) if victim.process.pid == pid and victim.process.is_alive() else None)
+        wait_until(lambda: victim.restarts == 1 and victim.report is not None)
+        self.assertNotEqual(victim.process.pid, pid)
+        wait_until(lambda: supervisor.status_report()["connections"] == {"CONNECTED": 6})
+        self.assertIn("WATCHDOG=1", messages)
+
+if __name__ == '__main__':
+    unittest.main()
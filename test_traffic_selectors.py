@@ -0,0 +1,123 @@
+import unittest
+import random
+import ipaddress
+from agent.config_schema import AgentConfig, ConnectionConfig, AuthConfig, EncryptionConfig
+from agent.traffic_selectors import (
+    TrafficSelector, classify, find_conflicts, find_connection_conflicts,
+    selectors_for_connection, parse_port_range, aggregate_subnets, aggregate_connection
+)
+
+def make_conn(name, local, remote, protocol="any", local_port="any", remote_port="any"):
+    return ConnectionConfig(
+        name=name, mode="tunnel",
+        auth=AuthConfig("psk", "x"),
+        encryption=EncryptionConfig("default", "default"),
+        local_subnets=local if isinstance(local, list) else [local],
+        remote_subnets=remote if isinstance(remote, list) else [remote],
+        protocol=protocol, local_port=local_port, remote_port=remote_port
+    )
+
+def naive_conflicts(selectors):
+    found = set()
+    for i, a in enumerate(selectors):
+        for b in selectors[i + 1:]:
+            if a.connection == b.connection:
+                continue
+            if classify(a, b):
+                found.add(frozenset([a, b]))
+    return found
+
+class TestTrafficSelectors(unittest.TestCase):
+    def test_duplicate(self):
+        conflicts = find_connection_conflicts([
+            make_conn("A", "10.0.0.0/24", "192.168.1.0/24"),
+            make_conn("B", "10.0.0.0/24", "192.168.1.0/24"),
+        ])
+        self.assertEqual(len(conflicts), 1)
+        self.assertEqual(conflicts[0].kind, "duplicate")
+
+    def test_shadowed(self):
+        conflicts = find_connection_conflicts([
+            make_conn("Narrow", "10.0.1.0/24", "192.168.1.0/24", protocol="tcp", remote_port="443"),
+            make_conn("Wide", "10.0.0.0/16", "192.168.0.0/16"),
+        ])
+        self.assertEqual(len(conflicts), 1)
+        self.assertEqual(conflicts[0].kind, "shadowed")
+        self.assertEqual(conflicts[0].first.connection, "Wide")
+        self.assertEqual(conflicts[0].second.connection, "Narrow")
+
+    def test_partial_overlap(self):
+        conflicts = find_connection_conflicts([
+            make_conn("A", "10.0.0.0/16", "192.168.1.0/24"),
+            make_conn("B", "10.0.1.0/24", "192.168.0.0/16"),
+        ])
+        self.assertEqual([c.kind for c in conflicts], ["overlap"])
+
+    def test_disjoint_ports_and_protocols(self):
+        conflicts = find_connection_conflicts([
+            make_conn("Web", "10.0.0.0/24", "192.168.1.0/24", protocol="tcp", remote_port="443"),
+            make_conn("Dns", "10.0.0.0/24", "192.168.1.0/24", protocol="udp", remote_port="53"),
+            make_conn("Ssh", "10.0.0.0/24", "192.168.1.0/24", protocol="tcp", remote_port="22"),
+        ])
+        self.assertEqual(conflicts, [])
+
+    def test_same_connection_and_family_ignored(self):
+        conn = make_conn("Multi", ["10.0.0.0/16", "10.0.1.0/24", "fd00::/64"], ["192.168.0.0/16", "fd01::/64"])
+        # Mixed-family pairs are dropped: 2 v4 locals x 1 v4 remote + 1 v6 x 1 v6
+        self.assertEqual(len(selectors_for_connection(conn)), 3)
+        self.assertEqual(find_connection_conflicts([conn]), [])
+
+    def test_port_without_protocol_is_tcp(self):
+        sel = selectors_for_connection(make_conn("A", "10.0.0.0/24", "10.1.0.0/24", local_port="80"))[0]
+        self.assertEqual(sel.protocol, 6)
+        self.assertEqual(parse_port_range("1000-2000"), (1000, 2000))
+
+    def test_matches_naive_pairwise(self):
+        rnd = random.Random(42)
+        selectors = []
+        for i in range(400):
+            plen_l = rnd.choice([8, 16, 24, 28])
+            plen_r = rnd.choice([8, 16, 24, 28])
+            local = ipaddress.ip_network(f"10.{rnd.randrange(4)}.{rnd.randrange(4)}.{rnd.randrange(0, 256, 16)}/{plen_l}", strict=False)
+            remote = ipaddress.ip_network(f"172.{rnd.randrange(16, 18)}.{rnd.randrange(4)}.0/{plen_r}", strict=False)
+            proto = rnd.choice([None, 6, 17])
+            port = rnd.choice([(0, 65535), (443, 443), (1000, 2000)]) if proto else (0, 65535)
+            selectors.append(TrafficSelector(f"c{i % 150}", local, remote, proto, (0, 65535), port))
+
+        fast = {frozenset([c.first, c.second]) for c in find_conflicts(selectors)}
+        self.assertEqual(fast, naive_conflicts(selectors))
+        self.assertEqual(len(fast), len(find_conflicts(selectors)))
+
+    def test_strict_mode_rejects(self):
+        config = AgentConfig(
+            connections=[
+                make_conn("A", "10.0.0.0/24", "192.168.1.0/24"),
+                make_conn("B", "10.0.0.0/24", "192.168.1.0/24"),
+            ],
+            logging_level="info"
+        )
+        config.validate()
+        self.assertEqual(len(config.selector_conflicts), 1)
+
+        config.strict_selectors = True
+        with self.assertRaises(ValueError):
+            config.validate()
+
+class TestSelectorAggregation(unittest.TestCase):
+    def test_collapse_per_family(self):
+        merged = aggregate_subnets(["10.0.1.0/24", "fd00::/65", "10.0.0.0/24", "10.0.0.128/25", "fd00:0:0:0:8000::/65"])
+        self.assertEqual(merged, ["10.0.0.0/23", "fd00::/64"])
+
+    def test_policy_counts(self):
+        conn = make_conn("Inv", ["10.0.0.0/24", "10.0.1.0/24", "10.0.2.0/24", "10.0.3.0/24"],
+                         ["192.168.0.0/24", "192.168.0.0/25"])
+        result = aggregate_connection(conn)
+        self.assertEqual(result.local_subnets, ["10.0.0.0/22"])
+        self.assertEqual(result.remote_subnets, ["192.168.0.0/24"])
+        # 4 x 2 pairs -> 1 pair, three directions each in tunnel mode
+        self.assertEqual(result.policies_before, 24)
+        self.assertEqual(result.policies_after, 3)
+        self.assertEqual(result.saved, 21)
+
+if __name__ == '__main__':
+    unittest.main()
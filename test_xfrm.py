@@ -0,0 +1,108 @@
+import shutil
+import logging
+import unittest
+from pathlib import Path
+from unittest.mock import patch, MagicMock
+from agent.config_schema import AgentConfig
+from agent.platforms.linux import LinuxAgent
+from agent.swanctl import parse_list_sas
+from agent.xfrm import parse_xfrm_stat, parse_xfrm_states, spi_connections, XfrmCollector, XfrmState
+from benchmarks.synthetic import synthetic_config_dict
+
+FIXTURES = Path(__file__).parent / "fixtures"
+XFRM_STAT = (FIXTURES / "sysinfo" / "x86_server" / "proc" / "net" / "xfrm_stat").read_text()
+XFRM_STATES = (FIXTURES / "ip_s_xfrm_state.txt").read_text()
+LIST_SAS = (FIXTURES / "swanctl_list_sas.txt").read_text()
+
+class TestXfrmParsers(unittest.TestCase):
+    def test_xfrm_stat(self):
+        counters = parse_xfrm_stat(XFRM_STAT)
+        self.assertEqual(len(counters), 28)
+        self.assertEqual(counters["XfrmInStateSeqError"], 41)
+        self.assertEqual(counters["XfrmInNoPols"], 7)
+
+    def test_states(self):
+        states = parse_xfrm_states(XFRM_STATES)
+        self.assertEqual(len(states), 5)
+        self.assertEqual(states[0], XfrmState("192.168.1.1", "10.0.0.1", "esp", 0xc3b0a1f2, 1, "tunnel",
+                                              bytes=48213, packets=512, replay_window=38, replay=3, integrity_failed=2))
+        self.assertEqual((states[1].spi, states[1].packets, states[1].replay), (0xca5e1234, 611, 0))
+        self.assertEqual(states[2].mode, "transport")
+        self.assertEqual(states[4].spi, 0x0badf00d)
+
+    def test_spi_mapping(self):
+        spis = spi_connections(parse_list_sas(LIST_SAS))
+        self.assertEqual(spis[0xc3b0a1f2], ("SiteA", "in"))
+        self.assertEqual(spis[0xca5e1234], ("SiteA", "out"))
+        self.assertEqual(spis[0xe5f6a7b8], ("SiteC", "out"))
+        self.assertNotIn(0x0badf00d, spis)
+
+class TestXfrmCollector(unittest.TestCase):
+    def setUp(self):
+        self.sas = parse_list_sas(LIST_SAS)
+        self.collector = XfrmCollector()
+
+    def test_first_sample_reports_totals(self):
+        report = self.collector.sample(100, XFRM_STAT, XFRM_STATES, self.sas)
+        self.assertIsNone(report.interval)
+        self.assertEqual(report.counters["XfrmInNoStates"], {"total": 12, "delta": 12})
+        self.assertEqual(report.connections["SiteA"]["in"]["total"]["integrity_failed"], 2)
+        self.assertEqual(report.connections["SiteC"]["out"]["total"]["packets"], 12)
+        self.assertEqual(report.unmapped_states, 1)
+
+    def test_deltas(self):
+        self.collector.sample(100, XFRM_STAT, XFRM_STATES, self.sas)
+        stat = XFRM_STAT.replace("XfrmInStateSeqError     \t41", "XfrmInStateSeqError     \t50")
+        states = (XFRM_STATES.replace("48213(bytes), 512(packets)", "58213(bytes), 600(packets)")
+                             .replace("replay-window 38 replay 3 failed 2", "replay-window 40 replay 3 failed 2"))
+        report = self.collector.sample(160, stat, states, self.sas)
+        self.assertEqual(report.interval, 60)
+        self.assertEqual(report.counters["XfrmInStateSeqError"], {"total": 50, "delta": 9})
+        self.assertEqual(report.counters["XfrmInNoStates"]["delta"], 0)
+        delta = report.connections["SiteA"]["in"]["delta"]
+        self.assertEqual((delta["bytes"], delta["packets"], delta["replay_window"], delta["replay"]), (10000, 88, 2, 0))
+        self.assertEqual(report.drops(), {"XfrmInStateSeqError": 9})
+        self.assertEqual(report.describe_drops(), [
+            "XfrmInStateSeqError +9 (sequence numbers outside the replay window)",
+            "SiteA: 2 outside the replay window",
+        ])
+
+    def test_rekeyed_sa_counts_from_zero(self):
+        self.collector.sample(100, XFRM_STAT, XFRM_STATES, self.sas)
+        states = XFRM_STATES.replace("0xd1e2f3a4(3521311652)", "0xd1e2f3a5(3521311653)")
+        sas = parse_list_sas(LIST_SAS.replace("in  d1e2f3a4", "in  d1e2f3a5"))
+        report = self.collector.sample(160, XFRM_STAT, states, sas)
+        self.assertEqual(report.connections["SiteC"]["in"]["delta"]["bytes"], 1024)
+        self.assertEqual(report.connections["SiteC"]["out"]["delta"]["bytes"], 0)
+
+class TestLinuxStats(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = Path("test_output_xfrm").resolve()
+        self.work_dir.mkdir(exist_ok=True)
+        self.logger = logging.getLogger("TestXfrm")
+        self.logger.setLevel(logging.CRITICAL)
+
+    def tearDown(self):
+        if self.work_dir.exists():
+            shutil.rmtree(self.work_dir)
+
+    @patch("agent.platforms.linux.shutil.which", return_value="/usr/sbin/ip")
+    @patch("agent.platforms.linux.subprocess.run")
+    def test_sample(self, run, which):
+        run.return_value = MagicMock(returncode=0, stdout=XFRM_STATES, stderr="")
+        agent = LinuxAgent(AgentConfig.from_dict(synthetic_config_dict(1)), self.work_dir, self.logger)
+        agent.proc_root = FIXTURES / "sysinfo" / "x86_server"
+        agent._run_list_sas = lambda: LIST_SAS
+        stats = agent.sample_stats(100)
+        self.assertEqual(run.call_args.args[0], ["ip", "-s", "xfrm", "state"])
+        self.assertEqual(stats["counters"]["XfrmInNoPols"]["total"], 7)
+        self.assertEqual(stats["connections"]["SiteA"]["out"]["total"]["bytes"], 102934)
+
+    @patch("agent.platforms.linux.shutil.which", return_value=None)
+    def test_nothing_to_sample(self, which):
+        agent = LinuxAgent(AgentConfig.from_dict(synthetic_config_dict(1)), self.work_dir, self.logger)
+        agent.proc_root = FIXTURES / "sysinfo" / "rpi4"
+        self.assertIsNone(agent.sample_stats(100))
+
+if __name__ == '__main__':
+    unittest.main()